@@ -0,0 +1,522 @@
+"""
+archive_optimizer.py - Recompresión del archivo de originales en horas de poca actividad
+
+Modos (se combinan, p. ej. "jpeg,faststart"):
+- jpeg: reoptimiza los JPEG sin pérdida con jpegtran (tablas Huffman óptimas,
+  copiando todos los marcadores). Se verifica que los píxeles y el
+  EXIF decodificados son idénticos antes de reemplazar el original.
+- faststart: mueve el átomo moov de los MP4/MOV delante de mdat (como
+  qt-faststart, sin recodificar) para que la web empiece a reproducir sin
+  descargar el video entero. Se verifica que los datos de mdat no cambian.
+- webp / avif: copia de archivo de alta calidad en ARCHIVE_COPY_PATH (el
+  original no se toca); se verifica tamaño y PSNR frente al original.
+
+Los archivos se procesan en un pool de procesos; el original solo se reemplaza
+con un rename atómico tras verificar la salida, conservando permisos, dueño y
+fechas. Cada archivo se anota en .index/archive.db con los bytes ahorrados y
+el tiempo de CPU (propio y de jpegtran), y no se vuelve a procesar salvo que
+cambie.
+
+    python archive_optimizer.py /data/fotos --modes jpeg,faststart --workers 4
+    python archive_optimizer.py /data/fotos --report
+"""
+import os
+import time
+import shutil
+import struct
+import sqlite3
+import hashlib
+import argparse
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    from PIL import Image, ImageChops
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    AVIF_AVAILABLE = PIL_AVAILABLE and hasattr(pillow_heif, "register_avif_opener")
+    if AVIF_AVAILABLE:
+        pillow_heif.register_avif_opener()
+except ImportError:
+    AVIF_AVAILABLE = False
+
+from media_metadata import VIDEO_EXTENSIONS
+
+ARCHIVE_FILENAME = "archive.db"
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+FASTSTART_EXTENSIONS = (".mp4", ".mov", ".m4v")
+COPY_FORMATS = {"webp": ".webp", "avif": ".avif"}
+IN_PLACE_MODES = ("jpeg", "faststart")  # Reemplazan el original (el resto escribe una copia)
+MODES = IN_PLACE_MODES + tuple(COPY_FORMATS)
+# Átomos que contienen otros átomos en el camino hasta stco/co64
+CONTAINER_ATOMS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"udta"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS optimized (
+    path TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    status TEXT NOT NULL,
+    size_before INTEGER,
+    size_after INTEGER,
+    cpu_s REAL,
+    mtime REAL,
+    detail TEXT,
+    optimized_at REAL NOT NULL,
+    PRIMARY KEY (path, mode)
+) WITHOUT ROWID;
+"""
+
+
+def default_archive_path(save_path):
+    return os.path.join(save_path, ".index", ARCHIVE_FILENAME)
+
+
+def mode_applies(mode, path):
+    lower = path.lower()
+    if mode == "jpeg":
+        return lower.endswith(JPEG_EXTENSIONS)
+    if mode == "faststart":
+        return lower.endswith(FASTSTART_EXTENSIONS)
+    return not lower.endswith(VIDEO_EXTENSIONS)
+
+
+def parse_modes(text):
+    modes = [mode.strip() for mode in (text or "").split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        raise ValueError(f"modos desconocidos: {', '.join(unknown)} (válidos: {', '.join(MODES)})")
+    return modes
+
+
+def parse_hours(text):
+    """'02:00-06:00' -> (120, 360) en minutos; la franja puede cruzar la medianoche"""
+    start, end = text.split("-")
+    to_minutes = lambda clock: int(clock.split(":")[0]) * 60 + int(clock.split(":")[1])
+    return to_minutes(start), to_minutes(end)
+
+
+# --- MP4/MOV: faststart ---------------------------------------------------------
+
+def iter_atoms(f, start, end):
+    """(tipo, posición, tamaño total, tamaño de cabecera) de los átomos entre start y end"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, atom_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            raise ValueError(f"átomo {atom_type!r} corrupto en {position}")
+        yield atom_type, position, size, header
+        position += size
+
+
+def shift_chunk_offsets(moov, delta):
+    """Suma delta a las tablas stco/co64 de un moov (bytearray) con NumPy, en su sitio"""
+    patched = 0
+
+    def walk(start, end):
+        nonlocal patched
+        position = start
+        while position + 8 <= end:
+            size, atom_type = struct.unpack_from(">I4s", moov, position)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from(">Q", moov, position + 8)[0]
+                header = 16
+            if size < header or position + size > end:
+                raise ValueError(f"átomo {atom_type!r} corrupto dentro de moov")
+            if atom_type in CONTAINER_ATOMS:
+                walk(position + header, position + size)
+            elif atom_type in (b"stco", b"co64"):
+                count = struct.unpack_from(">I", moov, position + header + 4)[0]
+                dtype = ">u4" if atom_type == b"stco" else ">u8"
+                table_start = position + header + 8
+                offsets = np.frombuffer(moov, dtype=dtype, count=count, offset=table_start).astype(np.uint64)
+                offsets += delta
+                if atom_type == b"stco" and count and offsets.max() > 0xFFFFFFFF:
+                    raise ValueError("los desplazamientos no caben en stco de 32 bits")
+                moov[table_start:table_start + offsets.size * np.dtype(dtype).itemsize] = offsets.astype(dtype).tobytes()
+                patched += 1
+            elif atom_type == b"cmov":
+                raise ValueError("moov comprimido (cmov) no soportado")
+            position += size
+
+    walk(8, len(moov))
+    return patched
+
+
+def faststart(source_path, target_path):
+    """Escribe en target_path el video con moov delante. None si ya estaba bien colocado."""
+    with open(source_path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        atoms = list(iter_atoms(f, 0, end))
+        types = [atom[0] for atom in atoms]
+        if b"moov" not in types or b"mdat" not in types:
+            raise ValueError("no es un MP4/MOV con moov y mdat")
+        if types.index(b"moov") < types.index(b"mdat"):
+            return None
+        moov_atom = atoms[types.index(b"moov")]
+        if moov_atom[3] != 8:
+            raise ValueError("moov con tamaño de 64 bits no soportado")
+        f.seek(moov_atom[1])
+        moov = bytearray(f.read(moov_atom[2]))
+        shift_chunk_offsets(moov, len(moov))
+
+        first_media = next(i for i, atom in enumerate(atoms) if atom[0] not in (b"ftyp", b"free", b"skip", b"wide"))
+        with open(target_path, "wb") as out:
+            for index, (atom_type, position, size, _) in enumerate(atoms):
+                if index == first_media:
+                    out.write(moov)
+                if atom_type == b"moov":
+                    continue
+                f.seek(position)
+                _copy_range(f, out, size)
+    return True
+
+
+def _copy_range(source, target, length, chunk=4 * 1024 * 1024):
+    while length > 0:
+        data = source.read(min(chunk, length))
+        if not data:
+            raise ValueError("archivo truncado")
+        target.write(data)
+        length -= len(data)
+
+
+def mdat_digest(path):
+    """Hash de los datos de mdat (idénticos antes y después de mover moov)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        for atom_type, position, size, header in iter_atoms(f, 0, end):
+            if atom_type == b"mdat":
+                f.seek(position + header)
+                remaining = size - header
+                while remaining > 0:
+                    data = f.read(min(4 * 1024 * 1024, remaining))
+                    if not data:
+                        break
+                    digest.update(data)
+                    remaining -= len(data)
+    return digest.hexdigest()
+
+
+def verify_faststart(source_path, target_path):
+    with open(target_path, "rb") as f:
+        types = [atom[0] for atom in iter_atoms(f, 0, os.fstat(f.fileno()).st_size)]
+    if types.index(b"moov") > types.index(b"mdat"):
+        return "moov sigue detrás de mdat"
+    if os.path.getsize(source_path) != os.path.getsize(target_path):
+        return "el tamaño cambió"
+    if mdat_digest(source_path) != mdat_digest(target_path):
+        return "los datos de mdat no coinciden"
+    return None
+
+
+# --- JPEG sin pérdida -------------------------------------------------------------
+
+def jpegtran_available():
+    return shutil.which("jpegtran") is not None
+
+
+def optimize_jpeg(source_path, target_path):
+    subprocess.run(
+        ["jpegtran", "-copy", "all", "-optimize", "-outfile", target_path, source_path],
+        check=True, capture_output=True, timeout=300,
+    )
+    return True
+
+
+def verify_jpeg(source_path, target_path):
+    """Mismos píxeles decodificados y mismo EXIF"""
+    with Image.open(source_path) as original, Image.open(target_path) as optimized:
+        if original.size != optimized.size or original.mode != optimized.mode:
+            return "dimensiones o modo distintos"
+        if original.info.get("exif") != optimized.info.get("exif"):
+            return "el EXIF no coincide"
+        if ImageChops.difference(original, optimized).getbbox() is not None:
+            return "los píxeles no coinciden"
+    return None
+
+
+# --- Copias WebP / AVIF -------------------------------------------------------------
+
+def write_archival_copy(source_path, target_path, image_format, quality):
+    with Image.open(source_path) as img:
+        options = {"quality": quality}
+        if img.info.get("exif"):
+            options["exif"] = img.info["exif"]
+        if img.info.get("icc_profile"):
+            options["icc_profile"] = img.info["icc_profile"]
+        if image_format == "webp":
+            options["method"] = 6
+        converted = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+        converted.save(target_path, format=image_format.upper(), **options)
+    return True
+
+
+def psnr(source_path, target_path, side=1024):
+    """PSNR entre reducciones equivalentes de los dos archivos"""
+    arrays = []
+    for path in (source_path, target_path):
+        with Image.open(path) as img:
+            img.draft("RGB", (side, side))
+            proxy = img.convert("RGB").resize((side, side))
+            arrays.append(np.asarray(proxy, dtype=np.float32))
+    mse = float(np.mean((arrays[0] - arrays[1]) ** 2))
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def verify_copy(source_path, target_path, min_psnr):
+    with Image.open(source_path) as original, Image.open(target_path) as copy:
+        if original.size != copy.size:
+            return "dimensiones distintas"
+    value = psnr(source_path, target_path)
+    if value < min_psnr:
+        return f"PSNR {value:.1f}dB < {min_psnr}dB"
+    return None
+
+
+# --- Trabajo por archivo (en el pool) ---------------------------------------------------
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def replace_preserving(temp_path, final_path):
+    """Reemplaza final_path por temp_path con los permisos, dueño y fechas del original"""
+    info = os.stat(final_path)
+    shutil.copystat(final_path, temp_path)
+    try:
+        os.chown(temp_path, info.st_uid, info.st_gid)
+    except PermissionError:
+        pass
+    os.replace(temp_path, final_path)
+    os.utime(final_path, ns=(info.st_atime_ns, info.st_mtime_ns))
+
+
+def process_file(task):
+    """Aplica un modo a un archivo. Devuelve un diccionario serializable con el resultado."""
+    path, relative, mode, options = task
+    started_cpu = _cpu_seconds()
+    result = {"path": relative, "mode": mode, "status": "error", "size_before": os.path.getsize(path),
+              "size_after": None, "detail": None}
+    directory, filename = os.path.split(path)
+    temp_path = os.path.join(directory, f".{filename}.opt")
+    try:
+        if mode in COPY_FORMATS:
+            copy_path = os.path.join(options["copy_path"], os.path.splitext(relative)[0] + COPY_FORMATS[mode])
+            os.makedirs(os.path.dirname(copy_path), mode=0o775, exist_ok=True)
+            temp_path = f"{copy_path}.tmp"
+            write_archival_copy(path, temp_path, mode, options["quality"])
+            error = verify_copy(path, temp_path, options["min_psnr"])
+            final_path = copy_path
+        else:
+            changed = (optimize_jpeg if mode == "jpeg" else faststart)(path, temp_path)
+            if changed is None:
+                result.update(status="skipped", size_after=result["size_before"], detail="ya optimizado")
+                return result
+            error = (verify_jpeg if mode == "jpeg" else verify_faststart)(path, temp_path)
+            final_path = path
+
+        size_after = os.path.getsize(temp_path)
+        if error:
+            # No se reintenta: volvería a fallar igual
+            result.update(status="rejected", detail=f"verificación fallida: {error}")
+        elif mode != "faststart" and size_after >= result["size_before"]:
+            result.update(status="skipped", size_after=result["size_before"], detail="sin ahorro")
+        else:
+            if final_path == path:
+                replace_preserving(temp_path, path)
+            else:
+                os.replace(temp_path, final_path)
+            result.update(status="done", size_after=size_after)
+    except Exception as e:
+        result["detail"] = str(e)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        result["cpu_s"] = _cpu_seconds() - started_cpu
+        result["mtime"] = os.path.getmtime(path)
+    return result
+
+
+def create_pool(workers):
+    """Pool de procesos con 'spawn': los trabajadores no heredan el estado del bot"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class ArchiveLog:
+    """Registro en SQLite de lo ya procesado y del ahorro conseguido"""
+
+    def __init__(self, save_path, db_path=None):
+        self.db_path = db_path or default_archive_path(save_path)
+        os.makedirs(os.path.dirname(self.db_path), mode=0o775, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def processed(self, mode):
+        """{ruta: mtime} de los archivos ya procesados o descartados en ese modo (los errores se reintentan)"""
+        return {row[0]: row[1] for row in self.conn.execute(
+            "SELECT path, mtime FROM optimized WHERE mode = ? AND status != 'error'", (mode,)
+        )}
+
+    def record(self, result):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO optimized "
+                "(path, mode, status, size_before, size_after, cpu_s, mtime, detail, optimized_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result["path"], result["mode"], result["status"], result["size_before"],
+                 result["size_after"], result["cpu_s"], result["mtime"], result["detail"], time.time()),
+            )
+
+    def totals(self):
+        """{modo: (archivos, bytes ahorrados, segundos de CPU, errores)}"""
+        return {row[0]: row[1:] for row in self.conn.execute(
+            "SELECT mode, SUM(status = 'done'), "
+            "COALESCE(SUM(CASE WHEN status = 'done' THEN size_before - size_after END), 0), "
+            "COALESCE(SUM(cpu_s), 0), SUM(status IN ('error', 'rejected')) FROM optimized GROUP BY mode ORDER BY mode"
+        )}
+
+
+def pending_tasks(save_path, files, modes, log, options, min_age_days=2):
+    """Tareas (ruta, relativa, modo, opciones) para los archivos con antigüedad suficiente.
+
+    files: {ruta relativa: (tamaño, mtime)}, por ejemplo MediaIndex.known_files().
+    """
+    limit = time.time() - min_age_days * 86400
+    tasks = []
+    for mode in modes:
+        done = log.processed(mode)
+        for relative, (_, mtime) in sorted(files.items()):
+            if not mode_applies(mode, relative) or (mtime and mtime > limit):
+                continue
+            if relative in done and abs(done[relative] - (mtime or 0)) < 1:
+                continue
+            tasks.append((os.path.join(save_path, relative), relative, mode, options))
+    return tasks
+
+
+def run(tasks, log, workers=2, deadline=None, on_result=None):
+    """Procesa las tareas en el pool hasta terminar o hasta deadline (time.time()).
+
+    Devuelve el resumen {"done", "skipped", "errors", "saved_bytes", "cpu_s", "elapsed_s", "pending"}
+    y en "replaced" los (ruta relativa, tamaño nuevo) de los originales reescritos.
+    """
+    summary = {"done": 0, "skipped": 0, "errors": 0, "saved_bytes": 0, "cpu_s": 0.0, "pending": 0, "replaced": []}
+    started = time.perf_counter()
+    queue = list(reversed(tasks))
+    with create_pool(workers) as pool:
+        running = set()
+        while queue or running:
+            # Nunca más tareas en vuelo que procesos: al acabar la franja solo se espera a las que corren
+            while queue and len(running) < workers and (deadline is None or time.time() < deadline):
+                running.add(pool.submit(process_file, queue.pop()))
+            if not running:
+                break
+            finished = next(as_completed(running))
+            running.discard(finished)
+            result = finished.result()
+            log.record(result)
+            summary["cpu_s"] += result["cpu_s"]
+            if result["status"] == "done":
+                summary["done"] += 1
+                summary["saved_bytes"] += result["size_before"] - result["size_after"]
+                if result["mode"] in IN_PLACE_MODES:
+                    summary["replaced"].append((result["path"], result["size_after"]))
+            elif result["status"] == "skipped":
+                summary["skipped"] += 1
+            else:
+                summary["errors"] += 1
+            if on_result:
+                on_result(result)
+    summary["pending"] = len(queue)
+    summary["elapsed_s"] = time.perf_counter() - started
+    return summary
+
+
+def available_modes(modes):
+    """Quita los modos cuyas herramientas no están instaladas (avisando)"""
+    modes = list(modes)
+    if "jpeg" in modes and not jpegtran_available():
+        print("⚠️ jpegtran no está instalado: se omite el modo jpeg")
+        modes.remove("jpeg")
+    if "avif" in modes and not AVIF_AVAILABLE:
+        print("⚠️ AVIF no disponible en pillow-heif: se omite el modo avif")
+        modes.remove("avif")
+    return modes
+
+
+def format_summary(summary):
+    return (f"{summary['done']} optimizados, {summary['skipped']} sin cambios, {summary['errors']} errores "
+            f"en {summary['elapsed_s']:.1f}s; ahorro {summary['saved_bytes'] / (1024 * 1024):.1f}MB, "
+            f"CPU {summary['cpu_s']:.1f}s")
+
+
+def format_result(result):
+    if result["status"] in ("error", "rejected"):
+        return f"❌ {result['path']} ({result['mode']}): {result['detail']}"
+    if result["status"] == "done" and result["mode"] == "faststart":
+        return f"🎬 {result['path']} (faststart): moov al principio, CPU {result['cpu_s']:.2f}s"
+    if result["status"] == "skipped":
+        return f"⏭️ {result['path']} ({result['mode']}): {result['detail']}"
+    saved = result["size_before"] - result["size_after"]
+    return (f"🗜️ {result['path']} ({result['mode']}): {result['size_before'] / 1024:.0f}KB -> "
+            f"{result['size_after'] / 1024:.0f}KB ({saved / max(1, result['size_before']):.1%} menos), "
+            f"CPU {result['cpu_s']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recomprime sin pérdida el archivo de fotos y videos")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--modes", default=os.getenv("ARCHIVE_MODES", "jpeg,faststart"))
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto, todos los núcleos)")
+    parser.add_argument("--min-age-days", type=int, default=2, help="No tocar archivos más recientes")
+    parser.add_argument("--copy-path", default=None, help="Destino de las copias webp/avif")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--min-psnr", type=float, default=40.0)
+    parser.add_argument("--report", action="store_true", help="Solo mostrar el ahorro acumulado")
+    args = parser.parse_args()
+
+    from media_index import MediaIndex
+
+    log = ArchiveLog(args.root)
+    if not args.report:
+        modes = available_modes(parse_modes(args.modes))
+        options = {"copy_path": args.copy_path or os.path.join(args.root, ".archivo"),
+                   "quality": args.quality, "min_psnr": args.min_psnr}
+        index = MediaIndex(args.root)
+        tasks = pending_tasks(args.root, index.known_files(), modes, log, options, args.min_age_days)
+        workers = args.workers or os.cpu_count() or 1
+        print(f"🔎 {len(tasks)} tareas ({', '.join(modes) or 'ningún modo'}) con {workers} procesos")
+        summary = run(tasks, log, workers, on_result=lambda result: print(format_result(result)))
+        index.update_sizes(summary["replaced"])
+        print(f"\n📊 {format_summary(summary)}")
+    for mode, (files, saved, cpu_s, errors) in log.totals().items():
+        print(f"📦 {mode}: {files or 0} archivos, {saved / (1024 * 1024):.1f}MB ahorrados, "
+              f"CPU {cpu_s:.1f}s, {errors or 0} errores")
+
+
+if __name__ == "__main__":
+    main()
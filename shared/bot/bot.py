@@ -1,15 +1,28 @@
 import os
+import io
 import random
 import asyncio
 import json
+import re
 import tempfile
 import shutil
 import stat
+import struct
+import zlib
+import errno
+import hashlib
+import resource
+import contextlib
+import time
+import threading
 import pwd
 import grp
+from collections import deque
+from types import SimpleNamespace
 from datetime import datetime, timedelta
 
-from telegram import Update
+from telegram import Update, InputFile, InputMediaPhoto, InputMediaVideo, InputMediaDocument
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -19,6 +32,18 @@ from telegram.ext import (
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.date import DateTrigger
+
+# Generación de planes (perfiles por día, horas de silencio, separación mínima)
+import numpy as np
+from plan_generator import generator_from_env, write_plans, PlanWriteError
+
+# Historial de planes y cumplimiento (/stats)
+from plan_history import PlanHistory, compact_plans
+
+# Jobs de notificación persistentes (sobreviven a reinicios)
+from job_store import SQLiteJobStore
 
 # Importaciones opcionales con fallback
 try:
@@ -40,19 +65,181 @@ except Exception as e:
     CV2_AVAILABLE = False
     print(f"⚠️ Error cargando OpenCV - validación de duración de video deshabilitada: {e}")
 
+# Conversión HEIC/HEIF (registra además el plugin de Pillow para leer sus cabeceras)
+from heif_normalizer import HEIF_AVAILABLE, is_heif, convert_heif, derivative_path_for, create_pool
+if HEIF_AVAILABLE:
+    print("✅ pillow-heif cargado correctamente")
+else:
+    print("⚠️ pillow-heif no disponible - las fotos HEIC/HEIF se guardan sin copia web")
+
+# Índice de archivos guardados con sus metadatos de captura (EXIF/QuickTime)
+from media_index import MediaIndex, file_sha256
+
+# Sorteo de recuerdos en tiempo constante (también exportado para la web)
+from memory_sampler import MemorySampler, parse_weights
+
+# Resúmenes del día y del mes (hoja de contactos y timelapse)
+from recap_renderer import render_recap
+
+# Filtro de calidad opcional (borrosas, negras o quemadas)
+from quality_gate import REASONS as QUALITY_REASONS, check_file as check_quality_file
+
+# Recompresión del archivo en horas de poca actividad (jpegtran, faststart, copias WebP/AVIF)
+import archive_optimizer
+# Archivo frío: los meses cerrados se empaquetan en un tar indexado por mes
+import media_tiering
+# Copia incremental a otro volumen a partir del manifiesto de la ingesta
+import media_backup
+# Registro de cambios (guardados, entregas, planes) para que la web no sondee el disco
+from change_feed import ChangeFeed, FeedServer, default_socket_path
+# API web de solo lectura servida desde el índice (feed, calendario, stats, archivos)
+from media_api import MediaAPI
+# Cola persistente para repartir el análisis de la ingesta entre procesos trabajadores
+from work_queue import WorkQueue, WorkerPool, ResultWaiter, default_queue_path, new_job_key
+from media_metadata import extract_metadata
+# Pools HTTP separados para getUpdates, la API y las descargas de archivos
+from http_pools import MeteredRequest, Downloader, DownloadError
+# Acceso al disco en un pool propio, con tiempo máximo y métricas por operación
+from storage import Storage, StorageTimeout, write_json_atomic, parent_chain
+
 # Configuración
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 USER_ID = int(os.getenv("TELEGRAM_USER_ID"))
-SAVE_PATH = "/data/fotos"
+SAVE_PATH = os.getenv("DATA_PATH", "/data/fotos")
+
+# Servidor propio de la Bot API (opcional): https://github.com/tdlib/telegram-bot-api
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")  # ej. http://telegram-bot-api:8081/bot
+TELEGRAM_API_FILE_URL = os.getenv("TELEGRAM_API_FILE_URL")  # ej. http://telegram-bot-api:8081/file/bot
+TELEGRAM_LOCAL_MODE = os.getenv("TELEGRAM_LOCAL_MODE", "false").lower() == "true"  # Servidor con --local
+TELEGRAM_LOCAL_HANDOFF = os.getenv("TELEGRAM_LOCAL_HANDOFF", "link")  # link | rename | copy
+LOCAL_STAGING_PATH = f"{SAVE_PATH}/.ingesta"  # Mismo volumen que SAVE_PATH: mover es un rename
+
+# Conexiones HTTP: el long-poll, los mensajes y las descargas no comparten pool
+HTTP_UPDATES_TIMEOUT = int(os.getenv("HTTP_UPDATES_TIMEOUT", "30"))  # Segundos de cada long-poll de getUpdates
+HTTP_API_POOL_SIZE = int(os.getenv("HTTP_API_POOL_SIZE", "8"))  # Conexiones para mensajes, get_file y subidas
+HTTP_API_TIMEOUT = float(os.getenv("HTTP_API_TIMEOUT", "20"))  # Lectura/escritura; cubre subidas de álbumes
+HTTP_DOWNLOAD_CONCURRENCY = int(os.getenv("HTTP_DOWNLOAD_CONCURRENCY", "2"))  # Descargas a la vez
+HTTP_DOWNLOAD_TIMEOUT = float(os.getenv("HTTP_DOWNLOAD_TIMEOUT", "60"))  # Segundos sin recibir datos
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"  # API y descargas por HTTP/2 (requiere h2)
 
 # Límites de contenido
 MAX_VIDEO_DURATION = 20  # segundos
 MIN_PHOTO_RESOLUTION = 1920 * 1080  # 1080p mínimo para fotos
-MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+MAX_FILE_SIZE_MB = 2000 if TELEGRAM_LOCAL_MODE else 20  # La API en la nube limita las descargas a 20MB
+MAX_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
+
+# Límites de memoria para procesar imágenes (el NAS tiene poca RAM)
+IMAGE_MEMORY_LIMIT_MB = int(os.getenv("IMAGE_MEMORY_LIMIT_MB", "96"))  # Máximo por tarea de decodificación
+IMAGE_PROXY_MAX_SIDE = int(os.getenv("IMAGE_PROXY_MAX_SIDE", "1024"))  # Lado máximo de las copias reducidas
+PNG_TILE_ROWS = int(os.getenv("PNG_TILE_ROWS", "256"))  # Filas por banda al procesar PNG grandes
+
+# Filtro de calidad: nitidez y exposición sobre una copia reducida (desactivado por defecto)
+QUALITY_GATE = os.getenv("QUALITY_GATE", "false").lower() == "true"
+QUALITY_THRESHOLDS = {
+    "min_sharpness": float(os.getenv("QUALITY_MIN_SHARPNESS", "20")),  # Varianza del laplaciano
+    "max_dark": float(os.getenv("QUALITY_MAX_DARK", "0.9")),  # Fracción máxima de píxeles negros
+    "max_bright": float(os.getenv("QUALITY_MAX_BRIGHT", "0.8")),  # Fracción máxima de píxeles quemados
+}
+QUALITY_PROXY_SIDE = int(os.getenv("QUALITY_PROXY_SIDE", "512"))
+QUALITY_VIDEO_FRAMES = int(os.getenv("QUALITY_VIDEO_FRAMES", "3"))
+QUALITY_BUDGET_MS = float(os.getenv("QUALITY_BUDGET_MS", "150"))  # Presupuesto por comprobación
+
+# Pipeline de ingesta (trabajadores por etapa y tamaño de las colas entre etapas)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+INGEST_DOWNLOAD_WORKERS = int(os.getenv("INGEST_DOWNLOAD_WORKERS", "3"))
+INGEST_VALIDATE_WORKERS = int(os.getenv("INGEST_VALIDATE_WORKERS", "2"))
+INGEST_STORE_WORKERS = int(os.getenv("INGEST_STORE_WORKERS", "2"))
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.5"))  # Segundos para reunir un álbum
+
+# Disco (NAS): las llamadas al sistema de archivos no bloquean el bucle de eventos
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "4"))
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "15"))  # Segundos por operación; 0 = sin límite
+STORAGE_SLOW_MS = float(os.getenv("STORAGE_SLOW_MS", "500"))  # A partir de aquí se avisa en el log
+STORAGE_BATCH_MS = float(os.getenv("STORAGE_BATCH_MS", "5"))  # Ventana para agrupar chown/chmod
+
+# Procesos de análisis: validación, calidad, HEIF y metadatos fuera del proceso del bot
+# 0 = todo en el bot (hilos y pool HEIF); "auto" = uno por núcleo
+_process_workers = os.getenv("INGEST_PROCESS_WORKERS", "0")
+INGEST_PROCESS_WORKERS = (os.cpu_count() or 1) if _process_workers == "auto" else int(_process_workers)
+INGEST_TASK_KIND = "ingest"
+
+# Copias web de las fotos HEIC/HEIF (se decodifican en un pool de procesos)
+HEIF_WORKERS = int(os.getenv("HEIF_WORKERS", "2"))
+HEIF_DERIVATIVE_FORMAT = os.getenv("HEIF_DERIVATIVE_FORMAT", "jpeg")  # jpeg | webp
+HEIF_DERIVATIVE_QUALITY = int(os.getenv("HEIF_DERIVATIVE_QUALITY", "90"))
+
+# Búsqueda por ubicación (/cerca o enviando una ubicación)
+NEAR_RADIUS_M = int(os.getenv("NEAR_RADIUS_M", "1000"))
+NEAR_MAX_RESULTS = 10
+
+# Reenvío de archivos guardados (/recuerdo, /dia y resumen diario)
+DAILY_DIGEST_TIME = os.getenv("DAILY_DIGEST_TIME", "")  # HH:MM; vacío = sin resumen diario
+MEDIA_GROUP_LIMIT = 10  # Máximo de elementos por álbum de Telegram
+
+# Sorteo de recuerdos (/azar y la web): pesos por tipo y por año, p. ej. "foto=1,video=2" y "2023=2"
+SAMPLER_TYPE_WEIGHTS = parse_weights(os.getenv("SAMPLER_TYPE_WEIGHTS", ""))
+SAMPLER_YEAR_WEIGHTS = parse_weights(os.getenv("SAMPLER_YEAR_WEIGHTS", ""))
+SAMPLER_EXPORT_MINUTES = int(os.getenv("SAMPLER_EXPORT_MINUTES", "5"))
+RANDOM_MAX_RESULTS = 10
+
+# Planes generados por adelantado (en lote, fuera de la medianoche)
+PLAN_DAYS_AHEAD = int(os.getenv("PLAN_DAYS_AHEAD", "7"))
+PLAN_PREGENERATE_TIME = os.getenv("PLAN_PREGENERATE_TIME", "03:00")
+
+# Días de planes JSON que se conservan tras compactarlos en el historial (0 = todos)
+PLAN_HISTORY_KEEP_DAYS = int(os.getenv("PLAN_HISTORY_KEEP_DAYS", "0"))
+
+# Notificaciones programadas: se guardan en SQLite y se reanudan al reiniciar
+NOTIFICATION_MISFIRE_GRACE_MINUTES = int(os.getenv("NOTIFICATION_MISFIRE_GRACE_MINUTES", "30"))
+NOTIFICATION_JOBSTORE = "plan"
+
+# Resúmenes renderizados: tras la última notificación del día y a fin de mes
+RECAP_DAILY = os.getenv("RECAP_DAILY", "true").lower() == "true"
+RECAP_MONTHLY = os.getenv("RECAP_MONTHLY", "true").lower() == "true"
+RECAP_DELAY_MINUTES = int(os.getenv("RECAP_DELAY_MINUTES", "60"))  # Margen tras la última ventana
+RECAP_MONTHLY_TIME = os.getenv("RECAP_MONTHLY_TIME", "23:30")  # HH:MM del último día del mes
+
+# Recompresión del archivo: modos separados por comas (jpeg,faststart,webp,avif); vacío = desactivada
+ARCHIVE_MODES = archive_optimizer.parse_modes(os.getenv("ARCHIVE_MODES", ""))
+ARCHIVE_HOURS = os.getenv("ARCHIVE_HOURS", "02:00-06:00")  # Franja de poca actividad
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", "1"))
+ARCHIVE_MIN_AGE_DAYS = int(os.getenv("ARCHIVE_MIN_AGE_DAYS", "2"))  # No tocar archivos recientes
+ARCHIVE_COPY_PATH = os.getenv("ARCHIVE_COPY_PATH", "")  # Copias webp/avif; vacío = SAVE_PATH/.archivo
+ARCHIVE_QUALITY = int(os.getenv("ARCHIVE_QUALITY", "90"))
+ARCHIVE_MIN_PSNR = float(os.getenv("ARCHIVE_MIN_PSNR", "40"))
+
+# Archivo frío: días recientes que quedan sueltos (0 = desactivado) y hora del empaquetado
+TIERING_HOT_DAYS = int(os.getenv("TIERING_HOT_DAYS", "0"))
+TIERING_TIME = os.getenv("TIERING_TIME", "06:30")  # Tras la franja de recompresión
+
+# Copia de seguridad incremental a otra ruta montada (vacío = desactivada)
+BACKUP_PATH = os.getenv("BACKUP_PATH", "")
+BACKUP_TIME = os.getenv("BACKUP_TIME", "07:00")  # Tras el empaquetado del archivo frío
+BACKUP_WORKERS = int(os.getenv("BACKUP_WORKERS", "4"))  # Archivos copiándose a la vez
+BACKUP_PRUNE = os.getenv("BACKUP_PRUNE", "false").lower() == "true"  # Borrar de la copia lo borrado aquí
+BACKUP_RESCAN_DAYS = int(os.getenv("BACKUP_RESCAN_DAYS", "7"))  # Repaso completo del origen
+
+# Registro de cambios en SAVE_PATH/.index/changes.jsonl y socket Unix para avisos en vivo
+CHANGE_FEED_MAX_MB = float(os.getenv("CHANGE_FEED_MAX_MB", "5"))  # Tamaño antes de rotar
+CHANGE_FEED_KEEP = int(os.getenv("CHANGE_FEED_KEEP", "3"))  # Archivos rotados que se conservan
+CHANGE_FEED_SOCKET = os.getenv("CHANGE_FEED_SOCKET", "true").lower() == "true"  # .index/changes.sock
+
+# API de medios en Python dentro del bot (0 = desactivada; la web PHP sigue funcionando igual)
+MEDIA_API_PORT = int(os.getenv("MEDIA_API_PORT", "0"))
+MEDIA_API_HOST = os.getenv("MEDIA_API_HOST", "0.0.0.0")
+MEDIA_API_THUMB_WORKERS = int(os.getenv("MEDIA_API_THUMB_WORKERS", "2"))  # Miniaturas generándose a la vez
+
+# Archivos recientes que se recuerdan en memoria para los comandos de administración
+RECENT_FILES_SIZE = int(os.getenv("RECENT_FILES_SIZE", "20"))
 
 # Configurar umask globalmente al inicio
 os.umask(0o002)
 
+# Reloj del bot (el simulador replay_harness.py lo sustituye por un reloj virtual)
+def get_current_datetime():
+    """Devuelve la fecha y hora actual usada por toda la lógica de planificación"""
+    return datetime.now()
+
 # Función para configurar permisos de archivos y directorios
 def setup_file_permissions(file_path):
     """Configura permisos correctos para un archivo o directorio"""
@@ -112,6 +299,16 @@ def setup_directory_permissions(dir_path):
         print(f"❌ Error configurando estructura de directorios {dir_path}: {e}")
         return False
 
+# Pool del disco (se crea con la primera operación)
+storage = None
+
+def get_storage():
+    global storage
+    if storage is None:
+        storage = Storage(STORAGE_WORKERS, STORAGE_TIMEOUT, STORAGE_SLOW_MS, STORAGE_BATCH_MS,
+                          finalize=setup_file_permissions)
+    return storage
+
 # Función para obtener texto de requisitos
 def get_requirements_text():
     """Devuelve el texto con los requisitos de contenido"""
@@ -119,7 +316,7 @@ def get_requirements_text():
         "📏 **Requisitos obligatorios:**",
         "• 📸 Fotos: Mínimo 1080p (1920x1080)",
         "• 🎥 Videos: Máximo 20 segundos",
-        "• 📦 Tamaño: Máximo 20MB",
+        f"• 📦 Tamaño: Máximo {MAX_FILE_SIZE_MB}MB",
         "• 🔧 Usa máxima calidad en tu cámara"
     ]
 
@@ -131,68 +328,180 @@ def get_requirements_text():
 
     return "\n".join(requirements)
 
+# Estado en memoria: plan del día ya leído y últimos archivos guardados.
+# Los comandos responden desde aquí en lugar de recorrer o releer el disco.
+PLAN_CACHE = {"path": None, "signature": None, "plan": None}
+PLAN_LOCK = threading.RLock()  # El plan se lee y escribe desde los hilos del pool del disco
+PREPARED_PLAN_DIRS = set()
+RECENT_FILES = deque(maxlen=RECENT_FILES_SIZE)
+ANSWERED_REPEATED_GROUPS = deque(maxlen=50)  # Álbumes repetidos ya respondidos
+REJECTED_GROUPS = deque(maxlen=50)  # Álbumes rechazados en su primer elemento: el resto se descarta
+IDEMPOTENCY_STATS = {"repeated": 0, "recorded": 0}
+
+def reset_runtime_state():
+    """Olvida el estado en memoria (el simulador lo usa al cambiar de usuario)"""
+    global memory_sampler
+    memory_sampler = None
+    PLAN_CACHE.update(path=None, signature=None, plan=None)
+    PREPARED_PLAN_DIRS.clear()
+    RECENT_FILES.clear()
+    ANSWERED_REPEATED_GROUPS.clear()
+    REJECTED_GROUPS.clear()
+
 # Ruta para guardar el plan en JSON
-def get_plan_json_path():
-    today = datetime.now().strftime("%Y-%m-%d")
+def get_plan_json_path(date=None):
+    date = date or get_current_datetime().strftime("%Y-%m-%d")
     plan_dir = f"{SAVE_PATH}/planificacion"
-    plan_path = f"{plan_dir}/{today}.json"
+    plan_path = f"{plan_dir}/{date}.json"
 
-    # Asegurar que el directorio de planificación existe con permisos correctos
-    try:
-        os.makedirs(plan_dir, mode=0o775, exist_ok=True)
-        setup_file_permissions(plan_dir)
-    except Exception as e:
-        print(f"⚠️ Error creando directorio de planificación: {e}")
+    # Asegurar que el directorio de planificación existe con permisos correctos (una vez)
+    if plan_dir not in PREPARED_PLAN_DIRS:
+        try:
+            os.makedirs(plan_dir, mode=0o775, exist_ok=True)
+            setup_file_permissions(plan_dir)
+            PREPARED_PLAN_DIRS.add(plan_dir)
+        except Exception as e:
+            print(f"⚠️ Error creando directorio de planificación: {e}")
 
     return plan_path
 
+def _plan_signature(path):
+    info = os.stat(path)
+    return info.st_mtime_ns, info.st_size
+
 def save_plan_json(plan):
     path = get_plan_json_path()
     try:
-        with open(path, "w") as f:
-            json.dump(plan, f, indent=2)
-        # Configurar permisos del archivo JSON
-        setup_file_permissions(path)
+        with PLAN_LOCK:
+            # Temporal + rename: la web nunca lee un plan a medio escribir
+            write_json_atomic(path, plan, indent=2)
+            # Configurar permisos del archivo JSON
+            setup_file_permissions(path)
+            PLAN_CACHE.update(path=path, signature=_plan_signature(path), plan=[dict(entry) for entry in plan])
         print(f"✅ Plan guardado en {path}")
     except Exception as e:
         print(f"❌ Error guardando plan: {e}")
 
 def load_plan_json():
+    """Plan del día; se relee del disco solo si el archivo cambió (mtime y tamaño)"""
     path = get_plan_json_path()
-    if not os.path.exists(path):
-        return None
+    with PLAN_LOCK:
+        try:
+            signature = _plan_signature(path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Error cargando plan json: {e}")
+            return None
+        if PLAN_CACHE["path"] != path or PLAN_CACHE["signature"] != signature:
+            try:
+                with open(path, "r") as f:
+                    plan = json.load(f)
+            except Exception as e:
+                print(f"Error cargando plan json: {e}")
+                return None
+            PLAN_CACHE.update(path=path, signature=signature, plan=plan)
+        # Copia: quien la modifique debe guardarla con save_plan_json
+        return [dict(entry) for entry in PLAN_CACHE["plan"]]
+
+async def load_plan():
+    """load_plan_json en el pool del disco; si el NAS no responde a tiempo se usa el plan en memoria"""
+    try:
+        return await get_storage().run("plan.load", load_plan_json)
+    except StorageTimeout:
+        today = f"{get_current_datetime().strftime('%Y-%m-%d')}.json"
+        with PLAN_LOCK:
+            if PLAN_CACHE["plan"] is None or os.path.basename(PLAN_CACHE["path"]) != today:
+                return None
+            return [dict(entry) for entry in PLAN_CACHE["plan"]]
+
+async def save_plan(plan):
+    # Sin tiempo máximo: tras un timeout la escritura seguiría en su hilo y el aviso de error sería falso
+    await get_storage().run("plan.save", save_plan_json, plan, timeout=0)
+
+# Registro de cambios (se abre con SAVE_PATH, como el índice de medios)
+change_feed = None
+
+def get_change_feed():
+    global change_feed
+    if change_feed is None or change_feed.save_path != SAVE_PATH:
+        change_feed = ChangeFeed(
+            SAVE_PATH, max_bytes=int(CHANGE_FEED_MAX_MB * 1024 * 1024), keep=CHANGE_FEED_KEEP,
+            finalize=setup_file_permissions
+        )
+    return change_feed
+
+def publish_change(event_type, date=None, **fields):
+    """Anota un cambio en el registro; un fallo aquí nunca interrumpe el guardado"""
     try:
-        with open(path, "r") as f:
-            return json.load(f)
+        return get_change_feed().publish(event_type, date, **fields)
     except Exception as e:
-        print(f"Error cargando plan json: {e}")
-    return None
+        print(f"⚠️ No se pudo anotar el cambio ({event_type}): {e}", flush=True)
+        return None
 
-# Función para generar horarios aleatorios con minutos
-def generate_random_schedule():
-    """Genera un horario aleatorio con horas y minutos"""
-    schedule = []
-    num_notifications = random.randint(5, 9)
+def publish_file_change(event_type, path, **fields):
+    """Cambio de un archivo YYYY/MM/DD/nombre (absoluto o relativo a SAVE_PATH)"""
+    relative = os.path.relpath(path, SAVE_PATH) if os.path.isabs(path) else path
+    parts = relative.split(os.sep)
+    date = "-".join(parts[:3]) if len(parts) == 4 else None
+    return publish_change(event_type, date, path=relative, **fields)
 
-    # Generar horarios entre 8:00 y 21:59
-    base_hours = sorted(random.sample(range(8, 22), min(num_notifications, 14)))
+def publish_saved_files(paths, kind):
+    for path in paths:
+        publish_file_change("saved", path, kind=kind)
 
-    for base_hour in base_hours:
-        # Añadir minutos aleatorios (0, 15, 30, 45)
-        minute = random.choice([0, 15, 30, 45])
+def remember_recent_file(path):
+    RECENT_FILES.append(path)
+
+def load_recent_files():
+    """Rellena los archivos recientes desde el índice al arrancar"""
+    RECENT_FILES.clear()
+    try:
+        for relative in reversed(get_media_index().recent(RECENT_FILES_SIZE)):
+            RECENT_FILES.append(os.path.join(SAVE_PATH, relative))
+    except Exception as e:
+        print(f"⚠️ No se pudieron cargar los archivos recientes del índice: {e}")
 
-        # Si es después de las 21:30, limitamos a 21:30 máximo
-        if base_hour == 21 and minute > 30:
-            minute = 30
+# Generador de planes (PLAN_PROFILES, PLAN_QUIET_HOURS, PLAN_MIN_SPACING_MINUTES...)
+plan_generator = generator_from_env()
 
-        schedule.append({
-            "hour": base_hour,
-            "minute": minute,
-            "type": random.choice(["foto", "video"]),
-            "delivered": False
-        })
+def plan_rng():
+    # Semilla desde random: el simulador fija la suya y los planes son reproducibles
+    return np.random.default_rng(random.getrandbits(64))
 
-    return schedule
+# Función para generar horarios aleatorios con minutos
+def generate_random_schedule():
+    """Genera un horario aleatorio para hoy según el perfil de su día de la semana"""
+    return plan_generator.generate(1, get_current_datetime().weekday(), plan_rng())[0]
+
+def pregenerate_plans(days=PLAN_DAYS_AHEAD):
+    """Genera de una vez los planes que falten para los próximos días y los escribe en lote"""
+    today = get_current_datetime().date()
+    missing = [day for day in (today + timedelta(days=offset) for offset in range(days))
+               if not os.path.exists(get_plan_json_path(day.strftime("%Y-%m-%d")))]
+    if not missing:
+        return 0
+    plans = plan_generator.generate_days(missing, [USER_ID], plan_rng())
+    try:
+        written = write_plans(
+            {get_plan_json_path(day.strftime("%Y-%m-%d")): plan for (_, day), plan in plans.items()},
+            finalize=setup_file_permissions
+        )
+    except PlanWriteError as e:
+        # Los que sí se reemplazaron se anuncian; el resto se reintenta en la próxima pasada
+        for path in e.replaced:
+            publish_change("plan", os.path.splitext(os.path.basename(path))[0])
+        raise
+    for day in missing:
+        publish_change("plan", day.strftime("%Y-%m-%d"))
+    print(f"🗓️ {written} planes generados por adelantado ({missing[0]} a {missing[-1]})", flush=True)
+    return written
+
+async def pregenerate_plans_job():
+    try:
+        await asyncio.to_thread(pregenerate_plans)
+    except Exception as e:
+        print(f"❌ Error generando planes por adelantado: {e}", flush=True)
 
 def format_notification_time(hour, minute):
     """Formatea la hora de notificación"""
@@ -230,7 +539,62 @@ def is_notification_window_active(plan, notification_index, current_total_minute
 
 # Funciones para validar contenido multimedia
 async def validate_video_duration(file_path):
-    """Valida que el video no exceda los 20 segundos"""
+    """Valida que el video no exceda los 20 segundos (en un hilo, sin bloquear el bot)"""
+    return await asyncio.to_thread(check_video_duration, file_path)
+
+async def validate_photo_resolution(file_path):
+    """Valida que la foto tenga resolución mínima de 1080p (en un hilo, sin bloquear el bot)"""
+    return await asyncio.to_thread(check_photo_resolution, file_path)
+
+async def validate_quality(file_path):
+    """Filtro de nitidez y exposición (en un hilo, sin bloquear el bot)"""
+    return await asyncio.to_thread(check_quality, file_path)
+
+# Coste acumulado del filtro de calidad (se muestra en /pipeline)
+QUALITY_STATS = {"count": 0, "rejected": 0, "total_ms": 0.0, "max_ms": 0.0, "over_budget": 0}
+
+def _quality_proxy(file_path, max_side):
+    proxy = open_image_proxy(file_path, max_side, mode="L")
+    return np.asarray(proxy) if proxy is not None else None
+
+def run_quality_check(file_path):
+    """Resultado completo del filtro de calidad o None si falló (nunca rechaza por error)"""
+    try:
+        return check_quality_file(
+            file_path,
+            side=QUALITY_PROXY_SIDE,
+            frames=QUALITY_VIDEO_FRAMES,
+            budget_ms=QUALITY_BUDGET_MS,
+            thresholds=QUALITY_THRESHOLDS,
+            loader=_quality_proxy,
+        )
+    except Exception as e:
+        print(f"Error en el filtro de calidad: {e}")
+        return None
+
+def check_quality(file_path):
+    """Devuelve el motivo de rechazo ("dark", "bright", "blur") o None; nunca rechaza por error"""
+    result = run_quality_check(file_path)
+    if result is None:
+        return None
+    return record_quality_result(result)
+
+def record_quality_result(result):
+    """Suma el resultado a QUALITY_STATS (también los que llegan de los procesos de análisis)"""
+    QUALITY_STATS["count"] += 1
+    QUALITY_STATS["rejected"] += 1 if result["reason"] else 0
+    QUALITY_STATS["total_ms"] += result["elapsed_ms"]
+    QUALITY_STATS["max_ms"] = max(QUALITY_STATS["max_ms"], result["elapsed_ms"])
+    QUALITY_STATS["over_budget"] += 1 if result["over_budget"] else 0
+    metrics = result["metrics"]
+    if metrics:
+        print(f"🔎 Calidad: nitidez {metrics['sharpness']:.0f}, negros {metrics['dark']:.0%}, "
+              f"quemados {metrics['bright']:.0%} ({result['frames']} muestras, {result['elapsed_ms']:.0f}ms"
+              f"{', fuera de presupuesto' if result['over_budget'] else ''})", flush=True)
+    return result["reason"]
+
+def check_video_duration(file_path):
+    """Comprueba que el video no exceda los 20 segundos"""
     if not CV2_AVAILABLE:
         print("OpenCV no disponible, saltando validación de duración")
         return True, 0  # Asumimos que es válido si no podemos validar
@@ -246,21 +610,232 @@ async def validate_video_duration(file_path):
         print(f"Error validando duración del video: {e}")
         return True, 0  # Asumimos que es válido si hay error
 
-async def validate_photo_resolution(file_path):
-    """Valida que la foto tenga resolución mínima de 1080p"""
-    if not PIL_AVAILABLE:
-        print("PIL no disponible, saltando validación de resolución")
-        return True, 0, 0  # Asumimos que es válido si no podemos validar
-
+def check_photo_resolution(file_path):
+    """Comprueba que la foto tenga resolución mínima de 1080p (solo lee la cabecera)"""
     try:
-        with Image.open(file_path) as img:
-            width, height = img.size
-            total_pixels = width * height
-            return total_pixels >= MIN_PHOTO_RESOLUTION, width, height
+        with measure_peak_rss("validar resolución"):
+            width, height = read_image_dimensions(file_path)
+        if width == 0 or height == 0:
+            print("No se pudo leer la resolución, saltando validación")
+            return True, 0, 0  # Asumimos que es válido si no podemos validar
+        total_pixels = width * height
+        return total_pixels >= MIN_PHOTO_RESOLUTION, width, height
     except Exception as e:
         print(f"Error validando resolución de la foto: {e}")
         return True, 0, 0  # Asumimos que es válido si hay error
 
+# Funciones de imagen con memoria acotada
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # Tipo de color PNG -> bytes por píxel (8 bits)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Último pico de RSS medido por operación (se muestra en /info)
+IMAGE_MEMORY_STATS = {}
+
+def _read_proc_status_kb(field):
+    """Lee un campo en kB de /proc/self/status (Linux)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+@contextlib.contextmanager
+def measure_peak_rss(label):
+    """Mide el pico de RSS de una operación y lo guarda en IMAGE_MEMORY_STATS"""
+    # Reiniciar el pico del proceso (VmHWM) para medir solo esta operación
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    start_kb = _read_proc_status_kb("VmRSS") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        yield
+    finally:
+        peak_kb = _read_proc_status_kb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = peak_kb / 1024
+        delta_mb = max(0, peak_kb - start_kb) / 1024
+        previous = IMAGE_MEMORY_STATS.get(label, {})
+        IMAGE_MEMORY_STATS[label] = {
+            "peak_mb": peak_mb,
+            "delta_mb": delta_mb,
+            "max_delta_mb": max(delta_mb, previous.get("max_delta_mb", 0)),
+            "count": previous.get("count", 0) + 1,
+        }
+        print(f"🧠 {label}: pico RSS {peak_mb:.1f}MB (+{delta_mb:.1f}MB)", flush=True)
+
+def read_image_dimensions(file_path):
+    """Obtiene (ancho, alto) leyendo solo la cabecera, sin decodificar píxeles"""
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(32)
+            if head.startswith(PNG_SIGNATURE) and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head.startswith(b"\xff\xd8"):
+                f.seek(2)
+                while True:
+                    marker = f.read(2)
+                    if len(marker) < 2 or marker[0] != 0xFF:
+                        break
+                    code = marker[1]
+                    if code == 0xFF:  # Relleno entre marcadores
+                        f.seek(-1, os.SEEK_CUR)
+                        continue
+                    if code in (0x01, 0xD8) or 0xD0 <= code <= 0xD7:
+                        continue
+                    length = struct.unpack(">H", f.read(2))[0]
+                    if code in JPEG_SOF_MARKERS:
+                        height, width = struct.unpack(">xHH", f.read(5))
+                        return width, height
+                    f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error) as e:
+        print(f"⚠️ Error leyendo cabecera de {file_path}: {e}")
+
+    # Otros formatos: PIL también lee solo la cabecera al abrir
+    if PIL_AVAILABLE:
+        try:
+            with Image.open(file_path) as img:
+                return img.size
+        except Exception as e:
+            print(f"⚠️ PIL no pudo leer {file_path}: {e}")
+    return 0, 0
+
+def estimate_decode_mb(width, height, bands=3):
+    """Memoria aproximada (MB) que ocuparía decodificar una imagen completa"""
+    return width * height * bands / (1024 * 1024)
+
+def _png_chunks(f):
+    """Itera los chunks (tipo, datos) de un PNG abierto tras la firma"""
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", head)
+        data = f.read(length)
+        f.read(4)  # CRC
+        yield chunk_type, data
+        if chunk_type == b"IEND":
+            return
+
+def _png_chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+def iter_png_bands(file_path, band_rows=None):
+    """Decodifica un PNG por bandas de filas con memoria acotada.
+
+    Cada banda de filas filtradas se envuelve en un PNG mínimo precedido por la
+    última fila ya decodificada (con filtro 0), de modo que PIL resuelve los
+    filtros Up/Average/Paeth sin tener la imagen completa en memoria.
+    Devuelve tuplas (fila_inicial, imagen_de_la_banda).
+    """
+    band_rows = band_rows or PNG_TILE_ROWS
+    with open(file_path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError("No es un PNG")
+
+        ihdr = None
+        width = stride = 0
+        extra_chunks = []
+        decompressor = zlib.decompressobj()
+        pending = bytearray()
+        previous_row = None
+        y = 0
+
+        def build_band(rows):
+            nonlocal previous_row
+            raw = bytearray()
+            offset = 0
+            if previous_row is not None:
+                raw += b"\x00" + previous_row
+                offset = 1
+            raw += pending[:rows * (stride + 1)]
+            del pending[:rows * (stride + 1)]
+            header = struct.pack(">II", width, rows + offset) + ihdr[8:]
+            png = (PNG_SIGNATURE + _png_chunk(b"IHDR", header) +
+                   b"".join(_png_chunk(t, d) for t, d in extra_chunks) +
+                   _png_chunk(b"IDAT", zlib.compress(raw, 0)) + _png_chunk(b"IEND", b""))
+            band = Image.open(io.BytesIO(png))
+            band.load()
+            if offset:
+                band = band.crop((0, 1, width, rows + 1))
+            previous_row = band.crop((0, rows - 1, width, rows)).tobytes()
+            return band
+
+        limit = (stride + 1) * band_rows
+        for chunk_type, data in _png_chunks(f):
+            if chunk_type == b"IHDR":
+                ihdr = data
+                width, _, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+                if depth != 8 or interlace or color_type not in PNG_CHANNELS:
+                    raise ValueError("PNG entrelazado o de profundidad distinta de 8 bits")
+                stride = width * PNG_CHANNELS[color_type]
+                limit = (stride + 1) * band_rows
+            elif chunk_type in (b"PLTE", b"tRNS"):
+                extra_chunks.append((chunk_type, data))
+            elif chunk_type == b"IDAT":
+                pending += decompressor.decompress(data, limit)
+                while True:
+                    while len(pending) >= limit:
+                        yield y, build_band(band_rows)
+                        y += band_rows
+                    if not decompressor.unconsumed_tail:
+                        break
+                    pending += decompressor.decompress(decompressor.unconsumed_tail, limit)
+
+        pending += decompressor.flush()
+        rows = len(pending) // (stride + 1) if stride else 0
+        if rows:
+            yield y, build_band(rows)
+
+def open_image_proxy(file_path, max_side=None, mode="RGB"):
+    """Devuelve una copia reducida de la imagen respetando IMAGE_MEMORY_LIMIT_MB.
+
+    - JPEG: usa draft() para que libjpeg decodifique ya escalado (DCT 1/2, 1/4, 1/8).
+    - PNG grande: se procesa por bandas con iter_png_bands().
+    - Resto: solo se decodifica si cabe en el límite de memoria.
+    Devuelve None si no se puede procesar dentro del presupuesto.
+    """
+    if not PIL_AVAILABLE:
+        return None
+    max_side = max_side or IMAGE_PROXY_MAX_SIDE
+
+    with measure_peak_rss("copia reducida"):
+        with Image.open(file_path) as img:
+            width, height = img.size
+            bands = len(img.getbands())
+            if img.format == "JPEG":
+                img.draft(mode, (max_side, max_side))
+                width, height = img.size
+            if estimate_decode_mb(width, height, bands) <= IMAGE_MEMORY_LIMIT_MB:
+                proxy = img.convert(mode)
+                proxy.thumbnail((max_side, max_side))
+                return proxy
+            if img.format != "PNG":
+                print(f"⚠️ {file_path} excede el límite de memoria ({estimate_decode_mb(width, height, bands):.0f}MB)")
+                return None
+
+        # PNG por bandas: cada banda se reduce y se pega en el lienzo final.
+        # Se dejan ~12 copias de margen por banda (datos filtrados, PNG temporal, decodificada...)
+        band_rows = max(1, min(PNG_TILE_ROWS, int(IMAGE_MEMORY_LIMIT_MB * 1024 * 1024 / (width * bands * 12))))
+        scale = min(1.0, max_side / max(width, height))
+        target_width = max(1, round(width * scale))
+        proxy = Image.new(mode, (target_width, max(1, round(height * scale))))
+        try:
+            for top, band in iter_png_bands(file_path, band_rows):
+                target_top = round(top * scale)
+                target_bottom = round((top + band.height) * scale)
+                if target_bottom > target_top:
+                    proxy.paste(band.convert(mode).resize((target_width, target_bottom - target_top)), (0, target_top))
+        except ValueError as e:
+            print(f"⚠️ No se pudo procesar {file_path} por bandas: {e}")
+            return None
+        return proxy
+
 def format_duration(seconds):
     """Formatea la duración en segundos a formato legible"""
     if seconds == 0:
@@ -288,12 +863,50 @@ def get_file_size_mb(file_size):
 # Funciones para manejar el estado integrado en el plan
 def update_delivery_state(hour_index, delivered=True):
     """Actualiza el estado de entrega para una hora específica"""
-    plan = load_plan_json()
-    if plan and hour_index < len(plan):
+    with PLAN_LOCK:
+        plan = load_plan_json()
+        if not plan or hour_index >= len(plan):
+            return False
         plan[hour_index]["delivered"] = delivered
         save_plan_json(plan)
-        return True
-    return False
+    publish_change("delivered", get_current_datetime().strftime("%Y-%m-%d"), window=hour_index, delivered=delivered)
+    return True
+
+# Historial de planes (se abre con SAVE_PATH, como el índice de medios)
+plan_history = None
+
+def get_plan_history():
+    global plan_history
+    if plan_history is None or plan_history.save_path != SAVE_PATH:
+        plan_history = PlanHistory(SAVE_PATH)
+    return plan_history
+
+def record_plan_event(event, entry, when):
+    """Registra en el historial el aviso ("notified") o la entrega ("delivered") de una ventana"""
+    try:
+        method = getattr(get_plan_history(), f"record_{event}")
+        method(when.strftime("%Y-%m-%d"), entry.get("hour", 8) * 60 + entry.get("minute", 0),
+               entry.get("type", "foto"), when.timestamp())
+    except Exception as e:
+        print(f"⚠️ No se pudo registrar en el historial: {e}", flush=True)
+
+def compact_plan_history():
+    """Pasa al historial los planes de días cerrados que aún no estén"""
+    index = get_media_index()
+    imported = compact_plans(
+        get_plan_history(), f"{SAVE_PATH}/planificacion", get_current_datetime().strftime("%Y-%m-%d"),
+        day_times=lambda date: [row["time"] for row in index.day(date)],
+        keep_days=PLAN_HISTORY_KEEP_DAYS
+    )
+    if imported:
+        print(f"🗄️ {imported} ventanas de planes anteriores añadidas al historial", flush=True)
+    return imported
+
+async def compact_plan_history_job():
+    try:
+        await asyncio.to_thread(compact_plan_history)
+    except Exception as e:
+        print(f"❌ Error compactando el historial de planes: {e}", flush=True)
 
 def get_delivery_state(hour_index):
     """Obtiene el estado de entrega para una hora específica"""
@@ -302,9 +915,10 @@ def get_delivery_state(hour_index):
         return plan[hour_index].get("delivered", False)
     return False
 
-def all_notifications_pending():
+def all_notifications_pending(plan=None):
     """Verifica si todas las notificaciones están pendientes"""
-    plan = load_plan_json()
+    if plan is None:
+        plan = load_plan_json()
     if not plan:
         return True
     return all(not entry.get("delivered", False) for entry in plan)
@@ -312,7 +926,7 @@ def all_notifications_pending():
 # Enviar notificación al usuario con recordatorio de límites
 async def send_photo_request(app, notification_entry):
     try:
-        now = datetime.now().strftime("%H:%M")
+        now = get_current_datetime().strftime("%H:%M")
         # Obtener el tipo directamente del entry que se pasa como parámetro
         tipo = notification_entry.get("type", "foto")
         hora_notificacion = notification_entry.get("hour", 8)
@@ -322,7 +936,7 @@ async def send_photo_request(app, notification_entry):
         print(f"📢 Enviando notificación de {tipo} programada para las {hora_programada}", flush=True)
 
         # Cargar el plan para calcular el fin de ventana
-        plan = load_plan_json()
+        plan = await load_plan()
         window_end_text = "el final del día"
 
         if plan:
@@ -342,7 +956,7 @@ async def send_photo_request(app, notification_entry):
                 f"🎥 **¡Hora de grabar!** Son las {now}\n"
                 f"Haz un video corto de lo que estás haciendo ahora.\n\n"
                 f"{get_requirements_text()}\n\n"
-                f"⚠️ **Importante:** El video será rechazado si excede los 20 segundos o 20MB.\n"
+                f"⚠️ **Importante:** El video será rechazado si excede los 20 segundos o {MAX_FILE_SIZE_MB}MB.\n"
                 f"⏰ **Tienes hasta {window_end_text} para enviarlo.**"
             )
         else:
@@ -350,11 +964,13 @@ async def send_photo_request(app, notification_entry):
                 f"📸 **¡Hora de fotografiar!** Son las {now}\n"
                 f"Haz una foto de lo que estás haciendo ahora.\n\n"
                 f"{get_requirements_text()}\n\n"
-                f"⚠️ **Importante:** La foto será rechazada si es menor a 1080p o mayor a 20MB.\n"
+                f"⚠️ **Importante:** La foto será rechazada si es menor a 1080p o mayor a {MAX_FILE_SIZE_MB}MB.\n"
                 f"⏰ **Tienes hasta {window_end_text} para enviarla.**"
             )
 
         await app.bot.send_message(chat_id=USER_ID, text=msg, parse_mode='Markdown')
+        await get_storage().run("history", record_plan_event, "notified", notification_entry, get_current_datetime(),
+                                timeout=0)
         print(f"✅ Notificación de {tipo} enviada correctamente", flush=True)
     except Exception as e:
         print(f"❌ Error enviando notificación: {e}")
@@ -373,7 +989,7 @@ def check_content_type(update, expected_type):
 
 # Función mejorada para encontrar la ventana de tiempo actual
 def get_current_time_window(plan):
-    now = datetime.now()
+    now = get_current_datetime()
     current_hour = now.hour
     current_minute = now.minute
     current_total_minutes = current_hour * 60 + current_minute
@@ -412,7 +1028,7 @@ def get_current_time_window(plan):
 async def show_updated_status(context, plan):
     """Muestra el estado actualizado después de recibir contenido"""
     # Recargar el plan para obtener el estado más actual
-    updated_plan = load_plan_json()
+    updated_plan = await load_plan()
     if not updated_plan:
         return
 
@@ -420,7 +1036,7 @@ async def show_updated_status(context, plan):
     total_count = len(updated_plan)
 
     # Encontrar próxima notificación pendiente
-    now = datetime.now()
+    now = get_current_datetime()
     current_total_minutes = now.hour * 60 + now.minute
     next_notification = None
 
@@ -442,33 +1058,965 @@ async def show_updated_status(context, plan):
     await context.bot.send_message(chat_id=USER_ID, text=status_msg, parse_mode='Markdown')
 
 # Función para guardar archivo con manejo mejorado de permisos
-def save_file_with_permissions(temp_path, final_path):
-    """Guarda un archivo desde ubicación temporal a final con permisos correctos"""
-    try:
-        # Asegurar que el directorio destino existe con permisos correctos
-        dest_dir = os.path.dirname(final_path)
-        setup_directory_permissions(dest_dir)
-
-        # Mover archivo de temporal a ubicación final
-        shutil.move(temp_path, final_path)
-
-        # Configurar permisos del archivo guardado
-        setup_file_permissions(final_path)
+def move_into_place(temp_path, final_path):
+    """Crea el directorio destino y mueve el archivo (en el pool del disco)"""
+    os.makedirs(os.path.dirname(final_path), mode=0o775, exist_ok=True)
+    shutil.move(temp_path, final_path)
 
+def discard_temp_file(temp_path):
+    if os.path.exists(temp_path):
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+async def save_file_with_permissions(temp_path, final_path):
+    """Guarda un archivo desde ubicación temporal a final con permisos correctos.
+
+    El movimiento va al pool del disco; dueño y permisos del archivo y de sus
+    directorios se aplican en lote con los de otros archivos guardados a la vez.
+    Ninguno lleva tiempo máximo: el hilo no se puede parar y, si se diera por
+    fallido a medias, el archivo acabaría guardado pero sin indexar.
+    """
+    storage = get_storage()
+    try:
+        await storage.run("move", move_into_place, temp_path, final_path, timeout=0)
+        await storage.permissions([*parent_chain(final_path, SAVE_PATH), final_path])
         print(f"✅ Archivo guardado con permisos correctos: {final_path}")
         return True
 
     except Exception as e:
         print(f"❌ Error guardando archivo {final_path}: {e}")
         # Limpiar archivo temporal si existe
-        if os.path.exists(temp_path):
+        with contextlib.suppress(Exception):
+            await storage.run("unlink", discard_temp_file, temp_path)
+        return False
+
+# Textos de respuesta por tipo de contenido recibido
+INGEST_LABELS = {
+    "Foto": {"received": "Foto recibida", "saved": "Foto recibida y guardada", "noun": "la foto"},
+    "Imagen": {"received": "Imagen recibida", "saved": "Imagen recibida y guardada", "noun": "la imagen"},
+    "Video": {"received": "Video recibido", "saved": "Video recibido y guardado", "noun": "el video"},
+}
+
+class IngestItem:
+    """Un archivo dentro de un envío (un álbum aporta varios)"""
+
+    def __init__(self, kind, label, source, suffix, final_path, file_size, error=None):
+        self.kind = kind  # "foto" o "video"
+        self.label = label  # "Foto", "Imagen" o "Video"
+        self.source = source  # PhotoSize, Video o Document de Telegram
+        self.suffix = suffix
+        self.final_path = final_path
+        self.file_size = file_size
+        self.error = error  # Motivo de rechazo; el elemento deja de procesarse
+        self.update_id = None  # Actualización de Telegram que lo trajo
+        self.file_kind = None  # "photo", "video" o "document": cómo se reenvía por file_id
+        self.temp_path = None
+        self.derivative_temp = None  # Copia web de un HEIF, pendiente de guardar
+        self.derivative_path = None
+        self.metadata = None  # Fila del índice tras guardar
+        self.capture_metadata = None  # Metadatos leídos por un proceso de análisis (se indexan sin releer)
+        self.sha256 = None  # Hash calculado al recibirlo: el manifiesto de copias no relee el archivo
+        self.task_id = None  # Tarea en la cola persistente (INGEST_PROCESS_WORKERS)
+        self.width = 0
+        self.height = 0
+        self.duration = 0
+
+class IngestJob:
+    """Estado de un envío mientras recorre las etapas del pipeline de ingesta"""
+
+    def __init__(self, context, window_index, items, media_group_id=None):
+        self.context = context
+        self.window_index = window_index
+        self.items = items
+        self.media_group_id = media_group_id
+        self.key = None  # Agrupa sus tareas en la cola persistente
+        self.timings = {}
+        self.received_at = time.perf_counter()
+        self.submitted_at = get_current_datetime()
+
+    def pending_items(self):
+        return [item for item in self.items if item.error is None]
+
+    @property
+    def is_album(self):
+        return self.media_group_id is not None
+
+class IngestPipeline:
+    """Etapas de ingesta unidas por colas acotadas.
+
+    Cada etapa tiene su propio número de trabajadores; si una cola se llena,
+    la etapa anterior (y en último término el handler) espera: backpressure.
+    Una etapa devuelve True para pasar el envío a la siguiente o False si ya
+    respondió al usuario (rechazo o error) y el envío termina ahí.
+    """
+
+    def __init__(self, stages, queue_size=INGEST_QUEUE_SIZE, on_finish=None):
+        self.stages = stages  # Lista de (nombre, función, trabajadores)
+        self.on_finish = on_finish  # Se llama con cada envío terminado (guardado o no)
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+        self.workers = []
+        self.in_flight = set()  # Índices de ventana con un envío en proceso
+        self.stats = {name: {"count": 0, "total_ms": 0.0, "max_ms": 0.0} for name, _, _ in stages}
+        self.stats["total"] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    def start(self):
+        for index, (name, _, workers) in enumerate(self.stages):
+            for _ in range(workers):
+                self.workers.append(asyncio.create_task(self._worker(index), name=f"ingesta-{name}"))
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self, job, stage=0):
+        """Encola un envío; stage > 0 retoma uno que ya pasó las etapas anteriores"""
+        self.in_flight.add(job.window_index)
+        await self.queues[stage].put(job)
+
+    async def join(self):
+        # Los envíos avanzan siempre hacia delante, así que basta con vaciar las colas en orden
+        for queue in self.queues:
+            await queue.join()
+
+    def _record(self, name, elapsed_ms):
+        stats = self.stats[name]
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    async def _worker(self, index):
+        name, stage, _ = self.stages[index]
+        queue = self.queues[index]
+        while True:
+            job = await queue.get()
+            started = time.perf_counter()
+            proceed = False
+            try:
+                proceed = await stage(job)
+            except Exception as e:
+                print(f"❌ Error en etapa {name} de la ingesta: {e}", flush=True)
+                # El aviso también puede fallar (red caída): el trabajador sigue vivo igualmente
+                try:
+                    await job.context.bot.send_message(chat_id=USER_ID, text="❌ Error al guardar el archivo.")
+                except Exception as reply_error:
+                    print(f"⚠️ No se pudo avisar del error: {reply_error}", flush=True)
+            finally:
+                # Siempre: métricas, siguiente etapa o cierre (libera la ventana y los temporales) y task_done
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                job.timings[name] = elapsed_ms
+                self._record(name, elapsed_ms)
+                try:
+                    if proceed and index + 1 < len(self.stages):
+                        await self.queues[index + 1].put(job)
+                    else:
+                        self._finish(job)
+                finally:
+                    queue.task_done()
+
+    def _finish(self, job):
+        self.in_flight.discard(job.window_index)
+        if self.on_finish is not None:
             try:
-                os.unlink(temp_path)
-            except:
-                pass
+                self.on_finish(job)
+            except Exception as e:
+                print(f"⚠️ Error al cerrar el envío: {e}", flush=True)
+        for item in job.items:
+            for path in (item.temp_path, item.derivative_temp):
+                if path and os.path.exists(path):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+        total_ms = (time.perf_counter() - job.received_at) * 1000
+        self._record("total", total_ms)
+        stages_text = ", ".join(f"{name} {ms:.0f}ms" for name, ms in job.timings.items())
+        print(f"⏱️ Ingesta terminada en {total_ms:.0f}ms ({stages_text})", flush=True)
+
+    def snapshot(self):
+        """Estadísticas por etapa: envíos, media y máximo en ms, cola y trabajadores"""
+        result = {}
+        for index, (name, _, workers) in enumerate(self.stages):
+            stats = self.stats[name]
+            result[name] = {
+                "count": stats["count"],
+                "avg_ms": stats["total_ms"] / stats["count"] if stats["count"] else 0.0,
+                "max_ms": stats["max_ms"],
+                "queued": self.queues[index].qsize(),
+                "workers": workers,
+            }
+        stats = self.stats["total"]
+        result["total"] = {
+            "count": stats["count"],
+            "avg_ms": stats["total_ms"] / stats["count"] if stats["count"] else 0.0,
+            "max_ms": stats["max_ms"],
+            "queued": sum(queue.qsize() for queue in self.queues),
+            "workers": len(self.workers),
+        }
+        return result
+
+async def _run_items(job, action, failure):
+    """Ejecuta una acción en paralelo sobre los elementos pendientes del envío.
+
+    Los elementos que fallan quedan marcados con el motivo `failure`; si falla
+    un envío de un solo elemento, la excepción se propaga como antes.
+    """
+    items = job.pending_items()
+    results = await asyncio.gather(*(action(job, item) for item in items), return_exceptions=True)
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            if not job.is_album:
+                raise result
+            print(f"❌ Error procesando elemento del álbum: {result}", flush=True)
+            item.error = failure
+
+async def send_album_summary(job, saved):
+    """Respuesta única para un álbum: guardados, rechazados y motivos"""
+    accepted = [item for item in job.items if item.error is None]
+    rejected = [item for item in job.items if item.error is not None]
+    photos = sum(1 for item in accepted if item.kind == "foto")
+    videos = len(accepted) - photos
+    if saved:
+        summary = f"✅ **Álbum recibido y guardado:** {len(accepted)}/{len(job.items)} elementos\n"
+        summary += f"📸 {photos} fotos · 🎥 {videos} videos\n"
+        summary += f"📦 **Tamaño:** {get_file_size_mb(sum(item.file_size or 0 for item in accepted))}"
+    else:
+        summary = f"❌ **Álbum rechazado:** ningún elemento válido de {len(job.items)}"
+    if rejected:
+        summary += "\n\n⚠️ **Rechazados:**\n"
+        summary += "\n".join(f"• {item.label} {index + 1}: {item.error}"
+                             for index, item in enumerate(job.items) if item.error is not None)
+    await job.context.bot.send_message(chat_id=USER_ID, text=summary, parse_mode='Markdown')
+
+def handoff_local_file(source_path, suffix):
+    """Toma un archivo del servidor local de la Bot API sin descargarlo por HTTP.
+
+    Con TELEGRAM_LOCAL_HANDOFF=link se crea un enlace duro y con rename se mueve;
+    ambos son operaciones de metadatos si el servidor comparte volumen con
+    SAVE_PATH. Si no es posible (otro sistema de archivos), se copia.
+    """
+    os.makedirs(LOCAL_STAGING_PATH, mode=0o775, exist_ok=True)
+    fd, target_path = tempfile.mkstemp(suffix=suffix, dir=LOCAL_STAGING_PATH)
+    os.close(fd)
+    os.unlink(target_path)
+    try:
+        if TELEGRAM_LOCAL_HANDOFF == "rename":
+            os.rename(source_path, target_path)
+        elif TELEGRAM_LOCAL_HANDOFF == "link":
+            os.link(source_path, target_path)
+        else:
+            raise OSError(errno.EXDEV, "copia configurada")
+    except OSError as e:
+        print(f"⚠️ No se pudo enlazar {source_path} ({e}), copiando", flush=True)
+        shutil.copy2(source_path, target_path)
+    return target_path
+
+# Pool de descargas (se crea con la primera descarga)
+downloader = None
+
+def get_downloader():
+    global downloader
+    if downloader is None:
+        downloader = Downloader(HTTP_DOWNLOAD_CONCURRENCY, read_timeout=HTTP_DOWNLOAD_TIMEOUT, http2=HTTP2)
+    return downloader
+
+# Etapa 1: descargar los archivos de Telegram a temporales (en paralelo)
+async def _download_item(job, item):
+    file = await item.source.get_file()
+    # Servidor local en modo --local: file_path es una ruta del disco, no una URL
+    if TELEGRAM_LOCAL_MODE and file.file_path and os.path.isabs(file.file_path):
+        item.temp_path = await get_storage().run("handoff", handoff_local_file, file.file_path, item.suffix)
+        return
+    # Con procesos de análisis el temporal va al volumen de datos: la tarea sobrevive a un reinicio
+    staging = LOCAL_STAGING_PATH if INGEST_PROCESS_WORKERS else None
+    storage = get_storage()
+    if file.file_path and file.file_path.startswith(("http://", "https://")):
+        # Pool de descargas propio (no ocupa las conexiones de los mensajes); cada trozo
+        # se escribe en el pool del disco según llega
+        item.temp_path = await storage.run("write", write_temp_file, b"", item.suffix, staging)
+        handle = await storage.run("write", open, item.temp_path, "wb")
+        digest = hashlib.sha256()
+
+        def write_chunk(chunk):
+            digest.update(chunk)
+            handle.write(chunk)
+
+        try:
+            await get_downloader().download(file.file_path, lambda chunk: storage.run("download.write", write_chunk, chunk))
+        finally:
+            await storage.run("write", handle.close)
+        item.sha256 = digest.hexdigest()
+        return
+    if file.file_path and os.path.isabs(file.file_path):
+        # Ruta local sin modo --local (volumen compartido con el servidor, simulador): copia por trozos en el pool
+        item.temp_path, item.sha256 = await storage.run("write", copy_temp_hashed, file.file_path, item.suffix, staging,
+                                                        timeout=0)
+        return
+    # Nunca se carga el archivo entero en memoria (hasta 2000MB en modo local)
+    raise DownloadError("el file_path de Telegram no es una URL ni una ruta local")
+
+def copy_temp_hashed(source_path, suffix, directory=None):
+    """Copia source_path a un temporal calculando su sha256 en la misma lectura: (temporal, sha256)"""
+    if directory:
+        os.makedirs(directory, mode=0o775, exist_ok=True)
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source, \
+            tempfile.NamedTemporaryFile(suffix=suffix, delete=False, dir=directory) as tmp_file:
+        for chunk in iter(lambda: source.read(media_tiering.COPY_CHUNK), b""):
+            digest.update(chunk)
+            tmp_file.write(chunk)
+    return tmp_file.name, digest.hexdigest()
+
+def write_temp_file(data, suffix, directory=None):
+    if directory:
+        os.makedirs(directory, mode=0o775, exist_ok=True)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False, dir=directory) as tmp_file:
+        tmp_file.write(data)
+    return tmp_file.name
+
+async def ingest_download(job):
+    await _run_items(job, _download_item, "error de descarga")
+    if job.pending_items():
+        return True
+    await send_album_summary(job, saved=False)
+    return False
+
+async def reject_low_resolution(job, item):
+    """Marca el elemento como rechazado por resolución y avisa si no es un álbum"""
+    item.error = f"resolución insuficiente ({format_resolution(item.width, item.height)})"
+    print(f"{item.label} con resolución insuficiente: {item.width}x{item.height}", flush=True)
+    if not job.is_album:
+        await job.context.bot.send_message(
+            chat_id=USER_ID,
+            text=(
+                f"❌ **Resolución insuficiente:** {format_resolution(item.width, item.height)}\n\n"
+                f"📸 **Mínimo requerido:** 1080p (1920x1080)\n"
+                f"💡 **Solución:** Configura tu cámara en máxima calidad"
+            ),
+            parse_mode='Markdown'
+        )
+
+async def reject_long_video(job, item):
+    """Marca el video como rechazado por duración y avisa si no es un álbum"""
+    item.error = f"demasiado largo ({format_duration(item.duration)})"
+    print(f"Video demasiado largo: {item.duration:.1f}s", flush=True)
+    if not job.is_album:
+        await job.context.bot.send_message(
+            chat_id=USER_ID,
+            text=(
+                f"❌ **Video demasiado largo:** {format_duration(item.duration)}\n\n"
+                f"🎥 **Máximo permitido:** 20 segundos\n"
+                f"💡 **Solución:** Graba un video más corto"
+            ),
+            parse_mode='Markdown'
+        )
+
+async def reject_undecodable_heif(job, item, error):
+    """Marca la foto HEIF que no se pudo decodificar y avisa si no es un álbum"""
+    print(f"❌ Error convirtiendo HEIF: {error}", flush=True)
+    item.error = "no se pudo decodificar el HEIF"
+    if not job.is_album:
+        await job.context.bot.send_message(chat_id=USER_ID, text="❌ No se pudo leer la imagen HEIC/HEIF.")
+
+QUALITY_TIPS = {
+    "dark": "Comprueba que el objetivo no esté tapado y que haya luz",
+    "bright": "Evita apuntar directamente a una luz fuerte",
+    "blur": "Mantén la cámara quieta y enfoca antes de disparar",
+}
+
+async def reject_low_quality(job, item, reason):
+    """Marca el elemento como rechazado por el filtro de calidad y avisa si no es un álbum"""
+    item.error = f"imagen {QUALITY_REASONS[reason]}"
+    print(f"{item.label} no pasa el filtro de calidad: imagen {QUALITY_REASONS[reason]}", flush=True)
+    if not job.is_album:
+        await job.context.bot.send_message(
+            chat_id=USER_ID,
+            text=(
+                f"❌ **Calidad insuficiente:** imagen {QUALITY_REASONS[reason]}\n\n"
+                f"💡 **Solución:** {QUALITY_TIPS[reason]}"
+            ),
+            parse_mode='Markdown'
+        )
+
+# Etapa 2: validar resolución o duración (en paralelo) y, si está activo, la calidad
+async def _validate_item(job, item):
+    if item.kind == "foto":
+        is_valid, item.width, item.height = await validate_photo_resolution(item.temp_path)
+        if not is_valid:
+            await reject_low_resolution(job, item)
+    else:
+        is_valid, item.duration = await validate_video_duration(item.temp_path)
+        if CV2_AVAILABLE and not is_valid:
+            await reject_long_video(job, item)
+
+    if QUALITY_GATE and item.error is None:
+        reason = await validate_quality(item.temp_path)
+        if reason:
+            await reject_low_quality(job, item, reason)
+
+async def ingest_validate(job):
+    await _run_items(job, _validate_item, "error de validación")
+    if job.pending_items():
+        return True
+    if job.is_album:
+        await send_album_summary(job, saved=False)
+    return False
+
+# Pool de procesos para decodificar HEIF (se crea con el primer archivo)
+heif_pool = None
+
+def get_heif_pool():
+    global heif_pool
+    if heif_pool is None:
+        heif_pool = create_pool(HEIF_WORKERS)
+    return heif_pool
+
+# Etapa 3: decodificar HEIC/HEIF en el pool, validar sus dimensiones reales y crear la copia web
+async def _convert_item(job, item):
+    if item.kind != "foto" or not is_heif(item.suffix):
+        return
+    if not HEIF_AVAILABLE:
+        print(f"⚠️ pillow-heif no disponible, se guarda {item.final_path} sin copia web", flush=True)
+        return
+    target_path = f"{item.temp_path}{os.path.splitext(derivative_path_for(item.final_path, HEIF_DERIVATIVE_FORMAT))[1]}"
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        get_heif_pool(), convert_heif, item.temp_path, target_path, HEIF_DERIVATIVE_FORMAT, HEIF_DERIVATIVE_QUALITY
+    )
+    if "error" in result:
+        await reject_undecodable_heif(job, item, result["error"])
+        return
+    item.derivative_temp = target_path
+    item.derivative_path = derivative_path_for(item.final_path, HEIF_DERIVATIVE_FORMAT)
+    item.width, item.height = result["width"], result["height"]
+    print(f"🖼️ HEIF convertido en {result['elapsed_ms']:.0f}ms: {item.width}x{item.height}", flush=True)
+    if item.width * item.height < MIN_PHOTO_RESOLUTION:
+        await reject_low_resolution(job, item)
+
+async def ingest_convert(job):
+    await _run_items(job, _convert_item, "error de conversión")
+    if job.pending_items():
+        return True
+    if job.is_album:
+        await send_album_summary(job, saved=False)
+    return False
+
+# Cola persistente y procesos de análisis (solo con INGEST_PROCESS_WORKERS > 0)
+work_queue = None
+result_waiter = None
+ingest_workers = None
+
+def get_work_queue():
+    global work_queue, result_waiter
+    if work_queue is None or work_queue.path != default_queue_path(SAVE_PATH):
+        work_queue = WorkQueue(default_queue_path(SAVE_PATH))
+        result_waiter = ResultWaiter(work_queue)
+    return work_queue
+
+def analysis_payload(job, item):
+    """Todo lo necesario para analizar el archivo en otro proceso y, tras un reinicio, rehacer el envío"""
+    derivative_temp = None
+    if item.kind == "foto" and is_heif(item.suffix):
+        if HEIF_AVAILABLE:
+            derivative_temp = f"{item.temp_path}{os.path.splitext(derivative_path_for(item.final_path, HEIF_DERIVATIVE_FORMAT))[1]}"
+        else:
+            print(f"⚠️ pillow-heif no disponible, se guarda {item.final_path} sin copia web", flush=True)
+    return {
+        "window_index": job.window_index,
+        "date": job.submitted_at.strftime("%Y-%m-%d"),
+        "media_group_id": job.media_group_id,
+        "kind": item.kind,
+        "label": item.label,
+        "suffix": item.suffix,
+        "final_path": item.final_path,
+        "file_size": item.file_size,
+        "update_id": item.update_id,
+        "file_kind": item.file_kind,
+        "file_id": getattr(item.source, "file_id", None),
+        "file_unique_id": getattr(item.source, "file_unique_id", None),
+        "temp_path": item.temp_path,
+        "derivative_temp": derivative_temp,
+        "sha256": item.sha256,
+    }
+
+def analyze_ingest_task(payload):
+    """Análisis de un archivo recibido en un proceso trabajador (ver work_queue.py).
+
+    Mismo orden que las etapas de validación y conversión del bot, pero sin
+    responder: devuelve el veredicto y el bot avisa al usuario.
+    """
+    temp_path = payload["temp_path"]
+    if not os.path.exists(temp_path):
+        return {"error": "temporal no encontrado"}
+    result = {"width": 0, "height": 0, "duration": 0, "reject": None, "quality": None,
+              "derivative_temp": None, "metadata": None}
+    if payload["kind"] == "foto":
+        is_valid, result["width"], result["height"] = check_photo_resolution(temp_path)
+        if not is_valid:
+            result["reject"] = "resolution"
+            return result
+    else:
+        is_valid, result["duration"] = check_video_duration(temp_path)
+        if CV2_AVAILABLE and not is_valid:
+            result["reject"] = "duration"
+            return result
+
+    if QUALITY_GATE:
+        result["quality"] = run_quality_check(temp_path)
+        if result["quality"] and result["quality"]["reason"]:
+            result["reject"] = "quality"
+            return result
+
+    if payload["derivative_temp"]:
+        converted = convert_heif(temp_path, payload["derivative_temp"], HEIF_DERIVATIVE_FORMAT, HEIF_DERIVATIVE_QUALITY)
+        if "error" in converted:
+            result.update(reject="heif", heif_error=converted["error"])
+            return result
+        result.update(width=converted["width"], height=converted["height"],
+                      derivative_temp=payload["derivative_temp"], heif_ms=converted["elapsed_ms"])
+        if result["width"] * result["height"] < MIN_PHOTO_RESOLUTION:
+            result["reject"] = "resolution"
+            return result
+
+    result["metadata"] = extract_metadata(temp_path)
+    # Sin hash de la descarga (temporal del servidor local) se calcula aquí, fuera del bot
+    result["sha256"] = payload.get("sha256") or file_sha256(temp_path)
+    return result
+
+async def _apply_analysis(job, item, state, result):
+    """Aplica al elemento el veredicto de un proceso de análisis y responde si hay rechazo"""
+    if state == "failed" or "error" in result:
+        print(f"❌ Error analizando {item.final_path}: {result.get('error')}", flush=True)
+        item.error = "error de validación"
+        if not job.is_album:
+            await job.context.bot.send_message(chat_id=USER_ID, text="❌ Error al validar el archivo.")
+        return
+    item.width, item.height, item.duration = result["width"], result["height"], result["duration"]
+    item.capture_metadata = result["metadata"]
+    item.sha256 = result.get("sha256") or item.sha256
+    if result["quality"]:
+        record_quality_result(result["quality"])
+    if result["derivative_temp"]:
+        item.derivative_temp = result["derivative_temp"]
+        item.derivative_path = derivative_path_for(item.final_path, HEIF_DERIVATIVE_FORMAT)
+        print(f"🖼️ HEIF convertido en {result['heif_ms']:.0f}ms: {item.width}x{item.height}", flush=True)
+
+    reject = result["reject"]
+    if reject == "resolution":
+        await reject_low_resolution(job, item)
+    elif reject == "duration":
+        await reject_long_video(job, item)
+    elif reject == "quality":
+        await reject_low_quality(job, item, result["quality"]["reason"])
+    elif reject == "heif":
+        await reject_undecodable_heif(job, item, result["heif_error"])
+
+# Etapa 2 con procesos de análisis: encolar los elementos y esperar su veredicto
+async def ingest_analyze(job):
+    queue = get_work_queue()
+    if job.key is None:
+        job.key = new_job_key()
+        items = job.pending_items()
+        payloads = [analysis_payload(job, item) for item in items]
+        task_ids = await asyncio.to_thread(queue.put_many, INGEST_TASK_KIND, payloads, job.key)
+        for item, task_id in zip(items, task_ids):
+            item.task_id = task_id
+    items = [item for item in job.items if item.task_id is not None]
+    outcomes = await result_waiter.wait([item.task_id for item in items])
+    for item, (state, result) in zip(items, outcomes):
+        await _apply_analysis(job, item, state, result)
+    if job.pending_items():
+        return True
+    if job.is_album:
+        await send_album_summary(job, saved=False)
+    return False
+
+# Índice de metadatos (se abre con el primer archivo guardado en SAVE_PATH)
+media_index = None
+
+def get_media_index():
+    global media_index
+    if media_index is None or media_index.save_path != SAVE_PATH:
+        if media_index is not None:
+            media_index.close()  # Otra SAVE_PATH: no dejar abierta la conexión de la anterior
+        media_index = MediaIndex(SAVE_PATH)
+    return media_index
+
+# Sorteo de recuerdos: se carga del índice una vez y crece con cada archivo guardado
+memory_sampler = None
+memory_sampler_path = None
+
+def get_memory_sampler():
+    global memory_sampler, memory_sampler_path
+    if memory_sampler is None or memory_sampler_path != SAVE_PATH:
+        sampler = MemorySampler(SAMPLER_TYPE_WEIGHTS, SAMPLER_YEAR_WEIGHTS)
+        sampler.load(get_media_index().sampling_rows())
+        memory_sampler, memory_sampler_path = sampler, SAVE_PATH
+    return memory_sampler
+
+def get_sampler_export_path():
+    return os.path.join(SAVE_PATH, ".index", "sampler.json")
+
+def export_memory_sampler(force=False):
+    """Escribe el reparto para random.php si hubo archivos nuevos desde la última vez"""
+    sampler = get_memory_sampler()
+    if not (force or sampler.dirty):
+        return
+    try:
+        exported = sampler.export(get_sampler_export_path())
+        setup_file_permissions(get_sampler_export_path())
+        print(f"🎲 Sorteo exportado para la web: {exported} archivos", flush=True)
+    except Exception as e:
+        print(f"⚠️ No se pudo exportar el sorteo para la web: {e}", flush=True)
+
+def telegram_file_kind(message):
+    if message.photo:
+        return "photo"
+    return "video" if message.video else "document"
+
+def index_saved_item(item):
+    """Lee una sola vez los metadatos del archivo guardado (solo cabeceras) y lo indexa.
+
+    Se guarda también el file_id de Telegram para reenviarlo sin subir bytes.
+    """
+    file_id = getattr(item.source, "file_id", None)
+    hashes = {item.final_path: item.sha256} if item.sha256 else None
+    try:
+        if item.derivative_path:
+            # La web muestra la copia; los metadatos se leen del original
+            row = get_media_index().record(item.derivative_path, original=item.final_path, file_id=file_id,
+                                           file_kind=item.file_kind, metadata=item.capture_metadata,
+                                           hashes=hashes)
+        else:
+            row = get_media_index().record(item.final_path, file_id=file_id, file_kind=item.file_kind,
+                                           metadata=item.capture_metadata, hashes=hashes)
+        if row:
+            get_memory_sampler().add(row["path"], row["kind"], row["date"], row["time"], row["size"], row["mtime"])
+        return row
+    except Exception as e:
+        print(f"⚠️ No se pudo indexar {item.final_path}: {e}", flush=True)
+        return None
+
+def format_capture_details(metadata):
+    """Líneas de cámara y ubicación para el mensaje de confirmación"""
+    if not metadata:
+        return ""
+    details = ""
+    camera = " ".join(part for part in (metadata.get("camera_make"), metadata.get("camera_model")) if part)
+    if camera:
+        details += f"\n📷 **Cámara:** {camera}"
+    if metadata.get("latitude") is not None and metadata.get("longitude") is not None:
+        details += f"\n📍 **Ubicación:** {metadata['latitude']:.4f}, {metadata['longitude']:.4f}"
+    return details
+
+# Etapa 4: mover a la ubicación final con permisos correctos e indexar metadatos (en paralelo)
+async def _store_item(job, item):
+    if not await save_file_with_permissions(item.temp_path, item.final_path):
+        item.error = "error al guardar"
+        if not job.is_album:
+            await job.context.bot.send_message(chat_id=USER_ID, text=f"❌ Error guardando {INGEST_LABELS[item.label]['noun']}.")
+        return
+    if item.derivative_temp:
+        if await save_file_with_permissions(item.derivative_temp, item.derivative_path):
+            item.derivative_temp = None
+        else:
+            item.derivative_path = None
+    item.metadata = await asyncio.to_thread(index_saved_item, item)
+    saved = [path for path in (item.final_path, item.derivative_path) if path]
+    # Original y copia web en una sola operación; si el disco no responde el archivo ya está guardado
+    with contextlib.suppress(StorageTimeout):
+        await get_storage().run("feed", publish_saved_files, saved, item.kind)
+    for path in saved:
+        remember_recent_file(path)
+
+async def ingest_store(job):
+    await _run_items(job, _store_item, "error al guardar")
+    if job.pending_items():
+        return True
+    if job.is_album:
+        await send_album_summary(job, saved=False)
+    return False
+
+# Etapa 5: marcar la ventana como entregada (una sola vez) y enviar el resultado final
+async def ingest_commit(job):
+    # Un envío retomado de otro día ya no cuenta para ninguna ventana del plan actual
+    if job.window_index is not None:
+        await get_storage().run("plan.save", update_delivery_state, job.window_index, True, timeout=0)
+        plan = await load_plan()
+        if plan and job.window_index < len(plan):
+            await get_storage().run("history", record_plan_event, "delivered", plan[job.window_index],
+                                    job.submitted_at, timeout=0)
+    if job.is_album:
+        for item in job.pending_items():
+            print(f"{item.label} del álbum guardado: {item.final_path}", flush=True)
+        await send_album_summary(job, saved=True)
+        await show_updated_status(job.context, None)
+        return True
+
+    item = job.items[0]
+    if item.kind == "foto":
+        detail = f"📏 **Resolución:** {format_resolution(item.width, item.height)}"
+        if item.derivative_path:
+            detail += f"\n🌐 **Copia web:** {os.path.basename(item.derivative_path)}"
+        print(f"{item.label} guardada: {item.final_path} - Resolución: {item.width}x{item.height}", flush=True)
+    else:
+        detail = f"⏱️ **Duración:** {format_duration(item.duration)}"
+        print(f"Video guardado: {item.final_path} - Duración: {item.duration:.1f}s", flush=True)
+    detail += format_capture_details(item.metadata)
+    await job.context.bot.send_message(
+        chat_id=USER_ID,
+        text=(
+            f"✅ **{INGEST_LABELS[item.label]['saved']}**\n"
+            f"{detail}\n"
+            f"📦 **Tamaño:** {get_file_size_mb(item.file_size)}"
+        ),
+        parse_mode='Markdown'
+    )
+    await show_updated_status(job.context, None)
+    return True
+
+# Motivos de fallo que pueden no repetirse: estos archivos se vuelven a procesar.
+# Los del filtro de calidad dependen de umbrales configurables, así que tampoco son definitivos
+TRANSIENT_ERRORS = {"error de descarga", "error de validación", "error de conversión", "error al guardar",
+                    *(f"imagen {reason}" for reason in QUALITY_REASONS.values())}
+
+def record_ingest_results(job):
+    """Registra el resultado de cada archivo descargado para responder a reentregas sin descargar"""
+    entries = []
+    for item in job.items:
+        file_unique_id = getattr(item.source, "file_unique_id", None)
+        if not file_unique_id or item.temp_path is None or item.error in TRANSIENT_ERRORS:
+            continue  # Rechazado antes de descargar (depende de la ventana) o fallo transitorio
+        if item.error is None:
+            entries.append((file_unique_id, item.update_id, item.derivative_path or item.final_path, "saved"))
+        else:
+            entries.append((file_unique_id, item.update_id, None, item.error))
+    get_media_index().record_ingested(entries)
+    IDEMPOTENCY_STATS["recorded"] += len(entries)
+    # El envío ya terminó: sus tareas dejan de hacer falta para retomarlo
+    task_ids = [item.task_id for item in job.items if item.task_id is not None]
+    if task_ids:
+        get_work_queue().remove(task_ids)
+
+def clean_staging(referenced):
+    """Borra los temporales de la ingesta que no pertenecen a ninguna tarea; devuelve cuántos"""
+    orphans = 0
+    if os.path.isdir(LOCAL_STAGING_PATH):
+        for entry in os.scandir(LOCAL_STAGING_PATH):
+            if entry.is_file() and entry.path not in referenced:
+                with contextlib.suppress(OSError):
+                    os.unlink(entry.path)
+                    orphans += 1
+    return orphans
+
+async def resume_ingest_jobs(app):
+    """Retoma los envíos que quedaron en la cola persistente al parar el bot.
+
+    Las tareas ya analizadas no se repiten: el envío vuelve a la etapa de análisis,
+    recoge el veredicto guardado y sigue. Los temporales que no pertenecen a
+    ninguna tarea (descargas a medias) se borran.
+    """
+    queue = get_work_queue()
+    released = await asyncio.to_thread(queue.release_running)
+    today = get_current_datetime().strftime("%Y-%m-%d")
+    referenced = set()
+    resumed = 0
+    for key, tasks in (await asyncio.to_thread(queue.jobs, INGEST_TASK_KIND)).items():
+        items, lost = [], []
+        for task_id, payload in tasks:
+            if not await get_storage().exists(payload["temp_path"]):
+                lost.append(task_id)  # Ya se guardó antes de parar o se perdió el temporal
+                continue
+            source = SimpleNamespace(file_id=payload["file_id"], file_unique_id=payload["file_unique_id"])
+            item = IngestItem(payload["kind"], payload["label"], source, payload["suffix"],
+                              payload["final_path"], payload["file_size"])
+            item.update_id, item.file_kind = payload["update_id"], payload["file_kind"]
+            item.temp_path, item.task_id = payload["temp_path"], task_id
+            items.append(item)
+            referenced.update(path for path in (payload["temp_path"], payload["derivative_temp"]) if path)
+        await asyncio.to_thread(queue.remove, lost)
+        if not items:
+            continue
+        first = tasks[0][1]
+        window_index = first["window_index"] if first["date"] == today else None
+        job = IngestJob(SimpleNamespace(bot=app.bot), window_index, items, media_group_id=first["media_group_id"])
+        job.key = key
+        await app.ingest_pipeline.submit(job, stage=1)
+        resumed += 1
+
+    orphans = await get_storage().run("staging", clean_staging, referenced)
+    print(f"📋 Cola de ingesta: {resumed} envíos retomados, {released} tareas reiniciadas, "
+          f"{orphans} temporales huérfanos borrados", flush=True)
+
+def get_message_media(message):
+    """Foto (mayor tamaño), video o documento de un mensaje"""
+    if message.photo:
+        return message.photo[-1]
+    return message.video or message.document
+
+async def answer_repeated_delivery(update, context):
+    """Reentregas de Telegram y reenvíos del mismo archivo se responden con el resultado guardado.
+
+    Se consulta por update_id y file_unique_id antes de cualquier get_file(),
+    así que no se descarga ni se escribe nada. Devuelve True si ya se respondió.
+    """
+    media = get_message_media(update.message)
+    if media is None:
+        return False
+    record = await asyncio.to_thread(
+        get_media_index().find_ingested, update.update_id, getattr(media, "file_unique_id", None)
+    )
+    if record is None:
         return False
+    IDEMPOTENCY_STATS["repeated"] += 1
+    print(f"♻️ Archivo ya procesado (actualización {update.update_id}): {record['path'] or record['result']}", flush=True)
+
+    media_group_id = getattr(update.message, "media_group_id", None)
+    if media_group_id:
+        if media_group_id in ANSWERED_REPEATED_GROUPS:
+            return True  # Un solo aviso por álbum repetido
+        ANSWERED_REPEATED_GROUPS.append(media_group_id)
+    if record["result"] == "saved":
+        saved_at = datetime.fromtimestamp(record["recorded_at"]).strftime("%d/%m %H:%M")
+        text = f"♻️ **Este archivo ya está guardado** (desde el {saved_at})\n📁 `{os.path.relpath(record['path'], SAVE_PATH)}`"
+    else:
+        text = f"♻️ **Este archivo ya se revisó y se rechazó:** {record['result']}"
+    await context.bot.send_message(chat_id=USER_ID, text=text, parse_mode='Markdown')
+    return True
+
+def create_ingest_pipeline():
+    """Crea el pipeline de ingesta con la concurrencia configurada por etapa"""
+    if INGEST_PROCESS_WORKERS:
+        # Validación y conversión pasan a los procesos de análisis; aquí solo se espera su veredicto
+        analysis = [("análisis", ingest_analyze, INGEST_PROCESS_WORKERS * 2)]
+    else:
+        analysis = [
+            ("validación", ingest_validate, INGEST_VALIDATE_WORKERS),
+            ("conversión", ingest_convert, HEIF_WORKERS),
+        ]
+    return IngestPipeline([
+        ("descarga", ingest_download, INGEST_DOWNLOAD_WORKERS),
+        *analysis,
+        ("guardado", ingest_store, INGEST_STORE_WORKERS),
+        ("confirmación", ingest_commit, 1),  # Un único escritor del plan
+    ], on_finish=record_ingest_results)
+
+def get_ingest_pipeline(application):
+    """Devuelve el pipeline de la aplicación, creándolo si aún no existe"""
+    pipeline = getattr(application, "ingest_pipeline", None)
+    if pipeline is None:
+        pipeline = create_ingest_pipeline()
+        pipeline.start()
+        application.ingest_pipeline = pipeline
+    return pipeline
+
+def build_album_item(message, expected_type, dir_path, item_time):
+    """Crea el IngestItem de un elemento de álbum, con su motivo de rechazo si no es válido"""
+    # Cada elemento avanza un segundo para mantener el formato HH-MM-SS.ext sin colisiones
+    hour = item_time.strftime("%H-%M-%S")
+    if message.photo:
+        item = IngestItem("foto", "Foto", message.photo[-1], ".jpg", f"{dir_path}/{hour}.jpg", message.photo[-1].file_size)
+    elif message.video:
+        item = IngestItem("video", "Video", message.video, ".mp4", f"{dir_path}/{hour}.mp4", message.video.file_size)
+    elif message.document and message.document.file_name:
+        doc = message.document
+        filename = doc.file_name.lower()
+        suffix = f'.{filename.split(".")[-1]}'
+        if filename.endswith((".jpg", ".jpeg", ".png", ".heic", ".heif")):
+            item = IngestItem("foto", "Imagen", doc, suffix, f"{dir_path}/{hour}_{doc.file_name}", doc.file_size)
+        elif filename.endswith((".mp4", ".mov", ".hevc")):
+            item = IngestItem("video", "Video", doc, suffix, f"{dir_path}/{hour}_{doc.file_name}", doc.file_size)
+        else:
+            return IngestItem(None, "Archivo", doc, suffix, None, doc.file_size, error="formato no soportado")
+    else:
+        return IngestItem(None, "Elemento", None, "", None, 0, error="no es foto ni video")
+
+    item.file_kind = telegram_file_kind(message)
+    if item.kind != expected_type:
+        item.error = f"se esperaba {expected_type.upper()}"
+    elif item.file_size and item.file_size > MAX_FILE_SIZE:
+        item.error = f"demasiado grande ({get_file_size_mb(item.file_size)})"
+    return item
+
+class MediaGroupCollector:
+    """Agrupa los elementos de un álbum (media_group_id) antes de ingerirlos juntos.
+
+    Telegram entrega cada elemento como una actualización distinta; el primero
+    pasa las comprobaciones del plan y reserva la ventana, el resto se añade
+    sin recargar el plan. Cuando pasan MEDIA_GROUP_WINDOW segundos sin nuevos
+    elementos, el álbum entra en el pipeline como un único envío.
+    """
+
+    def __init__(self, pipeline, window_seconds=MEDIA_GROUP_WINDOW):
+        self.pipeline = pipeline
+        self.window_seconds = window_seconds
+        self.groups = {}
+
+    def has(self, group_id):
+        return group_id in self.groups
+
+    def open(self, group_id, context, window_index, expected_type, dir_path, base_time):
+        self.pipeline.in_flight.add(window_index)
+        self.groups[group_id] = {
+            "job": IngestJob(context, window_index, [], media_group_id=group_id),
+            "expected_type": expected_type,
+            "dir_path": dir_path,
+            "base_time": base_time,
+            "timer": None,
+        }
+
+    def add(self, group_id, message, update_id=None):
+        group = self.groups[group_id]
+        job = group["job"]
+        item_time = group["base_time"] + timedelta(seconds=len(job.items))
+        item = build_album_item(message, group["expected_type"], group["dir_path"], item_time)
+        item.update_id = update_id
+        job.items.append(item)
+        if group["timer"] is not None:
+            group["timer"].cancel()
+        group["timer"] = asyncio.create_task(self._submit_later(group_id))
+
+    async def _submit_later(self, group_id):
+        await asyncio.sleep(self.window_seconds)
+        await self._submit(group_id)
+
+    async def _submit(self, group_id):
+        group = self.groups.pop(group_id, None)
+        if group is None:
+            return
+        job = group["job"]
+        print(f"📚 Álbum {group_id} completo con {len(job.items)} elementos", flush=True)
+        if not job.pending_items():
+            self.pipeline.in_flight.discard(job.window_index)
+            await send_album_summary(job, saved=False)
+            return
+        await self.pipeline.submit(job)
+
+    async def flush(self):
+        """Envía al pipeline todos los álbumes pendientes sin esperar a la ventana"""
+        for group_id in list(self.groups):
+            timer = self.groups[group_id]["timer"]
+            if timer is not None and timer is not asyncio.current_task():
+                timer.cancel()
+            await self._submit(group_id)
+
+def get_media_group_collector(application):
+    """Devuelve el agrupador de álbumes de la aplicación, creándolo si aún no existe"""
+    collector = getattr(application, "media_groups", None)
+    if collector is None:
+        collector = MediaGroupCollector(get_ingest_pipeline(application))
+        application.media_groups = collector
+    return collector
+
+# Recibir foto/video que el usuario envía y pasarlo al pipeline de ingesta
+def remember_rejected_group(media_group_id):
+    """Un álbum rechazado se responde una vez: sus demás elementos se descartan en silencio"""
+    if media_group_id:
+        REJECTED_GROUPS.append(media_group_id)
 
-# Guardar foto/video que el usuario envía
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print("photo_handler triggered", flush=True)
     if update.effective_user.id != USER_ID:
@@ -476,17 +2024,34 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
         return
 
+    # Reentregas y reenvíos del mismo archivo: se responde sin descargar nada
+    if await answer_repeated_delivery(update, context):
+        return
+
+    # Elementos adicionales de un álbum ya abierto: se añaden sin repetir comprobaciones
+    media_group_id = getattr(update.message, "media_group_id", None)
+    if media_group_id:
+        if media_group_id in REJECTED_GROUPS:
+            print(f"📚 Elemento de un álbum ya rechazado ({media_group_id}), se descarta", flush=True)
+            return
+        collector = get_media_group_collector(context.application)
+        if collector.has(media_group_id):
+            collector.add(media_group_id, update.message, update.update_id)
+            print(f"📚 Elemento añadido al álbum {media_group_id}", flush=True)
+            return
+
     # Verificar si puede enviar contenido
-    plan = load_plan_json()
+    plan = await load_plan()
 
     if not plan:
         await context.bot.send_message(chat_id=USER_ID, text="❌ No hay planificación activa. Usa /start para generar una.")
         print("No hay planificación activa aún", flush=True)
+        remember_rejected_group(media_group_id)
         return
 
     # Si ninguna notificación ha sido entregada todavía
-    if all_notifications_pending():
-        now = datetime.now()
+    if all_notifications_pending(plan):
+        now = get_current_datetime()
         first_notification = plan[0]
         primer_hora = first_notification.get("hour", 8)
         primer_minuto = first_notification.get("minute", 0)
@@ -495,13 +2060,14 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             next_time = format_notification_time(primer_hora, primer_minuto)
             await context.bot.send_message(chat_id=USER_ID, text=f"⏳ Aún no puedes enviar nada. La primera notificación será a las {next_time}.")
             print("Intento de envío antes de la primera notificación", flush=True)
+            remember_rejected_group(media_group_id)
             return
 
     # Verificar ventana de tiempo actual
     window_index, current_window = get_current_time_window(plan)
     if current_window is None:
         # No hay ventana activa, mostrar próxima notificación
-        now = datetime.now()
+        now = get_current_datetime()
         current_total_minutes = now.hour * 60 + now.minute
         next_notification = None
 
@@ -519,20 +2085,30 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await context.bot.send_message(chat_id=USER_ID, text="⏰ No hay más notificaciones programadas para hoy.")
         print("Intento de envío fuera de ventana de tiempo", flush=True)
+        remember_rejected_group(media_group_id)
+        return
+
+    pipeline = get_ingest_pipeline(context.application)
+
+    # Una ventana con un envío aún en proceso cuenta como ocupada
+    if window_index in pipeline.in_flight and not current_window.get("delivered", False):
+        await context.bot.send_message(chat_id=USER_ID, text="⏳ Ya estoy procesando un envío para esta notificación. Espera el resultado.")
+        print("Envío duplicado mientras la ventana está en proceso", flush=True)
+        remember_rejected_group(media_group_id)
         return
 
     # Verificar si ya se completó esta notificación
     if current_window.get("delivered", False):
         # Esta ventana específica ya está completada
         # Buscar si hay otras ventanas activas pendientes
-        now = datetime.now()
+        now = get_current_datetime()
         current_total_minutes = now.hour * 60 + now.minute
 
         # Buscar ventanas activas pendientes
         pending_active_windows = []
         for i, entry in enumerate(plan):
             if (is_notification_window_active(plan, i, current_total_minutes) and
-                not entry.get("delivered", False)):
+                not entry.get("delivered", False) and i not in pipeline.in_flight):
                 pending_active_windows.append((i, entry))
 
         if pending_active_windows:
@@ -558,10 +2134,21 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await context.bot.send_message(chat_id=USER_ID, text="✅ Ya completaste todas las notificaciones de hoy.")
             print("Intento de envío en notificación ya completada", flush=True)
+            remember_rejected_group(media_group_id)
             return
 
-    # Verificar tipo de contenido
+    # Primer elemento de un álbum: reservar la ventana y esperar al resto
     expected_type = current_window["type"]
+    if media_group_id:
+        now = get_current_datetime()
+        collector.open(media_group_id, context, window_index, expected_type,
+                       f"{SAVE_PATH}/{now.strftime('%Y/%m/%d')}", now)
+        collector.add(media_group_id, update.message, update.update_id)
+        await context.bot.send_message(chat_id=USER_ID, text="📥 Álbum recibido. Esperando el resto de elementos...")
+        print(f"📚 Nuevo álbum {media_group_id} para la ventana {window_index}", flush=True)
+        return
+
+    # Verificar tipo de contenido
     if not check_content_type(update, expected_type):
         if expected_type == "foto":
             await context.bot.send_message(
@@ -570,7 +2157,7 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "❌ **Se esperaba una FOTO**, pero enviaste otro tipo de contenido.\n\n"
                     "📸 Por favor, envía una imagen que cumpla:\n"
                     "• Mínimo 1080p (1920x1080)\n"
-                    "• Máximo 20MB\n"
+                    f"• Máximo {MAX_FILE_SIZE_MB}MB\n"
                     "• Formatos: JPG, PNG, HEIC, HEIF"
                 ),
                 parse_mode='Markdown'
@@ -582,7 +2169,7 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "❌ **Se esperaba un VIDEO**, pero enviaste otro tipo de contenido.\n\n"
                     "🎥 Por favor, envía un video que cumpla:\n"
                     "• Máximo 20 segundos\n"
-                    "• Máximo 20MB\n"
+                    f"• Máximo {MAX_FILE_SIZE_MB}MB\n"
                     "• Formatos: MP4, MOV, HEVC"
                 ),
                 parse_mode='Markdown'
@@ -591,18 +2178,13 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        now = datetime.now()
+        now = get_current_datetime()
         year = now.strftime("%Y")
         month = now.strftime("%m")
         day = now.strftime("%d")
         hour = now.strftime("%H-%M-%S")
         dir_path = f"{SAVE_PATH}/{year}/{month}/{day}"
 
-        # Configurar estructura de directorios con permisos correctos
-        if not setup_directory_permissions(dir_path):
-            await context.bot.send_message(chat_id=USER_ID, text="❌ Error configurando directorio de destino.")
-            return
-
         # Verificar si es mensaje de texto (no contenido multimedia)
         if update.message.text:
             await context.bot.send_message(
@@ -631,7 +2213,7 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 chat_id=USER_ID,
                 text=(
                     f"❌ **Archivo demasiado grande:** {size_mb:.1f}MB\n\n"
-                    f"📦 **Límite:** 20MB máximo\n"
+                    f"📦 **Límite:** {MAX_FILE_SIZE_MB}MB máximo\n"
                     f"💡 **Solución:** Reduce la calidad o duración del archivo"
                 ),
                 parse_mode='Markdown'
@@ -639,195 +2221,26 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             print(f"Archivo demasiado grande: {size_mb:.1f}MB", flush=True)
             return
 
-        # Procesar foto
+        # Identificar el contenido y su ruta final
+        item = None
         if update.message.photo:
-            photo = update.message.photo[-1]
-            file = await photo.get_file()
-
-            # Descargar a archivo temporal para validar
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-                temp_path = tmp_file.name
-                await file.download_to_drive(temp_path)
-
-                # Validar resolución
-                is_valid, width, height = await validate_photo_resolution(temp_path)
-
-                if PIL_AVAILABLE and not is_valid:
-                    os.unlink(temp_path)
-                    await context.bot.send_message(
-                        chat_id=USER_ID,
-                        text=(
-                            f"❌ **Resolución insuficiente:** {format_resolution(width, height)}\n\n"
-                            f"📸 **Mínimo requerido:** 1080p (1920x1080)\n"
-                            f"💡 **Solución:** Configura tu cámara en máxima calidad"
-                        ),
-                        parse_mode='Markdown'
-                    )
-                    print(f"Foto con resolución insuficiente: {width}x{height}", flush=True)
-                    return
-
-                # Guardar archivo con permisos correctos
-                final_path = f"{dir_path}/{hour}.jpg"
-                if save_file_with_permissions(temp_path, final_path):
-                    # Marcar como entregado
-                    update_delivery_state(window_index, True)
-                    await context.bot.send_message(
-                        chat_id=USER_ID,
-                        text=(
-                            f"✅ **Foto recibida y guardada**\n"
-                            f"📏 **Resolución:** {format_resolution(width, height)}\n"
-                            f"📦 **Tamaño:** {get_file_size_mb(file_size)}"
-                        ),
-                        parse_mode='Markdown'
-                    )
-                    print(f"Foto guardada: {final_path} - Resolución: {width}x{height}", flush=True)
-                    await show_updated_status(context, None)
-                else:
-                    await context.bot.send_message(chat_id=USER_ID, text="❌ Error guardando la foto.")
-                return
-
-        # Procesar video
-        if update.message.video:
-            video = update.message.video
-            file = await video.get_file()
-
-            # Descargar a archivo temporal para validar
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_file:
-                temp_path = tmp_file.name
-                await file.download_to_drive(temp_path)
-
-                # Validar duración
-                is_valid, duration = await validate_video_duration(temp_path)
-
-                if CV2_AVAILABLE and not is_valid:
-                    os.unlink(temp_path)
-                    await context.bot.send_message(
-                        chat_id=USER_ID,
-                        text=(
-                            f"❌ **Video demasiado largo:** {format_duration(duration)}\n\n"
-                            f"🎥 **Máximo permitido:** 20 segundos\n"
-                            f"💡 **Solución:** Graba un video más corto"
-                        ),
-                        parse_mode='Markdown'
-                    )
-                    print(f"Video demasiado largo: {duration:.1f}s", flush=True)
-                    return
-
-                # Guardar archivo con permisos correctos
-                final_path = f"{dir_path}/{hour}.mp4"
-                if save_file_with_permissions(temp_path, final_path):
-                    # Marcar como entregado
-                    update_delivery_state(window_index, True)
-                    await context.bot.send_message(
-                        chat_id=USER_ID,
-                        text=(
-                            f"✅ **Video recibido y guardado**\n"
-                            f"⏱️ **Duración:** {format_duration(duration)}\n"
-                            f"📦 **Tamaño:** {get_file_size_mb(file_size)}"
-                        ),
-                        parse_mode='Markdown'
-                    )
-                    print(f"Video guardado: {final_path} - Duración: {duration:.1f}s", flush=True)
-                    await show_updated_status(context, None)
-                else:
-                    await context.bot.send_message(chat_id=USER_ID, text="❌ Error guardando el video.")
-                return
-
-        # Procesar documento
-        if update.message.document:
+            item = IngestItem("foto", "Foto", update.message.photo[-1],
+                              ".jpg", f"{dir_path}/{hour}.jpg", file_size)
+        elif update.message.video:
+            item = IngestItem("video", "Video", update.message.video,
+                              ".mp4", f"{dir_path}/{hour}.mp4", file_size)
+        elif update.message.document:
             doc = update.message.document
             filename = doc.file_name.lower()
+            suffix = f'.{filename.split(".")[-1]}'
 
             # Solo aceptar imágenes y videos comunes
             if filename.endswith((".jpg", ".jpeg", ".png", ".heic", ".heif")):
-                # Es una imagen como documento
-                file = await doc.get_file()
-
-                with tempfile.NamedTemporaryFile(suffix=f'.{filename.split(".")[-1]}', delete=False) as tmp_file:
-                    temp_path = tmp_file.name
-                    await file.download_to_drive(temp_path)
-
-                    # Validar resolución
-                    is_valid, width, height = await validate_photo_resolution(temp_path)
-
-                    if PIL_AVAILABLE and not is_valid:
-                        os.unlink(temp_path)
-                        await context.bot.send_message(
-                            chat_id=USER_ID,
-                            text=(
-                                f"❌ **Resolución insuficiente:** {format_resolution(width, height)}\n\n"
-                                f"📸 **Mínimo requerido:** 1080p (1920x1080)\n"
-                                f"💡 **Solución:** Configura tu cámara en máxima calidad"
-                            ),
-                            parse_mode='Markdown'
-                        )
-                        print(f"Imagen con resolución insuficiente: {width}x{height}", flush=True)
-                        return
-
-                    # Guardar archivo con permisos correctos
-                    final_path = f"{dir_path}/{hour}_{doc.file_name}"
-                    if save_file_with_permissions(temp_path, final_path):
-                        # Marcar como entregado
-                        update_delivery_state(window_index, True)
-                        await context.bot.send_message(
-                            chat_id=USER_ID,
-                            text=(
-                                f"✅ **Imagen recibida y guardada**\n"
-                                f"📏 **Resolución:** {format_resolution(width, height)}\n"
-                                f"📦 **Tamaño:** {get_file_size_mb(file_size)}"
-                            ),
-                            parse_mode='Markdown'
-                        )
-                        print(f"Imagen guardada: {final_path} - Resolución: {width}x{height}", flush=True)
-                        await show_updated_status(context, None)
-                    else:
-                        await context.bot.send_message(chat_id=USER_ID, text="❌ Error guardando la imagen.")
-                    return
-
+                item = IngestItem("foto", "Imagen", doc,
+                                  suffix, f"{dir_path}/{hour}_{doc.file_name}", file_size)
             elif filename.endswith((".mp4", ".mov", ".hevc")):
-                # Es un video como documento
-                file = await doc.get_file()
-
-                with tempfile.NamedTemporaryFile(suffix=f'.{filename.split(".")[-1]}', delete=False) as tmp_file:
-                    temp_path = tmp_file.name
-                    await file.download_to_drive(temp_path)
-
-                    # Validar duración
-                    is_valid, duration = await validate_video_duration(temp_path)
-
-                    if CV2_AVAILABLE and not is_valid:
-                        os.unlink(temp_path)
-                        await context.bot.send_message(
-                            chat_id=USER_ID,
-                            text=(
-                                f"❌ **Video demasiado largo:** {format_duration(duration)}\n\n"
-                                f"🎥 **Máximo permitido:** 20 segundos\n"
-                                f"💡 **Solución:** Graba un video más corto"
-                            ),
-                            parse_mode='Markdown'
-                        )
-                        print(f"Video demasiado largo: {duration:.1f}s", flush=True)
-                        return
-
-                    # Guardar archivo con permisos correctos
-                    final_path = f"{dir_path}/{hour}_{doc.file_name}"
-                    if save_file_with_permissions(temp_path, final_path):
-                        # Marcar como entregado
-                        update_delivery_state(window_index, True)
-                        await context.bot.send_message(
-                            chat_id=USER_ID,
-                            text=(
-                                f"✅ **Video recibido y guardado**\n"
-                                f"⏱️ **Duración:** {format_duration(duration)}\n"
-                                f"📦 **Tamaño:** {get_file_size_mb(file_size)}"
-                            ),
-                            parse_mode='Markdown'
-                        )
-                        print(f"Video guardado: {final_path} - Duración: {duration:.1f}s", flush=True)
-                        await show_updated_status(context, None)
-                    else:
-                        await context.bot.send_message(chat_id=USER_ID, text="❌ Error guardando el video.")
-                    return
+                item = IngestItem("video", "Video", doc,
+                                  suffix, f"{dir_path}/{hour}_{doc.file_name}", file_size)
             else:
                 await context.bot.send_message(
                     chat_id=USER_ID,
@@ -842,19 +2255,618 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 print(f"Archivo ignorado: {filename}", flush=True)
                 return
 
+        if item is None:
+            await context.bot.send_message(
+                chat_id=USER_ID,
+                text=(
+                    "❌ **No se detectó imagen o video válido**\n\n"
+                    f"{get_requirements_text()}"
+                ),
+                parse_mode='Markdown'
+            )
+            print("No se detectó imagen o video en el mensaje", flush=True)
+            return
+
+        # Confirmar recepción al momento; el resultado llega al terminar el pipeline
+        await context.bot.send_message(
+            chat_id=USER_ID,
+            text=f"📥 {INGEST_LABELS[item.label]['received']}. Validando y guardando..."
+        )
+        item.update_id = update.update_id
+        item.file_kind = telegram_file_kind(update.message)
+        await pipeline.submit(IngestJob(context, window_index, [item]))
+
+    except Exception as e:
+        print(f"Error guardando archivo: {e}", flush=True)
+        await context.bot.send_message(chat_id=USER_ID, text="❌ Error al guardar el archivo.")
+
+# Búsqueda de fotos y videos por ubicación (índice geohash)
+async def reply_nearby(context, latitude, longitude, radius_m):
+    rows = await asyncio.to_thread(get_media_index().near, latitude, longitude, radius_m)
+    if not rows:
+        await context.bot.send_message(
+            chat_id=USER_ID,
+            text=f"📍 No hay fotos ni videos a menos de {radius_m}m de ({latitude:.4f}, {longitude:.4f})."
+        )
+        return
+    near_text = f"📍 **Cerca de ({latitude:.4f}, {longitude:.4f}), radio {radius_m}m:** {len(rows)} archivos\n\n"
+    for row in rows[:NEAR_MAX_RESULTS]:
+        emoji = "📸" if row["kind"] == "foto" else "🎥"
+        near_text += f"{emoji} {row['date']} {row['time'][:5]} a {row['distance_m']:.0f}m\n"
+    if len(rows) > NEAR_MAX_RESULTS:
+        near_text += f"... y {len(rows) - NEAR_MAX_RESULTS} más"
+    await context.bot.send_message(chat_id=USER_ID, text=near_text, parse_mode='Markdown')
+
+async def near_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /cerca LAT LON [RADIO]: fotos y videos tomados cerca de un punto"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    try:
+        latitude, longitude = float(context.args[0]), float(context.args[1])
+        radius_m = int(context.args[2]) if len(context.args) > 2 else NEAR_RADIUS_M
+    except (IndexError, ValueError):
         await context.bot.send_message(
             chat_id=USER_ID,
             text=(
-                "❌ **No se detectó imagen o video válido**\n\n"
-                f"{get_requirements_text()}"
+                "📍 **Uso:** `/cerca LAT LON [RADIO]`\n"
+                "Ejemplo: `/cerca 40.4168 -3.7038 500`\n\n"
+                "También puedes enviarme una ubicación desde Telegram."
             ),
             parse_mode='Markdown'
         )
-        print("No se detectó imagen o video en el mensaje", flush=True)
+        return
+    await reply_nearby(context, latitude, longitude, radius_m)
+
+async def location_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Una ubicación enviada al bot busca fotos y videos tomados cerca"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+    location = update.message.location
+    await reply_nearby(context, location.latitude, location.longitude, NEAR_RADIUS_M)
+
+# Reenvío de archivos guardados por file_id (sin subir bytes desde el NAS)
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+def saved_file_kind(row):
+    """Cómo reenviar una fila del índice: el tipo con el que llegó o, si no consta, por extensión"""
+    if row.get("file_kind"):
+        return row["file_kind"]
+    if row["kind"] == "video":
+        return "video"
+    return "document" if row["path"].lower().endswith((".heic", ".heif")) else "photo"
+
+def _sent_file_id(message, kind):
+    if kind == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    media = message.video if kind == "video" else message.document
+    return media.file_id if media else None
+
+class StreamedInputFile(InputFile):
+    """InputFile que sube desde un archivo abierto sin cargarlo en memoria.
+
+    InputFile lee el archivo entero al crearse; aquí se le deja el manejador y
+    httpx lo envía por trozos al hacer la petición. Esas lecturas ocurren en el
+    bucle de eventos: el manejador debe ser de disco local (stage_saved_file), no del NAS.
+    """
+
+    def __init__(self, handle, filename, attach=False):
+        super().__init__(b"", filename=filename, attach=attach)
+        self.input_file_content = handle
+
+def stage_saved_file(relative):
+    """Copia un archivo del diario (suelto o del tar de su mes) a un temporal local y lo devuelve abierto.
+
+    Se ejecuta en el pool del disco; el temporal no tiene nombre y desaparece al cerrarlo.
+    """
+    staged = tempfile.TemporaryFile(prefix="upload-")
+    try:
+        with media_tiering.open_media(SAVE_PATH, relative) as source:
+            shutil.copyfileobj(source, staged, media_tiering.COPY_CHUNK)
+        staged.seek(0)
+        return staged
+    except BaseException:
+        staged.close()
+        raise
+
+async def _send_saved_chunk(bot, rows, caption, upload):
+    """Envía hasta MEDIA_GROUP_LIMIT archivos; con upload, los sube desde el disco"""
+    inputs = []
+    uploaded = []
+    handles = []
+    try:
+        for row in rows:
+            if upload or not row.get("file_id"):
+                # Del NAS a un temporal local en el pool del disco: la subida no lee del NAS en el bucle
+                handle = await get_storage().run("read", stage_saved_file, row["path"])
+                handles.append(handle)
+                # En un álbum cada archivo va como attach://, fuera de él como el propio campo
+                inputs.append(StreamedInputFile(handle, os.path.basename(row["path"]), attach=len(rows) > 1))
+                uploaded.append(True)
+            else:
+                inputs.append(row["file_id"])
+                uploaded.append(False)
+
+        if len(rows) == 1:
+            kind = saved_file_kind(rows[0])
+            sender = {"photo": bot.send_photo, "video": bot.send_video, "document": bot.send_document}[kind]
+            messages = [await sender(USER_ID, inputs[0], caption=caption, filename=os.path.basename(rows[0]["path"]))]
+        else:
+            media = [
+                INPUT_MEDIA[saved_file_kind(row)](
+                    payload, caption=caption if index == 0 else None, filename=os.path.basename(row["path"])
+                )
+                for index, (row, payload) in enumerate(zip(rows, inputs))
+            ]
+            messages = await bot.send_media_group(USER_ID, media)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    # Los archivos subidos tienen un file_id nuevo: se guarda para la próxima vez
+    index = get_media_index()
+    for row, message, was_uploaded in zip(rows, messages, uploaded):
+        if was_uploaded:
+            kind = saved_file_kind(row)
+            file_id = _sent_file_id(message, kind)
+            if file_id:
+                await asyncio.to_thread(index.set_file_id, row["path"], file_id, kind)
+
+def _chunk_saved_rows(rows):
+    """Álbumes de Telegram: fotos y videos pueden ir juntos, los documentos van aparte"""
+    visual = [row for row in rows if saved_file_kind(row) != "document"]
+    documents = [row for row in rows if saved_file_kind(row) == "document"]
+    for group in (visual, documents):
+        for start in range(0, len(group), MEDIA_GROUP_LIMIT):
+            yield group[start:start + MEDIA_GROUP_LIMIT]
+
+async def send_saved_media(bot, rows, caption=None):
+    """Reenvía archivos del índice usando su file_id; si caducó, los sube desde el NAS"""
+    uploads = 0
+    for chunk in _chunk_saved_rows(rows):
+        try:
+            await _send_saved_chunk(bot, chunk, caption, upload=False)
+        except BadRequest as e:
+            print(f"⚠️ file_id no válido ({e}), subiendo {len(chunk)} archivos desde el NAS", flush=True)
+            await _send_saved_chunk(bot, chunk, caption, upload=True)
+            uploads += len(chunk)
+        caption = None  # El texto solo acompaña al primer envío
+    return uploads
+
+def describe_saved_rows(rows):
+    photos = sum(1 for row in rows if row["kind"] == "foto")
+    return f"{photos} fotos, {len(rows) - photos} videos"
+
+def format_saved_date(date):
+    return datetime.strptime(date, "%Y-%m-%d").strftime("%d/%m/%Y")
+
+def draw_saved_rows(count, kind=None, start=None, end=None):
+    """Sortea archivos con el sampler en memoria y devuelve sus filas del índice"""
+    index = get_media_index()
+    rows = []
+    for entry in get_memory_sampler().sample(count, kind, start, end):
+        row = index.get(os.path.join(SAVE_PATH, entry["path"]))
+        if row:
+            rows.append(row)
+    return rows
+
+def parse_random_args(args):
+    """/azar [foto|video] [AAAA | AAAA-MM-DD [AAAA-MM-DD]] [N] -> (n, tipo, desde, hasta)"""
+    count, kind, dates = 1, None, []
+    for arg in args:
+        arg = arg.lower()
+        if arg in ("foto", "fotos", "video", "videos"):
+            kind = arg.rstrip("s")
+        elif re.fullmatch(r"\d{4}", arg):
+            dates += [f"{arg}-01-01", f"{arg}-12-31"]
+        elif re.fullmatch(r"\d{4}-\d{2}-\d{2}", arg):
+            datetime.strptime(arg, "%Y-%m-%d")
+            dates.append(arg)
+        elif arg.isdigit():
+            count = max(1, min(int(arg), RANDOM_MAX_RESULTS))
+        else:
+            raise ValueError(arg)
+    if len(dates) > 2:
+        raise ValueError("demasiadas fechas")
+    start = dates[0] if dates else None
+    end = dates[1] if len(dates) > 1 else None
+    return count, kind, start, end
+
+async def random_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /azar: recuerdos al azar, filtrables por tipo y fechas (sorteo O(1) en memoria)"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    try:
+        count, kind, start, end = parse_random_args(context.args or [])
+    except ValueError:
+        await context.bot.send_message(
+            chat_id=USER_ID,
+            text="🎲 **Uso:** `/azar [foto|video] [AAAA | AAAA-MM-DD AAAA-MM-DD] [N]`",
+            parse_mode='Markdown'
+        )
+        return
+    rows = await asyncio.to_thread(draw_saved_rows, count, kind, start, end)
+    if not rows:
+        await context.bot.send_message(chat_id=USER_ID, text="📭 No hay recuerdos que cumplan ese filtro.")
+        return
+    rows.sort(key=lambda row: (row["date"], row["time"]))
+    if len(rows) == 1:
+        caption = f"🎲 Recuerdo del {format_saved_date(rows[0]['date'])} a las {rows[0]['time'][:5]}"
+    else:
+        caption = f"🎲 {len(rows)} recuerdos al azar: {describe_saved_rows(rows)}"
+    await send_saved_media(context.bot, rows, caption)
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /recuerdo: lo de este mismo día en años anteriores o, si no hay, un momento al azar"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    today = get_current_datetime()
+    index = get_media_index()
+    rows = []
+    if not (context.args and context.args[0].lower() == "azar"):
+        rows = await asyncio.to_thread(index.on_this_day, today.strftime("%m-%d"), today.strftime("%Y-%m-%d"))
+    if rows:
+        date = random.choice(sorted({row["date"] for row in rows}))
+        rows = [row for row in rows if row["date"] == date]
+        years = today.year - int(date[:4])
+        caption = f"📅 Tal día como hoy, hace {years} {'año' if years == 1 else 'años'} ({format_saved_date(date)})"
+    else:
+        yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+        rows = await asyncio.to_thread(draw_saved_rows, 1, None, None, yesterday)
+        if not rows:
+            await context.bot.send_message(chat_id=USER_ID, text="📭 Aún no hay recuerdos de días anteriores.")
+            return
+        row = rows[0]
+        caption = f"🎲 Recuerdo del {format_saved_date(row['date'])} a las {row['time'][:5]}"
+    await send_saved_media(context.bot, rows, caption)
+
+async def day_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /dia [YYYY-MM-DD]: reenvía las fotos y videos de un día"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    date = context.args[0] if context.args else get_current_datetime().strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        await context.bot.send_message(chat_id=USER_ID, text="📅 **Uso:** `/dia AAAA-MM-DD`", parse_mode='Markdown')
+        return
+    rows = await asyncio.to_thread(get_media_index().day, date)
+    if not rows:
+        await context.bot.send_message(chat_id=USER_ID, text=f"📭 No hay fotos ni videos del {format_saved_date(date)}.")
+        return
+    await send_saved_media(context.bot, rows, f"📚 {format_saved_date(date)}: {describe_saved_rows(rows)}")
+
+async def send_daily_digest(app):
+    """Resumen diario: el álbum con todo lo guardado hoy"""
+    today = get_current_datetime().strftime("%Y-%m-%d")
+    rows = await asyncio.to_thread(get_media_index().day, today)
+    if not rows:
+        print("📭 Sin archivos para el resumen diario", flush=True)
+        return
+    uploads = await send_saved_media(app.bot, rows, f"🌙 Resumen de hoy: {describe_saved_rows(rows)}")
+    print(f"📚 Resumen diario enviado: {len(rows)} archivos ({uploads} subidos desde el NAS)", flush=True)
+
+def render_period_recap(period):
+    """Hoja de contactos y timelapse de un día (YYYY-MM-DD) o un mes (YYYY-MM)"""
+    index = get_media_index()
+    if len(period) == 7:
+        rows = index.between(f"{period}-01", f"{period}-31")
+        labels = [f"{row['date'][8:]}/{row['date'][5:7]}" for row in rows]
+    else:
+        rows = index.day(period)
+        labels = [row["time"][:5] for row in rows]
+    if not rows:
+        return None, rows
+    # Rutas relativas: cada archivo se abre al usarlo, del tar del mes si está en el archivo frío
+    entries = [(row["path"], label) for row, label in zip(rows, labels)]
+    result = render_recap(entries, os.path.join(SAVE_PATH, ".recaps", period),
+                          opener=lambda relative: media_tiering.media_source(SAVE_PATH, relative))
+    if not result["collage"] and not result["timelapse"]:
+        return None, rows
+    for path in (result["collage"], result["timelapse"]):
+        if path:
+            setup_file_permissions(path)
+    return result, rows
+
+async def send_period_recap(bot, period):
+    """Renderiza el resumen en un hilo aparte y lo envía; devuelve False si no había archivos"""
+    result, rows = await asyncio.to_thread(render_period_recap, period)
+    if result is None:
+        return False
+    if len(period) == 7:
+        title = f"🗓️ Resumen de {datetime.strptime(period, '%Y-%m').strftime('%m/%Y')}"
+    else:
+        title = f"🌙 Resumen del {format_saved_date(period)}"
+    caption = f"{title}: {describe_saved_rows(rows)}"
+    if result["collage"]:
+        collage = await get_storage().read_bytes(result["collage"])
+        await bot.send_photo(USER_ID, collage, caption=caption, filename=os.path.basename(result["collage"]))
+        caption = None
+    if result["timelapse"]:
+        timelapse = await get_storage().read_bytes(result["timelapse"])
+        await bot.send_video(USER_ID, timelapse, caption=caption, supports_streaming=True,
+                             filename=os.path.basename(result["timelapse"]))
+    print(f"🎞️ Resumen {period} enviado: {result['tiles']} miniaturas, {result['frames']} archivos "
+          f"en el timelapse, renderizado en {result['elapsed_ms'] / 1000:.1f}s", flush=True)
+    return True
+
+async def daily_recap_job(date):
+    """Job persistente tras la última notificación del día"""
+    if not await send_period_recap(running_app.bot, date):
+        print(f"📭 Sin archivos para el resumen del {date}", flush=True)
+
+async def monthly_recap_job():
+    """Último día del mes: resumen del mes en curso"""
+    month = get_current_datetime().strftime("%Y-%m")
+    if not await send_period_recap(running_app.bot, month):
+        print(f"📭 Sin archivos para el resumen de {month}", flush=True)
+
+async def recap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /resumen [AAAA-MM-DD | AAAA-MM]: hoja de contactos y timelapse a petición"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    period = context.args[0] if context.args else get_current_datetime().strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(period, "%Y-%m" if len(period) == 7 else "%Y-%m-%d")
+    except ValueError:
+        await context.bot.send_message(chat_id=USER_ID, text="🎞️ **Uso:** `/resumen [AAAA-MM-DD | AAAA-MM]`", parse_mode='Markdown')
+        return
+    await context.bot.send_message(chat_id=USER_ID, text="⏳ Preparando el resumen...")
+    if not await send_period_recap(context.bot, period):
+        await context.bot.send_message(chat_id=USER_ID, text="📭 No hay fotos ni videos en ese periodo.")
+
+def optimize_archive(deadline):
+    """Recomprime en el pool de procesos lo pendiente hasta deadline (timestamp) y actualiza el índice"""
+    modes = archive_optimizer.available_modes(ARCHIVE_MODES)
+    if not modes:
+        return None
+    log = archive_optimizer.ArchiveLog(SAVE_PATH)
+    try:
+        options = {
+            "copy_path": ARCHIVE_COPY_PATH or os.path.join(SAVE_PATH, ".archivo"),
+            "quality": ARCHIVE_QUALITY,
+            "min_psnr": ARCHIVE_MIN_PSNR,
+        }
+        index = get_media_index()
+        packed = media_tiering.packed_paths(SAVE_PATH)  # Lo empaquetado no se reescribe
+        files = {relative: info for relative, info in index.known_files().items() if relative not in packed}
+        tasks = archive_optimizer.pending_tasks(SAVE_PATH, files, modes, log, options, ARCHIVE_MIN_AGE_DAYS)
+        print(f"🗜️ Recompresión: {len(tasks)} tareas ({', '.join(modes)}) con {ARCHIVE_WORKERS} procesos", flush=True)
+        summary = archive_optimizer.run(
+            tasks, log, ARCHIVE_WORKERS, deadline=deadline,
+            on_result=lambda result: print(archive_optimizer.format_result(result), flush=True)
+        )
+        index.update_sizes(summary["replaced"])
+        get_memory_sampler().update_sizes(summary["replaced"])
+        index.record_manifest([os.path.join(SAVE_PATH, relative) for relative, _ in summary["replaced"]])
+        for relative, size in summary["replaced"]:
+            publish_file_change("rewritten", relative, size=size)
+        return summary
+    finally:
+        log.close()
+
+async def archive_job():
+    """Job al empezar la franja ARCHIVE_HOURS: trabaja hasta que termina"""
+    start_minutes, end_minutes = archive_optimizer.parse_hours(ARCHIVE_HOURS)
+    now = get_current_datetime()
+    window_end = now.replace(hour=end_minutes // 60, minute=end_minutes % 60, second=0, microsecond=0)
+    if window_end <= now:
+        window_end += timedelta(days=1)  # La franja cruza la medianoche
+    try:
+        summary = await asyncio.to_thread(optimize_archive, window_end.timestamp())
+    except Exception as e:
+        print(f"❌ Error en la recompresión del archivo: {e}", flush=True)
+        return
+    if summary:
+        pending = f", {summary['pending']} pendientes para mañana" if summary["pending"] else ""
+        print(f"📊 Recompresión: {archive_optimizer.format_summary(summary)}{pending}", flush=True)
+
+def pack_cold_months():
+    """Empaqueta los meses cerrados y fija los permisos de los tars e índices nuevos"""
+    results = media_tiering.run(
+        SAVE_PATH, TIERING_HOT_DAYS, get_current_datetime().date(),
+        on_result=lambda result: print(media_tiering.format_result(result), flush=True)
+    )
+    index = get_media_index()
+    for result in results:
+        written = [os.path.join(SAVE_PATH, result["pack"]), os.path.join(SAVE_PATH, result["index"])]
+        for path in written:
+            setup_file_permissions(path)
+        index.record_manifest(written)
+        index.forget_manifest(result["removed"])
+        publish_change("packed", month=result["month"], pack=result["pack"], members=result["members"])
+    return results
+
+async def tiering_job():
+    """Job diario: pasa al archivo frío los meses que ya salieron de los días calientes"""
+    try:
+        results = await asyncio.to_thread(pack_cold_months)
+    except Exception as e:
+        print(f"❌ Error empaquetando el archivo frío: {e}", flush=True)
+        return
+    if results:
+        added = sum(result["added"] for result in results)
+        print(f"🧊 Archivo frío: {len(results)} meses, {added} archivos empaquetados", flush=True)
+
+def run_backup(force_rescan=False):
+    """Pasada incremental a BACKUP_PATH (en un hilo aparte)"""
+    def report(result):
+        if result["status"] != "copied":
+            print(media_backup.format_result(result), flush=True)
+
+    return media_backup.run(
+        SAVE_PATH, BACKUP_PATH, workers=BACKUP_WORKERS, prune=BACKUP_PRUNE,
+        rescan_days=BACKUP_RESCAN_DAYS, force_rescan=force_rescan, on_result=report
+    )
 
+async def backup_job():
+    """Job diario: copia a BACKUP_PATH lo nuevo o cambiado desde la última pasada"""
+    try:
+        summary = await asyncio.to_thread(run_backup)
     except Exception as e:
-        print(f"Error guardando archivo: {e}", flush=True)
-        await context.bot.send_message(chat_id=USER_ID, text="❌ Error al guardar el archivo.")
+        print(f"❌ Error en la copia de seguridad: {e}", flush=True)
+        return
+    print(f"💾 Copia de seguridad: {media_backup.format_summary(summary)}", flush=True)
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /copia [repaso]: lanza ahora la copia incremental"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+    if not BACKUP_PATH:
+        await context.bot.send_message(chat_id=USER_ID, text="💾 Copia de seguridad desactivada (`BACKUP_PATH` vacío).",
+                                       parse_mode='Markdown')
+        return
+
+    force_rescan = bool(context.args) and context.args[0].lower() == "repaso"
+    await context.bot.send_message(chat_id=USER_ID, text="💾 Copiando lo nuevo a la copia de seguridad...")
+    try:
+        summary = await asyncio.to_thread(run_backup, force_rescan)
+    except Exception as e:
+        await context.bot.send_message(chat_id=USER_ID, text=f"❌ Error en la copia de seguridad: {e}")
+        return
+    await context.bot.send_message(
+        chat_id=USER_ID,
+        text=f"💾 **Copia de seguridad:** {media_backup.format_summary(summary)}",
+        parse_mode='Markdown'
+    )
+
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /archivo: ahorro acumulado de la recompresión por modo"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    def read_totals():
+        log = archive_optimizer.ArchiveLog(SAVE_PATH)
+        try:
+            return log.totals()
+        finally:
+            log.close()
+
+    totals = await asyncio.to_thread(read_totals)
+    packed_months = await asyncio.to_thread(media_tiering.packed_months, SAVE_PATH)
+    archive_text = "🗜️ **Recompresión del archivo:**\n\n"
+    if ARCHIVE_MODES:
+        archive_text += f"⚙️ **Modos:** {', '.join(ARCHIVE_MODES)} ({ARCHIVE_HOURS}, {ARCHIVE_WORKERS} procesos)\n\n"
+    else:
+        archive_text += "⚙️ Desactivada (`ARCHIVE_MODES` vacío)\n\n"
+    if not totals:
+        archive_text += "📭 Aún no se ha procesado ningún archivo."
+    for mode, (files, saved, cpu_s, errors) in totals.items():
+        archive_text += (f"• **{mode}:** {files or 0} archivos, {saved / (1024 * 1024):.1f}MB ahorrados, "
+                         f"CPU {cpu_s:.0f}s, {errors or 0} descartados\n")
+    if TIERING_HOT_DAYS > 0:
+        archive_text += (f"\n🧊 **Archivo frío:** {len(packed_months)} meses empaquetados "
+                         f"(sueltos los últimos {TIERING_HOT_DAYS} días)")
+    await context.bot.send_message(chat_id=USER_ID, text=archive_text, parse_mode='Markdown')
+
+def format_delay(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+def format_rate(delivered, planned):
+    return f"{delivered}/{planned} ({delivered / planned * 100:.0f}%)" if planned else "sin datos"
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /stats: rachas, cumplimiento y retraso de respuesta desde el historial"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    started = time.perf_counter()
+    stats = await asyncio.to_thread(get_plan_history().stats, get_current_datetime().strftime("%Y-%m-%d"))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not stats["days"]:
+        await context.bot.send_message(chat_id=USER_ID, text="📭 Aún no hay días cerrados en el historial.")
+        return
+
+    stats_text = "📊 **Estadísticas:**\n\n"
+    stats_text += f"📅 **Días con plan:** {stats['days']} (desde {format_saved_date(stats['first_day'])})\n"
+    stats_text += f"✅ **Completadas:** {format_rate(stats['delivered'], stats['planned'])}\n"
+    stats_text += f"🗓️ **Últimos 30 días:** {format_rate(stats['recent_delivered'], stats['recent_planned'])}\n"
+    stats_text += f"🔥 **Racha actual:** {stats['current_streak']} días completos (mejor: {stats['best_streak']})\n"
+    if stats["median_delay_s"] is not None:
+        stats_text += f"⏱️ **Retraso mediano:** {format_delay(stats['median_delay_s'])}\n\n"
+        stats_text += "🕐 **Retraso mediano por hora:**\n"
+        for hour, (delay, count) in stats["delay_by_hour"].items():
+            stats_text += f"• {hour:02d}h: {format_delay(delay)} ({count} envíos)\n"
+    stats_text += f"\n⚡ Calculado en {elapsed_ms:.1f}ms"
+    await context.bot.send_message(chat_id=USER_ID, text=stats_text, parse_mode='Markdown')
+
+# Comando para ver los tiempos del pipeline de ingesta
+async def pipeline_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando para mostrar tiempos y colas del pipeline de ingesta"""
+    if update.effective_user.id != USER_ID:
+        await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
+        return
+
+    pipeline = get_ingest_pipeline(context.application)
+    pipeline_text = "🏭 **Pipeline de ingesta:**\n\n"
+    for name, stats in pipeline.snapshot().items():
+        pipeline_text += (
+            f"• **{name.capitalize()}:** {stats['count']} envíos, "
+            f"media {stats['avg_ms']:.0f}ms, máx {stats['max_ms']:.0f}ms, "
+            f"en cola {stats['queued']}, trabajadores {stats['workers']}\n"
+        )
+    pipeline_text += f"\n⏳ **En proceso:** {len(pipeline.in_flight)} ventanas"
+    pipeline_text += f"\n♻️ **Reentregas sin descarga:** {IDEMPOTENCY_STATS['repeated']}"
+    if ingest_workers is not None:
+        counts = await asyncio.to_thread(get_work_queue().counts)
+        pipeline_text += (
+            f"\n🔧 **Procesos de análisis:** {ingest_workers.alive()}/{ingest_workers.count} activos, "
+            f"{ingest_workers.restarts} relanzados; tareas pendientes {counts.get('pending', 0)}, "
+            f"en curso {counts.get('running', 0)}, terminadas {counts.get('done', 0) + counts.get('failed', 0)}"
+        )
+    pools = [request.stats.snapshot() | {"name": request.stats.name}
+             for request in getattr(context.application, "http_pools", [])]
+    if downloader is not None:
+        pools.append(downloader.snapshot() | {"name": "descargas"})
+    if pools:
+        pipeline_text += "\n\n🌐 **Conexiones HTTP:**\n"
+        for stats in pools:
+            pipeline_text += (
+                f"• {stats['name']} ({stats['size']}): {stats['requests']} peticiones, {stats['active']} activas, "
+                f"media {stats['avg_ms']:.0f}ms, máx {stats['max_ms']:.0f}ms, {stats['mb']:.1f}MB"
+                + (f", {stats['errors']} errores" if stats["errors"] else "")
+            )
+            if "mbps" in stats:
+                pipeline_text += (f", {stats['mbps']:.1f}MB/s (máx {stats['peak_mbps']:.1f}), "
+                                  f"{stats['waiting']} esperando, espera media {stats['avg_wait_ms']:.0f}ms")
+            pipeline_text += "\n"
+    disk_stats = get_storage().snapshot()
+    if disk_stats:
+        pipeline_text += f"\n\n💾 **Disco ({STORAGE_WORKERS} hilos, máx {STORAGE_TIMEOUT:.0f}s):**\n"
+        for op, stats in disk_stats.items():
+            pipeline_text += (
+                f"• {op}: {stats['count']} ops, media {stats['avg_ms']:.0f}ms, p95 {stats['p95_ms']:.0f}ms, "
+                f"máx {stats['max_ms']:.0f}ms"
+                + (f", {stats['timeouts']} sin respuesta" if stats["timeouts"] else "")
+                + (f", {stats['errors']} errores" if stats["errors"] else "")
+                + "\n"
+            )
+    if QUALITY_GATE and QUALITY_STATS["count"]:
+        pipeline_text += (
+            f"\n🔎 **Filtro de calidad:** {QUALITY_STATS['count']} comprobaciones, "
+            f"{QUALITY_STATS['rejected']} rechazadas, media {QUALITY_STATS['total_ms'] / QUALITY_STATS['count']:.0f}ms, "
+            f"máx {QUALITY_STATS['max_ms']:.0f}ms, {QUALITY_STATS['over_budget']} fuera de presupuesto "
+            f"({QUALITY_BUDGET_MS:.0f}ms)"
+        )
+
+    await context.bot.send_message(chat_id=USER_ID, text=pipeline_text, parse_mode='Markdown')
 
 # Comando para mostrar el estado de las notificaciones
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -862,12 +2874,12 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
         return
 
-    plan = load_plan_json()
+    plan = await load_plan()
     if not plan:
         await context.bot.send_message(chat_id=USER_ID, text="❌ No hay planificación activa para hoy.")
         return
 
-    now = datetime.now()
+    now = get_current_datetime()
     current_hour = now.hour
     current_total_minutes = current_hour * 60 + now.minute
     status_text = "📊 **Estado de notificaciones de hoy:**\n\n"
@@ -930,10 +2942,10 @@ async def start_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await context.bot.send_message(chat_id=USER_ID, text="📅 Generando horas para hoy...")
 
-    plan = load_plan_json()
+    plan = await load_plan()
     if plan is None:
         schedule = generate_random_schedule()
-        save_plan_json(schedule)
+        await save_plan(schedule)
         await context.bot.send_message(chat_id=USER_ID, text="✅ Nuevo plan generado. Las notificaciones se programarán automáticamente.")
     else:
         await context.bot.send_message(chat_id=USER_ID, text="✅ Ya existe un plan para hoy.")
@@ -951,7 +2963,8 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     info_text += f"📦 **Python Telegram Bot:** Disponible\n"
     info_text += f"⏰ **APScheduler:** Disponible\n"
     info_text += f"🖼️ **PIL/Pillow:** {'✅ Disponible' if PIL_AVAILABLE else '❌ No disponible'}\n"
-    info_text += f"🎥 **OpenCV:** {'✅ Disponible' if CV2_AVAILABLE else '❌ No disponible'}\n\n"
+    info_text += f"🎥 **OpenCV:** {'✅ Disponible' if CV2_AVAILABLE else '❌ No disponible'}\n"
+    info_text += f"📱 **HEIC/HEIF:** {'✅ Copia ' + HEIF_DERIVATIVE_FORMAT.upper() if HEIF_AVAILABLE else '❌ Sin conversión'}\n\n"
 
     if not PIL_AVAILABLE:
         info_text += "⚠️ **Sin PIL:** No se puede validar resolución de imágenes\n"
@@ -962,6 +2975,9 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         info_text += "✅ **Todas las validaciones activas**\n"
 
     info_text += f"\n📁 **Ruta de guardado:** {SAVE_PATH}\n"
+    if TELEGRAM_API_BASE_URL:
+        info_text += f"🛰️ **Bot API propia:** {TELEGRAM_API_BASE_URL}\n"
+        info_text += f"• Modo local: {'✅ ' + TELEGRAM_LOCAL_HANDOFF if TELEGRAM_LOCAL_MODE else '❌'}\n"
     info_text += f"🔧 **Configuración de permisos:**\n"
     info_text += f"• Umask actual: {oct(os.umask(0o002))[2:]}\n"
     info_text += f"• Archivos: 664 (rw-rw-r--)\n"
@@ -970,7 +2986,10 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     info_text += f"📏 **Límites configurados:**\n"
     info_text += f"• Fotos: Mínimo 1080p\n"
     info_text += f"• Videos: Máximo {MAX_VIDEO_DURATION}s\n"
-    info_text += f"• Tamaño: Máximo {MAX_FILE_SIZE/(1024*1024):.0f}MB"
+    info_text += f"• Tamaño: Máximo {MAX_FILE_SIZE/(1024*1024):.0f}MB\n\n"
+    info_text += f"🧠 **Memoria de imágenes:** máximo {IMAGE_MEMORY_LIMIT_MB}MB por tarea"
+    for label, stats in IMAGE_MEMORY_STATS.items():
+        info_text += f"\n• {label}: +{stats['delta_mb']:.1f}MB (máx +{stats['max_delta_mb']:.1f}MB, {stats['count']} ops)"
 
     await context.bot.send_message(chat_id=USER_ID, text=info_text, parse_mode='Markdown')
 
@@ -981,7 +3000,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
         return
 
-    help_text = """
+    help_text = f"""
 🤖 **Bot de Diario Fotográfico**
 
 Este bot te ayuda a crear un diario visual automático enviándote notificaciones aleatorias durante el día para que captures momentos especiales.
@@ -998,6 +3017,10 @@ Este bot te ayuda a crear un diario visual automático enviándote notificacione
 • Estado: PROGRAMADO, PENDIENTE, ENTREGADO, PERDIDO
 • Progreso actual y próxima notificación
 
+📈 `/stats` - Estadísticas del historial
+• Rachas de días completos y porcentaje entregado
+• Retraso mediano de respuesta por hora
+
 🔍 `/debug` - Debug de ventanas de tiempo
 • Información técnica de ventanas activas
 • Útil para resolver problemas
@@ -1018,19 +3041,48 @@ Este bot te ayuda a crear un diario visual automático enviándote notificacione
 • Próximas ejecuciones
 • Estado interno del programador
 
+🏭 `/pipeline` - Tiempos de la ingesta
+• Duración media y máxima de cada etapa
+• Envíos en cola y en proceso
+
+🎞️ `/recuerdo` - Un recuerdo del archivo
+• Lo de este mismo día en años anteriores
+• `/recuerdo azar` para un momento al azar
+
+🎲 `/azar [foto|video] [AAAA] [N]` - Recuerdos al azar
+• También con rango: `/azar 2023-06-01 2023-08-31`
+• Hasta {RANDOM_MAX_RESULTS} archivos a la vez
+
+📚 `/dia [AAAA-MM-DD]` - Reenviar las fotos y videos de un día
+• Sin fecha, los de hoy
+
+🎬 `/resumen [AAAA-MM-DD | AAAA-MM]` - Hoja de contactos y timelapse
+• De un día o de un mes entero; sin fecha, el de hoy
+• Se envía solo tras la última notificación del día y a fin de mes
+
+🗜️ `/archivo` - Ahorro de la recompresión del archivo
+• Bytes ahorrados y tiempo de CPU por modo
+
+💾 `/copia [repaso]` - Copia incremental a la ruta de respaldo
+• Solo lo nuevo o cambiado según el manifiesto; `repaso` revisa antes todo el árbol
+
+📍 `/cerca LAT LON [RADIO]` - Buscar por ubicación
+• Fotos y videos con GPS tomados cerca de un punto
+• También funciona enviando una ubicación
+
 ❓ `/help` o `/ayuda` - Mostrar esta ayuda
 
 📏 **REQUISITOS DE CONTENIDO:**
 
 📸 **Para FOTOS:**
 • Resolución mínima: 1080p (1920x1080)
-• Tamaño máximo: 20MB
+• Tamaño máximo: {MAX_FILE_SIZE_MB}MB
 • Formatos: JPG, PNG, HEIC, HEIF
 • Usa la máxima calidad de tu cámara
 
 🎥 **Para VIDEOS:**
 • Duración máxima: 20 segundos
-• Tamaño máximo: 20MB
+• Tamaño máximo: {MAX_FILE_SIZE_MB}MB
 • Formatos: MP4, MOV, HEVC
 • Graba en la mejor calidad disponible
 
@@ -1038,7 +3090,7 @@ Este bot te ayuda a crear un diario visual automático enviándote notificacione
 
 • Cada notificación abre una "ventana de tiempo"
 • La ventana permanece abierta hasta la siguiente notificación
-• Solo puedes enviar UNA foto/video por ventana
+• Solo puedes enviar UNA foto/video (o un álbum) por ventana
 • Si pierdes una ventana, se cierra automáticamente
 
 **Ejemplo:**
@@ -1089,7 +3141,7 @@ Accede a tu feed visual en: `http://localhost:8090`
     await context.bot.send_message(chat_id=USER_ID, text=help_text, parse_mode='Markdown')
 
     # Mostrar estado actual después de la ayuda
-    plan = load_plan_json()
+    plan = await load_plan()
     if plan:
         status_summary = f"\n📈 **Estado actual:** "
         delivered_count = sum(1 for entry in plan if entry.get("delivered", False))
@@ -1097,7 +3149,7 @@ Accede a tu feed visual en: `http://localhost:8090`
         status_summary += f"{delivered_count}/{total_count} completadas"
 
         # Próxima notificación
-        now = datetime.now()
+        now = get_current_datetime()
         current_total_minutes = now.hour * 60 + now.minute
         next_notification = None
 
@@ -1134,12 +3186,12 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_user.id, text="❌ No tienes permisos para usar este bot.")
         return
 
-    plan = load_plan_json()
+    plan = await load_plan()
     if not plan:
         await context.bot.send_message(chat_id=USER_ID, text="❌ No hay planificación activa.")
         return
 
-    now = datetime.now()
+    now = get_current_datetime()
     current_hour = now.hour
     current_minute = now.minute
     current_total_minutes = current_hour * 60 + current_minute
@@ -1219,12 +3271,14 @@ async def permissions_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         permissions_text = "🔧 **Estado de permisos:**\n\n"
 
         # Verificar directorio base
-        if os.path.exists(SAVE_PATH):
-            stat_info = os.stat(SAVE_PATH)
+        storage = get_storage()
+        if await storage.exists(SAVE_PATH):
+            stat_info = await storage.stat(SAVE_PATH)
+            writable = await storage.run("stat", os.access, SAVE_PATH, os.W_OK)
             permissions_text += f"📁 **{SAVE_PATH}:**\n"
             permissions_text += f"• Permisos: {oct(stat_info.st_mode)[-3:]}\n"
             permissions_text += f"• Owner: {stat_info.st_uid}:{stat_info.st_gid}\n"
-            permissions_text += f"• Escribible: {'✅' if os.access(SAVE_PATH, os.W_OK) else '❌'}\n\n"
+            permissions_text += f"• Escribible: {'✅' if writable else '❌'}\n\n"
         else:
             permissions_text += f"❌ **{SAVE_PATH} no existe**\n\n"
 
@@ -1236,20 +3290,18 @@ async def permissions_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         permissions_text += f"• Archivos nuevos: {oct(0o666 & ~current_umask)[2:]}\n"
         permissions_text += f"• Directorios nuevos: {oct(0o777 & ~current_umask)[2:]}\n\n"
 
-        # Verificar algunos archivos recientes
+        # Verificar los últimos archivos guardados (memoria, sin recorrer el archivo)
         permissions_text += "📄 **Archivos recientes:**\n"
         file_count = 0
-        for root, dirs, files in os.walk(SAVE_PATH):
-            for file in sorted(files)[-3:]:  # Solo los 3 más recientes
-                if file_count >= 3:
-                    break
-                file_path = os.path.join(root, file)
-                try:
-                    stat_info = os.stat(file_path)
-                    permissions_text += f"• {file}: {oct(stat_info.st_mode)[-3:]} ({stat_info.st_uid}:{stat_info.st_gid})\n"
-                    file_count += 1
-                except:
-                    continue
+        for file_path in reversed(RECENT_FILES):
+            if file_count >= 3:
+                break
+            try:
+                stat_info = await storage.stat(file_path)
+                permissions_text += f"• `{os.path.basename(file_path)}`: {oct(stat_info.st_mode)[-3:]} ({stat_info.st_uid}:{stat_info.st_gid})\n"
+                file_count += 1
+            except OSError:
+                continue
 
         if file_count == 0:
             permissions_text += "• No hay archivos recientes\n"
@@ -1260,8 +3312,22 @@ async def permissions_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         await context.bot.send_message(chat_id=USER_ID, text=f"❌ Error verificando permisos: {e}")
 
 # Función para programar una notificación
+# Aplicación en marcha: los jobs guardados en disco no pueden llevarla como argumento
+running_app = None
+
+def notification_job_prefix(date):
+    return f"notification_{date}_"
+
+async def notification_job(date, notification_data):
+    """Job de un solo disparo para una entrada del plan de un día concreto"""
+    today = get_current_datetime().strftime("%Y-%m-%d")
+    if date != today:
+        print(f"⏭️ Notificación del {date} descartada (hoy es {today})", flush=True)
+        return
+    await send_photo_request(running_app, notification_data)
+
 async def schedule_notification(scheduler, app, notification_data):
-    now = datetime.now()
+    now = get_current_datetime()
     target_hour = notification_data.get("hour", 8)
     target_minute = notification_data.get("minute", 0)
 
@@ -1270,26 +3336,66 @@ async def schedule_notification(scheduler, app, notification_data):
         print(f"Notificación para las {target_hour:02d}:{target_minute:02d} ya pasó, no se programa")
         return
 
-    # Usar el scheduler para programar con minutos exactos
-    job_id = f"notification_{target_hour}_{target_minute}"
+    # Un solo disparo en la fecha exacta: no se repite otros días con el plan de hoy
+    date = now.strftime("%Y-%m-%d")
+    job_id = f"{notification_job_prefix(date)}{target_hour:02d}_{target_minute:02d}"
     scheduler.add_job(
-        send_photo_request,
-        CronTrigger(hour=target_hour, minute=target_minute),
-        args=[app, notification_data],  # Pasar el entry completo
+        notification_job,
+        DateTrigger(run_date=now.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)),
+        args=[date, notification_data],  # Solo datos serializables: el job se guarda en disco
         id=job_id,
-        replace_existing=True
+        replace_existing=True,
+        jobstore=NOTIFICATION_JOBSTORE,
+        misfire_grace_time=NOTIFICATION_MISFIRE_GRACE_MINUTES * 60,
+        coalesce=True
     )
     print(f"Programada notificación de {notification_data.get('type', 'foto')} para las {target_hour:02d}:{target_minute:02d}")
 
+def prune_notification_jobs(scheduler, date):
+    """Elimina las notificaciones guardadas de otros días y devuelve las de hoy"""
+    prefix = notification_job_prefix(date)
+    pending = []
+    for job in scheduler.get_jobs():
+        if not job.id.startswith("notification_"):
+            continue
+        if job.id.startswith(prefix):
+            pending.append(job)
+        else:
+            scheduler.remove_job(job.id)
+            print(f"🧹 Notificación antigua eliminada: {job.id}")
+    return pending
+
+def schedule_daily_recap(scheduler, plan):
+    """Resumen del día RECAP_DELAY_MINUTES después de la última notificación (antes de medianoche)"""
+    if not plan:
+        return
+    now = get_current_datetime()
+    last_minutes = max(entry.get("hour", 8) * 60 + entry.get("minute", 0) for entry in plan)
+    run_minutes = min(last_minutes + RECAP_DELAY_MINUTES, 23 * 60 + 55)
+    run_date = now.replace(hour=run_minutes // 60, minute=run_minutes % 60, second=0, microsecond=0)
+    if run_date <= now:
+        return
+    date = now.strftime("%Y-%m-%d")
+    scheduler.add_job(
+        daily_recap_job,
+        DateTrigger(run_date=run_date),
+        args=[date],
+        id=f"recap_{date}",
+        replace_existing=True,
+        jobstore=NOTIFICATION_JOBSTORE,
+        misfire_grace_time=NOTIFICATION_MISFIRE_GRACE_MINUTES * 60
+    )
+    print(f"🎞️ Resumen del día programado para las {run_date:%H:%M}")
+
 # Función para enviar notificaciones perdidas que aún están en ventana activa
 async def send_missed_notifications_in_window(app):
     """Envía notificaciones que ya pasaron pero aún están en ventana activa"""
     try:
-        plan = load_plan_json()
+        plan = await load_plan()
         if not plan:
             return
 
-        now = datetime.now()
+        now = get_current_datetime()
         current_total_minutes = now.hour * 60 + now.minute
         notifications_sent = 0
 
@@ -1324,18 +3430,27 @@ async def send_missed_notifications_in_window(app):
 # Generar horarios aleatorios y programar notificaciones
 async def schedule_today(app, scheduler=None):
     try:
-        plan = load_plan_json()
+        plan = await load_plan()
 
         if plan is None:
             plan = generate_random_schedule()
-            save_plan_json(plan)
+            await save_plan(plan)
+            await get_storage().run("feed", publish_change, "plan", get_current_datetime().strftime("%Y-%m-%d"))
             print(f"✅ Plan generado con {len(plan)} notificaciones")
 
+        # Reinicio en caliente: las notificaciones de hoy siguen guardadas en el job store.
+        # Las que vencieron con el bot parado se disparan solas dentro del margen de gracia.
+        if scheduler:
+            pending = prune_notification_jobs(scheduler, get_current_datetime().strftime("%Y-%m-%d"))
+            if pending:
+                print(f"♻️ Reanudadas {len(pending)} notificaciones guardadas para hoy")
+                return
+
         # Verificar y enviar notificaciones perdidas que aún están en ventana activa
         await send_missed_notifications_in_window(app)
 
         # Programar solo las notificaciones que aún no han llegado
-        now = datetime.now()
+        now = get_current_datetime()
         current_total_minutes = now.hour * 60 + now.minute
         notifications_scheduled = 0
 
@@ -1351,6 +3466,9 @@ async def schedule_today(app, scheduler=None):
 
         print(f"Programadas {notifications_scheduled} notificaciones pendientes para hoy")
 
+        if scheduler and RECAP_DAILY:
+            schedule_daily_recap(scheduler, plan)
+
         # Mostrar cuántas notificaciones ya pasaron
         missed_count = len(plan) - notifications_scheduled
         if missed_count > 0:
@@ -1359,6 +3477,85 @@ async def schedule_today(app, scheduler=None):
     except Exception as e:
         print(f"Error en schedule_today: {e}")
 
+# Jobs fijos del scheduler (compartidos con el simulador replay_harness.py)
+def register_daily_jobs(scheduler, app):
+    """Registra los jobs diarios que no dependen del plan"""
+    # Job para programar nuevas notificaciones cada día a medianoche
+    scheduler.add_job(
+        schedule_today,
+        CronTrigger(hour=0, minute=0),
+        args=[app, scheduler],
+        id='daily_schedule'
+    )
+
+    # Planes de los próximos días, en lote y lejos de la medianoche
+    pregenerate_hour, pregenerate_minute = (int(part) for part in PLAN_PREGENERATE_TIME.split(":"))
+    scheduler.add_job(
+        pregenerate_plans_job,
+        CronTrigger(hour=pregenerate_hour, minute=pregenerate_minute),
+        id='plan_pregenerate'
+    )
+
+    # Compactar el plan del día anterior en el historial
+    scheduler.add_job(
+        compact_plan_history_job,
+        CronTrigger(hour=0, minute=10),
+        id='plan_history'
+    )
+
+    # Resumen del mes (hoja de contactos y timelapse) el último día
+    if RECAP_MONTHLY:
+        recap_hour, recap_minute = (int(part) for part in RECAP_MONTHLY_TIME.split(":"))
+        scheduler.add_job(
+            monthly_recap_job,
+            CronTrigger(day='last', hour=recap_hour, minute=recap_minute),
+            id='monthly_recap'
+        )
+
+    # Recompresión del archivo en la franja de poca actividad
+    if ARCHIVE_MODES:
+        archive_start, _ = archive_optimizer.parse_hours(ARCHIVE_HOURS)
+        scheduler.add_job(
+            archive_job,
+            CronTrigger(hour=archive_start // 60, minute=archive_start % 60),
+            id='archive_optimizer'
+        )
+
+    # Archivo frío: empaquetado de los meses cerrados
+    if TIERING_HOT_DAYS > 0:
+        tiering_hour, tiering_minute = (int(part) for part in TIERING_TIME.split(":"))
+        scheduler.add_job(
+            tiering_job,
+            CronTrigger(hour=tiering_hour, minute=tiering_minute),
+            id='media_tiering'
+        )
+
+    # Copia de seguridad incremental
+    if BACKUP_PATH:
+        backup_hour, backup_minute = (int(part) for part in BACKUP_TIME.split(":"))
+        scheduler.add_job(
+            backup_job,
+            CronTrigger(hour=backup_hour, minute=backup_minute),
+            id='media_backup'
+        )
+
+    # Resumen diario opcional con los archivos del día (reenviados por file_id)
+    if DAILY_DIGEST_TIME:
+        digest_hour, digest_minute = (int(part) for part in DAILY_DIGEST_TIME.split(":"))
+        scheduler.add_job(
+            send_daily_digest,
+            CronTrigger(hour=digest_hour, minute=digest_minute),
+            args=[app],
+            id='daily_digest'
+        )
+
+def telegram_file_url(base_url):
+    """URL de descargas de un servidor propio: ".../bot" -> ".../file/bot"; None si no acaba en /bot"""
+    base_url = base_url.rstrip("/")
+    if not base_url.endswith("/bot"):
+        return None
+    return base_url[:-len("/bot")] + "/file/bot"
+
 # Función principal
 async def main():
     try:
@@ -1376,8 +3573,72 @@ async def main():
         print("🔧 Configurando permisos iniciales...")
         setup_directory_permissions(SAVE_PATH)
 
+        # Últimos archivos guardados, desde el índice (sin recorrer el árbol de fotos)
+        load_recent_files()
+        print(f"🗂️ {len(RECENT_FILES)} archivos recientes cargados del índice")
+
+        # Sorteo de recuerdos en memoria y su copia para la web
+        print(f"🎲 {len(get_memory_sampler())} archivos en el sorteo de recuerdos")
+        export_memory_sampler(force=True)
+
+        # Registro de cambios y, si está activo, su socket para la web
+        feed_server = None
+        print(f"📰 Registro de cambios en la seq {get_change_feed().seq}")
+        if CHANGE_FEED_SOCKET:
+            try:
+                feed_server = FeedServer(get_change_feed(), default_socket_path(SAVE_PATH))
+                await feed_server.start()
+                print(f"📡 Avisos de cambios en {feed_server.path}")
+            except OSError as e:
+                feed_server = None
+                print(f"⚠️ No se pudo abrir el socket de cambios: {e}")
+
+        # API de medios sobre el mismo índice que escribe la ingesta
+        media_api = None
+        if MEDIA_API_PORT:
+            try:
+                media_api = MediaAPI(SAVE_PATH, index=get_media_index(), thumb_workers=MEDIA_API_THUMB_WORKERS)
+                await media_api.start(MEDIA_API_HOST, MEDIA_API_PORT)
+                print(f"🌐 API de medios en http://{MEDIA_API_HOST}:{MEDIA_API_PORT}/api")
+            except OSError as e:
+                media_api = None
+                print(f"⚠️ No se pudo arrancar la API de medios: {e}")
+
         # Crear la aplicación
-        app = ApplicationBuilder().token(TOKEN).build()
+        builder = ApplicationBuilder().token(TOKEN)
+        if TELEGRAM_API_BASE_URL:
+            # Servidor propio de la Bot API
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+            file_url = TELEGRAM_API_FILE_URL or telegram_file_url(TELEGRAM_API_BASE_URL)
+            if file_url:
+                builder = builder.base_file_url(file_url)
+            else:
+                print("⚠️ TELEGRAM_API_BASE_URL no acaba en /bot: define TELEGRAM_API_FILE_URL "
+                      "o las descargas irán a la URL de archivos de Telegram", flush=True)
+            print(f"🛰️ Bot API propia: {TELEGRAM_API_BASE_URL} (modo local: {'✅' if TELEGRAM_LOCAL_MODE else '❌'})")
+        if TELEGRAM_LOCAL_MODE:
+            builder = builder.local_mode(True)
+        # getUpdates con su propia conexión (PTB suma el timeout del long-poll a la lectura);
+        # mensajes y subidas en otro pool; las descargas usan get_downloader()
+        updates_request = MeteredRequest("updates", 1, read_timeout=5.0, pool_timeout=None)
+        api_request = MeteredRequest("api", HTTP_API_POOL_SIZE, read_timeout=HTTP_API_TIMEOUT, http2=HTTP2)
+        builder = builder.get_updates_request(updates_request).request(api_request)
+        app = builder.build()
+        app.http_pools = [updates_request, api_request]
+        print(f"🌐 HTTP: long-poll {HTTP_UPDATES_TIMEOUT}s, API {HTTP_API_POOL_SIZE} conexiones, "
+              f"{HTTP_DOWNLOAD_CONCURRENCY} descargas a la vez{', HTTP/2' if HTTP2 else ''}")
+
+        # Pipeline de ingesta por etapas (descarga, validación, guardado, confirmación)
+        app.ingest_pipeline = create_ingest_pipeline()
+        app.ingest_pipeline.start()
+
+        # Procesos de análisis que consumen la cola persistente (uno por núcleo con "auto")
+        global ingest_workers
+        if INGEST_PROCESS_WORKERS:
+            ingest_workers = WorkerPool(default_queue_path(SAVE_PATH), {INGEST_TASK_KIND: "bot:analyze_ingest_task"},
+                                        INGEST_PROCESS_WORKERS)
+            ingest_workers.start()
+            print(f"🔧 {INGEST_PROCESS_WORKERS} procesos de análisis sobre {ingest_workers.path}")
 
         # Agregar handlers para comandos
         app.add_handler(CommandHandler("start", start_day))
@@ -1386,27 +3647,53 @@ async def main():
         app.add_handler(CommandHandler("debug", debug_command))
         app.add_handler(CommandHandler("scheduler", scheduler_debug_command))
         app.add_handler(CommandHandler("permisos", permissions_command))
+        app.add_handler(CommandHandler("pipeline", pipeline_command))
+        app.add_handler(CommandHandler("cerca", near_command))
+        app.add_handler(CommandHandler("recuerdo", memory_command))
+        app.add_handler(CommandHandler("azar", random_command))
+        app.add_handler(CommandHandler("dia", day_command))
+        app.add_handler(CommandHandler("stats", stats_command))
+        app.add_handler(CommandHandler("resumen", recap_command))
+        app.add_handler(CommandHandler("archivo", archive_command))
+        app.add_handler(CommandHandler("copia", backup_command))
         app.add_handler(CommandHandler("help", help_command))
         app.add_handler(CommandHandler("ayuda", help_command))
 
         # Handler para mensajes (debe ir después de los comandos)
+        app.add_handler(MessageHandler(filters.LOCATION, location_handler))
         app.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO | filters.Document.ALL | filters.TEXT, photo_handler))
 
-        # Crear y configurar el scheduler
-        scheduler = AsyncIOScheduler()
+        # Crear y configurar el scheduler: las notificaciones del plan van a SQLite,
+        # los jobs fijos (que reciben la aplicación) se crean en memoria en cada arranque
+        global running_app
+        running_app = app
+        scheduler = AsyncIOScheduler(
+            jobstores={NOTIFICATION_JOBSTORE: SQLiteJobStore(os.path.join(SAVE_PATH, ".index", "jobs.db"))},
+            job_defaults={"coalesce": True, "misfire_grace_time": 60}
+        )
 
         # Guardar referencia del scheduler en la aplicación para debug
         app.scheduler = scheduler
 
-        # Job para programar nuevas notificaciones cada día a medianoche
+        register_daily_jobs(scheduler, app)
+
+        # Reexportar el sorteo para la web cuando haya archivos nuevos
         scheduler.add_job(
-            schedule_today,
-            CronTrigger(hour=0, minute=0),
-            args=[app, scheduler],
-            id='daily_schedule'
+            asyncio.to_thread,
+            IntervalTrigger(minutes=SAMPLER_EXPORT_MINUTES),
+            args=[export_memory_sampler],
+            id='sampler_export'
         )
+
+        # Relanzar los procesos de análisis que hayan caído
+        if ingest_workers is not None:
+            scheduler.add_job(ingest_workers.ensure, IntervalTrigger(seconds=30), id='ingest_workers')
         scheduler.start()
 
+        # Planes de hoy y de los próximos días (si faltan), antes de programar hoy
+        await pregenerate_plans_job()
+        await compact_plan_history_job()
+
         # Programar hoy si no existe
         await schedule_today(app, scheduler)
 
@@ -1415,7 +3702,9 @@ async def main():
         # Iniciar el bot
         await app.initialize()
         await app.start()
-        await app.updater.start_polling()
+        if ingest_workers is not None:
+            await resume_ingest_jobs(app)
+        await app.updater.start_polling(timeout=HTTP_UPDATES_TIMEOUT)
 
         # Mantener el bot corriendo
         try:
@@ -1425,8 +3714,22 @@ async def main():
         finally:
             await app.updater.stop()
             await app.stop()
+            await app.ingest_pipeline.stop()
+            if ingest_workers is not None:
+                result_waiter.stop()
+                await asyncio.to_thread(ingest_workers.stop)
+            if heif_pool is not None:
+                heif_pool.shutdown(cancel_futures=True)
             await app.shutdown()
             scheduler.shutdown()
+            if feed_server is not None:
+                await feed_server.stop()
+            if media_api is not None:
+                await media_api.stop()
+            if storage is not None:
+                storage.shutdown()
+            if downloader is not None:
+                await downloader.close()
 
     except Exception as e:
         print(f"❌ Error en main: {e}")
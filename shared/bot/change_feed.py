@@ -0,0 +1,258 @@
+"""
+change_feed.py - Registro de cambios del bot para invalidar cachés sin sondear el disco
+
+Cada cambio es una línea JSON en SAVE_PATH/.index/changes.jsonl:
+
+    {"seq": 1042, "ts": 1760000000.1, "type": "saved", "date": "2025-06-01",
+     "path": "2025/06/01/10-00-00.jpg", "kind": "foto"}
+
+Tipos: "saved" (archivo guardado), "delivered" (ventana entregada), "plan"
+(plan creado para una fecha), "rewritten" (original recomprimido) y "packed"
+(mes pasado al archivo frío).
+
+seq crece de uno en uno y se mantiene entre reinicios y rotaciones: al superar
+max_bytes el log pasa a changes.jsonl.1 (se conservan keep archivos). Junto al
+log, .index/changes.json resume la última seq global y la de cada fecha (y de
+cada mes empaquetado), de modo que la web invalida solo los días que cambiaron
+sin leer el log.
+
+Opcionalmente el bot escucha en un socket Unix: el cliente envía "since N" (o
+una línea vacía) y recibe en JSONL lo que se perdió y después los cambios en
+vivo.
+
+    python change_feed.py /data/fotos --since 1000       # lo que hay en el log
+    python change_feed.py /data/fotos --follow           # en vivo por el socket
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import contextlib
+import threading
+
+LOG_FILENAME = "changes.jsonl"
+STATE_FILENAME = "changes.json"
+SOCKET_FILENAME = "changes.sock"
+STATE_VERSION = 1
+CLIENT_QUEUE_SIZE = 1000  # Eventos pendientes por cliente antes de desconectarlo
+
+
+def feed_directory(save_path):
+    return os.path.join(save_path, ".index")
+
+
+def default_socket_path(save_path):
+    return os.path.join(feed_directory(save_path), SOCKET_FILENAME)
+
+
+def _last_seq(path):
+    """seq de la última línea completa de un log (0 si no hay)"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return 0
+    for line in reversed(lines):
+        try:
+            return json.loads(line)["seq"]
+        except (ValueError, KeyError):
+            continue
+    return 0
+
+
+class ChangeFeed:
+    """Escritor del log de cambios. Seguro entre hilos; avisa a los oyentes de cada evento."""
+
+    def __init__(self, save_path, max_bytes=5 * 1024 * 1024, keep=3, finalize=None):
+        self.save_path = save_path
+        self.directory = feed_directory(save_path)
+        self.log_path = os.path.join(self.directory, LOG_FILENAME)
+        self.state_path = os.path.join(self.directory, STATE_FILENAME)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.finalize = finalize  # Permisos de los archivos nuevos (la web solo lee)
+        self.lock = threading.Lock()
+        self.listeners = []
+        os.makedirs(self.directory, mode=0o775, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                # El log manda si el resumen se quedó atrás (parada a mitad de escritura)
+                state["seq"] = max(state["seq"], _last_seq(self.log_path))
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"version": STATE_VERSION, "seq": _last_seq(self.log_path), "updated": time.time(),
+                "dates": {}, "months": {}}
+
+    def _write_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, separators=(",", ":"))
+        os.replace(temp_path, self.state_path)
+
+    def _rotate(self):
+        for number in range(self.keep - 1, 0, -1):
+            older = f"{self.log_path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.log_path}.{number + 1}")
+        os.replace(self.log_path, f"{self.log_path}.1")
+
+    def publish(self, event_type, date=None, **fields):
+        """Añade un evento al log, actualiza el resumen por fecha y avisa a los oyentes"""
+        with self.lock:
+            self.state["seq"] += 1
+            event = {"seq": self.state["seq"], "ts": round(time.time(), 3), "type": event_type}
+            if date:
+                event["date"] = date
+            event.update(fields)
+            created = not os.path.exists(self.log_path)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+                rotate = f.tell() >= self.max_bytes
+            if date:
+                self.state["dates"][date] = event["seq"]
+            if "month" in fields:
+                self.state["months"][fields["month"]] = event["seq"]
+            self.state["updated"] = event["ts"]
+            self._write_state()
+            if rotate:
+                self._rotate()
+            if self.finalize and created:
+                self.finalize(self.log_path)
+                self.finalize(self.state_path)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"⚠️ Oyente del registro de cambios con error: {e}", flush=True)
+        return event
+
+    @property
+    def seq(self):
+        return self.state["seq"]
+
+    def since(self, seq, limit=None):
+        """Eventos con seq mayor que la dada, del más antiguo al más reciente (log y rotados)"""
+        events = []
+        paths = [f"{self.log_path}.{number}" for number in range(self.keep, 0, -1)] + [self.log_path]
+        for path in paths:
+            if not os.path.exists(path) or _last_seq(path) <= seq:
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # Última línea a medio escribir
+                    if event["seq"] > seq:
+                        events.append(event)
+        return events[:limit] if limit else events
+
+
+class FeedServer:
+    """Socket Unix que reparte los eventos en vivo a los clientes conectados"""
+
+    def __init__(self, feed, path):
+        self.feed = feed
+        self.path = path
+        self.server = None
+        self.loop = None
+        self.clients = set()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Socket huérfano de un arranque anterior
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o666)  # La web (www-data) también se conecta
+        self.feed.listeners.append(self._publish)
+
+    async def stop(self):
+        if self._publish in self.feed.listeners:
+            self.feed.listeners.remove(self._publish)
+        for queue in list(self.clients):
+            with contextlib.suppress(asyncio.QueueFull):
+                queue.put_nowait(None)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _publish(self, event):
+        # Se llama desde cualquier hilo: el reparto ocurre en el bucle del bot
+        self.loop.call_soon_threadsafe(self._broadcast, event)
+
+    def _broadcast(self, event):
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cliente lento: se desconecta y reanudará con since
+                self.clients.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _handle(self, reader, writer):
+        queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        self.clients.add(queue)  # Antes de leer el log: no se pierde nada entre medias
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            words = request.decode(errors="replace").split()
+            since = int(words[1]) if len(words) == 2 and words[0] == "since" and words[1].isdigit() else None
+            last = self.feed.seq
+            if since is not None:
+                backlog = await asyncio.to_thread(self.feed.since, since)
+                for event in backlog:
+                    writer.write((json.dumps(event, ensure_ascii=False) + "\n").encode())
+                last = backlog[-1]["seq"] if backlog else max(since, last)
+            await writer.drain()
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                if event["seq"] <= last:
+                    continue  # Ya enviado con el log
+                writer.write((json.dumps(event, ensure_ascii=False) + "\n").encode())
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.clients.discard(queue)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lee el registro de cambios del bot")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--since", type=int, default=0, help="Eventos posteriores a esta seq")
+    parser.add_argument("--follow", action="store_true", help="Sigue en vivo por el socket del bot")
+    args = parser.parse_args()
+
+    if not args.follow:
+        for event in ChangeFeed(args.root).since(args.since):
+            print(json.dumps(event, ensure_ascii=False))
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(default_socket_path(args.root))
+        client.sendall(f"since {args.since}\n".encode())
+        with client.makefile(encoding="utf-8") as stream:
+            for line in stream:
+                print(line, end="", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+heif_normalizer.py - Conversión de fotos HEIC/HEIF a JPEG/WebP para la web
+
+Los navegadores no muestran HEIF y Pillow no lo abre sin el plugin pillow-heif.
+Este módulo decodifica cada HEIF, obtiene sus dimensiones reales y escribe una
+copia JPEG (o WebP) junto al original conservando EXIF y perfil de color.
+
+Las funciones de conversión no dependen de bot.py para poder ejecutarse en un
+pool de procesos (el bot lo usa durante la ingesta) y en lotes desde consola:
+
+    python heif_normalizer.py /data/fotos --workers 4
+    python heif_normalizer.py /data/fotos/2025/06 --format webp --force
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    HEIF_AVAILABLE = PIL_AVAILABLE
+except ImportError:
+    HEIF_AVAILABLE = False
+
+HEIF_EXTENSIONS = (".heic", ".heif")
+DERIVATIVE_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+EXIF_ORIENTATION = 0x0112
+TIME_PREFIX = re.compile(r"^(\d{2}-\d{2}-\d{2})")
+
+
+def is_heif(path):
+    return path.lower().endswith(HEIF_EXTENSIONS)
+
+
+def derivative_path_for(original_path, image_format="jpeg"):
+    """Ruta de la copia web: HH-MM-SS.jpg junto al original (el formato que lista la web)"""
+    directory, filename = os.path.split(original_path)
+    match = TIME_PREFIX.match(filename)
+    stem = match.group(1) if match else os.path.splitext(filename)[0]
+    return os.path.join(directory, stem + DERIVATIVE_EXTENSIONS[image_format])
+
+
+def convert_heif(source_path, target_path, image_format="jpeg", quality=90):
+    """Decodifica un HEIF y escribe la copia web. Se ejecuta en un proceso del pool.
+
+    Devuelve un diccionario (serializable entre procesos) con las dimensiones
+    reales, los tamaños y el tiempo empleado, o con "error" si falló.
+    """
+    started = time.perf_counter()
+    result = {"source": source_path, "target": target_path, "width": 0, "height": 0}
+    if not HEIF_AVAILABLE:
+        result["error"] = "pillow-heif no disponible"
+        return result
+    temp_target = f"{target_path}.tmp"
+    try:
+        with Image.open(source_path) as img:
+            img.load()
+            result["width"], result["height"] = img.size
+            exif = img.getexif()
+            # pillow-heif ya aplica la rotación del contenedor: la orientación EXIF pasa a ser 1
+            if exif.get(EXIF_ORIENTATION, 1) != 1:
+                exif[EXIF_ORIENTATION] = 1
+            options = {"quality": quality, "exif": exif.tobytes()}
+            if img.info.get("icc_profile"):
+                options["icc_profile"] = img.info["icc_profile"]
+            if image_format == "jpeg":
+                options["optimize"] = True
+            converted = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+            converted.save(temp_target, format=image_format.upper(), **options)
+        os.replace(temp_target, target_path)
+        result["source_bytes"] = os.path.getsize(source_path)
+        result["target_bytes"] = os.path.getsize(target_path)
+    except Exception as e:
+        result["error"] = str(e)
+        if os.path.exists(temp_target):
+            os.unlink(temp_target)
+    result["elapsed_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def create_pool(workers):
+    """Pool de procesos con 'spawn': los trabajadores no heredan el estado del bot"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def find_heif_files(root):
+    """Recorre el árbol (YYYY/MM/DD) y devuelve los HEIF encontrados, ordenados"""
+    found = []
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError as e:
+            print(f"⚠️ No se pudo leer {current}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith("."):
+                    stack.append(entry.path)
+            elif is_heif(entry.name):
+                found.append(entry.path)
+    return sorted(found)
+
+
+def _backfill_task(args):
+    source_path, image_format, quality = args
+    return convert_heif(source_path, derivative_path_for(source_path, image_format), image_format, quality)
+
+
+def backfill(root, workers=None, image_format="jpeg", quality=90, force=False):
+    """Convierte en paralelo todos los HEIF de un árbol que aún no tengan copia web"""
+    files = find_heif_files(root)
+    pending = [path for path in files
+               if force or not os.path.exists(derivative_path_for(path, image_format))]
+    workers = workers or os.cpu_count() or 1
+    print(f"🔎 {len(files)} archivos HEIF, {len(pending)} por convertir con {workers} procesos")
+    if not pending:
+        return {"found": len(files), "converted": 0, "errors": 0}
+
+    started = time.perf_counter()
+    converted = errors = 0
+    saved_bytes = 0
+    cpu_ms = 0.0
+    tasks = [(path, image_format, quality) for path in pending]
+    with create_pool(workers) as pool:
+        for result in pool.map(_backfill_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+            cpu_ms += result.get("elapsed_ms", 0.0)
+            if "error" in result:
+                errors += 1
+                print(f"❌ {result['source']}: {result['error']}")
+                continue
+            converted += 1
+            saved_bytes += result["source_bytes"] - result["target_bytes"]
+            print(f"✅ {result['target']} ({result['width']}x{result['height']}, {result['elapsed_ms']:.0f}ms)")
+    elapsed = time.perf_counter() - started
+    rate = converted / elapsed if elapsed > 0 else 0.0
+    print(f"\n📊 {converted} convertidos, {errors} errores en {elapsed:.1f}s "
+          f"({rate:.1f} archivos/s, {cpu_ms / 1000:.1f}s de trabajo, x{cpu_ms / 1000 / elapsed if elapsed else 0:.1f} en paralelo)")
+    print(f"📦 Diferencia de tamaño (original - copia): {saved_bytes / (1024 * 1024):.1f}MB")
+    return {"found": len(files), "converted": converted, "errors": errors, "elapsed": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convierte fotos HEIC/HEIF a JPEG/WebP junto al original")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto, todos los núcleos)")
+    parser.add_argument("--format", choices=sorted(DERIVATIVE_EXTENSIONS), default="jpeg")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--force", action="store_true", help="Regenerar copias ya existentes")
+    args = parser.parse_args()
+
+    if not HEIF_AVAILABLE:
+        print("❌ pillow-heif no está instalado (pip install pillow-heif)")
+        sys.exit(1)
+    result = backfill(args.root, args.workers, args.format, args.quality, args.force)
+    sys.exit(1 if result["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
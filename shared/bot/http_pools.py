@@ -0,0 +1,222 @@
+"""
+http_pools.py - Conexiones HTTP separadas para getUpdates, la API y las descargas
+
+Con la configuración por defecto de ApplicationBuilder el long-poll de getUpdates,
+los send_message y las descargas de varios MB comparten un pool pequeño y los
+mismos tiempos máximos: una descarga lenta puede dejar sin conexión a un aviso.
+Aquí cada tráfico tiene su pool:
+
+- updates: una conexión para el long-poll, con lectura mayor que su timeout.
+- api: varias conexiones para mensajes, get_file y subidas.
+- descargas: cliente httpx propio, en streaming y con un máximo de descargas a la vez.
+
+Las conexiones se reutilizan (keep-alive HTTP); las de descarga llevan además
+keep-alive TCP para que un NAT no corte en silencio una transferencia parada
+(en los pools de la API no: con socket_options, HTTPXRequest 20.x crea su propio
+transporte e ignora el tamaño del pool y HTTP/2). HTTP/2 es opcional: necesita
+el paquete h2 y, si falta, se avisa y se sigue con HTTP/1.1. Cada pool anota
+peticiones, errores, latencia y bytes; las descargas también el caudal.
+
+    python http_pools.py https://ejemplo/archivo.jpg --concurrency 2   # prueba de caudal
+"""
+import time
+import socket
+import asyncio
+import argparse
+
+import httpx
+from telegram.request import HTTPXRequest
+
+try:
+    import h2  # noqa: F401  (lo usa httpx para HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+KEEPALIVE_IDLE = 60  # Segundos sin tráfico antes de la primera sonda TCP
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_PROBES = 4
+DOWNLOAD_CHUNK = 256 * 1024
+
+
+def keepalive_socket_options():
+    """Opciones de socket para keep-alive TCP (las que existan en este sistema)"""
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                        ("TCP_KEEPCNT", KEEPALIVE_PROBES)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+def http_version(http2):
+    if http2 and not HTTP2_AVAILABLE:
+        print("⚠️ HTTP/2 pedido pero falta el paquete h2 - se usa HTTP/1.1", flush=True)
+        return "1.1"
+    return "2" if http2 else "1.1"
+
+
+class PoolStats:
+    """Contadores de un pool: peticiones, errores, latencia y bytes"""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.bytes = 0
+
+    def add(self, elapsed_ms, size=0, error=False):
+        self.requests += 1
+        self.errors += 1 if error else 0
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.bytes += size
+
+    def snapshot(self):
+        return {
+            "size": self.size,
+            "requests": self.requests,
+            "errors": self.errors,
+            "active": self.active,
+            "avg_ms": self.total_ms / self.requests if self.requests else 0.0,
+            "max_ms": self.max_ms,
+            "mb": self.bytes / (1024 * 1024),
+        }
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest de python-telegram-bot que anota cada petición en su PoolStats"""
+
+    def __init__(self, name, pool_size, read_timeout, write_timeout=None, connect_timeout=5.0,
+                 pool_timeout=5.0, http2=False):
+        super().__init__(
+            connection_pool_size=pool_size,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout if write_timeout is not None else read_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout,
+            http_version=http_version(http2),
+        )
+        self.stats = PoolStats(name, pool_size)
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        self.stats.active += 1
+        try:
+            code, payload = await super().do_request(*args, **kwargs)
+        except Exception:
+            self.stats.add((time.perf_counter() - started) * 1000, error=True)
+            raise
+        finally:
+            self.stats.active -= 1
+        self.stats.add((time.perf_counter() - started) * 1000, len(payload), error=code >= 500)
+        return code, payload
+
+
+class DownloadError(Exception):
+    """Fallo de una descarga. El mensaje nunca lleva la URL: la de Telegram incluye el token del bot"""
+
+
+class Downloader:
+    """Descargas de archivos en su propio pool, en streaming y con un máximo simultáneo"""
+
+    def __init__(self, concurrency=2, read_timeout=60.0, connect_timeout=10.0, http2=False):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Límites y HTTP/2 van en el transporte: con uno propio, httpx ignora los del cliente
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+            transport=httpx.AsyncHTTPTransport(
+                http2=http_version(http2) == "2",
+                limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+                socket_options=keepalive_socket_options(),
+            ),
+        )
+        self.stats = PoolStats("descargas", concurrency)
+        self.waiting = 0
+        self.seconds = 0.0  # Tiempo transfiriendo (sin la espera por un hueco)
+        self.wait_ms = 0.0
+        self.peak_mbps = 0.0
+
+    async def download(self, url, sink):
+        """Descarga url pasando cada trozo a `await sink(bytes)`; devuelve los bytes recibidos"""
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.wait_ms += (time.perf_counter() - queued) * 1000
+            self.stats.active += 1
+            started = time.perf_counter()
+            received = 0
+            try:
+                async with self.client.stream("GET", url) as response:
+                    if response.is_error:
+                        raise DownloadError(f"HTTP {response.status_code}")
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK):
+                        received += len(chunk)
+                        await sink(chunk)
+            except httpx.HTTPError as e:
+                self.stats.add((time.perf_counter() - started) * 1000, received, error=True)
+                raise DownloadError(f"{type(e).__name__} tras {received} bytes") from None
+            except Exception:
+                self.stats.add((time.perf_counter() - started) * 1000, received, error=True)
+                raise
+            finally:
+                self.stats.active -= 1
+        finally:
+            self.semaphore.release()
+        elapsed = time.perf_counter() - started
+        self.stats.add(elapsed * 1000, received)
+        self.seconds += elapsed
+        if elapsed > 0:
+            self.peak_mbps = max(self.peak_mbps, received / (1024 * 1024) / elapsed)
+        return received
+
+    def snapshot(self):
+        result = self.stats.snapshot()
+        result.update(
+            waiting=self.waiting,
+            avg_wait_ms=self.wait_ms / self.stats.requests if self.stats.requests else 0.0,
+            mbps=result["mb"] / self.seconds if self.seconds else 0.0,
+            peak_mbps=self.peak_mbps,
+        )
+        return result
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de caudal del pool de descargas")
+    parser.add_argument("url")
+    parser.add_argument("--count", type=int, default=4, help="Descargas en total")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--http2", action="store_true")
+    args = parser.parse_args()
+
+    async def probe():
+        downloader = Downloader(args.concurrency, http2=args.http2)
+
+        async def discard(chunk):
+            pass
+
+        started = time.perf_counter()
+        await asyncio.gather(*(downloader.download(args.url, discard) for _ in range(args.count)))
+        await downloader.close()
+        stats = downloader.snapshot()
+        print(f"📥 {stats['requests']} descargas, {stats['mb']:.1f}MB en {time.perf_counter() - started:.2f}s; "
+              f"{stats['mbps']:.1f}MB/s por descarga (máx {stats['peak_mbps']:.1f}), "
+              f"espera media {stats['avg_wait_ms']:.0f}ms, {stats['errors']} errores")
+
+    asyncio.run(probe())
+
+
+if __name__ == "__main__":
+    main()
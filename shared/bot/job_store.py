@@ -0,0 +1,131 @@
+"""
+job_store.py - Almacén persistente de jobs de APScheduler sobre SQLite (stdlib)
+
+Equivalente a SQLAlchemyJobStore sin depender de SQLAlchemy: cada job se guarda
+serializado con pickle junto a su próxima ejecución (timestamp UTC indexado), de
+modo que al reiniciar el bot el scheduler recupera los jobs pendientes tal cual
+estaban, sin volver a generarlos.
+
+Los jobs guardados deben apuntar a funciones de nivel de módulo y recibir
+argumentos serializables (nada de la Application de Telegram).
+"""
+import os
+import pickle
+import sqlite3
+import threading
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+
+class SQLiteJobStore(BaseJobStore):
+    def __init__(self, path, pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.path = path
+        self.pickle_protocol = pickle_protocol
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, next_run_time REAL, job_state BLOB NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_next_run_time ON jobs (next_run_time)")
+
+    def shutdown(self):
+        if self.conn is not None:
+            with self.lock:
+                self.conn.close()
+            self.conn = None
+
+    def lookup_job(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT job_state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        return self._get_jobs("next_run_time <= ?", (datetime_to_utc_timestamp(now),))
+
+    def get_next_run_time(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT next_run_time FROM jobs WHERE next_run_time IS NOT NULL "
+                "ORDER BY next_run_time LIMIT 1"
+            ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "INSERT INTO jobs (id, next_run_time, job_state) VALUES (?, ?, ?)",
+                    (job.id, datetime_to_utc_timestamp(job.next_run_time), self._serialize(job)),
+                )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET next_run_time = ?, job_state = ? WHERE id = ?",
+                (datetime_to_utc_timestamp(job.next_run_time), self._serialize(job), job.id),
+            )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM jobs")
+
+    def _serialize(self, job):
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_job(self, job_state):
+        job = Job.__new__(Job)
+        job.__setstate__(pickle.loads(job_state))
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, condition=None, params=()):
+        query = "SELECT id, job_state FROM jobs"
+        if condition:
+            query += f" WHERE {condition}"
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY next_run_time", params).fetchall()
+
+        jobs = []
+        failed = []
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                self._logger.exception('Unable to restore job "%s" -- removing it', job_id)
+                failed.append(job_id)
+
+        # Los jobs que ya no se pueden restaurar (función renombrada, etc.) se descartan
+        if failed:
+            with self.lock, self.conn:
+                self.conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in failed])
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.path})>"
@@ -0,0 +1,286 @@
+"""
+local_api_standin.py - Servidor de pruebas que imita a telegram-bot-api en modo --local
+
+Implementa lo mínimo que usa bot.py (getMe, getUpdates, getFile, sendMessage y el
+resto de send*) y, como el servidor real con --local, devuelve en getFile la ruta
+del archivo en disco en lugar de una URL de descarga. Así se puede probar el bot
+de extremo a extremo con TELEGRAM_LOCAL_MODE sin depender de Telegram.
+
+Uso:
+    python local_api_standin.py --port 8081 --root /tmp/telegram-bot-api --user-id 515944439
+
+    # En otra terminal, el bot apuntando al servidor de pruebas:
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot TELEGRAM_LOCAL_MODE=true python bot.py
+
+    # Simular que el usuario envía una foto (se copia al directorio del servidor):
+    curl -X POST http://127.0.0.1:8081/inject -d '{"kind": "photo", "path": "/ruta/foto.jpg", "width": 4032, "height": 3024}'
+    curl -X POST http://127.0.0.1:8081/inject -d '{"kind": "text", "text": "/status"}'
+    curl -X POST http://127.0.0.1:8081/inject -d '{"kind": "location", "latitude": 40.4168, "longitude": -3.7038}'
+
+    # Consultar lo que el bot ha respondido:
+    curl http://127.0.0.1:8081/sent
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+class StandInState:
+    """Estado compartido del servidor: actualizaciones pendientes, archivos y mensajes enviados"""
+
+    def __init__(self, root, user_id, first_update_id=1):
+        self.root = root
+        self.user_id = user_id
+        self.updates = []
+        self.files = {}
+        self.sent = []
+        self.next_update_id = first_update_id
+        self.next_message_id = 1
+        self.next_file_id = 1
+        self.condition = threading.Condition()
+
+    def _message_base(self):
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        user = {"id": self.user_id, "is_bot": False, "first_name": "Prueba"}
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private", "first_name": "Prueba"},
+            "from": user,
+        }
+
+    def _register_file(self, source_path, folder, extension, file_unique_id=None):
+        file_number = self.next_file_id
+        self.next_file_id += 1
+        # Igual que el servidor real: <root>/<token>/<carpeta>/file_N.ext
+        target_dir = os.path.join(self.root, "standin", folder)
+        os.makedirs(target_dir, exist_ok=True)
+        target_path = os.path.join(target_dir, f"file_{file_number}{extension}")
+        shutil.copyfile(source_path, target_path)
+        file_id = f"standin-{file_number}"
+        self.files[file_id] = {
+            "file_id": file_id,
+            "file_unique_id": file_unique_id or f"unique-{file_number}",
+            "file_size": os.path.getsize(target_path),
+            "file_path": os.path.abspath(target_path),
+        }
+        return self.files[file_id]
+
+    def inject(self, payload):
+        """Crea una actualización de mensaje a partir de una petición a /inject"""
+        with self.condition:
+            message = self._message_base()
+            kind = payload.get("kind", "text")
+            if payload.get("media_group_id"):
+                message["media_group_id"] = str(payload["media_group_id"])
+            if kind == "location":
+                message["location"] = {"latitude": payload["latitude"], "longitude": payload["longitude"]}
+            elif kind == "text":
+                message["text"] = payload.get("text", "hola")
+                if message["text"].startswith("/"):
+                    command = message["text"].split()[0]
+                    message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+            else:
+                source_path = payload["path"]
+                # El mismo file_unique_id simula que el usuario reenvía el mismo archivo
+                unique_id = payload.get("file_unique_id")
+                extension = os.path.splitext(source_path)[1].lower()
+                if kind == "photo":
+                    info = self._register_file(source_path, "photos", extension or ".jpg", unique_id)
+                    message["photo"] = [dict(info, width=payload.get("width", 4032), height=payload.get("height", 3024))]
+                elif kind == "video":
+                    info = self._register_file(source_path, "videos", extension or ".mp4", unique_id)
+                    message["video"] = dict(info, width=payload.get("width", 1920), height=payload.get("height", 1080),
+                                            duration=payload.get("duration", 5))
+                else:
+                    info = self._register_file(source_path, "documents", extension, unique_id)
+                    message["document"] = dict(info, file_name=payload.get("file_name", os.path.basename(source_path)))
+                for section in ("photo", "video", "document"):
+                    entry = message.get(section)
+                    if entry:
+                        for item in (entry if isinstance(entry, list) else [entry]):
+                            item.pop("file_path", None)
+            update = {"update_id": self.next_update_id, "message": message}
+            self.next_update_id += 1
+            self.updates.append(update)
+            self.condition.notify_all()
+            return update
+
+    def get_updates(self, offset, timeout):
+        deadline = time.time() + min(float(timeout or 0), 30)
+        with self.condition:
+            while True:
+                pending = [u for u in self.updates if u["update_id"] >= (offset or 0)]
+                if pending or time.time() >= deadline:
+                    # Las actualizaciones confirmadas (offset) se olvidan, como en Telegram
+                    self.updates = pending
+                    return pending
+                self.condition.wait(max(0.0, deadline - time.time()))
+
+    def record_sent(self, method, params):
+        with self.condition:
+            message = self._message_base()
+            message["chat"]["id"] = params.get("chat_id", self.user_id)
+            if "text" in params:
+                message["text"] = params["text"]
+            if "caption" in params:
+                message["caption"] = params["caption"]
+            self.sent.append({"method": method, "params": {k: v for k, v in params.items() if isinstance(v, (str, int, float, bool, list, dict))}})
+            print(f"📤 {method}: {str(params.get('text') or params.get('caption') or '')[:80]!r}", flush=True)
+            return message
+
+    def _sent_media(self, kind, value):
+        """file_id de un archivo enviado: el mismo si se reenvía uno conocido, nuevo si se sube"""
+        if isinstance(value, str) and not value.startswith("attach://"):
+            if value not in self.files:
+                raise KeyError(value)
+            info = self.files[value]
+        else:
+            file_number = self.next_file_id
+            self.next_file_id += 1
+            info = {"file_id": f"standin-{file_number}", "file_unique_id": f"unique-{file_number}", "file_size": 0}
+            self.files[info["file_id"]] = info
+        info = {k: v for k, v in info.items() if k != "file_path"}
+        if kind == "photo":
+            return "photo", [dict(info, width=1, height=1)]
+        if kind == "video":
+            return "video", dict(info, width=1, height=1, duration=1)
+        return "document", dict(info, file_name="archivo")
+
+    def record_sent_media(self, method, params):
+        """sendPhoto/sendVideo/sendDocument/sendMediaGroup; un file_id desconocido falla como en Telegram"""
+        if method == "sendMediaGroup":
+            entries = [(entry["type"], entry["media"], entry.get("caption")) for entry in params["media"]]
+        else:
+            kind = method[4:].lower()
+            entries = [(kind, params.get(kind), params.get("caption"))]
+        messages = []
+        with self.condition:
+            for kind, value, caption in entries:
+                field, media = self._sent_media(kind, value)
+                message = self.record_sent(f"{method}:{kind}", {"chat_id": params.get("chat_id"), "caption": caption or ""})
+                message[field] = media
+                messages.append(message)
+        return messages if method == "sendMediaGroup" else messages[0]
+
+
+def parse_params(handler):
+    """Parámetros de la petición tal y como los envía python-telegram-bot"""
+    params = dict(parse_qsl(urlparse(handler.path).query))
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length) if length else b""
+    content_type = handler.headers.get("Content-Type", "")
+    if body and content_type.startswith("application/json"):
+        params.update(json.loads(body))
+    elif body and content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True) or b"")}
+            else:
+                params[name] = (part.get_payload(decode=True) or b"").decode("utf-8")
+    elif body:
+        params.update(parse_qsl(body.decode()))
+    # python-telegram-bot serializa los valores no textuales como JSON
+    for key, value in list(params.items()):
+        if isinstance(value, str):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+
+def build_handler(state):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, payload, status=200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            path = urlparse(self.path).path
+            params = parse_params(self)
+
+            if path == "/inject":
+                return self._reply({"ok": True, "result": state.inject(params)})
+            if path == "/sent":
+                return self._reply({"ok": True, "result": state.sent})
+
+            # /bot<token>/<método>
+            parts = path.strip("/").split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                return self._reply({"ok": False, "error_code": 404, "description": "Not Found"}, 404)
+            method = parts[1]
+
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "StandIn", "username": "standin_bot",
+                          "can_join_groups": False, "can_read_all_group_messages": False,
+                          "supports_inline_queries": False}
+            elif method == "getUpdates":
+                result = state.get_updates(params.get("offset"), params.get("timeout"))
+            elif method == "getFile":
+                info = state.files.get(params.get("file_id"))
+                if info is None:
+                    return self._reply({"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}, 400)
+                result = info
+            elif method in ("sendPhoto", "sendVideo", "sendDocument", "sendMediaGroup"):
+                try:
+                    result = state.record_sent_media(method, params)
+                except KeyError:
+                    return self._reply({"ok": False, "error_code": 400,
+                                        "description": "Bad Request: wrong file identifier/HTTP URL specified"}, 400)
+            elif method.startswith("send"):
+                result = state.record_sent(method, params)
+            else:
+                # deleteWebhook, setMyCommands, close, logOut...
+                result = True
+            self._reply({"ok": True, "result": result})
+
+    return StandInHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de pruebas que imita a telegram-bot-api --local")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--root", default="/tmp/telegram-bot-api", help="Directorio de archivos del servidor")
+    parser.add_argument("--user-id", type=int, default=int(os.getenv("TELEGRAM_USER_ID", "1")))
+    parser.add_argument("--first-update-id", type=int, default=1,
+                        help="Primer update_id (al reiniciar, mayor que el último que vio el bot)")
+    args = parser.parse_args()
+
+    state = StandInState(args.root, args.user_id, args.first_update_id)
+    server = ThreadingHTTPServer((args.host, args.port), build_handler(state))
+    print(f"🛰️ Bot API de pruebas en http://{args.host}:{args.port}/bot (archivos en {args.root})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Servidor de pruebas detenido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,887 @@
+"""
+media_api.py - API web de solo lectura servida desde el índice de medios (asyncio)
+
+Responde a las mismas rutas que la API PHP (feed, calendar, stats, search) con las
+mismas respuestas, pero sin recorrer directorios: carga una vez la lista del índice
+(media.db) en memoria y la reutiliza hasta que el índice o el registro de cambios
+del bot se modifican. Las respuestas JSON llevan un ETag derivado de esa versión,
+así que una petición repetida sin cambios se contesta con 304 sin calcular nada.
+
+Los archivos (sueltos o dentro del tar de su mes) y sus miniaturas se sirven con
+sendfile, Range de un solo tramo, ETag/If-None-Match e If-Modified-Since; los
+ETag son los mismos que genera PackStore.php, de modo que las cachés del
+navegador valen para las dos APIs.
+
+    python media_api.py serve /data/fotos --port 8090
+    python media_api.py bench --php http://localhost/api --py http://localhost:8090/api
+
+Rutas: /api/feed, /api/calendar[/YYYY/MM], /api/stats, /api/search,
+/api/media/YYYY/MM/DD/archivo (también /photos/...) y
+/api/thumbs/YYYY/MM/DD/archivo?size=320.
+"""
+import os
+import re
+import json
+import gzip
+import time
+import zlib
+import asyncio
+import argparse
+import calendar
+import threading
+import http.client
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from media_index import MediaIndex, INDEX_DIRNAME, INDEX_FILENAME
+from change_feed import STATE_FILENAME
+import media_tiering
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Archivos que lista la web (el mismo patrón que las rutas PHP)
+WEB_FILENAME = re.compile(r"^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$", re.IGNORECASE)
+# Archivos que se pueden servir (FileManager::isValidFilename)
+SERVABLE_FILENAME = re.compile(r"^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|heic|heif|mp4|mov)$", re.IGNORECASE)
+MEDIA_ROUTE = re.compile(r"^/(?:api/media|photos)/(\d{4})/(\d{2})/(\d{2})/([^/]+)$")
+THUMB_ROUTE = re.compile(r"^/api/thumbs/(\d{4})/(\d{2})/(\d{2})/([^/]+)$")
+CALENDAR_ROUTE = re.compile(r"^/api/calendar(?:/(\d{4})/(\d{1,2}))?$")
+MIME_TYPES = {
+    "jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp",
+    "heic": "image/heic", "heif": "image/heif", "mp4": "video/mp4", "mov": "video/quicktime",
+}
+
+THUMB_DIRNAME = ".thumbs"
+THUMB_SIZES = (160, 320, 640)
+THUMB_QUALITY = 80
+MAX_HEADER_BYTES = 16384
+KEEPALIVE_SECONDS = 15
+RESPONSE_CACHE_SIZE = 256  # Respuestas JSON guardadas por versión del índice
+GZIP_MIN_BYTES = 1024
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DAY_NAMES_ES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+MONTH_NAMES_ES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto",
+                  "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+WEEK_DAYS_SHORT = ["Dom", "Lun", "Mar", "Mié", "Jue", "Vie", "Sáb"]
+STATUS_TEXT = {200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request",
+               404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class BadRequest(Exception):
+    pass
+
+
+# --- Datos: instantánea del índice -------------------------------------------------
+
+class Snapshot:
+    """Lista del índice agrupada por día: {fecha: [archivo, ...]} en orden cronológico"""
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.days = {}
+        for path, day, clock, size, mtime in rows:
+            filename = path.rsplit("/", 1)[-1]
+            if not WEB_FILENAME.match(filename):
+                continue
+            self.days.setdefault(day, []).append({
+                "filename": filename,
+                "type": "video" if filename.lower().endswith(".mp4") else "photo",
+                "time": clock,
+                "path": path,
+                "size": size or 0,
+                "mtime": int(mtime or 0),
+            })
+        self.dates = sorted(self.days)
+
+
+def php_date_format(day):
+    """El formato completo de IntlDateFormatter es_ES: "lunes, 10 de junio de 2024\""""
+    return f"{DAY_NAMES_ES[day.weekday()].lower()}, {day.day} de {MONTH_NAMES_ES[day.month - 1].lower()} de {day.year}"
+
+
+def php_weekday(day):
+    """date('w'): 0 = domingo"""
+    return (day.weekday() + 1) % 7
+
+
+def feed_entry(snapshot, day_str):
+    files = snapshot.days.get(day_str)
+    if not files:
+        return None
+    year, month, day_number = day_str.split("-")
+    entries = [{
+        "filename": item["filename"],
+        "type": item["type"],
+        "timestamp": item["time"],
+        "path": f"/photos/{item['path']}",
+        "size": item["size"],
+        "size_mb": round(item["size"] / (1024 * 1024), 2),
+    } for item in files]
+    total_size = sum(item["size"] for item in files)
+    first_time, last_time = entries[0]["timestamp"], entries[-1]["timestamp"]
+    time_span = None
+    if first_time != last_time:
+        span = (int(last_time[:2]) * 60 + int(last_time[3:5])) - (int(first_time[:2]) * 60 + int(first_time[3:5]))
+        time_span = {"hours": span // 60, "minutes": span % 60, "total_minutes": span}
+    day = date(int(year), int(month), int(day_number))
+    photos = sum(1 for item in files if item["type"] == "photo")
+    return {
+        "date": day_str,
+        "date_formatted": php_date_format(day),
+        "day_of_week": DAY_NAMES[day.weekday()],
+        "day_of_week_spanish": DAY_NAMES_ES[day.weekday()],
+        "files": entries,
+        "summary": {
+            "total_files": len(files),
+            "photos": photos,
+            "videos": len(files) - photos,
+            "total_size": total_size,
+            "total_size_mb": round(total_size / (1024 * 1024), 2),
+            "first_capture": first_time,
+            "last_capture": last_time,
+            "time_span": time_span,
+        },
+    }
+
+
+def build_feed(snapshot, params, base_url):
+    page = max(1, _int(params, "page", 1))
+    limit = min(50, max(1, _int(params, "limit", 10)))
+    sort_order = params.get("sort", "desc")
+    offset = (page - 1) * limit
+    dates = snapshot.dates[::-1] if sort_order == "desc" else snapshot.dates
+    total = len(dates)
+    total_pages = -(-total // limit)
+
+    response = {
+        "feed": [feed_entry(snapshot, day) for day in dates[offset:offset + limit]],
+        "pagination": {
+            "current_page": page,
+            "total_pages": total_pages,
+            "total_entries": total,
+            "entries_per_page": limit,
+            "has_next": page < total_pages,
+            "has_previous": page > 1,
+            "next_page": page + 1 if page < total_pages else None,
+            "previous_page": page - 1 if page > 1 else None,
+        },
+        "meta": {"sort_order": sort_order, "generated_at": _now_iso(), "timezone": "Europe/Madrid"},
+    }
+    if "include_activity" in params:
+        days = min(30, max(1, _int(params, "activity_days", 7)))
+        today = date.today()
+        activity = []
+        for offset_days in range(days):
+            day_str = (today - timedelta(days=offset_days)).isoformat()
+            count = len(snapshot.days.get(day_str, []))
+            activity.append({"date": day_str, "count": count, "has_content": count > 0})
+        response["recent_activity"] = activity[::-1]
+
+    query = lambda number: f"{base_url}?page={number}&limit={limit}&sort={sort_order}"
+    response["links"] = {"self": query(page), "first": query(1), "last": query(total_pages)}
+    if page < total_pages:
+        response["links"]["next"] = query(page + 1)
+    if page > 1:
+        response["links"]["prev"] = query(page - 1)
+    return response
+
+
+def build_calendar(snapshot, year, month):
+    if not 1 <= month <= 12:
+        raise BadRequest("Mes inválido")
+    days_in_month = calendar.monthrange(year, month)[1]
+    calendar_data = []
+    hour_counts = [0] * 24
+    stats = {
+        "total_days": days_in_month, "active_days": 0, "total_files": 0, "total_photos": 0,
+        "total_videos": 0, "most_active_day": None, "least_active_day": None,
+        "average_files_per_active_day": 0, "most_productive_hours": [],
+        "activity_by_day_of_week": [0] * 7,
+    }
+    max_files, min_files = 0, None
+
+    for day_number in range(1, days_in_month + 1):
+        day_str = f"{year:04d}-{month:02d}-{day_number:02d}"
+        day_data = {
+            "date": day_str, "day": day_number, "has_content": False, "file_count": 0,
+            "photos": 0, "videos": 0, "files": [], "first_photo_time": None,
+            "last_photo_time": None, "time_span_hours": 0,
+        }
+        files = snapshot.days.get(day_str, [])
+        if files:
+            minutes = []
+            for item in files:
+                hour, minute, second = (int(part) for part in item["time"].split(":"))
+                minutes.append(hour * 60 + minute)
+                hour_counts[hour] += 1
+                day_data["videos" if item["type"] == "video" else "photos"] += 1
+                day_data["files"].append({
+                    "filename": item["filename"], "type": item["type"],
+                    "timestamp": f"{hour}:{minute}:{second}", "path": f"/photos/{item['path']}",
+                })
+            count = len(files)
+            first, last = min(minutes), max(minutes)
+            day_data.update(
+                has_content=True, file_count=count,
+                first_photo_time=f"{first // 60:02d}:{first % 60:02d}",
+                last_photo_time=f"{last // 60:02d}:{last % 60:02d}",
+                time_span_hours=round((last - first) / 60, 1),
+            )
+            stats["active_days"] += 1
+            stats["total_files"] += count
+            stats["total_photos"] += day_data["photos"]
+            stats["total_videos"] += day_data["videos"]
+            if count > max_files:
+                max_files = count
+                stats["most_active_day"] = {"date": day_str, "count": count}
+            if min_files is None or count < min_files:
+                min_files = count
+                stats["least_active_day"] = {"date": day_str, "count": count}
+            stats["activity_by_day_of_week"][php_weekday(date(year, month, day_number))] += count
+        calendar_data.append(day_data)
+
+    if stats["active_days"]:
+        stats["average_files_per_active_day"] = round(stats["total_files"] / stats["active_days"], 1)
+    top_hours = sorted(range(24), key=lambda hour: (-hour_counts[hour], hour))[:5]
+    stats["most_productive_hours"] = [
+        {"hour": f"{hour:02d}:00", "count": hour_counts[hour]} for hour in top_hours if hour_counts[hour] > 0
+    ]
+
+    current = date(year, month, 1)
+    previous = (current - timedelta(days=1)).replace(day=1)
+    following = (current + timedelta(days=days_in_month))
+    label = lambda day: f"{calendar.month_name[day.month]} {day.year}"
+    return {
+        "month_info": {
+            "year": year, "month": month, "month_name": calendar.month_name[month],
+            "month_name_spanish": MONTH_NAMES_ES[month - 1], "days_in_month": days_in_month,
+            "first_day_of_week": php_weekday(current),
+        },
+        "navigation": {
+            "previous": {"year": previous.year, "month": previous.month, "label": label(previous)},
+            "current": {"year": year, "month": month, "label": label(current)},
+            "next": {"year": following.year, "month": following.month, "label": label(following)},
+        },
+        "calendar_data": calendar_data,
+        "statistics": stats,
+        "generated_at": _now_iso(),
+    }
+
+
+def build_stats(snapshot, params):
+    start_date, end_date = params.get("start_date"), params.get("end_date")
+    file_type = params.get("type", "all")
+    filtered = bool(start_date and end_date)
+
+    stats = {
+        "total_files": 0, "total_photos": 0, "total_videos": 0, "total_size": 0,
+        "dates_with_content": [], "activity_by_date": [], "activity_by_hour": [0] * 24,
+        "activity_by_day_of_week": [0] * 7, "monthly_activity": {}, "earliest_date": None,
+        "latest_date": None, "avg_photos_per_day": 0, "most_active_hour": 0, "most_active_day": 0,
+    }
+    for day_str in snapshot.dates:
+        if filtered and not start_date <= day_str <= end_date:
+            continue
+        files = [item for item in snapshot.days[day_str] if file_type not in ("photo", "video") or item["type"] == file_type]
+        if not files:
+            continue
+        weekday = php_weekday(date.fromisoformat(day_str))
+        for item in files:
+            stats["total_size"] += item["size"]
+            stats["activity_by_hour"][int(item["time"][:2])] += 1
+            stats["total_photos" if item["type"] == "photo" else "total_videos"] += 1
+        stats["total_files"] += len(files)
+        stats["activity_by_day_of_week"][weekday] += len(files)
+        month_key = day_str[:7]
+        stats["monthly_activity"][month_key] = stats["monthly_activity"].get(month_key, 0) + len(files)
+        stats["dates_with_content"].append(day_str)
+        stats["activity_by_date"].append({"date": day_str, "count": len(files)})
+
+    if stats["dates_with_content"]:
+        stats["earliest_date"] = stats["dates_with_content"][0]
+        stats["latest_date"] = stats["dates_with_content"][-1]
+        stats["avg_photos_per_day"] = round(stats["total_files"] / len(stats["dates_with_content"]), 1)
+        stats["most_active_hour"] = stats["activity_by_hour"].index(max(stats["activity_by_hour"]))
+        stats["most_active_day"] = stats["activity_by_day_of_week"].index(max(stats["activity_by_day_of_week"]))
+    else:
+        stats["monthly_activity"] = []  # json_encode de un array PHP vacío
+
+    stats["filtered"] = filtered
+    if filtered:
+        stats["date_range"] = {"start": start_date, "end": end_date}
+    stats["generated_at"] = _now_iso()
+    stats["total_size_mb"] = round(stats["total_size"] / (1024 * 1024), 2)
+    stats["type_filter"] = file_type
+    stats["charts"] = {
+        "activity_timeline": stats["activity_by_date"][-30:],
+        "hourly_distribution": [{"hour": hour, "count": count} for hour, count in enumerate(stats["activity_by_hour"])],
+        "weekly_distribution": [{"day": WEEK_DAYS_SHORT[day], "count": count}
+                                for day, count in enumerate(stats["activity_by_day_of_week"])],
+    }
+    return stats
+
+
+def search_criteria(params):
+    criteria = {key: params[key] for key in ("query", "type", "date", "start_date", "end_date") if key in params}
+    for key in ("year", "month", "day", "hour", "min_size", "max_size"):
+        if key in params:
+            criteria[key] = _int(params, key, 0)
+    return criteria
+
+
+def matches_criteria(info, criteria):
+    if criteria.get("type", "all") != "all" and criteria["type"] != info["type"]:
+        return False
+    if "date" in criteria and criteria["date"] != info["date"]:
+        return False
+    if "start_date" in criteria and "end_date" in criteria and \
+            not criteria["start_date"] <= info["date"] <= criteria["end_date"]:
+        return False
+    for key in ("year", "month", "day", "hour"):
+        if key in criteria and criteria[key] != info[key]:
+            return False
+    if criteria.get("query") and criteria["query"].lower() not in f"{info['date']} {info['filename']}".lower():
+        return False
+    if "min_size" in criteria and info["size"] < criteria["min_size"]:
+        return False
+    if "max_size" in criteria and info["size"] > criteria["max_size"]:
+        return False
+    return True
+
+
+def build_search(snapshot, params):
+    if "dates_only" in params:
+        return {"dates": snapshot.dates, "count": len(snapshot.dates)}
+
+    criteria = search_criteria(params)
+    results = []
+    for day_str in snapshot.dates:
+        year, month, day_number = (int(part) for part in day_str.split("-"))
+        for item in snapshot.days[day_str]:
+            hour, minute, second = (int(part) for part in item["time"].split(":"))
+            info = {
+                "filename": item["filename"], "date": day_str, "year": year, "month": month,
+                "day": day_number, "path": f"/photos/{item['path']}", "size": item["size"],
+                "timestamp": item["mtime"], "hour": hour, "minute": minute, "second": second,
+                "type": item["type"], "extension": item["filename"].rsplit(".", 1)[-1].lower(),
+            }
+            if matches_criteria(info, criteria):
+                results.append(info)
+
+    sort_by = params.get("sort_by", "date")
+    sort_order = params.get("sort_order", "desc")
+    keys = {
+        "size": lambda info: info["size"],
+        "filename": lambda info: info["filename"],
+        "time": lambda info: (info["hour"], info["minute"], info["second"]),
+    }
+    results.sort(key=keys.get(sort_by, lambda info: info["date"]), reverse=sort_order == "desc")
+
+    page = _int(params, "page", 1)
+    limit = max(1, _int(params, "limit", 50))
+    total = len(results)
+    total_pages = -(-total // limit)
+    offset = (page - 1) * limit
+    dates = [info["date"] for info in results]
+    return {
+        "results": results[offset:offset + limit],
+        "pagination": {
+            "current_page": page, "total_pages": total_pages, "total_items": total,
+            "items_per_page": limit, "has_next": page < total_pages, "has_prev": page > 1,
+        },
+        "search_criteria": criteria,
+        "sort": {"by": sort_by, "order": sort_order},
+        "summary": {
+            "total_found": total,
+            "photos": sum(1 for info in results if info["type"] == "photo"),
+            "videos": sum(1 for info in results if info["type"] == "video"),
+            "total_size": sum(info["size"] for info in results),
+            "date_range": {"earliest": min(dates) if dates else None, "latest": max(dates) if dates else None},
+        },
+        "generated_at": _now_iso(),
+    }
+
+
+def _int(params, key, default):
+    try:
+        return int(params.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _now_iso():
+    return datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+# --- Archivos y miniaturas ---------------------------------------------------------
+
+def media_source(save_path, relative):
+    """(ruta en disco, offset, tamaño, mtime, etag) de un archivo suelto o empaquetado, o None"""
+    try:
+        info = os.stat(os.path.join(save_path, relative))
+        return os.path.join(save_path, relative), 0, info.st_size, int(info.st_mtime), f'"{info.st_size:x}-{int(info.st_mtime):x}"'
+    except FileNotFoundError:
+        pass
+    parts = media_tiering.split_relative(relative)
+    index = media_tiering.load_index(os.path.join(save_path, parts[0])) if parts else None
+    member = index["members"].get(parts[1]) if index else None
+    if member is None:
+        return None
+    offset, size, mtime = member[0], member[1], int(member[2])
+    pack = os.path.join(save_path, parts[0], index["pack"])
+    return pack, offset, size, mtime, f'"p{index["generation"]}-{offset:x}-{size:x}"'
+
+
+def render_thumbnail(save_path, relative, size, target):
+    """Miniatura JPEG (lado mayor = size) de una foto o del fotograma central de un video"""
+    from recap_renderer import load_pixels, resize_array
+    with media_tiering.materialized(save_path, [relative]) as paths:
+        if relative not in paths:
+            return False
+        pixels = load_pixels(paths[relative], size)
+    if pixels is None:
+        return False
+    height, width = pixels.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    pixels = resize_array(pixels, max(1, round(height * scale)), max(1, round(width * scale)))
+    os.makedirs(os.path.dirname(target), mode=0o775, exist_ok=True)
+    temp_path = f"{target}.tmp"
+    Image.fromarray(pixels).save(temp_path, "JPEG", quality=THUMB_QUALITY, optimize=True)
+    os.replace(temp_path, target)
+    return True
+
+
+# --- Servidor HTTP -----------------------------------------------------------------
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = parts.query
+        self.params = {key: values[-1] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+class MediaAPI:
+    """Servidor HTTP/1.1 con keep-alive. index: MediaIndex compartido (el del bot) o propio."""
+
+    def __init__(self, save_path, index=None, thumb_workers=2):
+        self.save_path = save_path
+        self.index = index or MediaIndex(save_path)
+        self.index_dir = os.path.join(save_path, INDEX_DIRNAME)
+        self.thumb_dir = os.path.join(save_path, THUMB_DIRNAME)
+        self.server = None
+        self.snapshot = None
+        self.snapshot_lock = asyncio.Lock()
+        self.responses = OrderedDict()
+        self.thumb_pool = ThreadPoolExecutor(max_workers=thumb_workers, thread_name_prefix="thumbs")
+        self.thumb_jobs = {}
+        self.stats = {"requests": 0, "not_modified": 0, "cached": 0, "snapshots": 0, "thumbnails": 0}
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES)
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.thumb_pool.shutdown(cancel_futures=True)
+
+    def version(self):
+        """Cambia cuando el bot escribe en el índice o en el registro de cambios"""
+        stamps = []
+        for name in (INDEX_FILENAME, INDEX_FILENAME + "-wal", STATE_FILENAME):
+            try:
+                stamps.append(os.stat(os.path.join(self.index_dir, name)).st_mtime_ns)
+            except FileNotFoundError:
+                stamps.append(0)
+        return f"{zlib.crc32(repr(stamps).encode()):08x}"
+
+    async def get_snapshot(self, version):
+        async with self.snapshot_lock:  # Una sola recarga aunque lleguen varias peticiones
+            if self.snapshot is None or self.snapshot.version != version:
+                rows = await asyncio.to_thread(self.index.listing)
+                self.snapshot = await asyncio.to_thread(Snapshot, rows, version)
+                self.stats["snapshots"] += 1
+            return self.snapshot
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                try:
+                    request = self._parse(head)
+                except ValueError:
+                    await self._send_json(writer, None, 400, {"error": "Petición inválida"})
+                    break
+                self.stats["requests"] += 1
+                await self._dispatch(request, writer)
+                if not request.keep_alive or request.headers.get("content-length", "0") != "0":
+                    break  # Sin cuerpos: no se intenta seguir leyendo tras uno
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(head):
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        return Request(method, target, version, headers)
+
+    async def _dispatch(self, request, writer):
+        if request.method == "OPTIONS":
+            return await self._send(writer, request, 200, {"Content-Length": "0"})
+        if request.method not in ("GET", "HEAD"):
+            return await self._send_json(writer, request, 405, {"error": "Método no permitido"})
+
+        try:
+            match = MEDIA_ROUTE.match(request.path)
+            if match:
+                return await self._serve_media(request, writer, "/".join(match.groups()))
+            match = THUMB_ROUTE.match(request.path)
+            if match:
+                return await self._serve_thumbnail(request, writer, "/".join(match.groups()))
+
+            builder = self._json_route(request)
+            if builder is None:
+                return await self._send_json(writer, request, 404, {
+                    "error": True, "message": f"La ruta '{request.path}' no fue encontrada", "code": 404
+                })
+            await self._serve_json(request, writer, builder)
+        except BadRequest as e:
+            await self._send_json(writer, request, 400, {"error": str(e)})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            print(f"❌ API de medios: error en {request.path}: {e}", flush=True)
+            await self._send_json(writer, request, 500, {"error": "Error interno del servidor", "message": str(e)})
+
+    def _json_route(self, request):
+        """Función snapshot -> respuesta para una ruta JSON, o None"""
+        path, params = request.path, request.params
+        if path == "/api/feed":
+            base_url = f"http://{request.headers.get('host', 'localhost')}{path}"
+            return lambda snapshot: build_feed(snapshot, params, base_url)
+        if path == "/api/stats":
+            return lambda snapshot: build_stats(snapshot, params)
+        if path == "/api/search":
+            return lambda snapshot: build_search(snapshot, params)
+        if path == "/api/health":
+            return lambda snapshot: {"status": "ok", "dates": len(snapshot.dates), "version": snapshot.version,
+                                     "stats": dict(self.stats)}
+        match = CALENDAR_ROUTE.match(path)
+        if match:
+            today = date.today()
+            year = int(match.group(1) or params.get("year") or today.year)
+            month = int(match.group(2) or params.get("month") or today.month)
+            return lambda snapshot: build_calendar(snapshot, year, month)
+        return None
+
+    async def _serve_json(self, request, writer, builder):
+        version = self.version()
+        # El feed depende del día (actividad reciente) y del Host (enlaces)
+        key = f"{request.path}?{request.query}|{date.today()}|{request.headers.get('host', '')}"
+        etag = f'W/"{version}-{zlib.crc32(key.encode()):08x}"'
+        if etag in request.headers.get("if-none-match", ""):
+            self.stats["not_modified"] += 1
+            return await self._send(writer, request, 304, {"ETag": etag})
+
+        cached = self.responses.get(key)
+        if cached and cached[0] == etag:
+            self.responses.move_to_end(key)
+            self.stats["cached"] += 1
+            body, compressed = cached[1], cached[2]
+        else:
+            snapshot = await self.get_snapshot(version)
+            data = await asyncio.to_thread(builder, snapshot)
+            body = json.dumps(data, indent=4).encode()
+            compressed = gzip.compress(body, 5) if len(body) >= GZIP_MIN_BYTES else None
+            self.responses[key] = (etag, body, compressed)
+            if len(self.responses) > RESPONSE_CACHE_SIZE:
+                self.responses.popitem(last=False)
+
+        headers = {"Content-Type": "application/json", "ETag": etag, "Cache-Control": "no-cache",
+                   "Vary": "Accept-Encoding"}
+        if compressed is not None and "gzip" in request.headers.get("accept-encoding", ""):
+            body = compressed
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(len(body))
+        await self._send(writer, request, 200, headers, body)
+
+    async def _send_json(self, writer, request, status, data):
+        body = json.dumps(data).encode()
+        await self._send(writer, request, status, {"Content-Type": "application/json",
+                                                   "Content-Length": str(len(body))}, body)
+
+    async def _send(self, writer, request, status, headers, body=b""):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                 f"Date: {formatdate(usegmt=True)}",
+                 "Access-Control-Allow-Origin: *",
+                 "Access-Control-Allow-Methods: GET, OPTIONS",
+                 "Access-Control-Allow-Headers: Content-Type"]
+        if status == 304:
+            headers.pop("Content-Length", None)
+        elif "Content-Length" not in headers:
+            headers["Content-Length"] = str(len(body))
+        if request is None or not request.keep_alive:
+            headers["Connection"] = "close"
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body and request is not None and request.method != "HEAD" and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+    async def _serve_media(self, request, writer, relative, source=None):
+        filename = relative.rsplit("/", 1)[-1]
+        if source is None:
+            if not SERVABLE_FILENAME.match(filename):
+                return await self._send_json(writer, request, 400, {"error": "Ruta de archivo inválida"})
+            source = await asyncio.to_thread(media_source, self.save_path, relative)
+        if source is None:
+            return await self._send_json(writer, request, 404, {"error": "Archivo no encontrado"})
+        path, offset, size, mtime, etag = source
+
+        headers = {
+            "Content-Type": MIME_TYPES.get(filename.rsplit(".", 1)[-1].lower(), "application/octet-stream"),
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": formatdate(mtime, usegmt=True),
+            "Cache-Control": "public, max-age=86400",
+        }
+        if self._not_modified(request, etag, mtime):
+            self.stats["not_modified"] += 1
+            return await self._send(writer, request, 304, headers)
+
+        start, end, status = 0, size - 1, 200
+        requested = re.match(r"^bytes=(\d*)-(\d*)$", request.headers.get("range", ""))
+        if requested and size > 0 and request.headers.get("if-range", etag) == etag:
+            first, last = requested.groups()
+            if first == "":
+                start = max(0, size - int(last or 0))
+            else:
+                start = int(first)
+                end = min(end, int(last)) if last else end
+            if start > end or start >= size:
+                headers["Content-Range"] = f"bytes */{size}"
+                return await self._send(writer, request, 416, headers)
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        length = end - start + 1 if size > 0 else 0
+        headers["Content-Length"] = str(length)
+        await self._send(writer, request, status, headers)
+        if request.method == "HEAD" or length == 0:
+            return
+
+        with open(path, "rb") as source_file:
+            # sendfile(2) del tramo: el contenido no pasa por Python (cae a read/write si no se puede)
+            await asyncio.get_running_loop().sendfile(writer.transport, source_file, offset + start, length)
+
+    @staticmethod
+    def _not_modified(request, etag, mtime):
+        if "if-none-match" in request.headers:
+            return etag in request.headers["if-none-match"] or request.headers["if-none-match"] == "*"
+        since = request.headers.get("if-modified-since")
+        if since:
+            try:
+                return mtime <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def _serve_thumbnail(self, request, writer, relative):
+        size = _int(request.params, "size", THUMB_SIZES[1])
+        if size not in THUMB_SIZES or not SERVABLE_FILENAME.match(relative.rsplit("/", 1)[-1]):
+            return await self._send_json(writer, request, 400, {"error": f"Tamaño válido: {THUMB_SIZES}"})
+        if not PIL_AVAILABLE:
+            return await self._send_json(writer, request, 503, {"error": "Miniaturas no disponibles (falta Pillow)"})
+
+        source = await asyncio.to_thread(media_source, self.save_path, relative)
+        if source is None:
+            return await self._send_json(writer, request, 404, {"error": "Archivo no encontrado"})
+        # HH-MM-SS.320.jpg: no coincide con el patrón de archivos que recorren las rutas PHP
+        target = os.path.join(self.thumb_dir, f"{os.path.splitext(relative)[0]}.{size}.jpg")
+        try:
+            fresh = os.stat(target).st_mtime >= source[3]
+        except FileNotFoundError:
+            fresh = False
+        if not fresh:
+            # Una sola generación por miniatura aunque la pidan varias pestañas a la vez
+            job = self.thumb_jobs.get(target)
+            if job is None:
+                job = asyncio.get_running_loop().run_in_executor(
+                    self.thumb_pool, render_thumbnail, self.save_path, relative, size, target
+                )
+                self.thumb_jobs[target] = job
+                job.add_done_callback(lambda _: self.thumb_jobs.pop(target, None))
+                self.stats["thumbnails"] += 1
+            if not await asyncio.shield(job):
+                return await self._send_json(writer, request, 404, {"error": "No se pudo generar la miniatura"})
+        info = os.stat(target)
+        thumb_source = (target, 0, info.st_size, int(info.st_mtime), f'"t{size}-{info.st_size:x}-{int(info.st_mtime):x}"')
+        await self._serve_media(request, writer, target.rsplit("/", 1)[-1], source=thumb_source)
+
+
+# --- Comparativa con la API PHP ----------------------------------------------------
+
+def bench_routes():
+    today = date.today()
+    return [
+        ("feed", "/feed?limit=10"),
+        ("calendar", f"/calendar/{today.year}/{today.month:02d}"),
+        ("stats", "/stats"),
+        ("search", "/search?limit=50"),
+        ("search-dia", f"/search?date={today.isoformat()}"),
+    ]
+
+
+# Un número comparable por ruta para comprobar que las dos APIs devuelven lo mismo
+BENCH_TOTALS = {
+    "feed": lambda data: data["pagination"]["total_entries"],
+    "calendar": lambda data: data["statistics"]["total_files"],
+    "stats": lambda data: data["total_files"],
+    "search": lambda data: data["summary"]["total_found"],
+    "search-dia": lambda data: data["summary"]["total_found"],
+}
+
+
+def bench_target(base_url, path, requests, concurrency, conditional):
+    """Latencias (s) de requests peticiones con concurrency conexiones keep-alive"""
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    target = parts.path.rstrip("/") + path
+    latencies, sizes, lock = [], [], threading.Lock()
+    remaining = [requests]
+    first_body = []
+
+    def worker():
+        connection = connection_class(parts.netloc, timeout=60)
+        etag = None
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            headers = {"Accept-Encoding": "gzip"}
+            if conditional and etag:
+                headers["If-None-Match"] = etag
+            started = time.perf_counter()
+            connection.request("GET", target, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+            elapsed = time.perf_counter() - started
+            etag = response.getheader("ETag") or etag
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(len(body))
+                if not first_body and response.status == 200:
+                    raw = gzip.decompress(body) if response.getheader("Content-Encoding") == "gzip" else body
+                    first_body.append(raw)
+        connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    total = None
+    if first_body:
+        try:
+            total = json.loads(first_body[0])
+        except ValueError:
+            pass
+    return {
+        "rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+        "bytes": sum(sizes) // max(1, len(sizes)),
+        "data": total,
+    }
+
+
+def run_bench(targets, requests, concurrency, conditional):
+    print(f"{'ruta':<11} {'api':<4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'bytes':>9}  total")
+    for name, path in bench_routes():
+        for label, base_url in targets:
+            try:
+                result = bench_target(base_url, path, requests, concurrency, conditional)
+            except (OSError, http.client.HTTPException) as e:
+                print(f"{name:<11} {label:<4} error: {e}")
+                continue
+            data = result["data"]
+            total = BENCH_TOTALS[name](data) if isinstance(data, dict) and "error" not in data else "-"
+            print(f"{name:<11} {label:<4} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} "
+                  f"{result['p95_ms']:>8.1f} {result['bytes']:>9}  {total}")
+
+
+async def serve(save_path, host, port, thumb_workers):
+    api = MediaAPI(save_path, thumb_workers=thumb_workers)
+    await api.start(host, port)
+    print(f"🌐 API de medios en http://{host}:{port}/api (índice de {save_path})", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API web servida desde el índice de medios")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Arranca el servidor")
+    serve_parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8090)
+    serve_parser.add_argument("--thumb-workers", type=int, default=2)
+
+    bench_parser = subparsers.add_parser("bench", help="Compara latencia y rendimiento con la API PHP")
+    bench_parser.add_argument("--php", help="Base de la API PHP, ej. http://localhost/api")
+    bench_parser.add_argument("--py", help="Base de esta API, ej. http://localhost:8090/api")
+    bench_parser.add_argument("--requests", type=int, default=200, help="Peticiones por ruta y API")
+    bench_parser.add_argument("--concurrency", type=int, default=8)
+    bench_parser.add_argument("--conditional", action="store_true", help="Reenvía el ETag (If-None-Match)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.root, args.host, args.port, args.thumb_workers))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    targets = [(label, url) for label, url in (("php", args.php), ("py", args.py)) if url]
+    if not targets:
+        parser.error("indica --php, --py o ambas")
+    run_bench(targets, args.requests, args.concurrency, args.conditional)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+media_backup.py - Copia incremental del diario a otro volumen montado
+
+El origen no se recorre: se parte del manifiesto (ruta, tamaño, mtime, sha256)
+que el bot anota en .index/media.db al guardar cada archivo (y al recomprimir
+o empaquetar meses). El destino guarda en .mirror/state.db lo que ya tiene
+copiado y con qué hash, así que cada pasada solo copia lo nuevo o lo que cambió.
+Lo que el bot anotó sin hash (PENDING_HASH) se hashea aquí, en la lectura de la copia.
+
+Cada archivo se copia a un temporal calculando el hash en la misma lectura, se
+sincroniza a disco, se vuelve a leer del destino para verificarlo y solo entonces
+se renombra a su sitio. Si el origen cambió desde que se anotó (un plan del día,
+por ejemplo), se copia su versión actual y se reanota en el manifiesto. Las copias van en un pool de hilos con un máximo de
+archivos en vuelo (la E/S está acotada aunque haya miles de pendientes).
+
+Las bases de datos de .index se copian con la API de backup de SQLite (copia
+consistente aunque el bot esté escribiendo). Un repaso periódico del árbol
+(--rescan) anota en el manifiesto lo que se escribió por otras vías (comentarios
+de la web, planes, archivos copiados a mano).
+
+    python media_backup.py /mnt/copia                # pasada incremental
+    python media_backup.py /mnt/copia --rescan       # repasa el origen antes de copiar
+"""
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from media_index import MediaIndex, file_sha256
+
+STATE_DIRNAME = ".mirror"
+STATE_FILENAME = "state.db"
+COPY_CHUNK = 1024 * 1024
+SKIPPED_NAMES = (".tmp", ".part")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mirrored (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    copied_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+class MirrorState:
+    """Lo que ya está copiado en el destino (vive en el propio destino)"""
+
+    def __init__(self, target):
+        directory = os.path.join(target, STATE_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, STATE_FILENAME))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def entries(self):
+        return {path: (size, mtime, digest)
+                for path, size, mtime, digest in self.conn.execute("SELECT path, size, mtime, sha256 FROM mirrored")}
+
+    def record(self, entries):
+        """[(ruta relativa, tamaño, mtime, sha256)] copiadas y verificadas"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO mirrored (path, size, mtime, sha256, copied_at) VALUES (?, ?, ?, ?, ?)",
+                [entry + (now,) for entry in entries],
+            )
+
+    def forget(self, paths):
+        with self.conn:
+            self.conn.executemany("DELETE FROM mirrored WHERE path = ?", [(path,) for path in paths])
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def source_files(save_path):
+    """Archivos del origen sin los directorios ocultos (.index, .recaps, .archivo...) ni temporales"""
+    for entry in sorted(os.listdir(save_path)):
+        if entry.startswith("."):
+            continue
+        top = os.path.join(save_path, entry)
+        if os.path.isfile(top):
+            yield top
+            continue
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+            for name in sorted(filenames):
+                if not name.startswith(".") and not name.endswith(SKIPPED_NAMES):
+                    yield os.path.join(dirpath, name)
+
+
+def rescan(index, workers=4):
+    """Anota en el manifiesto lo que falta o cambió de tamaño/mtime; solo se hashea eso.
+
+    Devuelve (anotados, olvidados): los que ya no existen salen del manifiesto.
+    """
+    manifest = index.manifest()
+    seen = set()
+    changed = []
+    for path in source_files(index.save_path):
+        relative = index.relative(path)
+        seen.add(relative)
+        info = os.stat(path)
+        known = manifest.get(relative)
+        if known is None or known[0] != info.st_size or abs(known[1] - info.st_mtime) >= 1:
+            changed.append(path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = dict(zip(changed, pool.map(file_sha256, changed)))
+    index.record_manifest(changed, hashes)
+    gone = set(manifest) - seen
+    index.forget_manifest(gone)
+    return len(changed), len(gone)
+
+
+def _drop_cache(fd):
+    """Descarta las páginas del archivo para que la verificación lea del disco"""
+    if hasattr(os, "posix_fadvise"):
+        with contextlib.suppress(OSError):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def copy_verified(source, target):
+    """Copia source a target vía temporal; devuelve (tamaño, sha256) o lanza IOError si no verifica"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = target + ".part"
+    digest = hashlib.sha256()
+    try:
+        with open(source, "rb", buffering=0) as src, open(temp_path, "wb", buffering=0) as dst:
+            before = os.fstat(src.fileno())
+            for chunk in iter(lambda: src.read(COPY_CHUNK), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+            after = os.fstat(src.fileno())
+            if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+                raise IOError("el origen cambió durante la copia")
+            os.fsync(dst.fileno())
+            _drop_cache(dst.fileno())
+        copied = digest.hexdigest()
+        if file_sha256(temp_path) != copied:
+            raise IOError("la copia leída del destino no coincide")
+        shutil.copystat(source, temp_path)
+        os.replace(temp_path, target)
+        return os.path.getsize(target), copied
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def _copy_task(task):
+    relative, source, target, (_, mtime, digest) = task
+    started = time.perf_counter()
+    try:
+        copied_size, copied = copy_verified(source, target)
+        # Si el origen cambió desde que se anotó, manda lo copiado (ya verificado) y se reanota
+        return {"path": relative, "status": "copied", "size": copied_size, "mtime": mtime, "sha256": copied,
+                "changed": copied != digest, "source": source, "elapsed_s": time.perf_counter() - started}
+    except FileNotFoundError:
+        return {"path": relative, "status": "missing"}
+    except Exception as e:
+        return {"path": relative, "status": "error", "error": str(e)}
+
+
+def backup_databases(save_path, target):
+    """Copia consistente de las bases SQLite de .index (API de backup, sin parar el bot)"""
+    source_dir = os.path.join(save_path, ".index")
+    target_dir = os.path.join(target, ".index")
+    copied = 0
+    if not os.path.isdir(source_dir):
+        return copied
+    os.makedirs(target_dir, exist_ok=True)
+    for name in sorted(os.listdir(source_dir)):
+        if not name.endswith(".db"):
+            continue
+        source = sqlite3.connect(os.path.join(source_dir, name))
+        temp_path = os.path.join(target_dir, name + ".part")
+        destination = sqlite3.connect(temp_path)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+        os.replace(temp_path, os.path.join(target_dir, name))
+        copied += 1
+    return copied
+
+
+def run(save_path, target, workers=4, prune=False, rescan_days=7, force_rescan=False, on_result=None):
+    """Pasada incremental de save_path a target.
+
+    Devuelve {"copied", "bytes", "unchanged", "missing", "errors", "pruned", "stale",
+    "rescanned", "databases", "elapsed_s"}.
+    """
+    started = time.perf_counter()
+    if not os.path.isdir(target):
+        raise FileNotFoundError(f"destino no montado: {target}")
+    index = MediaIndex(save_path)
+    state = MirrorState(target)
+    summary = {"copied": 0, "bytes": 0, "unchanged": 0, "missing": 0, "errors": 0, "pruned": 0,
+               "stale": 0, "rescanned": None, "databases": 0}
+    try:
+        last_rescan = float(state.get_meta("last_rescan", 0))
+        if force_rescan or not index.manifest() or (rescan_days and time.time() - last_rescan > rescan_days * 86400):
+            summary["rescanned"] = rescan(index, workers)
+            state.set_meta("last_rescan", time.time())
+
+        manifest = index.manifest()
+        mirrored = state.entries()
+        tasks = []
+        for relative, entry in sorted(manifest.items()):
+            done = mirrored.get(relative)
+            if done and done[2] == entry[2]:
+                summary["unchanged"] += 1
+                continue
+            tasks.append((relative, os.path.join(save_path, relative), os.path.join(target, relative), entry))
+
+        # Nunca más de workers * 2 archivos en vuelo: la memoria y la E/S quedan acotadas
+        copied = []
+        missing = []
+        changed = {}
+        queue = list(reversed(tasks))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = set()
+            while queue or running:
+                while queue and len(running) < workers * 2:
+                    running.add(pool.submit(_copy_task, queue.pop()))
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    if result["status"] == "copied":
+                        summary["copied"] += 1
+                        summary["bytes"] += result["size"]
+                        copied.append((result["path"], result["size"], result["mtime"], result["sha256"]))
+                        if result["changed"]:
+                            changed[result["source"]] = result["sha256"]
+                        if len(copied) >= 200:
+                            state.record(copied)
+                            copied = []
+                    elif result["status"] == "missing":
+                        summary["missing"] += 1
+                        missing.append(result["path"])
+                    else:
+                        summary["errors"] += 1
+                    if on_result:
+                        on_result(result)
+        state.record(copied)
+        index.record_manifest(list(changed), changed)
+        index.forget_manifest(missing)  # Borrados del origen: el próximo repaso no los busca
+
+        # Lo que ya no está en el origen se conserva salvo que se pida podar
+        stale = set(mirrored) - set(manifest)
+        if prune:
+            for relative in stale:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(target, relative))
+            state.forget(stale)
+            summary["pruned"] = len(stale)
+        else:
+            summary["stale"] = len(stale)
+
+        summary["databases"] = backup_databases(save_path, target)
+    finally:
+        state.close()
+        index.close()
+    summary["elapsed_s"] = time.perf_counter() - started
+    return summary
+
+
+def format_summary(summary):
+    elapsed = summary["elapsed_s"]
+    rate = summary["bytes"] / 1048576 / elapsed if elapsed > 0 else 0
+    text = (f"{summary['copied']} copiados ({summary['bytes'] / 1048576:.1f}MB, {rate:.1f}MB/s), "
+            f"{summary['unchanged']} sin cambios, {summary['errors']} errores")
+    if summary["missing"]:
+        text += f", {summary['missing']} ya no existen"
+    if summary["pruned"]:
+        text += f", {summary['pruned']} podados"
+    elif summary["stale"]:
+        text += f", {summary['stale']} solo en la copia"
+    if summary["rescanned"]:
+        text += f", repaso: {summary['rescanned'][0]} anotados"
+    return text + f" ({elapsed:.1f}s)"
+
+
+def format_result(result):
+    if result["status"] == "copied":
+        return f"💾 {result['path']} ({result['size'] / 1048576:.1f}MB, {result['elapsed_s']:.2f}s)"
+    if result["status"] == "missing":
+        return f"⚪ {result['path']}: ya no existe"
+    return f"❌ {result['path']}: {result['error']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copia incremental del diario a otro volumen")
+    parser.add_argument("target", help="Ruta montada de destino")
+    parser.add_argument("--root", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--workers", type=int, default=4, help="Archivos copiándose a la vez")
+    parser.add_argument("--prune", action="store_true", help="Borra de la copia lo que ya no está en el origen")
+    parser.add_argument("--rescan", action="store_true", help="Repasa el origen antes de copiar")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    summary = run(args.root, args.target, workers=args.workers, prune=args.prune, force_rescan=args.rescan,
+                  on_result=(lambda result: print(format_result(result))) if args.verbose else None)
+    print(f"✅ {format_summary(summary)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+"""
+media_index.py - Índice SQLite de los archivos guardados y sus metadatos
+
+Una fila por momento guardado (la ruta que muestra la web), con la fecha y hora
+del nombre HH-MM-SS, tamaño, mtime y los metadatos de captura extraídos una sola
+vez en la ingesta (ver media_metadata.py). Los consumidores consultan el índice
+en lugar de volver a abrir los archivos.
+
+Las fotos con GPS llevan además un geohash, de modo que las consultas por zona
+o por cercanía son búsquedas por rango de prefijos en lugar de abrir archivos.
+
+Reconstrucción del índice para archivos ya existentes (en paralelo):
+
+    python media_index.py /data/fotos --workers 4
+    python media_index.py /data/fotos --rebuild
+
+Consultas por ubicación:
+
+    python media_index.py /data/fotos --near 40.4168,-3.7038 --radius 500
+    python media_index.py /data/fotos --bbox 40.30,-3.80,40.50,-3.60
+"""
+import os
+import re
+import sys
+import math
+import time
+import sqlite3
+import argparse
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from media_metadata import METADATA_FIELDS, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, extract_metadata
+from media_tiering import packed_paths
+
+INDEX_DIRNAME = ".index"
+INDEX_FILENAME = "media.db"
+PENDING_HASH = ""  # sha256 aún sin calcular en el manifiesto (lo rellena la copia de seguridad)
+# Ruta relativa YYYY/MM/DD/HH-MM-SS[...].ext
+MEDIA_PATH = re.compile(r"^(\d{4})/(\d{2})/(\d{2})/(\d{2})-(\d{2})-(\d{2})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    original TEXT,
+    kind TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    captured_at TEXT,
+    orientation INTEGER,
+    camera_make TEXT,
+    camera_model TEXT,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    exposure_time REAL,
+    f_number REAL,
+    iso INTEGER,
+    focal_length REAL,
+    width INTEGER,
+    height INTEGER,
+    duration REAL,
+    indexed_at REAL,
+    geohash TEXT,
+    file_id TEXT,
+    file_kind TEXT
+);
+CREATE INDEX IF NOT EXISTS media_date ON media (date, time);
+
+-- Resultado de cada archivo recibido de Telegram, para no procesarlo dos veces
+CREATE TABLE IF NOT EXISTS ingested (
+    file_unique_id TEXT PRIMARY KEY,
+    update_id INTEGER,
+    path TEXT,
+    result TEXT NOT NULL,
+    recorded_at REAL
+);
+CREATE INDEX IF NOT EXISTS ingested_update ON ingested (update_id);
+
+-- Manifiesto para las copias de seguridad: lo que se escribió y su hash, sin recorrer el árbol.
+-- sha256 vacío: pendiente, lo calcula la copia de seguridad al copiar el archivo
+CREATE TABLE IF NOT EXISTS manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    recorded_at REAL
+);
+"""
+
+COLUMNS = ("path", "original", "kind", "date", "time", "size", "mtime") + METADATA_FIELDS + (
+    "indexed_at", "geohash", "file_id", "file_kind",
+)
+# Columnas añadidas después de la primera versión del índice (migración)
+ADDED_COLUMNS = (("geohash", "TEXT"), ("file_id", "TEXT"), ("file_kind", "TEXT"))
+# El file_id de Telegram solo se conoce en la ingesta: una reindexación no lo borra
+PRESERVED_COLUMNS = ("file_id", "file_kind")
+
+# Geohash: celdas anidadas codificadas en base 32 (12 caracteres ≈ 4cm)
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+MAX_QUERY_CELLS = 32  # Celdas (rangos de prefijo) como máximo por consulta
+EARTH_RADIUS_M = 6371008.8
+HASH_CHUNK = 1024 * 1024
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    result = []
+    bits = 0
+    value = 0
+    even = True
+    while len(result) < precision:
+        target, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if target >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            result.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return "".join(result)
+
+
+def geohash_cell_size(precision):
+    """(alto en grados de latitud, ancho en grados de longitud) de una celda"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def geohash_cover(south, west, north, east):
+    """Prefijos de geohash que cubren un rectángulo, con la mayor precisión posible"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lon = geohash_cell_size(precision)
+        rows = int((north - south) / cell_lat) + 2
+        cols = int((east - west) / cell_lon) + 2
+        if rows * cols <= MAX_QUERY_CELLS or precision == 1:
+            break
+    cells = set()
+    for row in range(rows):
+        latitude = min(south + row * cell_lat, north)
+        for col in range(cols):
+            longitude = min(west + col * cell_lon, east)
+            cells.add(geohash_encode(latitude, longitude, precision))
+    return sorted(cells)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def file_sha256(path):
+    """sha256 en hexadecimal leyendo por bloques"""
+    digest = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_index_path(save_path):
+    return os.path.join(save_path, INDEX_DIRNAME, INDEX_FILENAME)
+
+
+def media_kind(path):
+    lower = path.lower()
+    if lower.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    if lower.endswith(IMAGE_EXTENSIONS):
+        return "foto"
+    return None
+
+
+class MediaIndex:
+    """Acceso al índice. Una conexión compartida protegida con un lock (hilos del bot)."""
+
+    def __init__(self, save_path, db_path=None):
+        self.save_path = save_path
+        self.db_path = db_path or default_index_path(save_path)
+        os.makedirs(os.path.dirname(self.db_path), mode=0o775, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Añade las columnas nuevas (geohash, file_id) a índices creados antes"""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(media)")}
+        with self.conn:
+            for column, column_type in ADDED_COLUMNS:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE media ADD COLUMN {column} {column_type}")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS media_geohash ON media (geohash) WHERE geohash IS NOT NULL")
+            missing = self.conn.execute(
+                "SELECT path, latitude, longitude FROM media "
+                "WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL"
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE media SET geohash = ? WHERE path = ?",
+                [(geohash_encode(row["latitude"], row["longitude"]), row["path"]) for row in missing],
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def relative(self, path):
+        return os.path.relpath(path, self.save_path).replace(os.sep, "/")
+
+    def build_row(self, path, metadata=None, original=None):
+        """Fila del índice para un archivo guardado; extrae los metadatos si no se pasan"""
+        relative = self.relative(path)
+        match = MEDIA_PATH.match(relative)
+        if not match:
+            return None
+        year, month, day, hour, minute, second = match.groups()
+        info = os.stat(path)
+        row = dict.fromkeys(COLUMNS)
+        row.update(metadata if metadata is not None else extract_metadata(original or path))
+        row.update({
+            "path": relative,
+            "original": self.relative(original) if original else None,
+            "kind": media_kind(path),
+            "date": f"{year}-{month}-{day}",
+            "time": f"{hour}:{minute}:{second}",
+            "size": info.st_size,
+            "mtime": info.st_mtime,
+            "indexed_at": time.time(),
+        })
+        if row["latitude"] is not None and row["longitude"] is not None:
+            row["geohash"] = geohash_encode(row["latitude"], row["longitude"])
+        return row
+
+    def upsert_rows(self, rows):
+        """Inserta o actualiza varias filas en una sola transacción"""
+        rows = [row for row in rows if row]
+        if not rows:
+            return 0
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        updates = ", ".join(
+            f"{column} = COALESCE(excluded.{column}, media.{column})" if column in PRESERVED_COLUMNS
+            else f"{column} = excluded.{column}"
+            for column in COLUMNS if column != "path"
+        )
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO media ({', '.join(COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                [tuple(row[column] for column in COLUMNS) for row in rows],
+            )
+        return len(rows)
+
+    def record(self, path, original=None, file_id=None, file_kind=None, metadata=None, hashes=None):
+        """Extrae los metadatos de un archivo recién guardado y lo añade al índice.
+
+        file_id y file_kind ("photo", "video" o "document") permiten reenviarlo
+        por Telegram sin volver a subirlo. metadata evita releer el archivo si ya
+        se extrajeron (los procesos de análisis de la ingesta los leen del temporal).
+        hashes ({ruta: sha256}, calculados al descargar) van al manifiesto; los que
+        falten quedan pendientes para la copia de seguridad en lugar de releerse aquí.
+        """
+        row = self.build_row(path, metadata, original=original)
+        if row:
+            row.update(file_id=file_id, file_kind=file_kind)
+        self.upsert_rows([row])
+        self.record_manifest([path, original] if original else [path], hashes, defer=True)
+        return row
+
+    def set_file_id(self, relative_path, file_id, file_kind):
+        """Actualiza el file_id tras una subida de respaldo (el anterior caducó)"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE media SET file_id = ?, file_kind = ? WHERE path = ?",
+                              (file_id, file_kind, relative_path))
+
+    def day(self, date):
+        """Archivos de un día (YYYY-MM-DD) en orden cronológico"""
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT * FROM media WHERE date = ? ORDER BY time", (date,)
+            )]
+
+    def between(self, start_date, end_date):
+        """Archivos entre dos fechas (incluidas) en orden cronológico"""
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT * FROM media WHERE date BETWEEN ? AND ? ORDER BY date, time", (start_date, end_date)
+            )]
+
+    def on_this_day(self, month_day, before_date):
+        """Archivos del mismo día (MM-DD) de años anteriores"""
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT * FROM media WHERE substr(date, 6) = ? AND date < ? ORDER BY date, time",
+                (month_day, before_date),
+            )]
+
+    def sampling_rows(self):
+        """(ruta, tipo, fecha, hora, tamaño, mtime) de todo el índice en orden cronológico"""
+        with self.lock:
+            return [tuple(row) for row in self.conn.execute(
+                "SELECT path, kind, date, time, size, mtime FROM media ORDER BY date, time"
+            )]
+
+    def listing(self):
+        """(ruta, fecha, hora, tamaño, mtime) de todo el índice en orden cronológico"""
+        with self.lock:
+            return [tuple(row) for row in self.conn.execute(
+                "SELECT path, date, time, size, mtime FROM media ORDER BY date, time"
+            )]
+
+    def get(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM media WHERE path = ?", (self.relative(path),)).fetchone()
+        return dict(row) if row else None
+
+    def known_files(self):
+        """{ruta relativa: (tamaño, mtime)} de todo el índice"""
+        with self.lock:
+            return {row["path"]: (row["size"], row["mtime"])
+                    for row in self.conn.execute("SELECT path, size, mtime FROM media")}
+
+    def update_sizes(self, sizes):
+        """Actualiza el tamaño de archivos reescritos en su sitio: [(ruta relativa, tamaño)]"""
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE media SET size = ? WHERE path = ?", [(size, path) for path, size in sizes])
+
+    def record_manifest(self, paths, hashes=None, defer=False):
+        """Anota (tamaño, mtime, sha256) de archivos recién escritos; hashes evita releerlos.
+
+        Con defer, los que no traen hash se anotan como pendientes (PENDING_HASH)
+        y se hashean al copiarlos en la siguiente copia de seguridad.
+        """
+        hashes = hashes or {}
+        entries = []
+        for path in paths:
+            info = os.stat(path)
+            digest = hashes.get(path) or (PENDING_HASH if defer else file_sha256(path))
+            entries.append((self.relative(path), info.st_size, info.st_mtime, digest, time.time()))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO manifest (path, size, mtime, sha256, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                entries,
+            )
+        return len(entries)
+
+    def forget_manifest(self, relative_paths):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM manifest WHERE path = ?", [(path,) for path in relative_paths])
+
+    def manifest(self):
+        """{ruta relativa: (tamaño, mtime, sha256)} de todo lo anotado"""
+        with self.lock:
+            return {row["path"]: (row["size"], row["mtime"], row["sha256"])
+                    for row in self.conn.execute("SELECT path, size, mtime, sha256 FROM manifest")}
+
+    def remove(self, relative_paths):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM media WHERE path = ?", [(path,) for path in relative_paths])
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    def find_ingested(self, update_id, file_unique_id):
+        """Resultado registrado para una actualización o un archivo ya recibidos"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM ingested WHERE file_unique_id = ? OR update_id = ? LIMIT 1",
+                (file_unique_id, update_id),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def record_ingested(self, entries):
+        """Registra (file_unique_id, update_id, ruta, resultado) de archivos ya procesados"""
+        if not entries:
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ingested (file_unique_id, update_id, path, result, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(file_unique_id, update_id, path, result, now) for file_unique_id, update_id, path, result in entries],
+            )
+
+    def recent(self, limit):
+        """Rutas relativas de los últimos archivos, del más reciente al más antiguo"""
+        with self.lock:
+            return [row["path"] for row in self.conn.execute(
+                "SELECT path FROM media ORDER BY date DESC, time DESC LIMIT ?", (limit,)
+            )]
+
+    def in_bbox(self, south, west, north, east, limit=None):
+        """Archivos con GPS dentro del rectángulo, por rangos de prefijo de geohash"""
+        if west > east:  # Cruza el antimeridiano: dos rectángulos
+            rows = self.in_bbox(south, west, north, 180.0) + self.in_bbox(south, -180.0, north, east)
+            return rows[:limit] if limit else rows
+        cells = geohash_cover(south, west, north, east)
+        ranges = " OR ".join("(geohash >= ? AND geohash < ?)" for _ in cells)
+        params = [bound for cell in cells for bound in (cell, cell + "~")]
+        query = (
+            f"SELECT * FROM media WHERE ({ranges}) "
+            "AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ? ORDER BY date, time"
+        )
+        params += [south, north, west, east]
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, params)]
+
+    def near(self, latitude, longitude, radius_m, limit=None):
+        """Archivos a menos de radius_m metros, del más cercano al más lejano"""
+        d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+        d_lon = d_lat / max(math.cos(math.radians(latitude)), 1e-6)
+        south, north = max(latitude - d_lat, -90.0), min(latitude + d_lat, 90.0)
+        west = ((longitude - d_lon + 180.0) % 360.0) - 180.0
+        east = ((longitude + d_lon + 180.0) % 360.0) - 180.0
+        if d_lon >= 180.0:
+            west, east = -180.0, 180.0
+        rows = []
+        for row in self.in_bbox(south, west, north, east):
+            row["distance_m"] = haversine_m(latitude, longitude, row["latitude"], row["longitude"])
+            if row["distance_m"] <= radius_m:
+                rows.append(row)
+        rows.sort(key=lambda row: row["distance_m"])
+        return rows[:limit] if limit else rows
+
+
+def scan_media_files(save_path):
+    """Archivos del árbol YYYY/MM/DD, con el original HEIF asociado a su copia web"""
+    found = {}
+    for year in sorted(os.listdir(save_path)):
+        if not (year.isdigit() and len(year) == 4):
+            continue
+        for dirpath, dirnames, filenames in os.walk(os.path.join(save_path, year)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if media_kind(filename):
+                    found[os.path.join(dirpath, filename)] = None
+    # Si un HEIF tiene copia web, se indexa la copia (lo que muestra la web) con el original
+    for path in list(found):
+        if path.lower().endswith((".heic", ".heif")):
+            stem = os.path.basename(path)[:8]
+            directory = os.path.dirname(path)
+            for extension in (".jpg", ".webp"):
+                derivative = os.path.join(directory, stem + extension)
+                if derivative in found:
+                    found[derivative] = path
+                    del found[path]
+                    break
+    return found
+
+
+def _extract_task(task):
+    path, original = task
+    return path, original, extract_metadata(original or path)
+
+
+def rebuild(save_path, full=False, workers=None):
+    """Indexa los archivos nuevos o modificados (o todos con full) y quita los borrados.
+
+    La lectura de cabeceras se reparte en un pool de procesos; la escritura en
+    SQLite la hace solo este proceso, por lotes.
+    """
+    index = MediaIndex(save_path)
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    files = scan_media_files(save_path)
+    known = index.known_files()
+    pending = []
+    for path, original in files.items():
+        info = os.stat(path)
+        if full or known.get(index.relative(path)) != (info.st_size, info.st_mtime):
+            pending.append((path, original))
+    # Lo empaquetado en el archivo frío no cambia: se conserva tal cual en el índice
+    removed = set(known) - {index.relative(path) for path in files} - packed_paths(save_path)
+
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, min(64, len(pending) // (workers * 4)))
+        results = pool.map(_extract_task, pending, chunksize=chunksize)
+        for number, (path, original, metadata) in enumerate(results, 1):
+            batch.append(index.build_row(path, metadata, original))
+            if len(batch) >= 500:
+                index.upsert_rows(batch)
+                batch = []
+                print(f"📇 {number}/{len(pending)} archivos indexados")
+    index.upsert_rows(batch)
+    if removed:
+        index.remove(removed)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Índice actualizado: {len(pending)} indexados, {len(removed)} eliminados, "
+          f"{index.count()} en total ({elapsed:.1f}s, {workers} procesos)")
+    index.close()
+
+
+def print_rows(rows):
+    for row in rows:
+        distance = f" a {row['distance_m']:.0f}m" if "distance_m" in row else ""
+        print(f"📍 {row['date']} {row['time']} {row['path']} ({row['latitude']:.5f}, {row['longitude']:.5f}){distance}")
+    print(f"\n{len(rows)} resultados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye el índice de metadatos de los archivos guardados")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--rebuild", action="store_true", help="Volver a extraer los metadatos de todos los archivos")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para leer cabeceras (por defecto, todos los núcleos)")
+    parser.add_argument("--near", help="Consulta por cercanía: LAT,LON")
+    parser.add_argument("--radius", type=float, default=1000, help="Radio en metros para --near")
+    parser.add_argument("--bbox", help="Consulta por zona: SUR,OESTE,NORTE,ESTE")
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        print(f"❌ No existe el directorio {args.root}")
+        sys.exit(1)
+    if args.near:
+        latitude, longitude = (float(value) for value in args.near.split(","))
+        print_rows(MediaIndex(args.root).near(latitude, longitude, args.radius))
+    elif args.bbox:
+        print_rows(MediaIndex(args.root).in_bbox(*(float(value) for value in args.bbox.split(","))))
+    else:
+        rebuild(args.root, full=args.rebuild, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+media_metadata.py - Metadatos de captura de fotos (EXIF) y videos (QuickTime/MP4)
+
+Lee solo las cabeceras: en las fotos, Pillow abre el archivo de forma perezosa y
+los segmentos EXIF están antes de los píxeles; en los videos se recorren los
+átomos saltando 'mdat' y solo se lee 'moov'. Nunca se decodifica imagen ni video.
+
+Devuelve siempre un diccionario con las mismas claves (None si no hay dato):
+captured_at, orientation, camera_make, camera_model, latitude, longitude,
+altitude, exposure_time, f_number, iso, focal_length, width, height, duration.
+"""
+import os
+import re
+import struct
+from datetime import datetime, timedelta, timezone
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()  # EXIF de HEIC/HEIF sin decodificar
+except ImportError:
+    pass
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".hevc", ".m4v")
+
+METADATA_FIELDS = (
+    "captured_at", "orientation", "camera_make", "camera_model",
+    "latitude", "longitude", "altitude",
+    "exposure_time", "f_number", "iso", "focal_length",
+    "width", "height", "duration",
+)
+
+# Etiquetas EXIF utilizadas
+TAG_ORIENTATION = 0x0112
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_FOCAL_LENGTH = 0x920A
+
+# QuickTime: las fechas cuentan desde 1904 y 'moov' no debería ser enorme
+QUICKTIME_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+MAX_MOOV_BYTES = 16 * 1024 * 1024
+ISO6709 = re.compile(r"([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)?")
+# Rotación de la matriz de la pista -> orientación EXIF equivalente
+ROTATION_TO_ORIENTATION = {0: 1, 90: 6, 180: 3, 270: 8}
+
+
+def empty_metadata():
+    return dict.fromkeys(METADATA_FIELDS)
+
+
+def extract_metadata(file_path):
+    """Metadatos de captura de un archivo, según su extensión"""
+    lower = file_path.lower()
+    if lower.endswith(VIDEO_EXTENSIONS):
+        return read_quicktime_metadata(file_path)
+    if lower.endswith(IMAGE_EXTENSIONS):
+        return read_exif_metadata(file_path)
+    return empty_metadata()
+
+
+# --- Fotos: EXIF ---
+
+def _clean_text(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore")
+    if value is None:
+        return None
+    value = str(value).strip("\x00 ").strip()
+    return value or None
+
+
+def _number(value, digits=6):
+    try:
+        return round(float(value), digits)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _exif_datetime(value, offset=None):
+    """'2024:06:01 10:00:00' (+ '+02:00') -> ISO 8601"""
+    value = _clean_text(value)
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    result = parsed.isoformat()
+    offset = _clean_text(offset)
+    if offset and re.fullmatch(r"[+-]\d{2}:\d{2}", offset):
+        result += offset
+    return result
+
+
+def _gps_coordinate(values, ref):
+    try:
+        degrees, minutes, seconds = (float(v) for v in values)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    coordinate = degrees + minutes / 60 + seconds / 3600
+    if _clean_text(ref) in ("S", "W"):
+        coordinate = -coordinate
+    return round(coordinate, 7)
+
+
+def read_exif_metadata(file_path):
+    """EXIF de una foto. Image.open solo lee la cabecera; los píxeles no se tocan."""
+    metadata = empty_metadata()
+    if not PIL_AVAILABLE:
+        return metadata
+    try:
+        with Image.open(file_path) as img:
+            metadata["width"], metadata["height"] = img.size
+            exif = img.getexif()
+            exif_ifd = exif.get_ifd(TAG_EXIF_IFD)
+            gps_ifd = exif.get_ifd(TAG_GPS_IFD)
+    except Exception as e:
+        print(f"⚠️ No se pudieron leer los metadatos de {file_path}: {e}")
+        return metadata
+
+    metadata["orientation"] = exif.get(TAG_ORIENTATION)
+    metadata["camera_make"] = _clean_text(exif.get(TAG_MAKE))
+    metadata["camera_model"] = _clean_text(exif.get(TAG_MODEL))
+    metadata["captured_at"] = (
+        _exif_datetime(exif_ifd.get(TAG_DATETIME_ORIGINAL), exif_ifd.get(TAG_OFFSET_TIME_ORIGINAL))
+        or _exif_datetime(exif.get(TAG_DATETIME))
+    )
+    metadata["exposure_time"] = _number(exif_ifd.get(TAG_EXPOSURE_TIME), 8)
+    metadata["f_number"] = _number(exif_ifd.get(TAG_F_NUMBER), 2)
+    iso = exif_ifd.get(TAG_ISO)
+    metadata["iso"] = int(iso[0] if isinstance(iso, tuple) else iso) if iso else None
+    metadata["focal_length"] = _number(exif_ifd.get(TAG_FOCAL_LENGTH), 2)
+
+    if gps_ifd:
+        metadata["latitude"] = _gps_coordinate(gps_ifd.get(2), gps_ifd.get(1))
+        metadata["longitude"] = _gps_coordinate(gps_ifd.get(4), gps_ifd.get(3))
+        altitude = _number(gps_ifd.get(6), 2)
+        if altitude is not None and gps_ifd.get(5) in (1, b"\x01"):
+            altitude = -altitude
+        metadata["altitude"] = altitude
+    return metadata
+
+
+# --- Videos: átomos QuickTime/MP4 ---
+
+def _iter_atoms(data, start=0, end=None):
+    """Recorre los átomos de un bloque en memoria: (tipo, inicio del contenido, fin)"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def _read_moov(f, file_size):
+    """Busca 'moov' entre los átomos de primer nivel sin leer 'mdat'"""
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            return None
+        if kind == b"moov":
+            if size > MAX_MOOV_BYTES:
+                return None
+            f.seek(offset + header_size)
+            return f.read(size - header_size)
+        offset += size
+    return None
+
+
+def _child(data, start, end, kind):
+    for child_kind, child_start, child_end in _iter_atoms(data, start, end):
+        if child_kind == kind:
+            return child_start, child_end
+    return None
+
+
+def _parse_mvhd(data, start, metadata):
+    version = data[start]
+    if version == 1:
+        created, _, timescale, duration = struct.unpack(">QQIQ", data[start + 4:start + 32])
+    else:
+        created, _, timescale, duration = struct.unpack(">IIII", data[start + 4:start + 20])
+    if timescale:
+        metadata["duration"] = round(duration / timescale, 3)
+    if created:
+        captured = QUICKTIME_EPOCH + timedelta(seconds=created)
+        metadata["captured_at"] = captured.isoformat()
+
+
+def _parse_tkhd(data, start, metadata):
+    version = data[start]
+    matrix_at = start + (52 if version == 1 else 40)
+    size_at = matrix_at + 36
+    width, height = struct.unpack(">II", data[size_at:size_at + 8])
+    width, height = width >> 16, height >> 16
+    if not width or not height or metadata["width"]:
+        return  # Pista de audio o ya tenemos la de video
+    a, b = struct.unpack(">ii", data[matrix_at:matrix_at + 8])
+    if a == 0 and b > 0:
+        rotation = 90
+    elif a < 0:
+        rotation = 180
+    elif a == 0 and b < 0:
+        rotation = 270
+    else:
+        rotation = 0
+    metadata["width"], metadata["height"] = width, height
+    metadata["orientation"] = ROTATION_TO_ORIENTATION[rotation]
+
+
+def _apply_location(value, metadata):
+    match = ISO6709.match(value or "")
+    if not match:
+        return
+    metadata["latitude"] = round(float(match.group(1)), 7)
+    metadata["longitude"] = round(float(match.group(2)), 7)
+    if match.group(3):
+        metadata["altitude"] = round(float(match.group(3)), 2)
+
+
+def _parse_udta(data, start, end, metadata):
+    """Etiquetas clásicas ©xyz, ©mak y ©mod (texto con longitud e idioma)"""
+    for kind, child_start, child_end in _iter_atoms(data, start, end):
+        if kind not in (b"\xa9xyz", b"\xa9mak", b"\xa9mod") or child_end - child_start < 4:
+            continue
+        length = struct.unpack(">H", data[child_start:child_start + 2])[0]
+        value = data[child_start + 4:child_start + 4 + length].decode("utf-8", "ignore")
+        if kind == b"\xa9xyz":
+            _apply_location(value, metadata)
+        elif kind == b"\xa9mak":
+            metadata["camera_make"] = _clean_text(value)
+        else:
+            metadata["camera_model"] = _clean_text(value)
+
+
+def _parse_meta(data, start, end, metadata):
+    """Metadatos de Apple (keys + ilst): ubicación, cámara y fecha local de captura"""
+    # En MP4 'meta' es un FullBox (4 bytes de versión); en QuickTime no
+    if data[start + 4:start + 8] != b"hdlr" and data[start + 8:start + 12] == b"hdlr":
+        start += 4
+    keys = _child(data, start, end, b"keys")
+    items = _child(data, start, end, b"ilst")
+    if not keys or not items:
+        return
+    names = []
+    offset = keys[0] + 8
+    while offset + 8 <= keys[1]:
+        size = struct.unpack(">I", data[offset:offset + 4])[0]
+        if size < 8:
+            break
+        names.append(data[offset + 8:offset + size].decode("utf-8", "ignore"))
+        offset += size
+    for kind, item_start, item_end in _iter_atoms(data, items[0], items[1]):
+        index = struct.unpack(">I", kind)[0] - 1
+        value_atom = _child(data, item_start, item_end, b"data")
+        if not value_atom or not 0 <= index < len(names):
+            continue
+        value = data[value_atom[0] + 8:value_atom[1]].decode("utf-8", "ignore")
+        name = names[index]
+        if name == "com.apple.quicktime.location.ISO6709":
+            _apply_location(value, metadata)
+        elif name == "com.apple.quicktime.make":
+            metadata["camera_make"] = _clean_text(value)
+        elif name == "com.apple.quicktime.model":
+            metadata["camera_model"] = _clean_text(value)
+        elif name == "com.apple.quicktime.creationdate":
+            try:
+                metadata["captured_at"] = datetime.strptime(value.strip(), "%Y-%m-%dT%H:%M:%S%z").isoformat()
+            except ValueError:
+                pass
+
+
+def read_quicktime_metadata(file_path):
+    """Metadatos de un video MP4/MOV leyendo solo el átomo 'moov'"""
+    metadata = empty_metadata()
+    try:
+        with open(file_path, "rb") as f:
+            moov = _read_moov(f, os.fstat(f.fileno()).st_size)
+    except OSError as e:
+        print(f"⚠️ No se pudieron leer los metadatos de {file_path}: {e}")
+        return metadata
+    if not moov:
+        return metadata
+    try:
+        for kind, start, end in _iter_atoms(moov):
+            if kind == b"mvhd":
+                _parse_mvhd(moov, start, metadata)
+            elif kind == b"trak":
+                tkhd = _child(moov, start, end, b"tkhd")
+                if tkhd:
+                    _parse_tkhd(moov, tkhd[0], metadata)
+            elif kind == b"udta":
+                _parse_udta(moov, start, end, metadata)
+                meta = _child(moov, start, end, b"meta")
+                if meta:
+                    _parse_meta(moov, meta[0], meta[1], metadata)
+            elif kind == b"meta":
+                _parse_meta(moov, start, end, metadata)
+    except (struct.error, IndexError) as e:
+        print(f"⚠️ Átomos QuickTime inválidos en {file_path}: {e}")
+    return metadata
@@ -0,0 +1,497 @@
+"""
+media_tiering.py - Archivo frío: los meses cerrados se empaquetan en un tar por mes
+
+Los días recientes siguen como archivos sueltos en YYYY/MM/DD. Cuando un mes
+queda más atrás que los días "calientes", sus archivos se juntan en
+YYYY/MM/month-<n>.tar (sin compresión) con un índice central
+YYYY/MM/month.idx.json:
+
+    {"version": 1, "pack": "month-1.tar", "generation": 1,
+     "members": {"DD/HH-MM-SS.jpg": [offset, tamaño, mtime, sha256]}}
+
+Con el índice cada archivo se lee por acceso aleatorio (pread desde su
+offset) sin recorrer el tar. Los directorios de día se conservan vacíos como
+marcadores de fecha, así que quien recorre YYYY/MM/DD sigue encontrando los
+días y solo tiene que consultar el índice del mes para sus archivos.
+
+El índice es el punto de confirmación: se escribe un tar nuevo con otro
+nombre, se verifica miembro a miembro, se reemplaza el índice y solo después
+se borran el tar anterior y los archivos sueltos. Los archivos que lleguen
+tarde a un mes ya empaquetado entran en la siguiente generación del tar.
+
+    python media_tiering.py pack --hot-days 45
+    python media_tiering.py list 2024-05
+    python media_tiering.py unpack 2024-05
+"""
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import argparse
+import tempfile
+import contextlib
+from datetime import date, datetime, timedelta
+
+from media_metadata import VIDEO_EXTENSIONS
+
+INDEX_NAME = "month.idx.json"
+INDEX_VERSION = 1
+COPY_CHUNK = 1024 * 1024
+
+_indexes = {}  # Directorio del mes -> (mtime_ns del índice, índice)
+
+
+class MemberReader(io.RawIOBase):
+    """Vista de solo lectura de [offset, offset + size) dentro de un descriptor abierto"""
+
+    def __init__(self, fd, offset, size, owns_fd=False):
+        super().__init__()
+        self.fd = fd
+        self.offset = offset
+        self.size = size
+        self.position = 0
+        self.owns_fd = owns_fd
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        if position < 0:
+            raise ValueError("posición negativa")
+        self.position = position
+        return position
+
+    def readinto(self, buffer):
+        remaining = self.size - self.position
+        if remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:remaining]
+        data = os.pread(self.fd, len(view), self.offset + self.position)
+        view[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if self.owns_fd and not self.closed:
+            os.close(self.fd)
+        super().close()
+
+
+class HashingReader(io.RawIOBase):
+    """Envuelve un archivo y va calculando el sha256 de lo leído"""
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self.digest = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.source.readinto(buffer)
+        if count:
+            self.digest.update(memoryview(buffer)[:count])
+        return count
+
+
+def month_directory(save_path, year, month):
+    return os.path.join(save_path, f"{int(year):04d}", f"{int(month):02d}")
+
+
+def split_relative(relative):
+    """"YYYY/MM/DD/nombre" -> (directorio del mes relativo, "DD/nombre") o None"""
+    parts = relative.replace(os.sep, "/").split("/")
+    if len(parts) != 4 or not all(part.isdigit() for part in parts[:3]):
+        return None
+    return os.path.join(parts[0], parts[1]), f"{parts[2]}/{parts[3]}"
+
+
+def load_index(directory):
+    """Índice del mes (cacheado por mtime) o None si el mes no está empaquetado"""
+    path = os.path.join(directory, INDEX_NAME)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        _indexes.pop(directory, None)
+        return None
+    cached = _indexes.get(directory)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with open(path, encoding="utf-8") as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        print(f"⚠️ Índice de archivo frío con versión desconocida: {path}", flush=True)
+        return None
+    _indexes[directory] = (mtime_ns, index)
+    return index
+
+
+def locate(save_path, relative):
+    """(ruta del tar, offset, tamaño, mtime) de un archivo empaquetado o None"""
+    parts = split_relative(relative)
+    if parts is None:
+        return None
+    directory = os.path.join(save_path, parts[0])
+    index = load_index(directory)
+    member = index["members"].get(parts[1]) if index else None
+    if member is None:
+        return None
+    return os.path.join(directory, index["pack"]), member[0], member[1], member[2]
+
+
+def open_media(save_path, relative):
+    """Abre un archivo del diario: suelto si existe, si no desde el tar de su mes"""
+    try:
+        return open(os.path.join(save_path, relative), "rb")
+    except FileNotFoundError:
+        found = locate(save_path, relative)
+        if found is None:
+            raise
+    pack, offset, size, _ = found
+    return io.BufferedReader(MemberReader(os.open(pack, os.O_RDONLY), offset, size, owns_fd=True))
+
+
+def read_media(save_path, relative):
+    with open_media(save_path, relative) as f:
+        return f.read()
+
+
+def stat_media(save_path, relative):
+    """(tamaño, mtime) de un archivo suelto o empaquetado; None si no existe"""
+    try:
+        info = os.stat(os.path.join(save_path, relative))
+        return info.st_size, info.st_mtime
+    except FileNotFoundError:
+        found = locate(save_path, relative)
+        return (found[2], found[3]) if found else None
+
+
+@contextlib.contextmanager
+def materialized(save_path, relatives):
+    """{relativa: ruta en disco}; los empaquetados se extraen a un directorio temporal.
+
+    Para quien necesita una ruta real (OpenCV, procesos aparte); los archivos
+    sueltos se devuelven tal cual y los que no existen se omiten.
+    """
+    paths = {}
+    with tempfile.TemporaryDirectory(prefix="tiering-") as temp_dir:
+        for number, relative in enumerate(relatives):
+            path = os.path.join(save_path, relative)
+            if os.path.exists(path):
+                paths[relative] = path
+                continue
+            found = locate(save_path, relative)
+            if found is None:
+                continue
+            target = os.path.join(temp_dir, f"{number}-{os.path.basename(relative)}")
+            _extract(save_path, relative, found, target)
+            paths[relative] = target
+        yield paths
+
+
+@contextlib.contextmanager
+def media_source(save_path, relative):
+    """Un archivo del diario listo para decodificar: ruta, archivo abierto o None si no existe.
+
+    Para recorrer muchos archivos sin extraer un mes entero: las imágenes
+    empaquetadas se leen directamente del tar y solo los videos (OpenCV necesita
+    una ruta) se extraen, de uno en uno, a un temporal que se borra al salir.
+    """
+    path = os.path.join(save_path, relative)
+    if os.path.exists(path):
+        yield path
+        return
+    found = locate(save_path, relative)
+    if found is None:
+        yield None
+    elif not relative.lower().endswith(VIDEO_EXTENSIONS):
+        with open_media(save_path, relative) as source:
+            yield source
+    else:
+        with tempfile.TemporaryDirectory(prefix="tiering-") as temp_dir:
+            target = os.path.join(temp_dir, os.path.basename(relative))
+            _extract(save_path, relative, found, target)
+            yield target
+
+
+def _extract(save_path, relative, found, target):
+    with open_media(save_path, relative) as source, open(target, "wb") as output:
+        shutil.copyfileobj(source, output, COPY_CHUNK)
+    os.utime(target, (found[3], found[3]))
+
+
+def packed_months(save_path):
+    """Directorios de mes (relativos) que tienen índice de archivo frío"""
+    months = []
+    for year in sorted(os.listdir(save_path)):
+        if not (year.isdigit() and len(year) == 4):
+            continue
+        for month in sorted(os.listdir(os.path.join(save_path, year))):
+            if os.path.exists(os.path.join(save_path, year, month, INDEX_NAME)):
+                months.append(os.path.join(year, month))
+    return months
+
+
+def packed_paths(save_path):
+    """Rutas relativas de todos los archivos empaquetados"""
+    paths = set()
+    for month in packed_months(save_path):
+        index = load_index(os.path.join(save_path, month))
+        if index:
+            paths.update(os.path.join(month, *name.split("/")) for name in index["members"])
+    return paths
+
+
+def loose_members(directory):
+    """[("DD/nombre", ruta)] de los archivos sueltos de un mes (sin ocultos ni temporales)"""
+    members = []
+    for day in sorted(os.listdir(directory)):
+        day_path = os.path.join(directory, day)
+        if not (day.isdigit() and len(day) == 2 and os.path.isdir(day_path)):
+            continue
+        for name in sorted(os.listdir(day_path)):
+            path = os.path.join(day_path, name)
+            if name.startswith(".") or name.endswith((".tmp", ".part")) or not os.path.isfile(path):
+                continue
+            members.append((f"{day}/{name}", path))
+    return members
+
+
+def closed_months(save_path, hot_days, today=None):
+    """Meses (año, mes) con archivos sueltos cuyo último día queda fuera de los días calientes"""
+    today = today or date.today()
+    limit = today - timedelta(days=hot_days)
+    months = []
+    for year in sorted(os.listdir(save_path)):
+        if not (year.isdigit() and len(year) == 4):
+            continue
+        for month in sorted(os.listdir(os.path.join(save_path, year))):
+            if not (month.isdigit() and len(month) == 2):
+                continue
+            first_next = date(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+            if first_next > limit:
+                continue
+            if loose_members(os.path.join(save_path, year, month)):
+                months.append((year, month))
+    return months
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _copy_owner(path, reference):
+    info = os.stat(reference)
+    os.chmod(path, 0o664)
+    try:
+        os.chown(path, info.st_uid, info.st_gid)
+    except OSError:
+        pass
+
+
+def _verify_pack(pack_path, expected):
+    """Relee el tar: offsets de cada miembro y comprobación de su sha256"""
+    members = {}
+    with tarfile.open(pack_path, "r:") as tar, open(pack_path, "rb") as raw:
+        for info in tar:
+            digest = hashlib.sha256()
+            reader = MemberReader(raw.fileno(), info.offset_data, info.size)
+            for chunk in iter(lambda: reader.read(COPY_CHUNK), b""):
+                digest.update(chunk)
+            if digest.hexdigest() != expected.get(info.name):
+                raise IOError(f"{info.name}: el contenido empaquetado no coincide")
+            members[info.name] = [info.offset_data, info.size, int(info.mtime), digest.hexdigest()]
+    missing = set(expected) - set(members)
+    if missing:
+        raise IOError(f"faltan {len(missing)} miembros en {pack_path}")
+    return members
+
+
+def _add_member(tar, name, source, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o664
+    reader = HashingReader(source)
+    tar.addfile(info, io.BufferedReader(reader, COPY_CHUNK))
+    return reader.digest.hexdigest()
+
+
+def pack_month(save_path, year, month):
+    """Empaqueta los archivos sueltos de un mes (junto a lo ya empaquetado) y borra los sueltos.
+
+    Devuelve {"month", "pack", "index", "removed", "added", "members", "bytes", "elapsed_s"}
+    (rutas relativas; removed son los sueltos y el tar anterior) o None si no había nada.
+    """
+    started = time.perf_counter()
+    directory = month_directory(save_path, year, month)
+    loose = loose_members(directory)
+    if not loose:
+        return None
+    previous = load_index(directory)
+    generation = previous["generation"] + 1 if previous else 1
+    pack_name = f"month-{generation}.tar"
+    pack_path = os.path.join(directory, pack_name)
+    temp_path = pack_path + ".tmp"
+    loose_names = {name for name, _ in loose}
+
+    expected = {}
+    try:
+        with open(temp_path, "wb") as output:
+            with tarfile.open(fileobj=output, mode="w", format=tarfile.GNU_FORMAT) as tar:
+                if previous:
+                    # Lo ya empaquetado se copia por rangos desde el tar anterior
+                    with open(os.path.join(directory, previous["pack"]), "rb") as old:
+                        for name, (offset, size, mtime, _) in sorted(previous["members"].items()):
+                            if name not in loose_names:
+                                expected[name] = _add_member(
+                                    tar, name, MemberReader(old.fileno(), offset, size), size, mtime
+                                )
+                for name, path in loose:
+                    info = os.stat(path)
+                    with open(path, "rb", buffering=0) as source:
+                        expected[name] = _add_member(tar, name, source, info.st_size, int(info.st_mtime))
+            output.flush()
+            os.fsync(output.fileno())
+        members = _verify_pack(temp_path, expected)
+        _copy_owner(temp_path, directory)
+        os.replace(temp_path, pack_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+    index = {
+        "version": INDEX_VERSION,
+        "pack": pack_name,
+        "generation": generation,
+        "packed_at": datetime.now().isoformat(timespec="seconds"),
+        "members": dict(sorted(members.items())),
+    }
+    index_path = os.path.join(directory, INDEX_NAME)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    _copy_owner(index_path + ".tmp", directory)
+    os.replace(index_path + ".tmp", index_path)  # Punto de confirmación
+    _fsync_path(directory)
+
+    removed = []
+    if previous and previous["pack"] != pack_name:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, previous["pack"]))
+        removed.append(os.path.join(directory, previous["pack"]))
+    for _, path in loose:
+        os.remove(path)
+        removed.append(path)
+
+    return {
+        "month": f"{int(year):04d}-{int(month):02d}",
+        "pack": os.path.relpath(pack_path, save_path),
+        "index": os.path.relpath(index_path, save_path),
+        "removed": [os.path.relpath(path, save_path) for path in removed],
+        "added": len(loose),
+        "members": len(members),
+        "bytes": os.path.getsize(pack_path),
+        "elapsed_s": time.perf_counter() - started,
+    }
+
+
+def unpack_month(save_path, year, month):
+    """Devuelve los archivos de un mes a sus directorios de día y borra el tar y el índice"""
+    directory = month_directory(save_path, year, month)
+    index = load_index(directory)
+    if index is None:
+        return 0
+    pack_path = os.path.join(directory, index["pack"])
+    restored = 0
+    with open(pack_path, "rb") as raw:
+        for name, (offset, size, mtime, _) in index["members"].items():
+            target = os.path.join(directory, *name.split("/"))
+            if os.path.exists(target):
+                continue  # Una versión suelta más reciente manda
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target + ".tmp", "wb") as output:
+                shutil.copyfileobj(MemberReader(raw.fileno(), offset, size), output, COPY_CHUNK)
+            _copy_owner(target + ".tmp", directory)
+            os.utime(target + ".tmp", (mtime, mtime))
+            os.replace(target + ".tmp", target)
+            restored += 1
+    os.remove(os.path.join(directory, INDEX_NAME))
+    os.remove(pack_path)
+    _indexes.pop(directory, None)
+    return restored
+
+
+def run(save_path, hot_days, today=None, on_result=None):
+    """Empaqueta todos los meses cerrados; devuelve los resúmenes de cada mes"""
+    results = []
+    for year, month in closed_months(save_path, hot_days, today):
+        try:
+            result = pack_month(save_path, year, month)
+        except Exception as e:
+            print(f"❌ Error empaquetando {year}-{month}: {e}", flush=True)
+            continue
+        if result:
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def format_result(result):
+    return (f"🧊 {result['month']}: {result['added']} archivos al tar "
+            f"({result['members']} en total, {result['bytes'] / 1048576:.1f}MB, {result['elapsed_s']:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Empaqueta los meses cerrados del diario en tars indexados")
+    parser.add_argument("--root", default=os.getenv("DATA_PATH", "/data/fotos"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="Empaqueta los meses cerrados (o uno concreto)")
+    pack_parser.add_argument("--hot-days", type=int, default=45, help="Días recientes que quedan sueltos")
+    pack_parser.add_argument("--month", help="YYYY-MM a empaquetar aunque no esté cerrado")
+    for name, text in (("list", "Lista los miembros de un mes"), ("unpack", "Vuelve a dejar un mes suelto")):
+        subparsers.add_parser(name, help=text).add_argument("month", help="YYYY-MM")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        if args.month:
+            result = pack_month(args.root, *args.month.split("-"))
+            print(format_result(result) if result else "Nada que empaquetar")
+        else:
+            results = run(args.root, args.hot_days, on_result=lambda result: print(format_result(result)))
+            print(f"✅ {len(results)} meses empaquetados")
+    elif args.command == "list":
+        index = load_index(month_directory(args.root, *args.month.split("-")))
+        if index is None:
+            print("Mes sin empaquetar")
+            return
+        for name, (offset, size, mtime, _) in index["members"].items():
+            print(f"{name}\t{offset}\t{size}\t{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}")
+        print(f"\n{len(index['members'])} miembros en {index['pack']}")
+    else:
+        print(f"✅ {unpack_month(args.root, *args.month.split('-'))} archivos restaurados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+memory_sampler.py - Muestreo aleatorio en tiempo constante sobre el archivo de fotos
+
+Los archivos se guardan en arrays densos (una posición por archivo) y se agrupan
+en cubos por (tipo, año), cada uno ordenado por fecha. Una tabla de alias sobre
+los cubos, ponderada por tamaño y por los pesos de tipo y de año, permite elegir
+cubo en O(1); dentro del cubo basta un índice aleatorio. Con rango de fechas se
+acota cada cubo con una búsqueda binaria y la tabla se construye solo sobre los
+cubos afectados (hay pocos: dos tipos por año).
+
+El mismo reparto se exporta a JSON para que la web (random.php) pueda sortear
+sin recorrer el árbol de directorios.
+"""
+import os
+import re
+import json
+import time
+import random
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Nombres que lista la web (FileManager::$config['filename_pattern'])
+WEB_FILENAME = re.compile(r"^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|heic|heif|mp4|mov)$", re.IGNORECASE)
+WEB_TYPES = {"foto": "photo", "video": "video"}
+EXPORT_VERSION = 1
+
+
+def parse_weights(text):
+    """'foto=1,video=0.5' -> {'foto': 1.0, 'video': 0.5}"""
+    weights = {}
+    for part in (text or "").split(","):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            weights[key.strip()] = float(value)
+    return weights
+
+
+def date_key(date):
+    """'2024-06-01' -> 20240601 (entero comparable que cabe en un array)"""
+    return int(date.replace("-", ""))
+
+
+class AliasTable:
+    """Método de alias de Vose: muestreo ponderado en O(1) tras construir en O(n)"""
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = float(sum(weights))
+        self.prob = [0.0] * count
+        self.alias = [0] * count
+        if count == 0 or total <= 0:
+            self.prob = []
+            return
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        for index in large + small:
+            self.prob[index] = 1.0
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, rng=random):
+        column = rng.randrange(len(self.prob))
+        return column if rng.random() < self.prob[column] else self.alias[column]
+
+
+class MemorySampler:
+    """Índice en memoria para sortear recuerdos por tipo, año y rango de fechas"""
+
+    def __init__(self, type_weights=None, year_weights=None):
+        self.type_weights = type_weights or {}
+        self.year_weights = year_weights or {}
+        # Arrays densos: el id de un archivo es su posición
+        self.paths = []
+        self.kinds = []
+        self.times = []
+        self.dates = array("I")
+        self.sizes = array("q")  # Tamaño y mtime del índice, para exportar sin stat por archivo
+        self.mtimes = array("d")
+        # Cubos (tipo, año) -> ids y fechas, ordenados por fecha
+        self.bucket_ids = {}
+        self.bucket_dates = {}
+        self.known = {}  # Ruta -> id
+        self.tables = {}  # Tablas de alias por tipo (None = todos), se rehacen al cambiar
+        self.dirty = True
+        self.lock = threading.RLock()  # La ingesta añade desde hilos mientras los comandos sortean
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, path, kind, date, time_text, size=0, mtime=0.0):
+        """Añade un archivo en O(1) (inserción ordenada si llega con fecha antigua)"""
+        with self.lock:
+            if path in self.known or kind not in WEB_TYPES:
+                return None
+            file_id = self.known[path] = len(self.paths)
+            key = date_key(date)
+            self.paths.append(path)
+            self.kinds.append(kind)
+            self.times.append(time_text)
+            self.dates.append(key)
+            self.sizes.append(size or 0)
+            self.mtimes.append(mtime or 0.0)
+            bucket = (kind, key // 10000)
+            ids = self.bucket_ids.setdefault(bucket, array("I"))
+            dates = self.bucket_dates.setdefault(bucket, array("I"))
+            if not dates or dates[-1] <= key:
+                ids.append(file_id)
+                dates.append(key)
+            else:
+                position = bisect_right(dates, key)
+                ids.insert(position, file_id)
+                dates.insert(position, key)
+            self.tables.clear()
+            self.dirty = True
+            return file_id
+
+    def load(self, rows):
+        """Carga filas (path, kind, date, time, size, mtime) ordenadas por fecha"""
+        for row in rows:
+            self.add(row[0], row[1], row[2], row[3], row[4], row[5])
+
+    def update_sizes(self, sizes):
+        """Tamaño nuevo de archivos reescritos en su sitio: [(ruta relativa, tamaño)]"""
+        with self.lock:
+            for path, size in sizes:
+                file_id = self.known.get(path)
+                if file_id is not None:
+                    self.sizes[file_id] = size
+                    self.dirty = True
+
+    def bucket_weight(self, bucket, count):
+        kind, year = bucket
+        return count * self.type_weights.get(kind, 1.0) * self.year_weights.get(str(year), 1.0)
+
+    def _table(self, kind):
+        if kind not in self.tables:
+            buckets = [bucket for bucket in sorted(self.bucket_ids) if kind is None or bucket[0] == kind]
+            weights = [self.bucket_weight(bucket, len(self.bucket_ids[bucket])) for bucket in buckets]
+            self.tables[kind] = (buckets, AliasTable(weights))
+        return self.tables[kind]
+
+    def _ranges(self, kind, start, end):
+        """(cubo, desde, hasta) con los archivos de cada cubo dentro del rango de fechas"""
+        low = date_key(start) if start else 0
+        high = date_key(end) if end else 99999999
+        ranges = []
+        for bucket in sorted(self.bucket_ids):
+            if (kind is not None and bucket[0] != kind) or not low // 10000 <= bucket[1] <= high // 10000:
+                continue
+            dates = self.bucket_dates[bucket]
+            first, last = bisect_left(dates, low), bisect_right(dates, high)
+            if last > first:
+                ranges.append((bucket, first, last))
+        return ranges
+
+    def count(self, kind=None, start=None, end=None):
+        with self.lock:
+            return sum(last - first for _, first, last in self._ranges(kind, start, end))
+
+    def draw(self, kind=None, start=None, end=None, rng=random):
+        """Un archivo al azar (dict) o None. Sin rango de fechas es O(1)."""
+        with self.lock:
+            if start is None and end is None:
+                buckets, table = self._table(kind)
+                if not len(table):
+                    return None
+                bucket = buckets[table.draw(rng)]
+                ids = self.bucket_ids[bucket]
+                return self.entry(ids[rng.randrange(len(ids))])
+            ranges = self._ranges(kind, start, end)
+            table = AliasTable([self.bucket_weight(bucket, last - first) for bucket, first, last in ranges])
+            if not len(table):
+                return None
+            bucket, first, last = ranges[table.draw(rng)]
+            return self.entry(self.bucket_ids[bucket][rng.randrange(first, last)])
+
+    def sample(self, count, kind=None, start=None, end=None, rng=random):
+        """Hasta count archivos distintos (con pocos intentos extra si se repiten)"""
+        available = self.count(kind, start, end)
+        chosen = {}
+        attempts = 0
+        while len(chosen) < min(count, available) and attempts < count * 4:
+            entry = self.draw(kind, start, end, rng)
+            attempts += 1
+            if entry is not None:
+                chosen.setdefault(entry["id"], entry)
+        return list(chosen.values())
+
+    def entry(self, file_id):
+        key = self.dates[file_id]
+        return {
+            "id": file_id,
+            "path": self.paths[file_id],
+            "kind": self.kinds[file_id],
+            "date": f"{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}",
+            "time": self.times[file_id],
+        }
+
+    def export(self, target_path):
+        """Escribe el reparto para la web: archivos contiguos por cubo y tabla de alias.
+
+        Solo entran los nombres que lista la web. Cada archivo es
+        [ruta, tipo, fecha, hora, tamaño, mtime], con tamaño y mtime del índice
+        (no se toca el disco); los cubos indican su tramo [start, end) dentro de 'files'.
+        """
+        with self.lock:
+            snapshot = [(bucket, [(self.entry(file_id), self.sizes[file_id], self.mtimes[file_id])
+                                  for file_id in self.bucket_ids[bucket]])
+                        for bucket in sorted(self.bucket_ids)]
+            self.dirty = False
+
+        files = []
+        buckets = []
+        for bucket, entries in snapshot:
+            start = len(files)
+            for entry, size, mtime in entries:
+                if not WEB_FILENAME.match(os.path.basename(entry["path"])):
+                    continue
+                files.append([entry["path"], WEB_TYPES[entry["kind"]], entry["date"], entry["time"],
+                              size, int(mtime)])
+            if len(files) > start:
+                kind, year = bucket
+                buckets.append({
+                    "type": WEB_TYPES[kind],
+                    "year": year,
+                    "start": start,
+                    "end": len(files),
+                    "weight": self.type_weights.get(kind, 1.0) * self.year_weights.get(str(year), 1.0),
+                })
+
+        tables = {}
+        for name in ("all", "photo", "video"):
+            selected = [index for index, bucket in enumerate(buckets) if name == "all" or bucket["type"] == name]
+            table = AliasTable([buckets[index]["weight"] * (buckets[index]["end"] - buckets[index]["start"])
+                                for index in selected])
+            tables[name] = {"buckets": selected, "prob": [round(p, 6) for p in table.prob], "alias": table.alias}
+
+        payload = {
+            "version": EXPORT_VERSION,
+            "generated_at": int(time.time()),
+            "total": len(files),
+            "buckets": buckets,
+            "alias": tables,
+            "files": files,
+        }
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f"{target_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(temp_path, target_path)
+        return len(files)
@@ -0,0 +1,226 @@
+"""
+plan_generator.py - Generación vectorizada de planes de notificaciones
+
+Genera de una vez miles de planes (usuarios x días) con numpy respetando:
+- Perfiles por día de la semana: franja horaria y número de notificaciones
+- Horas de silencio en las que nunca se notifica
+- Separación mínima entre notificaciones
+
+Los planes se escriben en un solo lote: primero todos los temporales y, si no
+ha fallado ninguno, se renombran en su sitio. Así el job de medianoche solo
+tiene que leer el plan ya preparado.
+
+    python plan_generator.py /data/equipo --days 7          # un DATA_PATH por subdirectorio
+    python plan_generator.py --benchmark 10000
+"""
+import os
+import json
+import time
+import argparse
+from datetime import date, timedelta
+
+import numpy as np
+
+WEEKDAYS = ["lun", "mar", "mie", "jue", "vie", "sab", "dom"]
+# Equivale al generador original: entre las 08:00 y las 21:30, de 5 a 9 avisos
+DEFAULT_PROFILE = {"start": 8 * 60, "end": 21 * 60 + 30, "min": 5, "max": 9}
+
+
+def parse_clock(text):
+    hour, minute = text.strip().split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def parse_quiet_hours(text):
+    """'14:00-15:30,19:00-20:00' -> [(840, 930), (1140, 1200)]"""
+    ranges = []
+    for part in (text or "").split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            ranges.append((parse_clock(start), parse_clock(end)))
+    return ranges
+
+
+def parse_profiles(text):
+    """Perfiles por día: 'lun-vie=08:00-21:30/5-9,sab-dom=10:00-22:00/3-6' -> lista de 7 perfiles"""
+    profiles = [dict(DEFAULT_PROFILE) for _ in WEEKDAYS]
+    for part in (text or "").split(","):
+        if "=" not in part:
+            continue
+        days, spec = part.split("=")
+        first, _, last = days.strip().partition("-")
+        selected = range(WEEKDAYS.index(first), WEEKDAYS.index(last or first) + 1)
+        window, _, counts = spec.partition("/")
+        start, end = window.split("-")
+        profile = {"start": parse_clock(start), "end": parse_clock(end)}
+        low, _, high = (counts or f"{DEFAULT_PROFILE['min']}-{DEFAULT_PROFILE['max']}").partition("-")
+        profile.update(min=int(low), max=int(high or low))
+        for weekday in selected:
+            profiles[weekday] = profile
+    return profiles
+
+
+class PlanGenerator:
+    def __init__(self, profiles=None, quiet_hours=(), min_spacing=30, step=15, video_ratio=0.5):
+        self.profiles = profiles or [dict(DEFAULT_PROFILE) for _ in WEEKDAYS]
+        self.quiet_hours = list(quiet_hours)
+        self.step = step
+        # Separación mínima en huecos de la rejilla (las horas de silencio solo la amplían)
+        self.gap = max(1, -(-min_spacing // step))
+        self.video_ratio = video_ratio
+        self._slots = {}
+
+    def slots_for(self, weekday):
+        """Minutos del día en los que se puede notificar según el perfil"""
+        if weekday not in self._slots:
+            profile = self.profiles[weekday]
+            slots = np.arange(profile["start"], profile["end"] + 1, self.step)
+            for start, end in self.quiet_hours:
+                slots = slots[(slots < start) | (slots >= end)]
+            self._slots[weekday] = slots
+        return self._slots[weekday]
+
+    def generate(self, count, weekday, rng):
+        """count planes para un día de la semana en una sola pasada vectorizada"""
+        slots = self.slots_for(weekday)
+        n = len(slots)
+        if n == 0:
+            return [[] for _ in range(count)]
+        profile = self.profiles[weekday]
+        feasible = (n - 1) // self.gap + 1
+        high = min(profile["max"], feasible)
+        low = min(profile["min"], high)
+        sizes = rng.integers(low, high + 1, size=count)
+
+        # k posiciones distintas en [0, n - (k-1)(gap-1)) y luego se separan sumando i*(gap-1):
+        # reparto uniforme entre todas las combinaciones que respetan la separación
+        spread = self.gap - 1
+        limits = n - (sizes - 1) * spread
+        keys = rng.random((count, n))
+        keys[np.arange(n)[None, :] >= limits[:, None]] = 2.0
+        picked = np.argsort(keys, axis=1)[:, :high]
+        valid = np.arange(high)[None, :] < sizes[:, None]
+        picked = np.sort(np.where(valid, picked, n), axis=1)
+        positions = np.minimum(picked + np.arange(high)[None, :] * spread, n - 1)
+        minutes = slots[positions]
+        videos = rng.random((count, high)) < self.video_ratio
+
+        plans = []
+        for row in range(count):
+            plans.append([
+                {"hour": int(minute) // 60, "minute": int(minute) % 60,
+                 "type": "video" if video else "foto", "delivered": False}
+                for minute, video in zip(minutes[row, :sizes[row]], videos[row, :sizes[row]])
+            ])
+        return plans
+
+    def generate_days(self, days, users, rng):
+        """{(usuario, fecha): plan}, agrupando por día de la semana para vectorizar"""
+        plans = {}
+        by_weekday = {}
+        for day in days:
+            by_weekday.setdefault(day.weekday(), []).append(day)
+        for weekday, same_days in by_weekday.items():
+            keys = [(user, day) for day in same_days for user in users]
+            plans.update(zip(keys, self.generate(len(keys), weekday, rng)))
+        return plans
+
+
+class PlanWriteError(OSError):
+    """Falló un renombrado de write_plans; replaced son las rutas que ya quedaron reemplazadas"""
+
+    def __init__(self, path, error, replaced):
+        super().__init__(f"no se pudo reemplazar {path}: {error} ({len(replaced)} planes ya reemplazados)")
+        self.replaced = replaced
+
+
+def write_plans(plans, finalize=None):
+    """Escribe {ruta: plan} en un lote: primero todos los temporales y luego los renombrados.
+
+    Si falla la escritura de alguno no se reemplaza ninguno. Un fallo al renombrar
+    deja reemplazados los anteriores: se lanza PlanWriteError con esas rutas.
+    finalize(ruta) se aplica al temporal (permisos y propietario viajan con el renombrado).
+    Mismo formato que save_plan_json (indent=2).
+    """
+    for directory in {os.path.dirname(path) for path in plans}:
+        os.makedirs(directory, mode=0o775, exist_ok=True)
+    written = []
+    try:
+        for path, plan in plans.items():
+            temp_path = f"{path}.tmp"
+            # Se anota antes de escribir: un temporal a medias también se borra
+            written.append((temp_path, path))
+            with open(temp_path, "w") as f:
+                json.dump(plan, f, indent=2)
+            if finalize:
+                finalize(temp_path)
+    except Exception:
+        _discard_temps(written)
+        raise
+    replaced = []
+    for number, (temp_path, path) in enumerate(written):
+        try:
+            os.replace(temp_path, path)
+        except OSError as e:
+            _discard_temps(written[number:])
+            raise PlanWriteError(path, e, replaced) from e
+        replaced.append(path)
+    return len(written)
+
+
+def _discard_temps(written):
+    for temp_path, _ in written:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def generator_from_env():
+    return PlanGenerator(
+        profiles=parse_profiles(os.getenv("PLAN_PROFILES", "")),
+        quiet_hours=parse_quiet_hours(os.getenv("PLAN_QUIET_HOURS", "")),
+        min_spacing=int(os.getenv("PLAN_MIN_SPACING_MINUTES", "30")),
+        step=int(os.getenv("PLAN_STEP_MINUTES", "15")),
+        video_ratio=float(os.getenv("PLAN_VIDEO_RATIO", "0.5")),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera por adelantado los planes de muchos usuarios")
+    parser.add_argument("root", nargs="?", help="Directorio con un DATA_PATH por usuario")
+    parser.add_argument("--days", type=int, default=7, help="Días a generar desde hoy")
+    parser.add_argument("--force", action="store_true", help="Reemplazar planes ya existentes")
+    parser.add_argument("--benchmark", type=int, default=0, help="Solo medir: generar N planes sin escribir")
+    args = parser.parse_args()
+
+    generator = generator_from_env()
+    rng = np.random.default_rng()
+
+    if args.benchmark:
+        started = time.perf_counter()
+        plans = generator.generate(args.benchmark, date.today().weekday(), rng)
+        elapsed = time.perf_counter() - started
+        entries = sum(len(plan) for plan in plans)
+        print(f"📊 {len(plans)} planes ({entries} avisos) en {elapsed * 1000:.0f}ms "
+              f"({elapsed / len(plans) * 1e6:.1f}µs por plan)")
+        return
+    if not args.root:
+        parser.error("falta el directorio raíz (o --benchmark)")
+
+    users = sorted(entry.name for entry in os.scandir(args.root)
+                   if entry.is_dir() and not entry.name.startswith("."))
+    days = [date.today() + timedelta(days=offset) for offset in range(args.days)]
+    started = time.perf_counter()
+    plans = generator.generate_days(days, users, rng)
+    pending = {}
+    for (user, day), plan in plans.items():
+        path = os.path.join(args.root, user, "planificacion", f"{day:%Y-%m-%d}.json")
+        if args.force or not os.path.exists(path):
+            pending[path] = plan
+    written = write_plans(pending)
+    elapsed = time.perf_counter() - started
+    print(f"✅ {written} planes escritos para {len(users)} usuarios y {len(days)} días en {elapsed:.2f}s "
+          f"({len(plans) - written} ya existían)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+plan_history.py - Historial SQLite de planes y cumplimiento
+
+Compacta los planificacion/YYYY-MM-DD.json en una tabla de ventanas (una fila por
+notificación planificada) con la hora programada, el tipo, si se entregó y el
+retraso entre el aviso y el envío. El bot registra en vivo cuándo avisa y
+cuándo se entrega; los días cerrados se importan desde sus JSON (para los días
+antiguos el retraso se deduce del primer archivo guardado en la ventana, según
+el índice de medios).
+
+/stats consulta solo esta tabla: rachas, porcentaje completado y retraso
+mediano por hora sin abrir un JSON por día.
+
+    python plan_history.py /data/fotos            # importar los planes ya existentes
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta
+from statistics import median
+
+HISTORY_FILENAME = "history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    date TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    scheduled_at REAL NOT NULL,
+    notified_at REAL,
+    delivered_at REAL,
+    delay_s REAL,
+    PRIMARY KEY (date, minute)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS slots_delay ON slots (minute, delay_s) WHERE delay_s IS NOT NULL;
+CREATE TABLE IF NOT EXISTS compacted_days (
+    date TEXT PRIMARY KEY,
+    compacted_at REAL NOT NULL
+);
+"""
+
+
+def default_history_path(save_path):
+    return os.path.join(save_path, ".index", HISTORY_FILENAME)
+
+
+def slot_time(date, minute):
+    return datetime.strptime(date, "%Y-%m-%d") + timedelta(minutes=minute)
+
+
+def first_delivery_times(date, plan, times):
+    """Hora del primer archivo guardado dentro de cada ventana entregada del plan.
+
+    times: horas HH:MM:SS de los archivos del día (del índice de medios), ordenadas.
+    """
+    minutes = [entry.get("hour", 8) * 60 + entry.get("minute", 0) for entry in plan]
+    seconds = [int(t[:2]) * 3600 + int(t[3:5]) * 60 + int(t[6:8]) for t in times]
+    found = {}
+    for i, start in enumerate(minutes):
+        if not plan[i].get("delivered", False):
+            continue
+        end = minutes[i + 1] if i + 1 < len(minutes) else 24 * 60
+        for value in seconds:
+            if start * 60 <= value < end * 60:
+                found[start] = (slot_time(date, 0) + timedelta(seconds=value)).timestamp()
+                break
+    return found
+
+
+class PlanHistory:
+    def __init__(self, save_path, db_path=None):
+        self.save_path = save_path
+        self.db_path = db_path or default_history_path(save_path)
+        os.makedirs(os.path.dirname(self.db_path), mode=0o775, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _upsert(self, date, minute, slot_type, **values):
+        scheduled_at = slot_time(date, minute).timestamp()
+        columns = ["date", "minute", "type", "scheduled_at"] + list(values)
+        updates = ", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in values)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO slots ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+                f"ON CONFLICT (date, minute) DO UPDATE SET type = excluded.type"
+                + (f", {updates}" if updates else ""),
+                [date, minute, slot_type, scheduled_at] + list(values.values()),
+            )
+
+    def record_notified(self, date, minute, slot_type, at):
+        self._upsert(date, minute, slot_type, notified_at=at)
+
+    def record_delivered(self, date, minute, slot_type, at):
+        """Marca la ventana como entregada y guarda el retraso desde el aviso (o la hora programada)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT notified_at, delivered_at FROM slots WHERE date = ? AND minute = ?", (date, minute)
+            ).fetchone()
+        if row and row[1]:
+            return  # Cuenta el primer envío de la ventana
+        reference = row[0] if row and row[0] else slot_time(date, minute).timestamp()
+        self._upsert(date, minute, slot_type, delivered=1, delivered_at=at, delay_s=max(0.0, at - reference))
+
+    def known_days(self):
+        """Días cuyo plan ya se compactó (los registros en vivo no cuentan: falta el plan completo)"""
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT date FROM compacted_days")}
+
+    def import_days(self, days):
+        """Compacta días completos: {fecha: (plan, {minuto: hora de entrega})} en una transacción"""
+        rows = []
+        for date, (plan, delivered_times) in days.items():
+            for entry in plan:
+                minute = entry.get("hour", 8) * 60 + entry.get("minute", 0)
+                delivered = 1 if entry.get("delivered", False) else 0
+                at = delivered_times.get(minute) if delivered else None
+                scheduled_at = slot_time(date, minute).timestamp()
+                rows.append((date, minute, entry.get("type", "foto"), delivered, scheduled_at, at,
+                             max(0.0, at - scheduled_at) if at else None))
+        with self.lock, self.conn:
+            # Los datos en vivo (aviso y entrega reales) prevalecen sobre los deducidos
+            self.conn.executemany(
+                "INSERT INTO slots (date, minute, type, delivered, scheduled_at, delivered_at, delay_s) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (date, minute) DO UPDATE SET type = excluded.type, "
+                "delivered = MAX(delivered, excluded.delivered), "
+                "delivered_at = COALESCE(delivered_at, excluded.delivered_at), "
+                "delay_s = COALESCE(delay_s, excluded.delay_s)",
+                rows,
+            )
+            now = time.time()
+            self.conn.executemany("INSERT OR REPLACE INTO compacted_days (date, compacted_at) VALUES (?, ?)",
+                                  [(date, now) for date in days])
+        return len(rows)
+
+    def stats(self, today, recent_days=30):
+        """Resumen de los días cerrados (anteriores a today)"""
+        with self.lock:
+            days = self.conn.execute(
+                "SELECT date, COUNT(*), SUM(delivered) FROM slots WHERE date < ? GROUP BY date ORDER BY date",
+                (today,),
+            ).fetchall()
+            delays = self.conn.execute(
+                "SELECT minute / 60, delay_s FROM slots WHERE delay_s IS NOT NULL AND date < ?", (today,)
+            ).fetchall()
+
+        result = {"days": len(days), "first_day": days[0][0] if days else None,
+                  "planned": sum(row[1] for row in days), "delivered": sum(row[2] for row in days)}
+        since = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=recent_days)).strftime("%Y-%m-%d")
+        recent = [row for row in days if row[0] >= since]
+        result["recent_planned"] = sum(row[1] for row in recent)
+        result["recent_delivered"] = sum(row[2] for row in recent)
+
+        # Rachas de días completos (todas las ventanas entregadas) en días consecutivos
+        best = current = 0
+        previous = None
+        for date, planned, delivered in days:
+            day = datetime.strptime(date, "%Y-%m-%d").date()
+            if delivered == planned and planned > 0:
+                current = current + 1 if previous and (day - previous).days == 1 else 1
+            else:
+                current = 0
+            previous = day
+            best = max(best, current)
+        yesterday = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=1)).date()
+        result["best_streak"] = best
+        result["current_streak"] = current if previous == yesterday else 0
+
+        by_hour = {}
+        for hour, delay in delays:
+            by_hour.setdefault(hour, []).append(delay)
+        result["median_delay_s"] = median(delay for _, delay in delays) if delays else None
+        result["delay_by_hour"] = {hour: (median(values), len(values)) for hour, values in sorted(by_hour.items())}
+        return result
+
+
+def compact_plans(history, plan_dir, today, day_times=None, keep_days=0):
+    """Importa los planes de días cerrados que aún no están en el historial.
+
+    day_times(fecha) devuelve las horas de los archivos guardados ese día (para
+    deducir el retraso). Con keep_days > 0 borra los JSON ya importados más
+    antiguos que ese número de días.
+    """
+    if not os.path.isdir(plan_dir):
+        return 0
+    known = history.known_days()
+    pending = {}
+    imported_files = []
+    for name in sorted(os.listdir(plan_dir)):
+        date = name[:-5]
+        if not name.endswith(".json") or len(date) != 10 or date >= today:
+            continue
+        imported_files.append((date, os.path.join(plan_dir, name)))
+        if date in known:
+            continue
+        try:
+            with open(os.path.join(plan_dir, name), "r") as f:
+                plan = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Plan ilegible {name}: {e}")
+            continue
+        times = day_times(date) if day_times else []
+        pending[date] = (plan, first_delivery_times(date, plan, times))
+    imported = history.import_days(pending) if pending else 0
+
+    if keep_days > 0:
+        limit = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+        known = history.known_days()
+        for date, path in imported_files:
+            if date < limit and date in known:
+                os.unlink(path)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacta los planes diarios en el historial SQLite")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    args = parser.parse_args()
+
+    from media_index import MediaIndex
+
+    index = MediaIndex(args.root)
+    history = PlanHistory(args.root)
+    today = datetime.now().strftime("%Y-%m-%d")
+    started = time.perf_counter()
+    imported = compact_plans(history, os.path.join(args.root, "planificacion"), today,
+                             day_times=lambda date: [row["time"] for row in index.day(date)])
+    print(f"✅ {imported} ventanas importadas en {time.perf_counter() - started:.2f}s")
+    started = time.perf_counter()
+    stats = history.stats(today)
+    print(f"📊 {stats['days']} días, {stats['delivered']}/{stats['planned']} entregadas, "
+          f"racha actual {stats['current_streak']}, mejor {stats['best_streak']} "
+          f"({(time.perf_counter() - started) * 1000:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+quality_gate.py - Filtro rápido de calidad: fotos borrosas, negras o quemadas
+
+Las métricas se calculan con NumPy sobre una copia reducida en escala de grises
+(unos cientos de píxeles de lado), nunca sobre la imagen completa:
+- Nitidez: varianza del laplaciano (4 vecinos) en el proxy
+- Exposición: fracción de píxeles casi negros y casi blancos según el histograma
+
+En los videos se muestrean unos pocos fotogramas repartidos y se toma el mejor
+de cada métrica: solo se rechaza si todos los fotogramas muestreados fallan.
+Cada comprobación tiene un presupuesto de tiempo; si se agota, se decide con lo
+que ya se haya medido.
+
+    python quality_gate.py /data/fotos/2025/06          # métricas para ajustar umbrales
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+from media_metadata import VIDEO_EXTENSIONS
+
+DARK_LEVEL = 20     # Luminancia por debajo de la cual un píxel cuenta como negro
+BRIGHT_LEVEL = 245  # Luminancia por encima de la cual un píxel cuenta como quemado
+DEFAULT_THRESHOLDS = {"min_sharpness": 20.0, "max_dark": 0.9, "max_bright": 0.8}
+REASONS = {"dark": "demasiado oscura", "bright": "sobreexpuesta", "blur": "borrosa"}  # De "imagen"
+
+
+def reduce_gray(gray, side):
+    """Reduce un array de grises a lado máximo ~side con la media de bloques enteros"""
+    factor = max(gray.shape) // side
+    if factor < 2:
+        return gray
+    height, width = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+    return gray[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(
+        axis=(1, 3), dtype=np.float32
+    )
+
+
+def image_metrics(gray):
+    """Nitidez y exposición de un array 2D de luminancia (0-255)"""
+    gray = np.asarray(gray, dtype=np.float32)
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return {"sharpness": 0.0, "mean": float(gray.mean()) if gray.size else 0.0, "dark": 1.0, "bright": 0.0}
+    laplacian = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]) - 4 * gray[1:-1, 1:-1]
+    histogram = np.bincount(np.clip(gray, 0, 255).astype(np.uint8).ravel(), minlength=256)
+    total = histogram.sum()
+    return {
+        "sharpness": float(laplacian.var()),
+        "mean": float(histogram @ np.arange(256) / total),
+        "dark": float(histogram[:DARK_LEVEL].sum() / total),
+        "bright": float(histogram[BRIGHT_LEVEL + 1:].sum() / total),
+    }
+
+
+def best_metrics(samples):
+    """Combina los fotogramas de un video quedándose con el mejor valor de cada métrica"""
+    return {
+        "sharpness": max(sample["sharpness"] for sample in samples),
+        "mean": float(np.median([sample["mean"] for sample in samples])),
+        "dark": min(sample["dark"] for sample in samples),
+        "bright": min(sample["bright"] for sample in samples),
+    }
+
+
+def evaluate(metrics, thresholds=None):
+    """Motivo de rechazo ("dark", "bright", "blur") o None si pasa el filtro"""
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    if metrics["dark"] > thresholds["max_dark"]:
+        return "dark"
+    if metrics["bright"] > thresholds["max_bright"]:
+        return "bright"
+    if metrics["sharpness"] < thresholds["min_sharpness"]:
+        return "blur"
+    return None
+
+
+def load_gray_proxy(path, side):
+    """Grises reducidos de una foto (draft de JPEG: libjpeg decodifica ya escalado)"""
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            img.draft("L", (side, side))
+        img = ImageOps.exif_transpose(img).convert("L")
+        img.thumbnail((side, side))
+        return np.asarray(img)
+
+
+def video_samples(path, side, frames=3, deadline=None):
+    """Métricas de hasta frames fotogramas repartidos por el video (se detiene en deadline)"""
+    samples = []
+    capture = cv2.VideoCapture(path)
+    try:
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        positions = [int(total * (i + 1) / (frames + 1)) for i in range(frames)] if total > 0 else [0]
+        for position in positions:
+            if samples and deadline and time.perf_counter() >= deadline:
+                break
+            capture.set(cv2.CAP_PROP_POS_FRAMES, position)
+            ok, frame = capture.read()
+            if not ok:
+                continue
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            samples.append(image_metrics(reduce_gray(gray, side)))
+    finally:
+        capture.release()
+    return samples
+
+
+def check_file(path, side=512, frames=3, budget_ms=150, thresholds=None, loader=None):
+    """Evalúa una foto o un video; loader(ruta, lado) sustituye a load_gray_proxy para las fotos.
+
+    Devuelve {"reason", "metrics", "frames", "elapsed_ms", "over_budget"}; con
+    reason None si pasa o si no se pudo medir.
+    """
+    started = time.perf_counter()
+    deadline = started + budget_ms / 1000
+    samples = []
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        if CV2_AVAILABLE:
+            samples = video_samples(path, side, frames, deadline)
+    elif PIL_AVAILABLE:
+        gray = (loader or load_gray_proxy)(path, side)
+        if gray is not None:
+            samples.append(image_metrics(gray))
+
+    metrics = best_metrics(samples) if samples else None
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return {
+        "reason": evaluate(metrics, thresholds) if metrics else None,
+        "metrics": metrics,
+        "frames": len(samples),
+        "elapsed_ms": elapsed_ms,
+        "over_budget": elapsed_ms > budget_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide nitidez y exposición para ajustar los umbrales del filtro")
+    parser.add_argument("path", help="Archivo o directorio")
+    parser.add_argument("--side", type=int, default=512, help="Lado máximo del proxy")
+    parser.add_argument("--budget-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(args.path)
+            for name in names
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".heic", ".heif", ".mp4", ".mov"))
+        )
+    else:
+        paths = [args.path]
+
+    costs = []
+    for path in paths:
+        try:
+            result = check_file(path, side=args.side, budget_ms=args.budget_ms)
+        except Exception as e:
+            print(f"⚠️ {path}: {e}")
+            continue
+        costs.append(result["elapsed_ms"])
+        metrics = result["metrics"]
+        if metrics is None:
+            print(f"⚪ {path}: sin métricas")
+            continue
+        verdict = f"❌ {REASONS[result['reason']]}" if result["reason"] else "✅"
+        print(f"{verdict} {path}: nitidez {metrics['sharpness']:.0f}, negros {metrics['dark']:.0%}, "
+              f"quemados {metrics['bright']:.0%} ({result['elapsed_ms']:.0f}ms)")
+    if costs:
+        print(f"📊 {len(costs)} archivos, media {np.mean(costs):.1f}ms, p95 {np.percentile(costs, 95):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
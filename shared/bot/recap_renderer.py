@@ -0,0 +1,290 @@
+"""
+recap_renderer.py - Resúmenes del día o del mes: hoja de contactos y timelapse
+
+Cada archivo se decodifica reducido (draft de JPEG, que libjpeg escala en la DCT;
+en los videos, un fotograma central) y se redimensiona con NumPy (promedio por
+bloques + bilineal vectorizado). Los fotogramas del timelapse se escriben en el
+codificador según se generan: en memoria solo están la miniatura de cada
+archivo para la hoja de contactos y los dos fotogramas del fundido en curso, así
+que un mes de fotos 4K nunca se carga entero.
+
+    python recap_renderer.py /data/fotos 2025-06-14        # un día
+    python recap_renderer.py /data/fotos 2025-06           # un mes
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from PIL import Image, ImageDraw, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass
+
+from media_metadata import VIDEO_EXTENSIONS
+
+BACKGROUND = (24, 24, 24)
+LABEL_HEIGHT = 18
+RESIZE_BAND = 64  # Filas de salida por pasada de resize_array
+VIDEO_CODECS = [codec.strip() for codec in os.getenv("RECAP_VIDEO_CODECS", "avc1,mp4v").split(",") if codec.strip()]
+_working_codec = None  # Primer códec que abrió correctamente (se prueba una vez por proceso)
+
+
+def resize_array(pixels, height, width):
+    """Redimensiona un array HxWx3 con NumPy: promedio por bloques enteros y luego bilineal"""
+    source_height, source_width = pixels.shape[:2]
+    if (source_height, source_width) == (height, width):
+        return pixels
+    factor = min(source_height // height, source_width // width)
+    if factor >= 2:
+        # Reducción fuerte: media de bloques factor x factor (antialiasing sin coste extra)
+        cropped_h, cropped_w = source_height // factor * factor, source_width // factor * factor
+        pixels = pixels[:cropped_h, :cropped_w].reshape(
+            cropped_h // factor, factor, cropped_w // factor, factor, -1
+        ).mean(axis=(1, 3), dtype=np.float32)
+        source_height, source_width = pixels.shape[:2]
+
+    ys = (np.arange(height, dtype=np.float32) + 0.5) * source_height / height - 0.5
+    xs = (np.arange(width, dtype=np.float32) + 0.5) * source_width / width - 0.5
+    y0 = np.clip(np.floor(ys).astype(np.intp), 0, source_height - 1)
+    x0 = np.clip(np.floor(xs).astype(np.intp), 0, source_width - 1)
+    y1 = np.minimum(y0 + 1, source_height - 1)
+    x1 = np.minimum(x0 + 1, source_width - 1)
+    wy = np.clip(ys - y0, 0.0, 1.0)[:, None, None]
+    wx = np.clip(xs - x0, 0.0, 1.0)[None, :, None]
+
+    # Por bandas de filas: los temporales en float32 no crecen con el tamaño del fotograma
+    result = np.empty((height, width, pixels.shape[2]), dtype=np.uint8)
+    for start in range(0, height, RESIZE_BAND):
+        band = slice(start, start + RESIZE_BAND)
+        top = pixels[y0[band]]
+        top = top[:, x0] * (1 - wx) + top[:, x1] * wx
+        bottom = pixels[y1[band]]
+        bottom = bottom[:, x0] * (1 - wx) + bottom[:, x1] * wx
+        top *= 1 - wy[band]
+        bottom *= wy[band]
+        top += bottom
+        top += 0.5
+        result[band] = np.clip(top, 0, 255, out=top)
+    return result
+
+
+def load_pixels(path, min_side, source=None):
+    """RGB reducido (lado menor >= min_side si el original lo permite) o None.
+
+    source, si se da, es lo que se decodifica (una ruta o un archivo abierto)
+    y path solo sirve para saber el tipo y para los avisos.
+    """
+    source = path if source is None else source
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        if not CV2_AVAILABLE:
+            return None
+        capture = cv2.VideoCapture(source)
+        try:
+            frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            capture.set(cv2.CAP_PROP_POS_FRAMES, max(0, frames // 2))
+            ok, frame = capture.read()
+        finally:
+            capture.release()
+        if not ok:
+            return None
+        height, width = frame.shape[:2]
+        factor = max(1, min(height, width) // min_side)
+        # Submuestreo previo: el fotograma completo (p. ej. 4K) se suelta enseguida
+        return np.ascontiguousarray(frame[::factor, ::factor, ::-1])
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        with Image.open(source) as img:
+            width, height = img.size
+            scale = min_side / min(width, height)
+            if img.format == "JPEG" and scale < 1:
+                img.draft("RGB", (max(1, round(width * scale)), max(1, round(height * scale))))
+            img = ImageOps.exif_transpose(img)
+            return np.asarray(img.convert("RGB"))
+    except Exception as e:
+        print(f"⚠️ No se pudo leer {path} para el resumen: {e}")
+        return None
+
+
+def load_entry(path, min_side, opener=None):
+    """load_pixels de una entrada; opener(path) da un contexto con lo que decodificar (o None)"""
+    if opener is None:
+        return load_pixels(path, min_side)
+    with opener(path) as source:
+        return None if source is None else load_pixels(path, min_side, source)
+
+
+def square_tile(pixels, size):
+    height, width = pixels.shape[:2]
+    side = min(height, width)
+    top, left = (height - side) // 2, (width - side) // 2
+    return resize_array(pixels[top:top + side, left:left + side], size, size)
+
+
+def fit_frame(pixels, height, width):
+    """Encaja la imagen en un fotograma height x width con bandas negras"""
+    source_height, source_width = pixels.shape[:2]
+    scale = min(height / source_height, width / source_width)
+    fitted = resize_array(pixels, max(1, round(source_height * scale)), max(1, round(source_width * scale)))
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    top, left = (height - fitted.shape[0]) // 2, (width - fitted.shape[1]) // 2
+    frame[top:top + fitted.shape[0], left:left + fitted.shape[1]] = fitted
+    return frame
+
+
+def spread(items, limit):
+    """Como mucho limit elementos repartidos a lo largo de la lista"""
+    if len(items) <= limit:
+        return list(items)
+    step = len(items) / limit
+    return [items[int(i * step)] for i in range(limit)]
+
+
+def render_contact_sheet(entries, target_path, tile=256, max_tiles=48, gap=6, opener=None):
+    """Hoja de contactos de (ruta, etiqueta). Devuelve cuántas miniaturas tiene."""
+    entries = spread(entries, max_tiles)
+    tiles = []
+    for path, label in entries:
+        pixels = load_entry(path, tile, opener)
+        if pixels is not None:
+            tiles.append((square_tile(pixels, tile), label))
+    if not tiles:
+        return 0
+
+    columns = max(1, min(len(tiles), int(np.ceil(np.sqrt(len(tiles) * 4 / 3)))))
+    rows = -(-len(tiles) // columns)
+    cell_h, cell_w = tile + LABEL_HEIGHT + gap, tile + gap
+    canvas = np.empty((rows * cell_h + gap, columns * cell_w + gap, 3), dtype=np.uint8)
+    canvas[:] = BACKGROUND
+    for index, (pixels, _) in enumerate(tiles):
+        top = gap + (index // columns) * cell_h
+        left = gap + (index % columns) * cell_w
+        canvas[top:top + tile, left:left + tile] = pixels
+
+    sheet = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(sheet)
+    for index, (_, label) in enumerate(tiles):
+        top = gap + (index // columns) * cell_h + tile + 3
+        left = gap + (index % columns) * cell_w + 3
+        draw.text((left, top), label, fill=(220, 220, 220))
+    temp_path = f"{target_path}.tmp"
+    sheet.save(temp_path, format="JPEG", quality=88, optimize=True)
+    os.replace(temp_path, target_path)
+    return len(tiles)
+
+
+def open_writer(target_path, fps, width, height):
+    global _working_codec
+    for codec in ([_working_codec] if _working_codec else VIDEO_CODECS):
+        writer = cv2.VideoWriter(target_path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+        if writer.isOpened():
+            _working_codec = codec
+            return writer
+        writer.release()
+    return None
+
+
+def render_timelapse(paths, target_path, width=1280, height=720, fps=12, max_seconds=30, fade_frames=3,
+                     opener=None):
+    """Timelapse con fundidos; cada fotograma se escribe al generarse. Devuelve los archivos usados."""
+    if not CV2_AVAILABLE or not paths:
+        return 0
+    # Cada archivo dura lo mismo, sin pasar de max_seconds en total
+    hold = max(1, min(fps // 2, int(max_seconds * fps / len(paths))))
+    temp_path = f"{target_path}.tmp.mp4"
+    writer = open_writer(temp_path, fps, width, height)
+    if writer is None:
+        print("⚠️ Ningún códec de video disponible para el timelapse")
+        return 0
+
+    used = 0
+    previous = None
+    try:
+        for path in paths:
+            pixels = load_entry(path, height, opener)
+            if pixels is None:
+                continue
+            frame = np.ascontiguousarray(fit_frame(pixels, height, width)[:, :, ::-1])
+            del pixels
+            if previous is not None and fade_frames:
+                for step in range(1, fade_frames + 1):
+                    alpha = step / (fade_frames + 1)
+                    writer.write(cv2.addWeighted(previous, 1 - alpha, frame, alpha, 0))
+            for _ in range(hold):
+                writer.write(frame)
+            previous = frame
+            used += 1
+    finally:
+        writer.release()
+    if used:
+        os.replace(temp_path, target_path)
+    elif os.path.exists(temp_path):
+        os.unlink(temp_path)
+    return used
+
+
+def render_recap(entries, output_base, tile=256, max_tiles=48, width=1280, height=720, max_seconds=30,
+                 opener=None):
+    """Renderiza hoja de contactos y timelapse de (ruta, etiqueta) en orden cronológico.
+
+    Con opener, las rutas se abren de una en una a través de él al ir usándolas
+    (p. ej. media_tiering.media_source para los meses del archivo frío).
+    """
+    os.makedirs(os.path.dirname(output_base), mode=0o775, exist_ok=True)
+    started = time.perf_counter()
+    result = {"collage": None, "timelapse": None}
+    collage_path = f"{output_base}-contactos.jpg"
+    result["tiles"] = render_contact_sheet(entries, collage_path, tile=tile, max_tiles=max_tiles, opener=opener)
+    if result["tiles"]:
+        result["collage"] = collage_path
+    timelapse_path = f"{output_base}-timelapse.mp4"
+    result["frames"] = render_timelapse([path for path, _ in entries], timelapse_path,
+                                        width=width, height=height, max_seconds=max_seconds, opener=opener)
+    if result["frames"]:
+        result["timelapse"] = timelapse_path
+    result["elapsed_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera la hoja de contactos y el timelapse de un día o un mes")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("period", help="AAAA-MM-DD (día) o AAAA-MM (mes)")
+    args = parser.parse_args()
+
+    import media_tiering
+    from media_index import MediaIndex
+
+    index = MediaIndex(args.root)
+    if len(args.period) == 7:
+        rows = index.between(f"{args.period}-01", f"{args.period}-31")
+        entries = [(row["path"], row["date"][8:]) for row in rows]
+    else:
+        rows = index.day(args.period)
+        entries = [(row["path"], row["time"][:5]) for row in rows]
+    if not entries:
+        print("📭 No hay archivos en ese periodo")
+        return
+    result = render_recap(entries, os.path.join(args.root, ".recaps", args.period),
+                          opener=lambda relative: media_tiering.media_source(args.root, relative))
+    print(f"✅ {result['tiles']} miniaturas, {result['frames']} archivos en el timelapse "
+          f"en {result['elapsed_ms'] / 1000:.1f}s: {result['collage']} {result['timelapse']}")
+
+
+if __name__ == "__main__":
+    main()
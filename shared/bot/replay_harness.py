@@ -0,0 +1,660 @@
+"""
+replay_harness.py - Simulador de días completos con reloj virtual
+
+Ejecuta la lógica real de bot.py (schedule_today, send_missed_notifications_in_window,
+el job daily_schedule de medianoche, photo_handler...) contra un reloj virtual y un
+scheduler/bot de Telegram simulados. Permite simular días o semanas de planes y envíos
+en segundos y sirve también como prueba de carga con muchos usuarios.
+
+Uso:
+    python replay_harness.py --days 7 --users 20 --seed 42
+    python replay_harness.py --days 3 --record envios.jsonl      # guardar el flujo generado
+    python replay_harness.py --days 3 --replay envios.jsonl --seed 42  # reproducirlo
+
+Formato del flujo (JSONL, una actualización por línea):
+    {"at": "2024-01-01T10:32:00", "user": 0, "kind": "photo", "width": 4032, "height": 3024, "file_size": 2500000}
+    kind: photo | video | document | text  (document requiere "file_name")
+
+Salida: precisión de las notificaciones respecto al plan, ventanas perdidas,
+respuestas del bot y uso de recursos (tiempo real, CPU, pico de RSS).
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+import contextlib
+import importlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+
+# Reloj virtual que sustituye a bot.get_current_datetime
+class VirtualClock:
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def set(self, value):
+        # El tiempo virtual nunca retrocede
+        if value > self.current:
+            self.current = value
+
+
+# Scheduler mínimo compatible con el uso que hace bot.py de AsyncIOScheduler
+class VirtualScheduler:
+    def __init__(self, clock):
+        self.clock = clock
+        self.jobs = {}
+        self._counter = 0
+
+    def _localize(self, value, tz):
+        if hasattr(tz, "localize"):
+            return tz.localize(value)
+        return value.replace(tzinfo=tz)
+
+    def _next_fire(self, trigger, previous=None):
+        tz = getattr(trigger, "timezone", None)
+        now = self._localize(self.clock.now(), tz) if tz else self.clock.now()
+        prev = self._localize(previous, tz) if (previous and tz) else previous
+        next_time = trigger.get_next_fire_time(prev, now)
+        if next_time is None:
+            return None
+        if tz:
+            return next_time.astimezone(tz).replace(tzinfo=None)
+        # DateTrigger no guarda la zona: su fecha ya viene localizada a la zona del sistema
+        return next_time.astimezone().replace(tzinfo=None) if next_time.tzinfo else next_time
+
+    def add_job(self, func, trigger, args=None, kwargs=None, id=None, replace_existing=False, **options):
+        self._counter += 1
+        job_id = id or f"job_{self._counter}"
+        if job_id in self.jobs and not replace_existing:
+            raise ValueError(f"Job duplicado: {job_id}")
+        job = SimpleNamespace(
+            id=job_id,
+            func=func,
+            trigger=trigger,
+            args=list(args or []),
+            kwargs=dict(kwargs or {}),
+            options=options,
+            next_run_time=None,
+        )
+        job.next_run_time = self._next_fire(trigger)
+        self.jobs[job_id] = job
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_jobs(self):
+        return sorted(
+            (job for job in self.jobs.values() if job.next_run_time),
+            key=lambda job: job.next_run_time,
+        )
+
+    def remove_job(self, job_id):
+        self.jobs.pop(job_id, None)
+
+    def next_due(self):
+        jobs = self.get_jobs()
+        return jobs[0] if jobs else None
+
+    async def run_job(self, job):
+        fire_time = job.next_run_time
+        result = job.func(*job.args, **job.kwargs)
+        if asyncio.iscoroutine(result):
+            await result
+        # El job puede haberse reemplazado durante su propia ejecución
+        if self.jobs.get(job.id) is job:
+            job.next_run_time = self._next_fire(job.trigger, fire_time)
+            if job.next_run_time is None:
+                self.jobs.pop(job.id, None)
+
+
+# Bot de Telegram simulado: registra todos los envíos
+class VirtualBot:
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+        self._message_id = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return self._record("send_message", chat_id, text=text, **kwargs)
+
+    def _record(self, method, chat_id, **kwargs):
+        self._message_id += 1
+        self.sent.append((self.clock.now(), method, chat_id, kwargs.get("text") or kwargs.get("caption") or ""))
+        return SimpleNamespace(message_id=self._message_id, chat_id=chat_id, photo=[], video=None, document=None)
+
+    def __getattr__(self, name):
+        # Cualquier otro send_* (fotos, álbumes, documentos...) se registra igual
+        if name.startswith("send_"):
+            async def sender(chat_id, *args, **kwargs):
+                return self._record(name, chat_id, **kwargs)
+            return sender
+        raise AttributeError(name)
+
+
+# Ficheros simulados que devuelve get_file()
+class VirtualFile:
+    def __init__(self, source_path, file_id):
+        self.source_path = source_path
+        self.file_id = file_id
+        self.file_path = source_path
+
+    async def download_to_drive(self, custom_path=None):
+        shutil.copyfile(self.source_path, custom_path)
+        return custom_path
+
+
+class VirtualMedia:
+    def __init__(self, factory, event, file_id):
+        self.factory = factory
+        self.event = event
+        self.file_id = file_id
+        self.file_unique_id = event.get("file_unique_id", f"u{file_id}")
+        self.file_size = event.get("file_size", 2 * 1024 * 1024)
+        self.width = event.get("width", 0)
+        self.height = event.get("height", 0)
+        self.duration = event.get("duration", 0)
+        self.file_name = event.get("file_name")
+
+    async def get_file(self):
+        return VirtualFile(self.factory.sample_for(self.event), self.file_id)
+
+
+# Genera (y cachea) ficheros de muestra para cada tipo de contenido
+class SampleFactory:
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.cache = {}
+
+    def sample_for(self, event):
+        kind = event["kind"]
+        if kind == "document":
+            extension = os.path.splitext(event.get("file_name", "x.bin"))[1].lower()
+            kind = "photo" if extension in (".jpg", ".jpeg", ".png") else "video"
+        if kind == "photo":
+            key = (kind, event.get("width", 0), event.get("height", 0))
+        else:
+            key = (kind, round(event.get("duration", 0)))
+        if key not in self.cache:
+            self.cache[key] = self._create(*key)
+        return self.cache[key]
+
+    def _create(self, kind, *params):
+        path = os.path.join(self.workdir, f"sample_{kind}_" + "x".join(str(p) for p in params))
+        if kind == "photo":
+            path += ".jpg"
+            try:
+                from PIL import Image
+                width, height = params
+                Image.new("RGB", (max(width, 1), max(height, 1)), (90, 120, 160)).save(path, "JPEG", quality=70)
+                return path
+            except ImportError:
+                pass
+        else:
+            path += ".mp4"
+            try:
+                import cv2
+                import numpy as np
+                # Video diminuto a 5fps con la duración pedida
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 5, (64, 64))
+                frame = np.full((64, 64, 3), 128, dtype=np.uint8)
+                for _ in range(max(1, params[0] * 5)):
+                    writer.write(frame)
+                writer.release()
+                return path
+            except ImportError:
+                pass
+        # Contenido opaco: las validaciones lo tratan como "no detectado"
+        with open(path, "wb") as f:
+            f.write(os.urandom(4096))
+        return path
+
+
+# Generador reactivo de envíos: responde a las notificaciones como lo haría un usuario
+class SubmissionGenerator:
+    def __init__(self, rng, args):
+        self.rng = rng
+        self.args = args
+
+    def on_notification(self, now, entry):
+        if self.rng.random() < self.args.skip_rate:
+            return []
+        delay = min(self.rng.expovariate(1.0 / self.args.mean_delay), self.args.max_delay)
+        kind = "photo" if entry.get("type") == "foto" else "video"
+        if self.rng.random() < self.args.wrong_type_rate:
+            kind = "video" if kind == "photo" else "photo"
+        events = [self._event(now + timedelta(minutes=delay), kind)]
+        if self.rng.random() < self.args.album_rate:
+            # Álbum: varios elementos con el mismo media_group_id en el mismo instante
+            group_id = f"album{self.rng.getrandbits(32):x}"
+            events[0]["media_group_id"] = group_id
+            for _ in range(self.rng.randint(1, 4)):
+                events.append(dict(self._event(events[0]["at"], kind), media_group_id=group_id))
+            return events
+        if self.rng.random() < self.args.duplicate_rate:
+            # Reenvío del mismo contenido (red inestable o usuario impaciente)
+            events.append(dict(events[0], at=events[0]["at"] + timedelta(seconds=self.rng.randint(5, 120))))
+        return events
+
+    def noise_for_day(self, day_start):
+        events = []
+        for _ in range(self.args.noise_per_day):
+            at = day_start + timedelta(minutes=self.rng.randint(0, 24 * 60 - 1))
+            events.append(self._event(at, self.rng.choice(["photo", "video", "text"])))
+        return events
+
+    def _event(self, at, kind):
+        event = {"at": at, "kind": kind, "file_size": self.rng.randint(500_000, 6_000_000)}
+        if kind == "photo":
+            low_res = self.rng.random() < self.args.low_res_rate
+            event.update(width=1280 if low_res else 4032, height=720 if low_res else 3024)
+        elif kind == "video":
+            event["duration"] = round(self.rng.uniform(3, 25), 1)
+        else:
+            event["text"] = "hola"
+        event["file_unique_id"] = f"g{self.rng.getrandbits(48):x}"
+        return event
+
+
+def load_stream(path):
+    events = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            event["at"] = datetime.fromisoformat(event["at"])
+            events.append(event)
+    return events
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class UserSimulation:
+    """Simula a un usuario (con su propio directorio de datos) durante N días"""
+
+    def __init__(self, bot, args, index, workdir, samples, stream, recorder):
+        self.bot = bot
+        self.args = args
+        self.index = index
+        self.user_id = 1000 + index
+        self.data_path = os.path.join(workdir, f"user_{index:04d}")
+        self.samples = samples
+        self.stream = stream
+        self.recorder = recorder
+        self.rng = random.Random((args.seed or 0) * 7919 + index)
+
+        self.start = args.start
+        self.end = args.start + timedelta(days=args.days)
+        self.clock = VirtualClock(self.start)
+        self.scheduler = VirtualScheduler(self.clock)
+        self.telegram = VirtualBot(self.clock)
+        self.app = SimpleNamespace(bot=self.telegram, scheduler=self.scheduler, bot_data={})
+        self.generator = SubmissionGenerator(self.rng, args)
+
+        self.queue = []
+        self.sequence = 0
+        self.update_id = 0
+        self.notifications = []
+        self.handler_latencies = []
+        self.job_latencies = []
+        self.ingest_stats = {}
+
+    def push(self, event):
+        if self.start <= event["at"] < self.end:
+            self.sequence += 1
+            heapq.heappush(self.queue, (event["at"], self.sequence, event))
+
+    def build_update(self, event):
+        self.update_id += 1
+        message = SimpleNamespace(
+            message_id=self.update_id,
+            photo=[],
+            video=None,
+            document=None,
+            text=None,
+            media_group_id=event.get("media_group_id"),
+        )
+        kind = event["kind"]
+        file_id = f"replay-{self.index}-{self.update_id}"
+        if kind == "photo":
+            message.photo = [VirtualMedia(self.samples, event, file_id)]
+        elif kind == "video":
+            message.video = VirtualMedia(self.samples, event, file_id)
+        elif kind == "document":
+            message.document = VirtualMedia(self.samples, event, file_id)
+        else:
+            message.text = event.get("text", "texto")
+        user = SimpleNamespace(id=self.user_id)
+        return SimpleNamespace(update_id=self.update_id, effective_user=user, message=message)
+
+    def install(self):
+        """Apunta el módulo bot a este usuario y a su reloj"""
+        bot = self.bot
+        bot.SAVE_PATH = self.data_path
+        bot.USER_ID = self.user_id
+        bot.get_current_datetime = self.clock.now
+        bot.running_app = self.app
+        if hasattr(bot, "reset_runtime_state"):
+            bot.reset_runtime_state()
+        os.makedirs(self.data_path, exist_ok=True)
+
+        simulation = self
+        original = self.original_send_photo_request
+
+        async def traced_send_photo_request(app, notification_entry):
+            simulation.on_notification(notification_entry)
+            await original(app, notification_entry)
+
+        bot.send_photo_request = traced_send_photo_request
+
+    def on_notification(self, entry):
+        now = self.clock.now()
+        planned = now.replace(hour=entry.get("hour", 8), minute=entry.get("minute", 0), second=0, microsecond=0)
+        plan = self.bot.load_plan_json() or []
+        in_plan = any(
+            e.get("hour") == entry.get("hour") and e.get("minute") == entry.get("minute") and e.get("type") == entry.get("type")
+            for e in plan
+        )
+        self.notifications.append({
+            "date": now.strftime("%Y-%m-%d"),
+            "slot": (entry.get("hour"), entry.get("minute")),
+            "error_s": (now - planned).total_seconds(),
+            "stale": not in_plan,
+        })
+        if self.stream is None and in_plan:
+            for event in self.generator.on_notification(now, entry):
+                self.push(event)
+
+    async def run(self):
+        bot = self.bot
+        self.install()
+
+        if self.stream is not None:
+            for event in self.stream:
+                if event.get("user", 0) == self.index:
+                    self.push(dict(event))
+        else:
+            day = self.start.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day < self.end:
+                for event in self.generator.noise_for_day(day):
+                    self.push(event)
+                day += timedelta(days=1)
+
+        # Arranque equivalente a main()
+        await self._timed(self.job_latencies, bot.schedule_today(self.app, self.scheduler))
+        bot.register_daily_jobs(self.scheduler, self.app)
+
+        while True:
+            job = self.scheduler.next_due()
+            job_time = job.next_run_time if job else None
+            event_time = self.queue[0][0] if self.queue else None
+            candidates = [t for t in (job_time, event_time) if t is not None]
+            if not candidates or min(candidates) >= self.end:
+                break
+
+            if job_time is not None and (event_time is None or job_time <= event_time):
+                self.clock.set(job_time)
+                await self._timed(self.job_latencies, self.scheduler.run_job(job))
+            else:
+                _, _, event = heapq.heappop(self.queue)
+                self.clock.set(event["at"])
+                if self.recorder:
+                    self.recorder.write(json.dumps(dict(event, at=event["at"].isoformat(), user=self.index)) + "\n")
+                context = SimpleNamespace(bot=self.telegram, application=self.app, args=[], bot_data=self.app.bot_data)
+                await self._timed(self.handler_latencies, bot.photo_handler(self.build_update(event), context))
+                # Los elementos de un mismo álbum llegan seguidos antes de procesarse
+                next_event = self.queue[0][2] if self.queue else None
+                group_id = event.get("media_group_id")
+                if not (group_id and next_event and next_event.get("media_group_id") == group_id):
+                    await self._drain()
+
+        self.clock.set(self.end)
+        await self._drain()
+        pipeline = getattr(self.app, "ingest_pipeline", None)
+        if pipeline is not None:
+            self.ingest_stats = pipeline.snapshot()
+            await pipeline.stop()
+        return self.summary()
+
+    async def _drain(self):
+        # Cierra los álbumes pendientes y espera a que el pipeline termine los envíos en curso
+        collector = getattr(self.app, "media_groups", None)
+        if collector is not None:
+            await collector.flush()
+        pipeline = getattr(self.app, "ingest_pipeline", None)
+        if pipeline is not None:
+            await pipeline.join()
+
+    async def _timed(self, sink, awaitable):
+        started = time.perf_counter()
+        await awaitable
+        sink.append((time.perf_counter() - started) * 1000)
+
+    def summary(self):
+        planned = 0
+        delivered = 0
+        missed = 0
+        plan_dir = os.path.join(self.data_path, "planificacion")
+        if os.path.isdir(plan_dir):
+            for name in sorted(os.listdir(plan_dir)):
+                # Los planes generados por adelantado para después de la simulación no cuentan
+                if not name.endswith(".json") or name[:-5] >= self.end.strftime("%Y-%m-%d"):
+                    continue
+                with open(os.path.join(plan_dir, name), "r") as f:
+                    plan = json.load(f)
+                planned += len(plan)
+                delivered += sum(1 for e in plan if e.get("delivered", False))
+                missed += sum(1 for e in plan if not e.get("delivered", False))
+
+        sends = {}
+        for n in self.notifications:
+            key = (n["date"], n["slot"])
+            sends[key] = sends.get(key, 0) + 1
+
+        return {
+            "planned": planned,
+            "delivered": delivered,
+            "missed_windows": missed,
+            "notifications": len(self.notifications),
+            "duplicates": sum(count - 1 for count in sends.values() if count > 1),
+            "stale": sum(1 for n in self.notifications if n["stale"]),
+            "errors_s": [n["error_s"] for n in self.notifications if not n["stale"]],
+            "messages": len(self.telegram.sent),
+            "updates": self.update_id,
+            "handler_ms": self.handler_latencies,
+            "job_ms": self.job_latencies,
+            "ingest": self.ingest_stats,
+        }
+
+
+async def run_simulation(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="replay_")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:replay")
+    os.environ.setdefault("TELEGRAM_USER_ID", "1000")
+    os.environ.setdefault("DATA_PATH", workdir)
+
+    random.seed(args.seed)
+    sink = None if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(sink or sys.stdout):
+        bot = importlib.import_module("bot")
+    original_send_photo_request = bot.send_photo_request
+    original_clock = bot.get_current_datetime
+
+    stream = load_stream(args.replay) if args.replay else None
+    recorder = open(args.record, "w") if args.record else None
+    samples = SampleFactory(workdir)
+
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    results = []
+    try:
+        for index in range(args.users):
+            simulation = UserSimulation(bot, args, index, workdir, samples, stream, recorder)
+            simulation.original_send_photo_request = original_send_photo_request
+            with contextlib.redirect_stdout(sink or sys.stdout):
+                results.append(await simulation.run())
+    finally:
+        bot.send_photo_request = original_send_photo_request
+        bot.get_current_datetime = original_clock
+        if recorder:
+            recorder.close()
+        if sink:
+            sink.close()
+
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    errors = [abs(e) for r in results for e in r["errors_s"]]
+    on_time = [e for e in errors if e < 60]
+    handler_ms = [v for r in results for v in r["handler_ms"]]
+    job_ms = [v for r in results for v in r["job_ms"]]
+    total = lambda key: sum(r[key] for r in results)
+
+    # Tiempos por etapa del pipeline de ingesta, agregados entre usuarios
+    ingest = {}
+    for r in results:
+        for stage, stats in r["ingest"].items():
+            merged = ingest.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            merged["count"] += stats["count"]
+            merged["total_ms"] += stats["avg_ms"] * stats["count"]
+            merged["max_ms"] = max(merged["max_ms"], stats["max_ms"])
+    ingest_ms = {
+        stage: {
+            "count": stats["count"],
+            "avg": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0.0,
+            "max": round(stats["max_ms"], 2),
+        }
+        for stage, stats in ingest.items()
+    }
+
+    report = {
+        "users": args.users,
+        "days": args.days,
+        "simulated_hours": args.users * args.days * 24,
+        "plan_slots": total("planned"),
+        "delivered": total("delivered"),
+        "missed_windows": total("missed_windows"),
+        "notifications_sent": total("notifications"),
+        "duplicate_notifications": total("duplicates"),
+        "stale_notifications": total("stale"),
+        "timing": {
+            "on_time": len(on_time),
+            "late": len(errors) - len(on_time),
+            "mean_error_s": round(statistics.mean(errors), 1) if errors else 0.0,
+            "max_error_s": round(max(errors), 1) if errors else 0.0,
+        },
+        "updates_processed": total("updates"),
+        "bot_messages": total("messages"),
+        "handler_latency_ms": {
+            "p50": round(percentile(handler_ms, 0.50), 2),
+            "p95": round(percentile(handler_ms, 0.95), 2),
+            "max": round(max(handler_ms), 2) if handler_ms else 0.0,
+        },
+        "ingest_stage_ms": ingest_ms,
+        "job_latency_ms": {
+            "p50": round(percentile(job_ms, 0.50), 2),
+            "p95": round(percentile(job_ms, 0.95), 2),
+            "max": round(max(job_ms), 2) if job_ms else 0.0,
+        },
+        "resources": {
+            "wall_s": round(wall, 2),
+            "cpu_s": round(cpu, 2),
+            "peak_rss_mb": round(peak_rss_mb, 1),
+            "speedup": round(args.users * args.days * 86400 / wall, 0) if wall > 0 else 0,
+            "updates_per_s": round(total("updates") / wall, 1) if wall > 0 else 0,
+        },
+        "workdir": workdir,
+    }
+    return report
+
+
+def print_report(report):
+    timing = report["timing"]
+    resources = report["resources"]
+    print("📊 **Resultado de la simulación**")
+    print(f"• Usuarios: {report['users']} | Días: {report['days']} ({report['simulated_hours']}h simuladas)")
+    print(f"• Ventanas planificadas: {report['plan_slots']} | Entregadas: {report['delivered']} | Perdidas: {report['missed_windows']}")
+    print(f"• Notificaciones enviadas: {report['notifications_sent']} "
+          f"(duplicadas: {report['duplicate_notifications']}, obsoletas: {report['stale_notifications']})")
+    print(f"• Precisión: {timing['on_time']} puntuales, {timing['late']} tardías "
+          f"(error medio {timing['mean_error_s']}s, máximo {timing['max_error_s']}s)")
+    print(f"• Actualizaciones procesadas: {report['updates_processed']} | Mensajes del bot: {report['bot_messages']}")
+    print(f"• Latencia handler: p50 {report['handler_latency_ms']['p50']}ms, "
+          f"p95 {report['handler_latency_ms']['p95']}ms, máx {report['handler_latency_ms']['max']}ms")
+    for stage, stats in report["ingest_stage_ms"].items():
+        print(f"  - Ingesta {stage}: {stats['count']} envíos, media {stats['avg']}ms, máx {stats['max']}ms")
+    print(f"• Latencia jobs: p50 {report['job_latency_ms']['p50']}ms, "
+          f"p95 {report['job_latency_ms']['p95']}ms, máx {report['job_latency_ms']['max']}ms")
+    print(f"• Recursos: {resources['wall_s']}s reales, {resources['cpu_s']}s CPU, "
+          f"pico RSS {resources['peak_rss_mb']}MB, x{resources['speedup']:.0f} tiempo real, "
+          f"{resources['updates_per_s']} act/s")
+    if report["workdir"]:
+        print(f"• Datos simulados en: {report['workdir']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador de días completos del bot con reloj virtual")
+    parser.add_argument("--days", type=int, default=1, help="Días a simular")
+    parser.add_argument("--users", type=int, default=1, help="Usuarios simulados (cada uno con su directorio)")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="Inicio de la simulación (ISO). Por defecto mañana a las 07:00")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla para planes y envíos reproducibles")
+    parser.add_argument("--replay", help="Reproducir un flujo de actualizaciones grabado (JSONL)")
+    parser.add_argument("--record", help="Grabar el flujo de actualizaciones generado (JSONL)")
+    parser.add_argument("--workdir", help="Directorio de datos simulado (por defecto temporal)")
+    parser.add_argument("--json", help="Guardar el informe en JSON")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida del bot")
+    parser.add_argument("--keep", action="store_true", help="No borrar el directorio temporal al terminar")
+    # Comportamiento del usuario simulado
+    parser.add_argument("--skip-rate", type=float, default=0.15, help="Probabilidad de ignorar una notificación")
+    parser.add_argument("--mean-delay", type=float, default=25.0, help="Retraso medio de respuesta (minutos)")
+    parser.add_argument("--max-delay", type=float, default=240.0, help="Retraso máximo de respuesta (minutos)")
+    parser.add_argument("--wrong-type-rate", type=float, default=0.05, help="Probabilidad de enviar el tipo equivocado")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="Probabilidad de reenviar el mismo contenido")
+    parser.add_argument("--album-rate", type=float, default=0.1, help="Probabilidad de responder con un álbum")
+    parser.add_argument("--low-res-rate", type=float, default=0.05, help="Probabilidad de foto con resolución baja")
+    parser.add_argument("--noise-per-day", type=int, default=2, help="Envíos aleatorios fuera de plan por día")
+    args = parser.parse_args(argv)
+    if args.start is None:
+        tomorrow = datetime.now() + timedelta(days=1)
+        args.start = tomorrow.replace(hour=7, minute=0, second=0, microsecond=0)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cleanup = args.workdir is None and not args.keep
+    report = asyncio.run(run_simulation(args))
+    if cleanup:
+        shutil.rmtree(report["workdir"], ignore_errors=True)
+        report["workdir"] = None
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
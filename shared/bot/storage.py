@@ -0,0 +1,268 @@
+"""
+storage.py - Acceso al disco sin bloquear el bucle de eventos del bot
+
+Las fotos viven en un NAS cuya latencia varía mucho: un json.dump, un chown o un
+shutil.move que tarda segundos en el hilo del bucle congela el polling de Telegram
+y las notificaciones programadas. Storage ejecuta esas llamadas en un pool de
+hilos propio (no el de asyncio.to_thread, que comparten la decodificación y las
+consultas), con un tiempo máximo por operación y métricas de latencia por tipo:
+
+    storage = Storage(workers=4, timeout=10)
+    plan = await storage.run("plan.load", load_plan_json)
+    await storage.permissions([dir_path, file_path])   # se agrupan con otras llamadas cercanas
+    storage.snapshot()  # {"plan.load": {"count", "avg_ms", "p95_ms", "max_ms", "slow", "timeouts", "errors"}}
+
+Si una operación supera el tiempo máximo se lanza StorageTimeout; el hilo sigue
+con ella (no se puede interrumpir una llamada al sistema) pero el bot continúa.
+Por eso las escrituras que no se pueden repetir (mover, permisos, el plan) van
+con timeout=0: un timeout diría que fallaron mientras terminan en segundo plano.
+
+    python storage.py /data/fotos      # mide la latencia del volumen (stat, escritura, chmod)
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+LATENCY_SAMPLES = 256  # Latencias recientes por operación para los percentiles
+
+
+class StorageTimeout(TimeoutError):
+    """Una operación de disco superó el tiempo máximo"""
+
+    def __init__(self, op, timeout):
+        super().__init__(f"{op}: sin respuesta del disco en {timeout:.1f}s")
+        self.op = op
+
+
+class _OpStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.slow = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, elapsed_ms, slow_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.slow += 1 if elapsed_ms >= slow_ms else 0
+        self.recent.append(elapsed_ms)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "p95_ms": recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+            "max_ms": self.max_ms,
+            "slow": self.slow,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+class Storage:
+    """Pool de hilos para el disco con tiempo máximo y métricas por operación"""
+
+    def __init__(self, workers=4, timeout=10.0, slow_ms=500, batch_ms=5, finalize=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storage")
+        self.workers = workers
+        self.timeout = timeout
+        self.slow_ms = slow_ms
+        self.batch_delay = batch_ms / 1000
+        self.finalize = finalize  # Función(ruta) que aplica dueño y permisos a una ruta
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.pending = {}  # Rutas esperando el próximo lote de permisos -> futuros
+        self.flush_handle = None
+
+    def _record(self, op, elapsed_ms=None, error=False, timed_out=False):
+        with self.lock:
+            stats = self.stats.setdefault(op, _OpStats())
+            if timed_out:
+                stats.timeouts += 1
+            elif error:
+                stats.errors += 1
+            if elapsed_ms is not None:
+                stats.add(elapsed_ms, self.slow_ms)
+
+    def _timed(self, op, function, args, kwargs):
+        # Se mide en el hilo: la latencia es la del disco, no la espera en la cola del pool
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            self._record(op, error=True)
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._record(op, elapsed_ms)
+            if elapsed_ms >= self.slow_ms:
+                print(f"🐢 Disco lento: {op} tardó {elapsed_ms:.0f}ms", flush=True)
+
+    async def run(self, op, function, *args, timeout=None, **kwargs):
+        """Ejecuta function(*args, **kwargs) en el pool del disco; op nombra la métrica"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(self._timed, op, function, args, kwargs))
+        limit = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, limit) if limit else await future
+        except asyncio.TimeoutError:
+            self._record(op, timed_out=True)
+            print(f"⏱️ Sin respuesta del disco en {limit:.1f}s ({op})", flush=True)
+            raise StorageTimeout(op, limit) from None
+
+    # --- Operaciones habituales -------------------------------------------------------
+
+    async def read_json(self, path, op="json.read"):
+        return await self.run(op, read_json, path)
+
+    async def write_json(self, path, data, op="json.write", **kwargs):
+        return await self.run(op, write_json_atomic, path, data, **kwargs)
+
+    async def read_bytes(self, path, op="read"):
+        return await self.run(op, read_bytes, path)
+
+    async def makedirs(self, path, mode=0o775):
+        return await self.run("makedirs", os.makedirs, path, mode=mode, exist_ok=True)
+
+    async def exists(self, path):
+        return await self.run("stat", os.path.exists, path)
+
+    async def stat(self, path):
+        return await self.run("stat", os.stat, path)
+
+    async def unlink(self, path):
+        return await self.run("unlink", os.unlink, path)
+
+    async def listdir(self, path):
+        return await self.run("listdir", os.listdir, path)
+
+    async def walk(self, path):
+        """os.walk completo en el pool: [(raíz, directorios, archivos), ...]"""
+        return await self.run("walk", lambda root: list(os.walk(root)), path)
+
+    # --- Permisos en lote -------------------------------------------------------------
+
+    async def permissions(self, paths):
+        """Aplica finalize a las rutas; las peticiones de los próximos batch_ms van en una sola tarea.
+
+        Un álbum guarda varios archivos en el mismo directorio: cada ruta (y su
+        cadena de directorios) se cambia una vez por lote en lugar de una por archivo.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for path in paths:
+            future = self.pending.get(path)
+            if future is None:
+                future = self.pending[path] = loop.create_future()
+            futures.append(future)
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.batch_delay, self._flush_permissions)
+        await asyncio.gather(*futures)
+
+    def _flush_permissions(self):
+        batch, self.pending, self.flush_handle = self.pending, {}, None
+        # Sin tiempo máximo: el lote sigue aplicándose aunque se dejara de esperar
+        task = asyncio.ensure_future(self.run("permissions", self._apply_permissions, list(batch), timeout=0))
+        task.add_done_callback(functools.partial(_resolve_batch, batch))
+
+    def _apply_permissions(self, paths):
+        # Directorios primero (el orden de sorted pone cada padre antes que su contenido)
+        for path in sorted(paths):
+            self.finalize(path)
+        return len(paths)
+
+    def snapshot(self):
+        with self.lock:
+            return {op: stats.snapshot() for op, stats in sorted(self.stats.items())}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _resolve_batch(batch, task):
+    error = None if task.cancelled() else task.exception()
+    for future in batch.values():
+        if future.done():
+            continue
+        if task.cancelled():
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_json_atomic(path, data, indent=2):
+    """Escribe en un temporal del mismo directorio y lo renombra: nunca queda un JSON a medias"""
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def parent_chain(path, root):
+    """Directorios desde el de path hasta root (incluidos), para aplicar permisos a toda la cadena"""
+    chain = []
+    current = os.path.dirname(path)
+    while current and current != os.path.dirname(current):
+        chain.append(current)
+        if current == root:
+            break
+        current = os.path.dirname(current)
+    return chain
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide la latencia del volumen de datos con el pool del disco")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    async def probe():
+        storage = Storage(workers=args.workers, timeout=30, finalize=lambda path: os.chmod(path, 0o664))
+        probe_path = os.path.join(args.root, ".index", ".storage-probe.json")
+        await storage.makedirs(os.path.dirname(probe_path))
+        for number in range(args.rounds):
+            await storage.write_json(probe_path, {"round": number})
+            await storage.read_json(probe_path)
+            await storage.stat(args.root)
+            await storage.permissions([probe_path])
+        await storage.unlink(probe_path)
+        storage.shutdown()
+        for op, stats in storage.snapshot().items():
+            print(f"{op:12} {stats['count']:5d} ops  media {stats['avg_ms']:7.2f}ms  "
+                  f"p95 {stats['p95_ms']:7.2f}ms  máx {stats['max_ms']:7.2f}ms")
+
+    asyncio.run(probe())
+
+
+if __name__ == "__main__":
+    main()
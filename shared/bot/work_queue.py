@@ -0,0 +1,350 @@
+"""
+work_queue.py - Cola de tareas persistente (SQLite) y procesos trabajadores
+
+El bot (proceso principal) recibe las actualizaciones de Telegram y programa las
+notificaciones; el trabajo de CPU de cada archivo recibido (validación, filtro de
+calidad, decodificación HEIF, metadatos) se encola aquí y lo ejecutan procesos
+aparte, uno por núcleo si se quiere, sin competir por el GIL del bot.
+
+La cola vive en SAVE_PATH/.index/work.db y sobrevive a los reinicios:
+
+- put_many() guarda la tarea como "pending"; un trabajador la reclama (claim) con un
+  plazo (lease). Si el proceso muere, al vencer el plazo otro la vuelve a tomar
+  (hasta MAX_ATTEMPTS veces; después queda "failed").
+- El resultado se guarda con la tarea ("done"); quien la encoló la borra con
+  remove() cuando ya no la necesita. Así, si el bot se reinicia entre medias, las
+  tareas terminadas siguen ahí para retomarlas.
+
+Los manejadores se indican como "módulo:función" y cada trabajador los importa
+al arrancar; reciben el payload (dict) y devuelven un dict serializable en JSON.
+
+    python work_queue.py /data/fotos                          # estado de la cola
+    python work_queue.py /data/fotos --worker ingest=bot:analyze_ingest_task
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import argparse
+import importlib
+import threading
+import multiprocessing
+
+QUEUE_FILENAME = "work.db"
+LEASE_SECONDS = 120  # Tiempo máximo de una tarea antes de darla por perdida
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 0.2  # Espera de un trabajador sin tareas
+RESULT_TIMEOUT = LEASE_SECONDS * MAX_ATTEMPTS + 60  # Espera máxima de un resultado: todos los intentos y margen
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    job TEXT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job);
+"""
+
+
+def default_queue_path(save_path):
+    return os.path.join(save_path, ".index", QUEUE_FILENAME)
+
+
+def resolve_handler(spec):
+    """"módulo:función" -> función"""
+    module_name, _, function_name = spec.partition(":")
+    # Con "spawn" el script principal ya está cargado como __mp_main__: no se importa dos veces
+    main_module = sys.modules.get("__mp_main__")
+    main_file = getattr(main_module, "__file__", None) or ""
+    if os.path.splitext(os.path.basename(main_file))[0] == module_name:
+        return getattr(main_module, function_name)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class WorkQueue:
+    """Acceso a la cola. Una conexión por proceso, protegida con un lock (hilos)."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), mode=0o775, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def put_many(self, kind, payloads, job=None):
+        """Encola varias tareas en una transacción y devuelve sus ids en orden"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [self.conn.execute(
+                    "INSERT INTO tasks (kind, job, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, job, json.dumps(payload), now, now),
+                ).lastrowid for payload in payloads]
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def claim(self, worker, kinds, lease_seconds=LEASE_SECONDS):
+        """Reclama la tarea pendiente más antigua (o una con el plazo vencido): (id, kind, payload) o None"""
+        now = time.time()
+        placeholders = ", ".join("?" for _ in kinds)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")  # Un solo trabajador gana cada tarea
+            try:
+                row = self.conn.execute(
+                    f"SELECT id, kind, payload, attempts FROM tasks WHERE kind IN ({placeholders}) AND "
+                    "(state = 'pending' OR (state = 'running' AND lease_until < ?)) ORDER BY id LIMIT 1",
+                    (*kinds, now),
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= MAX_ATTEMPTS:
+                    self.conn.execute(
+                        "UPDATE tasks SET state = 'failed', result = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps({"error": f"abandonada tras {row['attempts']} intentos"}), now, row["id"]),
+                    )
+                    self.conn.execute("COMMIT")
+                    return self.claim(worker, kinds, lease_seconds)
+                self.conn.execute(
+                    "UPDATE tasks SET state = 'running', worker = ?, attempts = attempts + 1, "
+                    "lease_until = ?, updated_at = ? WHERE id = ?",
+                    (worker, now + lease_seconds, now, row["id"]),
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row["id"], row["kind"], json.loads(row["payload"])
+
+    def finish(self, task_id, result, failed=False):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE tasks SET state = ?, result = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                ("failed" if failed else "done", json.dumps(result, default=str), time.time(), task_id),
+            )
+
+    def results(self, task_ids):
+        """{id: (estado, resultado)} de las tareas ya terminadas (done o failed)"""
+        if not task_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in task_ids)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, state, result FROM tasks WHERE id IN ({placeholders}) AND state IN ('done', 'failed')",
+                list(task_ids),
+            ).fetchall()
+        return {row["id"]: (row["state"], json.loads(row["result"])) for row in rows}
+
+    def release_running(self):
+        """Devuelve a "pending" las tareas en curso (los trabajadores murieron con el bot)"""
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE tasks SET state = 'pending', worker = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE state = 'running'", (time.time(),)
+            ).rowcount
+
+    def jobs(self, kind):
+        """{job: [(id, payload), ...]} de todas las tareas guardadas de un tipo (para retomarlas)"""
+        grouped = {}
+        with self.lock:
+            for row in self.conn.execute("SELECT id, job, payload FROM tasks WHERE kind = ? ORDER BY id", (kind,)):
+                grouped.setdefault(row["job"], []).append((row["id"], json.loads(row["payload"])))
+        return grouped
+
+    def remove(self, task_ids):
+        if not task_ids:
+            return
+        placeholders = ", ".join("?" for _ in task_ids)
+        with self.lock:
+            self.conn.execute(f"DELETE FROM tasks WHERE id IN ({placeholders})", list(task_ids))
+
+    def counts(self):
+        with self.lock:
+            return {row["state"]: row["total"] for row in self.conn.execute(
+                "SELECT state, COUNT(*) AS total FROM tasks GROUP BY state"
+            )}
+
+
+# --- Trabajadores ------------------------------------------------------------------
+
+def run_worker(path, handlers, name, stop_event=None):
+    """Bucle de un trabajador: reclama, ejecuta y guarda el resultado hasta que se pida parar.
+
+    handlers: {kind: "módulo:función"}
+    """
+    functions = {kind: resolve_handler(spec) for kind, spec in handlers.items()}
+    queue = WorkQueue(path)
+    print(f"🔧 Trabajador {name} listo (pid {os.getpid()}): {', '.join(functions)}", flush=True)
+    try:
+        while stop_event is None or not stop_event.is_set():
+            task = queue.claim(name, list(functions))
+            if task is None:
+                time.sleep(POLL_SECONDS)
+                continue
+            task_id, kind, payload = task
+            try:
+                queue.finish(task_id, functions[kind](payload))
+            except Exception as e:
+                print(f"❌ Trabajador {name}: tarea {task_id} ({kind}) falló: {e}", flush=True)
+                queue.finish(task_id, {"error": str(e)}, failed=True)
+    finally:
+        queue.close()
+
+
+class WorkerPool:
+    """Procesos trabajadores ('spawn': no heredan el estado del bot); se relanzan si mueren"""
+
+    def __init__(self, path, handlers, count):
+        self.path = path
+        self.handlers = handlers
+        self.count = count
+        self.context = multiprocessing.get_context("spawn")
+        self.stop_event = self.context.Event()
+        self.processes = []
+        self.restarts = 0
+
+    def _spawn(self, number):
+        process = self.context.Process(
+            target=run_worker, args=(self.path, self.handlers, f"w{number}", self.stop_event),
+            name=f"ingesta-w{number}", daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self):
+        self.processes = [self._spawn(number) for number in range(self.count)]
+
+    def ensure(self):
+        """Relanza los trabajadores caídos; devuelve cuántos"""
+        restarted = 0
+        for number, process in enumerate(self.processes):
+            if not process.is_alive() and not self.stop_event.is_set():
+                print(f"⚠️ Trabajador w{number} terminó (código {process.exitcode}), relanzando", flush=True)
+                self.processes[number] = self._spawn(number)
+                restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def alive(self):
+        return sum(1 for process in self.processes if process.is_alive())
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+
+
+class ResultWaiter:
+    """Espera asíncrona de resultados: una sola consulta periódica por todas las tareas pendientes"""
+
+    def __init__(self, queue, interval=0.05, timeout=RESULT_TIMEOUT):
+        self.queue = queue
+        self.interval = interval
+        self.timeout = timeout
+        self.waiting = {}
+        self.task = None
+
+    async def wait(self, task_ids, timeout=None):
+        """Resultados de varias tareas en orden: [(estado, resultado), ...].
+
+        Las que no terminan en timeout segundos (por defecto el de la instancia)
+        se devuelven como ("failed", {"error": ...}): un envío nunca espera para siempre.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for task_id in task_ids:
+            future = self.waiting.get(task_id)
+            if future is None:
+                future = self.waiting[task_id] = loop.create_future()
+            futures.append(future)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._poll(), name="cola-resultados")
+        limit = self.timeout if timeout is None else timeout
+        if futures and limit:
+            _, pending = await asyncio.wait(futures, timeout=limit)
+            expired = {"error": f"sin resultado en {limit:.0f}s"}
+            for task_id, future in zip(task_ids, futures):
+                if future in pending:
+                    if self.waiting.get(task_id) is future:
+                        del self.waiting[task_id]
+                    future.set_result(("failed", expired))
+        return await asyncio.gather(*futures)
+
+    async def _poll(self):
+        while self.waiting:
+            await asyncio.sleep(self.interval)
+            try:
+                finished = await asyncio.to_thread(self.queue.results, list(self.waiting))
+            except Exception as e:
+                # Un fallo de la base no deja sin consultas a quien espera: se reintenta
+                print(f"⚠️ No se pudieron leer los resultados de la cola: {e}", flush=True)
+                await asyncio.sleep(1)
+                continue
+            for task_id, outcome in finished.items():
+                future = self.waiting.pop(task_id, None)
+                if future is not None and not future.done():
+                    future.set_result(outcome)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+def new_job_key():
+    return uuid.uuid4().hex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cola de tareas persistente del bot")
+    parser.add_argument("root", nargs="?", default=os.getenv("DATA_PATH", "/data/fotos"))
+    parser.add_argument("--worker", metavar="KIND=MÓDULO:FUNCIÓN", action="append",
+                        help="Ejecuta un trabajador para esos manejadores (ej. ingest=bot:analyze_ingest_task)")
+    parser.add_argument("--release", action="store_true", help="Devuelve a pendientes las tareas en curso")
+    args = parser.parse_args()
+
+    path = default_queue_path(args.root)
+    if args.worker:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        handlers = dict(spec.split("=", 1) for spec in args.worker)
+        try:
+            run_worker(path, handlers, f"cli-{os.getpid()}")
+        except KeyboardInterrupt:
+            pass
+        return
+
+    queue = WorkQueue(path)
+    if args.release:
+        print(f"♻️ {queue.release_running()} tareas devueltas a la cola")
+    counts = queue.counts()
+    print(f"📋 {path}: " + (", ".join(f"{state} {total}" for state, total in sorted(counts.items())) or "vacía"))
+
+
+if __name__ == "__main__":
+    main()
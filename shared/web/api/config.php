@@ -220,10 +220,10 @@ function hasValidFiles($dirPath) {
         return false;
     }
 
-    $files = glob($dirPath . '/*.{jpg,jpeg,png,mp4}', GLOB_BRACE);
+    $files = glob($dirPath . '/*.{jpg,jpeg,png,webp,mp4}', GLOB_BRACE);
     return !empty(array_filter($files, function($file) {
         $filename = basename($file);
-        return preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename);
+        return preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename);
     }));
 }
 
@@ -243,7 +243,7 @@ function getValidFilesInDirectory($dirPath, $relativePath = '') {
     }
 
     while (false !== ($file = readdir($handle))) {
-        if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $file)) {
+        if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $file)) {
             $fullPath = $dirPath . '/' . $file;
             $isVideo = preg_match('/\.mp4$/i', $file);
 
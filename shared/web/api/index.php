@@ -20,6 +20,8 @@ if ($_SERVER['REQUEST_METHOD'] === 'OPTIONS') {
 // Incluir archivos de configuración y utilidades
 require_once __DIR__ . '/config.php';
 require_once __DIR__ . '/utils/ResponseHelper.php';
+require_once __DIR__ . '/utils/PackStore.php';
+require_once __DIR__ . '/utils/ChangeFeed.php';
 require_once __DIR__ . '/utils/FileManager.php';
 
 // Configurar ResponseHelper
@@ -47,6 +49,7 @@ class APIRouter {
         $this->routes = [
             // Rutas básicas
             'GET /photos/{year}/{month}/{day}' => 'photos.php',
+            'GET /media/{year}/{month}/{day}/{file}' => 'media.php', // Archivos del archivo frío
             'GET /search' => 'search.php',
             'GET /stats' => 'stats.php',
             'GET /dates' => 'dates.php',
@@ -55,6 +58,7 @@ class APIRouter {
             'GET /calendar/{year}/{month}' => 'calendar.php',
             'GET /calendar' => 'calendar.php', // Mes actual por defecto
             'GET /feed' => 'feed.php',
+            'GET /changes' => 'changes.php', // Registro de cambios del bot (SSE o ?since=)
             'GET /comments/{date}' => 'comments.php',
             'POST /comments/{date}' => 'comments.php',
             'DELETE /comments/{date}' => 'comments.php',
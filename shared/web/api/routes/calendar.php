@@ -44,8 +44,15 @@ function getCalendarData($basePath, $year, $month) {
 
             $handle = opendir($dirPath);
             if ($handle) {
+                // Sueltos y empaquetados en el tar del mes (archivo frío)
+                $names = array_keys(PackStore::dayMembers($dirPath));
                 while (false !== ($file = readdir($handle))) {
-                    if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $file)) {
+                    $names[] = $file;
+                }
+                closedir($handle);
+
+                foreach (array_unique($names) as $file) {
+                    if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $file)) {
                         $isVideo = preg_match('/\.mp4$/i', $file);
 
                         // Extraer timestamp
@@ -74,7 +81,6 @@ function getCalendarData($basePath, $year, $month) {
                         }
                     }
                 }
-                closedir($handle);
 
                 if (!empty($files)) {
                     $dayData['has_content'] = true;
@@ -0,0 +1,29 @@
+<?php
+// web/api/changes.php - Registro de cambios del bot
+// Con ?since=N devuelve JSON; sin él abre un flujo Server-Sent Events
+
+$photosBasePath = $_ENV['PHOTOS_PATH'] ?? '/data/fotos';
+
+// EventSource reenvía la última seq recibida al reconectar
+$since = $_GET['since'] ?? $_SERVER['HTTP_LAST_EVENT_ID'] ?? null;
+
+if (isset($_GET['since'])) {
+    $limit = min(1000, max(1, intval($_GET['limit'] ?? 500)));
+    $events = ChangeFeed::since($photosBasePath, intval($since), $limit);
+    $state = ChangeFeed::state($photosBasePath);
+    echo json_encode([
+        'events' => $events,
+        'seq' => $state['seq'] ?? 0,
+        'has_more' => count($events) === $limit,
+        'generated_at' => date('c')
+    ]);
+    exit();
+}
+
+// Primera conexión: solo lo nuevo desde ahora
+if ($since === null) {
+    $state = ChangeFeed::state($photosBasePath);
+    $since = $state['seq'] ?? 0;
+}
+
+ChangeFeed::stream($photosBasePath, intval($since));
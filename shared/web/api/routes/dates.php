@@ -36,10 +36,10 @@ function getAvailableDates($basePath) {
                 $day = basename($dayPath);
 
                 // Verificar si hay archivos válidos en este día
-                $files = glob($dayPath . '/*.{jpg,jpeg,png,mp4}', GLOB_BRACE);
+                $files = array_merge(glob($dayPath . '/*.{jpg,jpeg,png,webp,mp4}', GLOB_BRACE), PackStore::dayFiles($dayPath));
                 $validFiles = array_filter($files, function($file) {
                     $filename = basename($file);
-                    return preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename);
+                    return preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename);
                 });
 
                 if (!empty($validFiles)) {
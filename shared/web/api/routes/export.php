@@ -21,8 +21,8 @@ function createZipExport($files, $exportName) {
     }
 
     foreach ($files as $file) {
-        if (file_exists($file['path'])) {
-            $zip->addFile($file['path'], $file['archive_name']);
+        if (PackStore::exists($file['path'])) {
+            PackStore::addToZip($zip, $file['path'], $file['archive_name']);
         }
     }
 
@@ -63,18 +63,24 @@ function getFilesForDate($basePath, $date) {
     if (is_dir($dirPath)) {
         $handle = opendir($dirPath);
         if ($handle) {
+            // Sueltos y empaquetados en el tar del mes (archivo frío)
+            $names = array_keys(PackStore::dayMembers($dirPath));
             while (false !== ($file = readdir($handle))) {
-                if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $file)) {
+                $names[] = $file;
+            }
+            closedir($handle);
+
+            foreach (array_unique($names) as $file) {
+                if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $file)) {
                     $files[] = [
                         'path' => "$dirPath/$file",
                         'archive_name' => "$date/$file",
                         'filename' => $file,
                         'date' => $date,
-                        'size' => filesize("$dirPath/$file")
+                        'size' => PackStore::stat("$dirPath/$file")['size']
                     ];
                 }
             }
-            closedir($handle);
         }
     }
 
@@ -120,16 +126,13 @@ function getAllFiles($basePath) {
         return $files;
     }
 
-    $iterator = new RecursiveIteratorIterator(
-        new RecursiveDirectoryIterator($basePath, RecursiveDirectoryIterator::SKIP_DOTS)
-    );
-
-    foreach ($iterator as $file) {
+    // Archivos sueltos y los empaquetados en el archivo frío
+    foreach (PackStore::files($basePath) as $file) {
         if ($file->isFile()) {
             $filename = $file->getFilename();
             $relativePath = str_replace($basePath . '/', '', $file->getPathname());
 
-            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename)) {
+            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename)) {
                 $pathParts = explode('/', $relativePath);
                 if (count($pathParts) >= 4) {
                     $year = $pathParts[0];
@@ -34,10 +34,10 @@ function getFeedData($basePath, $limit = 10, $offset = 0, $sortOrder = 'desc') {
                 $day = basename($dayPath);
 
                 // Verificar si hay archivos en este día
-                $files = glob($dayPath . '/*.{jpg,jpeg,png,mp4}', GLOB_BRACE);
+                $files = array_merge(glob($dayPath . '/*.{jpg,jpeg,png,webp,mp4}', GLOB_BRACE), PackStore::dayFiles($dayPath));
                 $validFiles = array_filter($files, function($file) {
                     $filename = basename($file);
-                    return preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename);
+                    return preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename);
                 });
 
                 if (!empty($validFiles)) {
@@ -91,9 +91,20 @@ function getFeedEntryForDate($basePath, $date) {
         return null;
     }
 
+    // Sueltos y empaquetados en el tar del mes: [nombre => tamaño]
+    $sizes = [];
+    foreach (PackStore::dayMembers($dirPath) as $file => $member) {
+        $sizes[$file] = $member['size'];
+    }
     while (false !== ($file = readdir($handle))) {
-        if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $file)) {
+        $sizes[$file] = null;
+    }
+    closedir($handle);
+
+    foreach ($sizes as $file => $packedSize) {
+        if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $file)) {
             $fullPath = "$dirPath/$file";
+            $size = $packedSize ?? (file_exists($fullPath) ? filesize($fullPath) : 0);
             $isVideo = preg_match('/\.mp4$/i', $file);
 
             // Extraer timestamp
@@ -107,12 +118,11 @@ function getFeedEntryForDate($basePath, $date) {
                 'type' => $isVideo ? 'video' : 'photo',
                 'timestamp' => $timestamp,
                 'path' => "/photos/$year/$month/$day/$file",
-                'size' => file_exists($fullPath) ? filesize($fullPath) : 0,
-                'size_mb' => file_exists($fullPath) ? round(filesize($fullPath) / (1024 * 1024), 2) : 0
+                'size' => $size,
+                'size_mb' => round($size / (1024 * 1024), 2)
             ];
         }
     }
-    closedir($handle);
 
     if (empty($files)) {
         return null;
@@ -0,0 +1,24 @@
+<?php
+// web/api/media.php - Sirve un archivo del diario, suelto o desde el tar de su mes
+// Apache reescribe aquí las peticiones a /photos/YYYY/MM/DD/archivo que no existen sueltas
+
+$year = $_GET['year'] ?? '';
+$month = $_GET['month'] ?? '';
+$day = $_GET['day'] ?? '';
+$file = $_GET['file'] ?? '';
+
+if (!preg_match('/^\d{4}$/', $year) ||
+    !preg_match('/^\d{2}$/', $month) ||
+    !preg_match('/^\d{2}$/', $day) ||
+    !FileManager::isValidFilename($file)) {
+    http_response_code(400);
+    echo json_encode(['error' => 'Ruta de archivo inválida']);
+    exit();
+}
+
+$photosBasePath = $_ENV['PHOTOS_PATH'] ?? '/data/fotos';
+$fullPath = "$photosBasePath/$year/$month/$day/$file";
+
+if (!PackStore::serve($fullPath)) {
+    ResponseHelper::notFound('Archivo');
+}
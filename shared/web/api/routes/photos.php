@@ -46,13 +46,20 @@ if (is_dir($dirPath)) {
     if ($handle) {
         while (false !== ($file = readdir($handle))) {
             // Filtrar solo archivos de imagen y video con el formato correcto
-            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $file)) {
+            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $file)) {
                 $files[] = $file;
                 error_log("Archivo encontrado: $file");
             }
         }
         closedir($handle);
 
+        // Archivos del día que ya están en el tar del mes (archivo frío)
+        foreach (array_keys(PackStore::dayMembers($dirPath)) as $file) {
+            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $file) && !in_array($file, $files)) {
+                $files[] = $file;
+            }
+        }
+
         // Ordenar archivos por nombre (que corresponde al timestamp)
         sort($files);
     }
@@ -11,6 +11,8 @@ if ($_SERVER['REQUEST_METHOD'] === 'OPTIONS') {
     exit();
 }
 
+require_once __DIR__ . '/../utils/RandomSampler.php';
+
 function getAllMediaFiles($basePath) {
     $files = [];
 
@@ -18,17 +20,14 @@ function getAllMediaFiles($basePath) {
         return $files;
     }
 
-    $iterator = new RecursiveIteratorIterator(
-        new RecursiveDirectoryIterator($basePath, RecursiveDirectoryIterator::SKIP_DOTS)
-    );
-
-    foreach ($iterator as $file) {
+    // Archivos sueltos y los empaquetados en el archivo frío
+    foreach (PackStore::files($basePath) as $file) {
         if ($file->isFile()) {
             $filename = $file->getFilename();
             $relativePath = str_replace($basePath . '/', '', $file->getPathname());
 
             // Verificar formato esperado
-            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename)) {
+            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename)) {
                 $pathParts = explode('/', $relativePath);
                 if (count($pathParts) >= 4) {
                     $year = $pathParts[0];
@@ -132,10 +131,70 @@ try {
 
     error_log("Obteniendo archivos aleatorios: count=$count, type=$type");
 
-    // Obtener todos los archivos
-    $allFiles = getAllMediaFiles($photosBasePath);
+    // Excluir archivos recientes: solo fechas anteriores al corte
+    $cutoffDate = null;
+    if ($excludeRecent) {
+        $excludeDays = intval($excludeRecent);
+        $cutoffDate = date('Y-m-d', strtotime("-$excludeDays days"));
+    }
+
+    $sampler = RandomSampler::load($photosBasePath);
+
+    if ($sampler !== null) {
+        // Sorteo con el índice que exporta el bot (sin recorrer el árbol)
+        $rangeStart = ($startDate && $endDate) ? $startDate : null;
+        $rangeEnd = ($startDate && $endDate) ? $endDate : null;
+        if ($cutoffDate) {
+            $dayBefore = date('Y-m-d', strtotime("$cutoffDate -1 day"));
+            $rangeEnd = $rangeEnd ? min($rangeEnd, $dayBefore) : $dayBefore;
+        }
+
+        $ranges = RandomSampler::ranges($sampler, $type, $rangeStart, $rangeEnd);
+        $totalInSystem = $sampler['total'];
+        $totalAvailable = RandomSampler::countRanges($ranges);
+        $summary = RandomSampler::summarize($sampler, $ranges);
+
+        $randomFiles = [];
+        foreach (RandomSampler::draw($sampler, $photosBasePath, $count, $type, $rangeStart, $rangeEnd) as $file) {
+            $file['path'] = '/photos/' . $file['relative_path'];
+            unset($file['relative_path']);
+            $randomFiles[] = $file;
+        }
+    } else {
+        // Obtener todos los archivos
+        $allFiles = getAllMediaFiles($photosBasePath);
+        $totalInSystem = count($allFiles);
+
+        // Aplicar filtros
+        $filteredFiles = $allFiles;
+
+        // Filtrar por tipo
+        $filteredFiles = filterFilesByType($filteredFiles, $type);
+
+        // Filtrar por rango de fechas
+        if ($startDate && $endDate) {
+            $filteredFiles = filterFilesByDateRange($filteredFiles, $startDate, $endDate);
+        }
+
+        if ($cutoffDate) {
+            $filteredFiles = array_filter($filteredFiles, function($file) use ($cutoffDate) {
+                return $file['date'] < $cutoffDate;
+            });
+        }
 
-    if (empty($allFiles)) {
+        $totalAvailable = count($filteredFiles);
+        $summary = [
+            'photos' => count(array_filter($filteredFiles, fn($f) => $f['type'] === 'photo')),
+            'videos' => count(array_filter($filteredFiles, fn($f) => $f['type'] === 'video')),
+            'earliest' => !empty($filteredFiles) ? min(array_column($filteredFiles, 'date')) : null,
+            'latest' => !empty($filteredFiles) ? max(array_column($filteredFiles, 'date')) : null
+        ];
+
+        // Obtener archivos aleatorios
+        $randomFiles = getRandomFiles(array_values($filteredFiles), $count);
+    }
+
+    if ($totalInSystem === 0) {
         http_response_code(404);
         echo json_encode([
             'error' => 'No se encontraron archivos multimedia',
@@ -145,27 +204,7 @@ try {
         exit();
     }
 
-    // Aplicar filtros
-    $filteredFiles = $allFiles;
-
-    // Filtrar por tipo
-    $filteredFiles = filterFilesByType($filteredFiles, $type);
-
-    // Filtrar por rango de fechas
-    if ($startDate && $endDate) {
-        $filteredFiles = filterFilesByDateRange($filteredFiles, $startDate, $endDate);
-    }
-
-    // Excluir archivos recientes si se solicita
-    if ($excludeRecent) {
-        $excludeDays = intval($excludeRecent);
-        $cutoffDate = date('Y-m-d', strtotime("-$excludeDays days"));
-        $filteredFiles = array_filter($filteredFiles, function($file) use ($cutoffDate) {
-            return $file['date'] < $cutoffDate;
-        });
-    }
-
-    if (empty($filteredFiles)) {
+    if ($totalAvailable === 0) {
         http_response_code(404);
         echo json_encode([
             'error' => 'No se encontraron archivos que cumplan los criterios',
@@ -181,14 +220,11 @@ try {
         exit();
     }
 
-    // Obtener archivos aleatorios
-    $randomFiles = getRandomFiles(array_values($filteredFiles), $count);
-
     // Formatear respuesta
     $response = [
         'random_files' => [],
         'count' => count($randomFiles),
-        'total_available' => count($filteredFiles),
+        'total_available' => $totalAvailable,
         'generated_at' => date('c')
     ];
 
@@ -226,7 +262,7 @@ try {
             }
 
             // Verificar si el archivo existe
-            $fileData['exists'] = file_exists($file['full_path']);
+            $fileData['exists'] = PackStore::exists($file['full_path']);
 
             // Remover ruta completa del sistema por seguridad
             unset($fileData['full_path']);
@@ -245,14 +281,15 @@ try {
         ];
 
         $response['statistics'] = [
-            'total_files_in_system' => count($allFiles),
-            'files_after_filters' => count($filteredFiles),
-            'photos_available' => count(array_filter($filteredFiles, fn($f) => $f['type'] === 'photo')),
-            'videos_available' => count(array_filter($filteredFiles, fn($f) => $f['type'] === 'video')),
+            'total_files_in_system' => $totalInSystem,
+            'files_after_filters' => $totalAvailable,
+            'photos_available' => $summary['photos'],
+            'videos_available' => $summary['videos'],
             'date_range' => [
-                'earliest' => !empty($filteredFiles) ? min(array_column($filteredFiles, 'date')) : null,
-                'latest' => !empty($filteredFiles) ? max(array_column($filteredFiles, 'date')) : null
-            ]
+                'earliest' => $summary['earliest'],
+                'latest' => $summary['latest']
+            ],
+            'source' => $sampler !== null ? 'sampler' : 'scan'
         ];
     }
 
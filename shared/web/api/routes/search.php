@@ -18,16 +18,13 @@ function searchFiles($basePath, $criteria) {
         return $results;
     }
 
-    $iterator = new RecursiveIteratorIterator(
-        new RecursiveDirectoryIterator($basePath, RecursiveDirectoryIterator::SKIP_DOTS)
-    );
-
-    foreach ($iterator as $file) {
+    // Archivos sueltos y los empaquetados en el archivo frío
+    foreach (PackStore::files($basePath) as $file) {
         if ($file->isFile()) {
             $filename = $file->getFilename();
             $relativePath = str_replace($basePath . '/', '', $file->getPathname());
 
-            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename)) {
+            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename)) {
                 $pathParts = explode('/', $relativePath);
                 if (count($pathParts) >= 4) {
                     $year = $pathParts[0];
@@ -215,7 +212,7 @@ function getAvailableDates($basePath) {
                 $day = basename($dayPath);
 
                 // Verificar si hay archivos en este día
-                $files = glob($dayPath . '/*.{jpg,jpeg,png,mp4}', GLOB_BRACE);
+                $files = array_merge(glob($dayPath . '/*.{jpg,jpeg,png,webp,mp4}', GLOB_BRACE), PackStore::dayFiles($dayPath));
                 if (!empty($files)) {
                     $dates[] = "$year-$month-$day";
                 }
@@ -21,17 +21,14 @@ function getAllPhotos($basePath) {
         return ['photos' => [], 'videos' => [], 'all' => []];
     }
 
-    $iterator = new RecursiveIteratorIterator(
-        new RecursiveDirectoryIterator($basePath, RecursiveDirectoryIterator::SKIP_DOTS)
-    );
-
-    foreach ($iterator as $file) {
+    // Archivos sueltos y los empaquetados en el archivo frío
+    foreach (PackStore::files($basePath) as $file) {
         if ($file->isFile()) {
             $filename = $file->getFilename();
             $relativePath = str_replace($basePath . '/', '', $file->getPathname());
 
             // Verificar formato de archivo esperado (HH-MM-SS.ext)
-            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|mp4)$/i', $filename)) {
+            if (preg_match('/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|mp4)$/i', $filename)) {
                 $pathParts = explode('/', $relativePath);
                 if (count($pathParts) >= 4) {
                     $year = $pathParts[0];
@@ -52,7 +49,7 @@ function getAllPhotos($basePath) {
                         'second' => intval(substr($filename, 6, 2))
                     ];
 
-                    if (preg_match('/\.(jpg|jpeg|png)$/i', $filename)) {
+                    if (preg_match('/\.(jpg|jpeg|png|webp)$/i', $filename)) {
                         $fileInfo['type'] = 'photo';
                         $photos[] = $fileInfo;
                     } elseif (preg_match('/\.mp4$/i', $filename)) {
@@ -0,0 +1,190 @@
+<?php
+// web/api/utils/ChangeFeed.php - Lectura del registro de cambios que escribe el bot
+
+/**
+ * El bot anota cada archivo guardado, ventana entregada, plan creado, original
+ * recomprimido o mes empaquetado en .index/changes.jsonl (lo escribe
+ * change_feed.py) y resume en .index/changes.json la última seq de cada fecha.
+ *
+ * Las cachés usan version() como clave: un día sigue en caché mientras el bot no
+ * anote nada de esa fecha, sin TTL ni recorridos del disco. Para avisos en vivo
+ * se lee el socket Unix del bot (.index/changes.sock) o, si no está, se relee el
+ * log cuando cambia el resumen.
+ */
+class ChangeFeed {
+
+    const LOG_NAME = 'changes.jsonl';
+    const STATE_NAME = 'changes.json';
+    const SOCKET_NAME = 'changes.sock';
+    const VERSION = 1;
+    const KEEP = 3;             // Archivos rotados que mira since() (CHANGE_FEED_KEEP del bot)
+    const IDLE_SECONDS = 5;     // Espera entre comprobaciones sin socket y entre latidos
+
+    private static $cache = [];
+
+    /**
+     * Resumen {seq, updated, dates, months} o null si el bot aún no escribe el registro
+     */
+    public static function state($basePath) {
+        $path = "$basePath/.index/" . self::STATE_NAME;
+        // Sin la caché de stat de PHP: el bot reescribe el resumen varias veces por segundo
+        clearstatcache(true, $path);
+        $stat = @stat($path);
+        if ($stat === false) {
+            return null;
+        }
+
+        // mtime solo tiene resolución de segundos; el bot reemplaza el archivo (inodo nuevo)
+        // en cada escritura, así que inodo y tamaño distinguen dos versiones del mismo segundo
+        $cacheKey = "changes_" . md5($path) . "_{$stat['ino']}_{$stat['size']}_{$stat['mtime']}";
+        if (isset(self::$cache[$cacheKey])) {
+            return self::$cache[$cacheKey];
+        }
+        if (function_exists('apcu_fetch')) {
+            $cached = apcu_fetch($cacheKey, $found);
+            if ($found) {
+                return self::$cache[$cacheKey] = $cached;
+            }
+        }
+
+        $state = json_decode(@file_get_contents($path), true);
+        if (!is_array($state) || ($state['version'] ?? null) !== self::VERSION) {
+            return null; // A medio reemplazar o de otra versión: se trata como sin registro
+        }
+
+        if (function_exists('apcu_store')) {
+            apcu_store($cacheKey, $state, 300);
+        }
+        return self::$cache[$cacheKey] = $state;
+    }
+
+    /**
+     * Versión de una fecha (YYYY-MM-DD) o de todo el diario: cambia con cada anotación
+     * que la afecta. null si no hay registro (las cachés vuelven a su TTL)
+     */
+    public static function version($basePath, $date = null) {
+        $state = self::state($basePath);
+        if ($state === null) {
+            return null;
+        }
+        if ($date === null) {
+            return (string)$state['seq'];
+        }
+        $day = $state['dates'][$date] ?? 0;
+        $month = $state['months'][substr($date, 0, 7)] ?? 0;
+        return "$day.$month";
+    }
+
+    /**
+     * Eventos con seq mayor que la dada, del más antiguo al más reciente
+     */
+    public static function since($basePath, $seq, $limit = 500) {
+        $logPath = "$basePath/.index/" . self::LOG_NAME;
+        $paths = [];
+        for ($number = self::KEEP; $number >= 1; $number--) {
+            $paths[] = "$logPath.$number";
+        }
+        $paths[] = $logPath;
+
+        $events = [];
+        foreach ($paths as $path) {
+            $handle = @fopen($path, 'r');
+            if (!$handle) {
+                continue;
+            }
+            while (($line = fgets($handle)) !== false) {
+                $event = json_decode($line, true);
+                if (is_array($event) && $event['seq'] > $seq) {
+                    $events[] = $event;
+                }
+            }
+            fclose($handle);
+        }
+        return array_slice($events, 0, $limit);
+    }
+
+    /**
+     * Sigue el registro desde $seq llamando a $onEvent con cada evento. $onIdle se llama
+     * en los ratos sin cambios; cualquiera de los dos corta devolviendo false.
+     * Devuelve la última seq vista.
+     */
+    public static function follow($basePath, $seq, $onEvent, $maxSeconds = null, $onIdle = null) {
+        $deadline = $maxSeconds ? time() + $maxSeconds : null;
+        $socket = @stream_socket_client("unix://$basePath/.index/" . self::SOCKET_NAME, $errno, $errstr, 2);
+
+        if ($socket) {
+            fwrite($socket, "since $seq\n");
+            stream_set_timeout($socket, self::IDLE_SECONDS);
+            while ($deadline === null || time() < $deadline) {
+                $line = fgets($socket);
+                if ($line === false) {
+                    if (!stream_get_meta_data($socket)['timed_out']) {
+                        break; // El bot cerró el socket (reinicio): quien llama reconecta
+                    }
+                    if ($onIdle && $onIdle() === false) {
+                        break;
+                    }
+                    continue;
+                }
+                $event = json_decode($line, true);
+                if (is_array($event)) {
+                    $seq = $event['seq'];
+                    if ($onEvent($event) === false) {
+                        break;
+                    }
+                }
+            }
+            fclose($socket);
+            return $seq;
+        }
+
+        // Sin socket: solo se relee el log cuando cambia el resumen
+        while ($deadline === null || time() < $deadline) {
+            clearstatcache();
+            $state = self::state($basePath);
+            $events = ($state && $state['seq'] > $seq) ? self::since($basePath, $seq) : [];
+            foreach ($events as $event) {
+                $seq = $event['seq'];
+                if ($onEvent($event) === false) {
+                    return $seq;
+                }
+            }
+            if (empty($events)) {
+                if ($onIdle && $onIdle() === false) {
+                    break;
+                }
+                sleep(self::IDLE_SECONDS);
+            }
+        }
+        return $seq;
+    }
+
+    /**
+     * Server-Sent Events durante $maxSeconds (el navegador reconecta con Last-Event-ID;
+     * la conexión se corta pronto para no retener un proceso de Apache)
+     */
+    public static function stream($basePath, $seq, $maxSeconds = 25) {
+        header('Content-Type: text/event-stream');
+        header('Cache-Control: no-cache');
+        header('X-Accel-Buffering: no');
+        while (ob_get_level() > 0) {
+            ob_end_flush();
+        }
+
+        echo "retry: 2000\n\n";
+        flush();
+
+        self::follow($basePath, $seq, function($event) {
+            echo "id: {$event['seq']}\n";
+            echo "event: {$event['type']}\n";
+            echo 'data: ' . json_encode($event, JSON_UNESCAPED_UNICODE) . "\n\n";
+            flush();
+            return !connection_aborted();
+        }, $maxSeconds, function() {
+            echo ": ping\n\n";
+            flush();
+            return !connection_aborted();
+        });
+    }
+}
+?>
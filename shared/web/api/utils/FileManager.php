@@ -1,6 +1,9 @@
 <?php
 // web/api/utils/FileManager.php - Utilidad para gestión de archivos
 
+require_once __DIR__ . '/PackStore.php';
+require_once __DIR__ . '/ChangeFeed.php';
+
 /**
  * Clase para gestión centralizada de archivos y directorios
  */
@@ -8,8 +11,8 @@ class FileManager {
 
     private static $config = [
         'base_path' => '/data/fotos',
-        'allowed_extensions' => ['jpg', 'jpeg', 'png', 'heic', 'heif', 'mp4', 'mov'],
-        'filename_pattern' => '/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|heic|heif|mp4|mov)$/i',
+        'allowed_extensions' => ['jpg', 'jpeg', 'png', 'webp', 'heic', 'heif', 'mp4', 'mov'],
+        'filename_pattern' => '/^\d{2}-\d{2}-\d{2}\.(jpg|jpeg|png|webp|heic|heif|mp4|mov)$/i',
         'max_file_size' => 20971520, // 20MB
         'permissions' => [
             'files' => 0664,
@@ -18,7 +21,7 @@ class FileManager {
             'group' => 33
         ],
         'cache_enabled' => true,
-        'cache_ttl' => 300 // 5 minutos
+        'cache_ttl' => 300 // 5 minutos (solo sin registro de cambios del bot)
     ];
 
     private static $cache = [];
@@ -32,15 +35,28 @@ class FileManager {
 
     /**
      * Obtener archivos válidos en un directorio
+     *
+     * Con el registro de cambios del bot la caché de un día dura hasta que el bot
+     * anota algo de esa fecha (y se comparte entre procesos con APCu); sin él, TTL.
      */
     public static function getValidFiles($dirPath, $useCache = true) {
-        $cacheKey = "files_" . md5($dirPath);
+        $version = self::dayVersion($dirPath);
+        $cacheKey = "files_" . md5($dirPath) . ($version === null ? '' : "_v$version");
 
         // Verificar caché
-        if ($useCache && self::$config['cache_enabled'] && isset(self::$cache[$cacheKey])) {
-            $cached = self::$cache[$cacheKey];
-            if ((time() - $cached['timestamp']) < self::$config['cache_ttl']) {
-                return $cached['data'];
+        if ($useCache && self::$config['cache_enabled']) {
+            if (isset(self::$cache[$cacheKey])) {
+                $cached = self::$cache[$cacheKey];
+                if ($version !== null || (time() - $cached['timestamp']) < self::$config['cache_ttl']) {
+                    return $cached['data'];
+                }
+            }
+            if ($version !== null && function_exists('apcu_fetch')) {
+                $cached = apcu_fetch($cacheKey, $found);
+                if ($found) {
+                    self::$cache[$cacheKey] = ['data' => $cached, 'timestamp' => time()];
+                    return $cached;
+                }
             }
         }
 
@@ -56,6 +72,7 @@ class FileManager {
                 return $files;
             }
 
+            $seen = [];
             while (false !== ($filename = readdir($handle))) {
                 if (self::isValidFilename($filename)) {
                     $fullPath = $dirPath . '/' . $filename;
@@ -64,6 +81,7 @@ class FileManager {
                         $fileInfo = self::getFileInfo($fullPath, $filename);
                         if ($fileInfo) {
                             $files[] = $fileInfo;
+                            $seen[$filename] = true;
                         }
                     }
                 }
@@ -71,6 +89,16 @@ class FileManager {
 
             closedir($handle);
 
+            // Archivos del mismo día que ya están en el tar del mes
+            foreach (PackStore::dayMembers($dirPath) as $filename => $member) {
+                if (!isset($seen[$filename]) && self::isValidFilename($filename)) {
+                    $fileInfo = self::getFileInfo($dirPath . '/' . $filename, $filename);
+                    if ($fileInfo) {
+                        $files[] = $fileInfo;
+                    }
+                }
+            }
+
             // Ordenar por timestamp
             usort($files, function($a, $b) {
                 return strcmp($a['timestamp'], $b['timestamp']);
@@ -82,6 +110,9 @@ class FileManager {
                     'data' => $files,
                     'timestamp' => time()
                 ];
+                if ($version !== null && function_exists('apcu_store')) {
+                    apcu_store($cacheKey, $files, 86400);
+                }
             }
 
         } catch (Exception $e) {
@@ -91,11 +122,23 @@ class FileManager {
         return $files;
     }
 
+    /**
+     * Versión de un directorio de día YYYY/MM/DD según el registro de cambios (null sin registro)
+     */
+    private static function dayVersion($dirPath) {
+        $dirPath = rtrim($dirPath, '/');
+        if (!preg_match('#/(\d{4})/(\d{2})/(\d{2})$#', $dirPath, $matches)) {
+            return null;
+        }
+        return ChangeFeed::version(dirname($dirPath, 3), "$matches[1]-$matches[2]-$matches[3]");
+    }
+
     /**
      * Obtener información de un archivo
      */
     public static function getFileInfo($fullPath, $filename = null) {
-        if (!file_exists($fullPath)) {
+        $stat = PackStore::stat($fullPath);
+        if ($stat === null) {
             return null;
         }
 
@@ -114,8 +157,8 @@ class FileManager {
             'filename' => $filename,
             'type' => $type,
             'timestamp' => $timestamp,
-            'size' => filesize($fullPath),
-            'modified' => filemtime($fullPath),
+            'size' => $stat['size'],
+            'modified' => $stat['mtime'],
             'path' => str_replace(self::$config['base_path'], '', $fullPath),
             'full_path' => $fullPath
         ];
@@ -201,11 +244,8 @@ class FileManager {
             return $files;
         }
 
-        $iterator = new RecursiveIteratorIterator(
-            new RecursiveDirectoryIterator($basePath, RecursiveDirectoryIterator::SKIP_DOTS)
-        );
-
-        foreach ($iterator as $file) {
+        // Archivos sueltos y los empaquetados en el archivo frío
+        foreach (PackStore::files($basePath) as $file) {
             if ($file->isFile()) {
                 $filename = $file->getFilename();
 
@@ -424,7 +464,7 @@ class FileManager {
         if (function_exists('mime_content_type')) {
             $mimeType = mime_content_type($filePath);
             $allowedMimes = [
-                'image/jpeg', 'image/png', 'image/heic', 'image/heif',
+                'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif',
                 'video/mp4', 'video/quicktime'
             ];
 
@@ -538,9 +578,9 @@ class FileManager {
         }
 
         foreach ($files as $file) {
-            if (isset($file['full_path']) && file_exists($file['full_path'])) {
+            if (isset($file['full_path']) && PackStore::exists($file['full_path'])) {
                 $archiveName = isset($file['archive_name']) ? $file['archive_name'] : $file['filename'];
-                $zip->addFile($file['full_path'], $archiveName);
+                PackStore::addToZip($zip, $file['full_path'], $archiveName);
             }
         }
 
@@ -552,6 +592,31 @@ class FileManager {
      * Obtener archivos aleatorios
      */
     public static function getRandomFiles($count = 1, $criteria = []) {
+        // Con el índice que exporta el bot se sortea sin recorrer el árbol
+        // (solo admite filtros por tipo y rango de fechas)
+        $samplerCriteria = ['type', 'start_date', 'end_date'];
+        if (!array_diff(array_keys($criteria), $samplerCriteria)) {
+            require_once __DIR__ . '/RandomSampler.php';
+            $sampler = RandomSampler::load(self::$config['base_path']);
+            if ($sampler !== null) {
+                $hasRange = isset($criteria['start_date']) && isset($criteria['end_date']);
+                $files = RandomSampler::draw(
+                    $sampler,
+                    self::$config['base_path'],
+                    $count,
+                    $criteria['type'] ?? 'all',
+                    $hasRange ? $criteria['start_date'] : null,
+                    $hasRange ? $criteria['end_date'] : null
+                );
+                foreach ($files as &$file) {
+                    $file['path'] = '/' . $file['relative_path'];
+                    unset($file['relative_path']);
+                }
+                unset($file);
+                return $files;
+            }
+        }
+
         $allFiles = self::searchFiles(null, $criteria);
 
         if (empty($allFiles)) {
@@ -848,46 +913,29 @@ class FileManager {
     }
 
     /**
-     * Monitorear cambios en directorio (para desarrollo)
+     * Monitorear cambios en el diario (para desarrollo): sigue el registro de cambios
+     * del bot en lugar de sondear el disco. $callback recibe el evento y su tipo.
      */
     public static function watchDirectory($callback = null, $interval = 5) {
-        if (!function_exists('inotify_init')) {
-            throw new Exception('inotify extension no disponible');
-        }
-
         $basePath = self::$config['base_path'];
-        $inotify = inotify_init();
+        $state = ChangeFeed::state($basePath);
+        $seq = $state['seq'] ?? 0;
 
-        // Agregar watch para el directorio base
-        $watch = inotify_add_watch($inotify, $basePath, IN_CREATE | IN_DELETE | IN_MODIFY);
-
-        echo "Monitoreando cambios en: $basePath\n";
+        echo "Monitoreando cambios en: $basePath (desde la seq $seq)\n";
         echo "Presiona Ctrl+C para detener...\n";
 
         while (true) {
-            $events = inotify_read($inotify);
-
-            if ($events) {
-                foreach ($events as $event) {
-                    $eventType = '';
-                    if ($event['mask'] & IN_CREATE) $eventType = 'CREATED';
-                    if ($event['mask'] & IN_DELETE) $eventType = 'DELETED';
-                    if ($event['mask'] & IN_MODIFY) $eventType = 'MODIFIED';
+            $seq = ChangeFeed::follow($basePath, $seq, function($event) use ($callback) {
+                $eventType = strtoupper($event['type']);
+                $target = $event['path'] ?? $event['date'] ?? $event['month'] ?? '';
+                echo date('Y-m-d H:i:s', (int)$event['ts']) . " - [$eventType] $target\n";
 
-                    $message = "[$eventType] {$event['name']}";
-                    echo date('Y-m-d H:i:s') . " - $message\n";
-
-                    if ($callback && is_callable($callback)) {
-                        $callback($event, $eventType);
-                    }
+                if ($callback && is_callable($callback)) {
+                    $callback($event, $eventType);
                 }
-            }
-
-            sleep($interval);
+            });
+            sleep($interval); // El bot se reinició: reconectar
         }
-
-        inotify_rm_watch($inotify, $watch);
-        fclose($inotify);
     }
 }
 
@@ -0,0 +1,296 @@
+<?php
+// web/api/utils/PackStore.php - Lectura del archivo frío que empaqueta el bot
+
+/**
+ * Los meses cerrados viven en YYYY/MM/month-<n>.tar con el índice central
+ * YYYY/MM/month.idx.json (lo escribe media_tiering.py). Los directorios de día
+ * se conservan vacíos, así que los recorridos por fecha siguen funcionando y
+ * solo tienen que sumar los miembros del índice del mes.
+ *
+ * Cada miembro se sirve por acceso aleatorio (fseek al offset del índice), con
+ * soporte de Range y ETag.
+ */
+class PackStore {
+
+    const INDEX_NAME = 'month.idx.json';
+    const VERSION = 1;
+    const CHUNK = 65536;
+
+    private static $cache = [];
+
+    /**
+     * Índice de un mes agrupado por día (null si el mes no está empaquetado)
+     */
+    public static function load($monthPath) {
+        $path = rtrim($monthPath, '/') . '/' . self::INDEX_NAME;
+        $mtime = @filemtime($path);
+        if ($mtime === false) {
+            return null;
+        }
+
+        $cacheKey = "pack_" . md5($path) . "_$mtime";
+        if (isset(self::$cache[$cacheKey])) {
+            return self::$cache[$cacheKey];
+        }
+        if (function_exists('apcu_fetch')) {
+            $cached = apcu_fetch($cacheKey, $found);
+            if ($found) {
+                return self::$cache[$cacheKey] = $cached;
+            }
+        }
+
+        $index = json_decode(@file_get_contents($path), true);
+        if (!is_array($index) || ($index['version'] ?? null) !== self::VERSION) {
+            error_log("PackStore: $path no es válido");
+            return null;
+        }
+
+        $pack = [
+            'pack' => rtrim($monthPath, '/') . '/' . $index['pack'],
+            'generation' => $index['generation'],
+            'days' => []
+        ];
+        foreach ($index['members'] as $name => $member) {
+            list($day, $filename) = explode('/', $name, 2);
+            $pack['days'][$day][$filename] = [
+                'offset' => $member[0],
+                'size' => $member[1],
+                'mtime' => $member[2]
+            ];
+        }
+
+        if (function_exists('apcu_store')) {
+            apcu_store($cacheKey, $pack, 3600);
+        }
+        return self::$cache[$cacheKey] = $pack;
+    }
+
+    /**
+     * Miembros empaquetados de un directorio de día: [nombre => [offset, size, mtime]]
+     */
+    public static function dayMembers($dayPath) {
+        $pack = self::load(dirname($dayPath));
+        return $pack['days'][basename($dayPath)] ?? [];
+    }
+
+    /**
+     * Rutas (virtuales) de los archivos empaquetados de un día, como las devolvería glob
+     */
+    public static function dayFiles($dayPath) {
+        $files = [];
+        foreach (array_keys(self::dayMembers($dayPath)) as $filename) {
+            $files[] = "$dayPath/$filename";
+        }
+        return $files;
+    }
+
+    /**
+     * Miembro de una ruta YYYY/MM/DD/nombre con la ruta de su tar, o null
+     */
+    public static function find($fullPath) {
+        $dayPath = dirname($fullPath);
+        $pack = self::load(dirname($dayPath));
+        $member = $pack['days'][basename($dayPath)][basename($fullPath)] ?? null;
+        if ($member === null) {
+            return null;
+        }
+        return array_merge($member, ['pack' => $pack['pack'], 'generation' => $pack['generation']]);
+    }
+
+    /**
+     * Tamaño y fecha de un archivo suelto o empaquetado (null si no existe)
+     */
+    public static function stat($fullPath) {
+        if (is_file($fullPath)) {
+            return ['size' => filesize($fullPath), 'mtime' => filemtime($fullPath), 'packed' => false];
+        }
+        $member = self::find($fullPath);
+        return $member ? ['size' => $member['size'], 'mtime' => $member['mtime'], 'packed' => true] : null;
+    }
+
+    /**
+     * Existe como archivo suelto o dentro del tar de su mes
+     */
+    public static function exists($fullPath) {
+        return is_file($fullPath) || self::find($fullPath) !== null;
+    }
+
+    /**
+     * Contenido completo de un archivo suelto o empaquetado
+     */
+    public static function read($fullPath) {
+        if (is_file($fullPath)) {
+            return file_get_contents($fullPath);
+        }
+        $member = self::find($fullPath);
+        if ($member === null || $member['size'] === 0) {
+            return $member === null ? false : '';
+        }
+        return file_get_contents($member['pack'], false, null, $member['offset'], $member['size']);
+    }
+
+    /**
+     * Añadir a un ZIP un archivo suelto o el tramo de su tar (sin cargarlo en memoria)
+     */
+    public static function addToZip($zip, $fullPath, $archiveName) {
+        if (is_file($fullPath)) {
+            return $zip->addFile($fullPath, $archiveName);
+        }
+        $member = self::find($fullPath);
+        if ($member === null) {
+            return false;
+        }
+        if ($member['size'] === 0) {
+            return $zip->addFromString($archiveName, '');
+        }
+        return $zip->addFile($member['pack'], $archiveName, $member['offset'], $member['size']);
+    }
+
+    /**
+     * Servir un archivo suelto o empaquetado con Range, ETag y Last-Modified
+     */
+    public static function serve($fullPath) {
+        if (is_file($fullPath)) {
+            $source = $fullPath;
+            $offset = 0;
+            $size = filesize($fullPath);
+            $mtime = filemtime($fullPath);
+            $etag = sprintf('"%x-%x"', $size, $mtime);
+        } else {
+            $member = self::find($fullPath);
+            if ($member === null) {
+                return false;
+            }
+            $source = $member['pack'];
+            $offset = $member['offset'];
+            $size = $member['size'];
+            $mtime = $member['mtime'];
+            $etag = sprintf('"p%d-%x-%x"', $member['generation'], $offset, $size);
+        }
+
+        header('Content-Type: ' . self::mimeType($fullPath));
+        header('Accept-Ranges: bytes');
+        header('ETag: ' . $etag);
+        header('Last-Modified: ' . gmdate('D, d M Y H:i:s', $mtime) . ' GMT');
+        header('Cache-Control: public, max-age=86400');
+
+        if (trim($_SERVER['HTTP_IF_NONE_MATCH'] ?? '') === $etag) {
+            http_response_code(304);
+            return true;
+        }
+
+        // Un solo rango (lo que piden los navegadores para avanzar en un video)
+        $start = 0;
+        $end = $size - 1;
+        if (preg_match('/^bytes=(\d*)-(\d*)$/', $_SERVER['HTTP_RANGE'] ?? '', $matches) && $size > 0) {
+            if ($matches[1] === '') {
+                $start = max(0, $size - intval($matches[2]));
+            } else {
+                $start = intval($matches[1]);
+                $end = $matches[2] === '' ? $end : min($end, intval($matches[2]));
+            }
+            if ($start > $end || $start >= $size) {
+                http_response_code(416);
+                header("Content-Range: bytes */$size");
+                return true;
+            }
+            http_response_code(206);
+            header("Content-Range: bytes $start-$end/$size");
+        }
+        $length = $size > 0 ? $end - $start + 1 : 0;
+        header('Content-Length: ' . $length);
+
+        if ($_SERVER['REQUEST_METHOD'] === 'HEAD' || $length === 0) {
+            return true;
+        }
+
+        $handle = fopen($source, 'rb');
+        if (!$handle) {
+            return false;
+        }
+        fseek($handle, $offset + $start);
+        while ($length > 0 && !feof($handle)) {
+            $chunk = fread($handle, min(self::CHUNK, $length));
+            if ($chunk === false || $chunk === '') {
+                break;
+            }
+            echo $chunk;
+            $length -= strlen($chunk);
+            flush();
+        }
+        fclose($handle);
+        return true;
+    }
+
+    /**
+     * Recorre el árbol como RecursiveDirectoryIterator, sumando los miembros de cada tar
+     * (como PackedFileInfo, con la misma interfaz que SplFileInfo)
+     */
+    public static function files($basePath) {
+        $iterator = new RecursiveIteratorIterator(
+            new RecursiveDirectoryIterator($basePath, RecursiveDirectoryIterator::SKIP_DOTS)
+        );
+
+        foreach ($iterator as $file) {
+            if ($file->getFilename() !== self::INDEX_NAME) {
+                yield $file;
+                continue;
+            }
+            $pack = self::load($file->getPath());
+            foreach ($pack['days'] ?? [] as $day => $members) {
+                foreach ($members as $filename => $member) {
+                    $pathname = $file->getPath() . "/$day/$filename";
+                    if (!is_file($pathname)) { // Una versión suelta más reciente manda
+                        yield new PackedFileInfo($pathname, $member);
+                    }
+                }
+            }
+        }
+    }
+
+    private static function mimeType($fullPath) {
+        $types = [
+            'jpg' => 'image/jpeg', 'jpeg' => 'image/jpeg', 'png' => 'image/png', 'webp' => 'image/webp',
+            'heic' => 'image/heic', 'heif' => 'image/heif', 'mp4' => 'video/mp4', 'mov' => 'video/quicktime'
+        ];
+        return $types[strtolower(pathinfo($fullPath, PATHINFO_EXTENSION))] ?? 'application/octet-stream';
+    }
+}
+
+/**
+ * Miembro de un tar con los métodos de SplFileInfo que usan los recorridos
+ */
+class PackedFileInfo {
+
+    private $pathname;
+    private $member;
+
+    public function __construct($pathname, $member) {
+        $this->pathname = $pathname;
+        $this->member = $member;
+    }
+
+    public function isFile() {
+        return true;
+    }
+
+    public function getFilename() {
+        return basename($this->pathname);
+    }
+
+    public function getPathname() {
+        return $this->pathname;
+    }
+
+    public function getPath() {
+        return dirname($this->pathname);
+    }
+
+    public function getSize() {
+        return $this->member['size'];
+    }
+
+    public function getMTime() {
+        return $this->member['mtime'];
+    }
+}
@@ -0,0 +1,201 @@
+<?php
+// web/api/utils/RandomSampler.php - Sorteo de archivos con el índice que exporta el bot
+
+/**
+ * Lee .index/sampler.json (lo escribe el bot al guardar archivos nuevos) y sortea
+ * sin recorrer el árbol de directorios.
+ *
+ * Los archivos están agrupados en cubos por tipo y año, cada uno ordenado por fecha.
+ * Sin filtro de fechas se usa la tabla de alias exportada (sorteo en O(1)); con
+ * rango de fechas cada cubo se acota con una búsqueda binaria.
+ */
+class RandomSampler {
+
+    const FILENAME = '.index/sampler.json';
+    const VERSION = 1;
+
+    private static $cache = [];
+
+    /**
+     * Cargar el sorteo exportado (null si no existe o no es válido)
+     */
+    public static function load($basePath) {
+        $path = rtrim($basePath, '/') . '/' . self::FILENAME;
+        $mtime = @filemtime($path);
+        if ($mtime === false) {
+            return null;
+        }
+
+        $cacheKey = "sampler_" . md5($path) . "_$mtime";
+        if (isset(self::$cache[$cacheKey])) {
+            return self::$cache[$cacheKey];
+        }
+        if (function_exists('apcu_fetch')) {
+            $cached = apcu_fetch($cacheKey, $found);
+            if ($found) {
+                return self::$cache[$cacheKey] = $cached;
+            }
+        }
+
+        $sampler = json_decode(@file_get_contents($path), true);
+        if (!is_array($sampler) || ($sampler['version'] ?? null) !== self::VERSION) {
+            error_log("RandomSampler: $path no es válido, se recorrerá el árbol");
+            return null;
+        }
+
+        if (function_exists('apcu_store')) {
+            apcu_store($cacheKey, $sampler, 3600);
+        }
+        return self::$cache[$cacheKey] = $sampler;
+    }
+
+    /**
+     * Tramos [cubo, primero, último) que cumplen el tipo y el rango de fechas
+     */
+    public static function ranges($sampler, $type = 'all', $startDate = null, $endDate = null) {
+        $ranges = [];
+        $startYear = $startDate ? intval(substr($startDate, 0, 4)) : 0;
+        $endYear = $endDate ? intval(substr($endDate, 0, 4)) : 9999;
+
+        foreach ($sampler['buckets'] as $index => $bucket) {
+            if ($type !== 'all' && $bucket['type'] !== $type) {
+                continue;
+            }
+            if ($bucket['year'] < $startYear || $bucket['year'] > $endYear) {
+                continue;
+            }
+
+            $first = $startDate ? self::lowerBound($sampler['files'], $bucket['start'], $bucket['end'], $startDate, false) : $bucket['start'];
+            $last = $endDate ? self::lowerBound($sampler['files'], $first, $bucket['end'], $endDate, true) : $bucket['end'];
+            if ($last > $first) {
+                $ranges[] = [$index, $first, $last];
+            }
+        }
+
+        return $ranges;
+    }
+
+    /**
+     * Primera posición con fecha >= $date (o > $date si $after) dentro del cubo
+     */
+    private static function lowerBound($files, $low, $high, $date, $after) {
+        while ($low < $high) {
+            $middle = intdiv($low + $high, 2);
+            $value = $files[$middle][2];
+            if ($value < $date || ($after && $value === $date)) {
+                $low = $middle + 1;
+            } else {
+                $high = $middle;
+            }
+        }
+        return $low;
+    }
+
+    /**
+     * Número de archivos en los tramos
+     */
+    public static function countRanges($ranges) {
+        $total = 0;
+        foreach ($ranges as $range) {
+            $total += $range[2] - $range[1];
+        }
+        return $total;
+    }
+
+    /**
+     * Sortear hasta $count archivos distintos
+     */
+    public static function draw($sampler, $basePath, $count, $type = 'all', $startDate = null, $endDate = null) {
+        $ranges = self::ranges($sampler, $type, $startDate, $endDate);
+        $available = self::countRanges($ranges);
+        $count = min($count, $available);
+        $useAlias = !$startDate && !$endDate && isset($sampler['alias'][$type]);
+
+        // Pesos de los tramos para el sorteo con fechas (hay pocos: dos tipos por año)
+        $weights = [];
+        $totalWeight = 0.0;
+        foreach ($ranges as $range) {
+            $totalWeight += $sampler['buckets'][$range[0]]['weight'] * ($range[2] - $range[1]);
+            $weights[] = $totalWeight;
+        }
+
+        $chosen = [];
+        $attempts = 0;
+        while (count($chosen) < $count && $attempts < $count * 4) {
+            $attempts++;
+            if ($useAlias) {
+                $table = $sampler['alias'][$type];
+                $column = random_int(0, count($table['prob']) - 1);
+                $bucket = $sampler['buckets'][self::randomFloat() < $table['prob'][$column]
+                    ? $table['buckets'][$column]
+                    : $table['buckets'][$table['alias'][$column]]];
+                $position = random_int($bucket['start'], $bucket['end'] - 1);
+            } else {
+                $target = self::randomFloat() * $totalWeight;
+                $selected = count($ranges) - 1;
+                foreach ($weights as $index => $weight) {
+                    if ($target < $weight) {
+                        $selected = $index;
+                        break;
+                    }
+                }
+                $position = random_int($ranges[$selected][1], $ranges[$selected][2] - 1);
+            }
+            if (!isset($chosen[$position])) {
+                $chosen[$position] = self::fileInfo($sampler['files'][$position], $basePath);
+            }
+        }
+
+        return array_values($chosen);
+    }
+
+    /**
+     * Datos de un archivo con las mismas claves que FileManager::getFileInfo
+     */
+    public static function fileInfo($entry, $basePath) {
+        list($relativePath, $type, $date, $timestamp, $size, $modified) = $entry;
+        list($year, $month, $day) = explode('-', $date);
+
+        return [
+            'filename' => basename($relativePath),
+            'type' => $type,
+            'timestamp' => $timestamp,
+            'size' => $size,
+            'modified' => $modified,
+            'relative_path' => $relativePath,
+            'full_path' => rtrim($basePath, '/') . '/' . $relativePath,
+            'date' => $date,
+            'year' => intval($year),
+            'month' => intval($month),
+            'day' => intval($day)
+        ];
+    }
+
+    /**
+     * Fotos, videos y fechas extremas de los tramos
+     */
+    public static function summarize($sampler, $ranges) {
+        $summary = ['photos' => 0, 'videos' => 0, 'earliest' => null, 'latest' => null];
+
+        foreach ($ranges as $range) {
+            $bucket = $sampler['buckets'][$range[0]];
+            $summary[$bucket['type'] === 'video' ? 'videos' : 'photos'] += $range[2] - $range[1];
+
+            $first = $sampler['files'][$range[1]][2];
+            $last = $sampler['files'][$range[2] - 1][2];
+            if ($summary['earliest'] === null || $first < $summary['earliest']) {
+                $summary['earliest'] = $first;
+            }
+            if ($summary['latest'] === null || $last > $summary['latest']) {
+                $summary['latest'] = $last;
+            }
+        }
+
+        return $summary;
+    }
+
+    private static function randomFloat() {
+        return mt_rand() / (mt_getrandmax() + 1);
+    }
+}
+?>
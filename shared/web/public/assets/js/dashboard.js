@@ -53,6 +53,29 @@ class PhotoDashboard {
     this.setupEventListeners();
     this.initializeComponents();
     this.loadInitialData();
+    this.watchChanges();
+  }
+
+  /**
+   * Avisos en vivo del bot (fotos guardadas, entregas, planes): recarga lo visible
+   */
+  watchChanges() {
+    if (!window.EventSource) return;
+
+    const source = new EventSource(`${this.API_BASE}/changes`);
+    const refresh = () => {
+      clearTimeout(this.changesTimer);
+      // Un álbum llega como varios eventos seguidos: una sola recarga
+      this.changesTimer = setTimeout(() => this.refreshAll(), 1000);
+    };
+
+    ["saved", "delivered", "plan", "rewritten", "packed"].forEach((type) =>
+      source.addEventListener(type, refresh)
+    );
+    source.onerror = () => {
+      // EventSource reconecta solo (la API corta cada conexión a los ~25 s)
+    };
+    this.changesSource = source;
   }
 
   /**
@@ -860,6 +883,15 @@ class PhotoDashboard {
     await this.loadStats();
   }
 
+  async refreshAll() {
+    this.cache.clear();
+    await Promise.all([
+      this.loadStats(),
+      this.loadAvailableDates(),
+      this.loadCalendarData(),
+    ]);
+  }
+
   startSlideshowAll() {
     // Implementar slideshow con todas las fotos disponibles
     console.log("🎬 Iniciando slideshow completo...");